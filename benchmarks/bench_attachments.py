@@ -0,0 +1,116 @@
+"""
+Benchmark — peak memory for concurrent sends of a large attachment.
+
+"stdlib" builds each message with `email.mime` (the file read whole and
+base64-encoded in memory) and hands the bytes to the pool; "streamed" sends
+through `sender.send`, which reads and encodes the file in chunks during
+the DATA phase. Each mode runs in its own process against the local SMTP
+sink (benchmarks/smtp_sink.py, a third process), and reports how
+far its peak RSS rose above the baseline after imports.
+
+Run:
+    python benchmarks/bench_attachments.py [--size-mb 20] [--concurrency 10]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import smtp_sink  # noqa: E402
+from email_service import pool, sender, settings, Attachment, EmailMessage, SmtpProfile  # noqa: E402
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux, bytes on macOS.
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+
+
+def _stdlib_bytes(message: EmailMessage, profile: SmtpProfile, path: Path) -> bytes:
+    doc = MIMEMultipart("mixed")
+    doc["From"] = profile.from_email
+    doc["To"] = ", ".join(message.to)
+    doc["Subject"] = message.subject
+    doc.attach(MIMEText(message.text, "plain"))
+    part = MIMEApplication(path.read_bytes())
+    part.add_header("Content-Disposition", "attachment", filename=path.name)
+    doc.attach(part)
+    return doc.as_bytes()
+
+
+async def _run(mode: str, port: int, path: Path, concurrency: int) -> dict:
+    settings.attachments_dir = str(path.parent)
+    settings.attachment_max_bytes = path.stat().st_size
+    settings.smtp_pool_size = concurrency
+    profile = SmtpProfile(profile_id="bench", smtp_host="127.0.0.1", smtp_port=port, from_email="bench@example.com")
+
+    async def one(i: int) -> None:
+        message = EmailMessage(
+            to=[f"user{i}@example.com"], subject="Report", text="Attached.",
+            attachments=[Attachment(path=path.name)],
+        )
+        if mode == "streamed":
+            await sender.send(message, profile)
+        else:
+            data = await asyncio.to_thread(_stdlib_bytes, message, profile, path)
+            await pool.get_pool(profile, lambda: None).sendmail(profile.from_email, message.to, data)
+
+    baseline = _peak_rss_mb()
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    await pool.close_all()
+    return {"mode": mode, "seconds": elapsed, "peak_rss_mb": _peak_rss_mb(), "growth_mb": _peak_rss_mb() - baseline}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=20.0, help="attachment size")
+    parser.add_argument("--concurrency", type=int, default=10, help="simultaneous sends")
+    parser.add_argument("--mode", choices=("stdlib", "streamed"), help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(asyncio.run(_run(args.mode, args.port, Path(args.file), args.concurrency))))
+        return
+
+    port = smtp_sink.free_port()
+    sink = subprocess.Popen([sys.executable, smtp_sink.__file__, "--port", str(port)])
+    try:
+        smtp_sink.wait_for(port)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "attachment.bin"
+            with open(path, "wb") as f:
+                for _ in range(int(args.size_mb)):
+                    f.write(os.urandom(1024 * 1024))
+            print(f"{args.concurrency} concurrent sends of a {args.size_mb:g} MB attachment\n")
+            print(f"{'mode':<10} {'seconds':>9} {'peak RSS MB':>12} {'growth MB':>10}")
+            for mode in ("stdlib", "streamed"):
+                out = subprocess.run(
+                    [sys.executable, __file__, "--mode", mode, "--port", str(port), "--file", str(path),
+                     "--concurrency", str(args.concurrency)],
+                    check=True, capture_output=True, text=True,
+                ).stdout
+                r = json.loads(out.strip().splitlines()[-1])
+                print(f"{mode:<10} {r['seconds']:>9.2f} {r['peak_rss_mb']:>12.1f} {r['growth_mb']:>10.1f}")
+    finally:
+        sink.terminate()
+        sink.wait()
+
+
+if __name__ == "__main__":
+    main()
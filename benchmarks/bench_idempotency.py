@@ -0,0 +1,59 @@
+"""
+Benchmark — idempotency cache lookups/sec and memory per key.
+
+Fills the in-memory cache with N completed keys (as a day of traffic would),
+then times hits and misses and reports the bytes each key costs, measured
+with tracemalloc. IDEMPOTENCY_MAX_KEYS caps the total at that cost per key.
+
+Run:
+    python benchmarks/bench_idempotency.py [--keys 1000000]
+"""
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from email_service import idempotency, settings  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, default=1_000_000, help="keys stored in the cache")
+    args = parser.parse_args()
+
+    settings.idempotency_max_keys = args.keys
+    body = json.dumps({"message": "Email sent", "status": "sent", "message_id": "<0123456789abcdef@example.com>"})
+    expires_at = time.time() + 86400
+
+    tracemalloc.start()
+    for i in range(args.keys):
+        fingerprint = idempotency.fingerprint(f"request {i}".encode())
+        entry = idempotency._Entry(expires_at, fingerprint, 200, body.encode())
+        idempotency._cache.put(idempotency.digest(f"order-{i:012d}"), entry)
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    keys = [idempotency.digest(f"order-{i:012d}") for i in range(args.keys)]
+    start = time.perf_counter()
+    for key in keys:
+        idempotency._cache.get(key)
+    hits = len(keys) / (time.perf_counter() - start)
+
+    misses = [idempotency.digest(f"new-{i}") for i in range(len(keys))]
+    start = time.perf_counter()
+    for key in misses:
+        idempotency._cache.get(key)
+    miss_rate = len(misses) / (time.perf_counter() - start)
+
+    print(f"{args.keys:,} keys, {len(body)} B responses\n")
+    print(f"{'bytes/key':>10} {'total MB':>9} {'hits/s':>12} {'misses/s':>12}")
+    print(f"{used / args.keys:>10,.0f} {used / 2**20:>9,.0f} {hits:>12,.0f} {miss_rate:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
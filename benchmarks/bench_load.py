@@ -0,0 +1,268 @@
+"""
+Benchmark — load test: throughput, latency, CPU and memory at fixed concurrency.
+
+Starts a local SMTP sink (benchmarks/smtp_sink.py, in its own process so
+its CPU is not counted) with optional latency, failure injection and TLS,
+then sends a fixed number of messages at each concurrency level through
+one or both targets:
+
+- "send": `email_service.send` called directly (pool, MIME, rate limiter);
+- "api": POST /email/send on the FastAPI app, in process over ASGI (adds
+  validation, routing, inline retries and JSON).
+
+Each level reports messages/sec (successful sends), p50/p95/p99 latency,
+errors, the CPU time used by this process and its RSS. `--json FILE` writes
+the results with the revision, Python version and options they were taken
+with; `--compare FILE` prints the change against such an earlier run.
+
+Implicit TLS binds the sink to port 465 and STARTTLS to 587 (the service
+picks the TLS mode from the port), which may need privileges. Settings come
+from the environment as usual, e.g. SMTP_POOL_SIZE or RATE_LIMIT_COOLDOWN
+(which pauses a profile after every injected 451).
+
+Run:
+    python benchmarks/bench_load.py [--messages 2000] [--concurrency 1,10,50]
+        [--target send,api] [--latency-ms 0] [--fail-rate 0] [--reject-rate 0]
+        [--tls none|implicit|starttls] [--json results.json] [--compare baseline.json]
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import smtp_sink  # noqa: E402
+from email_service import pool, profiles, send, settings, EmailMessage, SmtpProfile  # noqa: E402
+
+TLS_PORTS = {"implicit": 465, "starttls": 587}
+
+
+def _cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _rss_mb() -> float:
+    """Current resident set size (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except OSError:
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+
+
+def _percentile(ordered: list[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+async def _level(send_one: Callable[[int], Awaitable[bool]], messages: int, concurrency: int) -> dict:
+    """Send `messages` with `concurrency` workers; one row of results."""
+    # Warm up: open the pooled sessions and fill the caches before measuring.
+    await asyncio.gather(*(send_one(i) for i in range(min(concurrency, messages))))
+
+    latencies: list[float] = []
+    errors = 0
+    next_index = 0
+
+    async def worker() -> None:
+        nonlocal errors, next_index
+        while next_index < messages:
+            i = next_index
+            next_index += 1
+            start = time.perf_counter()
+            ok = await send_one(i)
+            latencies.append(time.perf_counter() - start)
+            errors += not ok
+
+    cpu, wall = _cpu_seconds(), time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    seconds = time.perf_counter() - wall
+    cpu = _cpu_seconds() - cpu
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "messages": messages,
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "msgs_per_sec": round((messages - errors) / seconds, 1),
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+        "cpu_seconds": round(cpu, 3),
+        "cpu_percent": round(100 * cpu / seconds, 1),
+        "rss_mb": round(_rss_mb(), 1),
+    }
+
+
+def _message(i: int, body: str) -> EmailMessage:
+    return EmailMessage(to=[f"user{i}@example.com"], subject="Load test", text=body)
+
+
+async def _run(args, profile: SmtpProfile) -> list[dict]:
+    body = ("Load test message body. " * 43 + "\n") * max(1, round(args.size_kb))
+
+    async def via_send(i: int) -> bool:
+        try:
+            await send(_message(i, body), profile)
+            return True
+        except Exception:
+            return False
+
+    client = None
+    if "api" in args.targets:
+        from httpx import AsyncClient, ASGITransport
+        from main import app
+        client = AsyncClient(transport=ASGITransport(app=app), base_url="http://bench")
+        payload = {"subject": "Load test", "text": body}
+
+    async def via_api(i: int) -> bool:
+        r = await client.post("/email/send", json={"to": [f"user{i}@example.com"], **payload})
+        return r.status_code == 200
+
+    results = []
+    try:
+        for target in args.targets:
+            for concurrency in args.concurrency:
+                row = await _level(via_send if target == "send" else via_api, args.messages, concurrency)
+                results.append({"target": target, **row})
+                _print_row(results[-1])
+                await pool.close_all()
+    finally:
+        if client is not None:
+            await client.aclose()
+    return results
+
+
+HEADER = (f"{'target':<6} {'conc':>5} {'msgs/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'errors':>7} {'CPU %':>6} {'RSS MB':>7}")
+
+
+def _print_row(r: dict) -> None:
+    print(f"{r['target']:<6} {r['concurrency']:>5} {r['msgs_per_sec']:>9,.1f} {r['p50_ms']:>8.2f} "
+          f"{r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['errors']:>7} {r['cpu_percent']:>6.1f} {r['rss_mb']:>7.1f}",
+          flush=True)
+
+
+def _compare(results: list[dict], path: str) -> None:
+    baseline = {(r["target"], r["concurrency"]): r for r in json.loads(Path(path).read_text())["results"]}
+    print(f"\nChange against {path}:")
+    print(f"{'target':<6} {'conc':>5} {'msgs/s':>9} {'p95 ms':>9} {'CPU s':>9}")
+    for r in results:
+        old = baseline.get((r["target"], r["concurrency"]))
+        if old is None:
+            continue
+
+        def change(field: str) -> str:
+            return f"{100 * (r[field] - old[field]) / old[field]:+.1f}%" if old[field] else "n/a"
+
+        print(f"{r['target']:<6} {r['concurrency']:>5} {change('msgs_per_sec'):>9} {change('p95_ms'):>9} "
+              f"{change('cpu_seconds'):>9}")
+
+
+def _revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], cwd=ROOT, check=True, capture_output=True, text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _list(kind: Callable[[str], object]):
+    return lambda value: [kind(v) for v in value.split(",") if v]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000, help="messages sent per concurrency level")
+    parser.add_argument("--concurrency", type=_list(int), default=[1, 10, 50], help="comma-separated levels")
+    parser.add_argument("--target", dest="targets", type=_list(str), default=["send", "api"],
+                        help="comma-separated: send, api")
+    parser.add_argument("--size-kb", type=float, default=1.0, help="text body size")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="sink delay before acknowledging a message")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of messages the sink refuses with 451")
+    parser.add_argument("--reject-rate", type=float, default=0.0, help="share of messages the sink refuses with 554")
+    parser.add_argument("--tls", choices=("none", "implicit", "starttls"), default="none")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="results file of an earlier run to compare against")
+    args = parser.parse_args()
+    if not set(args.targets) <= {"send", "api"}:
+        parser.error("--target takes 'send' and/or 'api'")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        port = TLS_PORTS.get(args.tls) or smtp_sink.free_port()
+        sink_args = [
+            "--port", str(port), "--latency-ms", str(args.latency_ms), "--fail-rate", str(args.fail_rate),
+            "--reject-rate", str(args.reject_rate), "--tls", args.tls,
+        ]
+        ca_file = None
+        if args.tls != "none":
+            ca_file, key = smtp_sink.make_certificate(Path(tmp))
+            sink_args += ["--cert", ca_file, "--key", key]
+        sink = subprocess.Popen([sys.executable, str(Path(smtp_sink.__file__)), *sink_args])
+        try:
+            smtp_sink.wait_for(port)
+            if sink.poll() is not None:
+                sys.exit(f"SMTP sink could not listen on port {port}")
+
+            settings.profiles_file = str(Path(tmp) / "profiles.json")
+            settings.default_profile_id = "bench"
+            settings.default_group = ""
+            settings.queue_enabled = False
+            profile = SmtpProfile(
+                profile_id="bench", smtp_host="127.0.0.1", smtp_port=port, from_email="bench@example.com",
+                ca_file=ca_file,
+            )
+            profiles.add(profile)
+
+            print(f"{args.messages} messages per level, {args.size_kb:g} KB bodies, sink latency "
+                  f"{args.latency_ms:g} ms, fail {args.fail_rate:g}, reject {args.reject_rate:g}, TLS {args.tls}, "
+                  f"pool size {settings.smtp_pool_size}\n")
+            print(HEADER)
+            # Injected failures would log a line per message; keep the table readable.
+            logging.disable(logging.ERROR)
+            results = asyncio.run(_run(args, profile))
+        finally:
+            sink.terminate()
+            sink.wait()
+
+    report = {
+        "revision": _revision(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "options": {
+            "messages": args.messages, "size_kb": args.size_kb, "latency_ms": args.latency_ms,
+            "fail_rate": args.fail_rate, "reject_rate": args.reject_rate, "tls": args.tls,
+            "smtp_pool_size": settings.smtp_pool_size,
+        },
+        "results": results,
+    }
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2) + "\n")
+        print(f"\nResults written to {args.json}")
+    if args.compare:
+        _compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Benchmark — messages/sec for building MIME, stdlib vs cached builder.
+
+"stdlib" builds a MIMEMultipart with MIMEText parts per message and
+serializes it (the old sender path); "cached" renders a per-recipient copy
+from the prepared body. Every message goes to a different recipient with
+the same newsletter body.
+
+Run:
+    python benchmarks/bench_mime.py [--seconds 1]
+"""
+
+import argparse
+import sys
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import formataddr
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from email_service import mime, SmtpProfile, EmailMessage  # noqa: E402
+
+SIZES = {"1 KB": 1024, "100 KB": 100 * 1024, "1 MB": 1024 * 1024}
+
+
+def _stdlib(message: EmailMessage, profile: SmtpProfile) -> bytes:
+    doc = MIMEMultipart("alternative")
+    doc["From"] = formataddr((profile.from_name, profile.from_email))
+    doc["To"] = ", ".join(message.to)
+    doc["Subject"] = message.subject
+    doc.attach(MIMEText(message.html, "html"))
+    return doc.as_bytes()
+
+
+def _rate(build, html: str, profile: SmtpProfile, seconds: float) -> float:
+    count = 0
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    while time.perf_counter() < deadline:
+        message = EmailMessage.model_construct(
+            to=[f"user{count}@example.com"], subject="Newsletter", text=None, html=html,
+        )
+        build(message, profile)
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=1.0, help="duration of each run")
+    args = parser.parse_args()
+
+    profile = SmtpProfile(
+        profile_id="bench",
+        smtp_host="smtp.example.com",
+        smtp_user="u@example.com",
+        smtp_password="pw",
+        from_email="news@example.com",
+        from_name="Newsletter",
+    )
+    print(f"{'html size':>10} {'stdlib msg/s':>14} {'cached msg/s':>14} {'speedup':>9}")
+    for label, size in SIZES.items():
+        html = ("<p>Héllo newsletter readers, here is the news.</p>\n" * (size // 50 + 1))[:size]
+        stdlib = _rate(_stdlib, html, profile, args.seconds)
+        cached = _rate(mime.render, html, profile, args.seconds)
+        print(f"{label:>10} {stdlib:>14,.0f} {cached:>14,.0f} {cached / stdlib:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Benchmark — profile probes: time to warm every profile by probe
+concurrency, and the first send per profile, cold vs warm.
+
+Registers --profiles profiles on a local SMTP sink (benchmarks/smtp_sink.py,
+a separate process) and:
+
+- probes them all with PROBE_CONCURRENCY = each --concurrency level,
+  reporting the wall time until every profile is ready;
+- sends each profile's first message with cold pools (DNS, TCP, TLS and
+  EHLO on the send path) and after probing (the warm session is reused),
+  reporting latency percentiles.
+
+With --tls implicit the sink serves TLS on port 465 (binding it may need
+privileges), so the handshake includes a TLS negotiation, as in production.
+
+Run:
+    python benchmarks/bench_probes.py [--profiles 200] [--concurrency 1,16,64] [--tls implicit]
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import smtp_sink  # noqa: E402
+from email_service import pool, send, settings, EmailMessage, SmtpProfile  # noqa: E402
+from email_service.probes import Prober  # noqa: E402
+
+
+def _percentile(values: list[float], q: int) -> float:
+    return statistics.quantiles(values, n=100)[q - 1] * 1000
+
+
+async def _warm_all(profile_list: list[SmtpProfile], concurrency: int) -> float:
+    await pool.close_all()
+    prober = Prober(concurrency=concurrency)
+    start = time.perf_counter()
+    await asyncio.gather(*(prober.submit(p) for p in profile_list))
+    seconds = time.perf_counter() - start
+    failed = [r for r in prober.status() if r["status"] != "ready"]
+    if failed:
+        raise RuntimeError(f"{len(failed)} probe(s) failed, e.g. {failed[0]['error']}")
+    return seconds
+
+
+async def _first_sends(profile_list: list[SmtpProfile]) -> list[float]:
+    message = EmailMessage(to=["user@example.com"], subject="First", text="Hello")
+    latencies = []
+    for profile in profile_list:
+        start = time.perf_counter()
+        await send(message, profile)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def _run(args, port: int) -> None:
+    profile_list = [
+        SmtpProfile(profile_id=f"p{n}", smtp_host="127.0.0.1", smtp_port=port, verify_ssl=False,
+                    from_email=f"p{n}@example.com")
+        for n in range(args.profiles)
+    ]
+    print(f"{args.profiles} profiles, TLS {args.tls}\n")
+    print(f"{'concurrency':>11} {'warm all s':>11} {'profiles/s':>11}")
+    for concurrency in args.concurrency:
+        seconds = await _warm_all(profile_list, concurrency)
+        print(f"{concurrency:>11} {seconds:>11.3f} {args.profiles / seconds:>11,.0f}", flush=True)
+
+    await pool.close_all()
+    cold = await _first_sends(profile_list)
+    await pool.close_all()
+    await _warm_all(profile_list, max(args.concurrency))
+    warm = await _first_sends(profile_list)
+    await pool.close_all()
+    print(f"\n{'first send':<11} {'p50 ms':>8} {'p95 ms':>8}")
+    for label, latencies in (("cold", cold), ("warm", warm)):
+        print(f"{label:<11} {_percentile(latencies, 50):>8.2f} {_percentile(latencies, 95):>8.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", type=int, default=200)
+    parser.add_argument("--concurrency", type=lambda v: [int(n) for n in v.split(",")], default=[1, 16, 64])
+    parser.add_argument("--tls", choices=("none", "implicit"), default="none")
+    args = parser.parse_args()
+
+    settings.probe_timeout = 30.0
+    settings.default_group = ""
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        command = [sys.executable, smtp_sink.__file__]
+        if args.tls == "implicit":
+            port = 465
+            cert, key = smtp_sink.make_certificate(Path(tmp))
+            command += ["--tls", "implicit", "--cert", cert, "--key", key]
+        else:
+            port = smtp_sink.free_port()
+        sink = subprocess.Popen(command + ["--port", str(port)])
+        try:
+            smtp_sink.wait_for(port)
+            asyncio.run(_run(args, port))
+        finally:
+            sink.terminate()
+            sink.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Microbenchmark — profile lookups per second, uncached vs cached.
+
+"before" replays the old `profiles.get` path (lock + open + json.load +
+SmtpProfile validation on every call); "after" is the current snapshot lookup.
+
+Run:
+    python benchmarks/bench_profiles.py [--profiles 20] [--seconds 2]
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from email_service import profiles, settings, SmtpProfile  # noqa: E402
+
+
+def _uncached_get(profile_id: str):
+    with profiles._lock:
+        data = profiles._load_profiles().get(profile_id)
+    return SmtpProfile(**data) if data else None
+
+
+def _rate(fn, profile_id: str, seconds: float) -> float:
+    calls = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            fn(profile_id)
+        calls += 100
+    return calls / seconds
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", type=int, default=20, help="profiles in the store")
+    parser.add_argument("--seconds", type=float, default=2.0, help="duration of each run")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        settings.profiles_file = str(Path(tmp) / "profiles.json")
+        for i in range(args.profiles):
+            profiles.add(SmtpProfile(
+                profile_id=f"p{i}",
+                smtp_host="smtp.example.com",
+                smtp_user=f"user{i}@example.com",
+                smtp_password="secret",
+                from_email=f"user{i}@example.com",
+            ))
+        target = f"p{args.profiles // 2}"
+
+        before = _rate(_uncached_get, target, args.seconds)
+        after = _rate(profiles.get, target, args.seconds)
+
+    print(f"profiles in store : {args.profiles}")
+    print(f"before (uncached) : {before:>12,.0f} lookups/s")
+    print(f"after  (cached)   : {after:>12,.0f} lookups/s")
+    print(f"speedup           : {after / before:>12.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Benchmark — send scheduler: connections per host and latency per priority
+class while tenants burst bulk mail.
+
+Several profiles share one SMTP host. Half of them send a burst of bulk
+messages while the others send transactional mail at a steady rate; every
+send goes through `send`, with the SMTP hand-off replaced by a fixed delay
+(--latency-ms). Two runs:
+
+- "unlimited": SEND_HOST_CONCURRENCY and SEND_PROFILE_CONCURRENCY too high
+  to matter, so only each profile's SMTP_POOL_SIZE connections limit it,
+  and sends wait for a connection in arrival order;
+- "scheduled": the host limited to --host-limit sends in flight, shared
+  fairly, transactional first.
+
+"peak" is the most sends the host saw at once; latencies are per send,
+queue wait included (the email_send_seconds histogram's input).
+
+Run:
+    python benchmarks/bench_scheduler.py [--tenants 8] [--bulk 2000] [--transactional 200] [--host-limit 8]
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import sys
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+from aiosmtplib import SMTPResponse
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from email_service import scheduler, send, settings, EmailMessage, SmtpProfile  # noqa: E402
+
+
+def _percentile(values: list[float], q: float) -> float:
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else values[0]
+
+
+async def _run(args, host_limit: int, profile_limit: int) -> dict:
+    settings.send_host_concurrency = host_limit
+    settings.send_profile_concurrency = profile_limit
+    scheduler.reset()
+    running, peak = [0], [0]
+    connections: dict = {}
+
+    async def sendmail(self, *a, **kw):
+        # One of the profile's SMTP_POOL_SIZE connections, as the real pool does.
+        async with connections.setdefault(self, asyncio.Semaphore(settings.smtp_pool_size)):
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            await asyncio.sleep(args.latency_ms / 1000)
+            running[0] -= 1
+        return {}, SMTPResponse(250, "OK")
+
+    tenants = [
+        SmtpProfile(profile_id=f"tenant{n}", smtp_host="smtp.shared.example", from_email=f"t{n}@example.com")
+        for n in range(args.tenants)
+    ]
+    latencies: dict[str, list[float]] = {"transactional": [], "bulk": []}
+
+    async def timed(message: EmailMessage, profile: SmtpProfile) -> None:
+        start = time.perf_counter()
+        await send(message, profile)
+        latencies[message.priority].append(time.perf_counter() - start)
+
+    async def steady(profile: SmtpProfile, count: int) -> None:
+        message = EmailMessage(to=["user@example.com"], subject="Receipt", text="Thanks!")
+        tasks = []
+        for _ in range(count):
+            tasks.append(asyncio.create_task(timed(message, profile)))
+            await asyncio.sleep(args.interval_ms / 1000)
+        await asyncio.gather(*tasks)
+
+    bulk = EmailMessage(to=["user@example.com"], subject="Newsletter", text="News", priority="bulk")
+    bursting, steady_tenants = tenants[: args.tenants // 2], tenants[args.tenants // 2:]
+    per_tenant = max(1, args.transactional // max(1, len(steady_tenants)))
+    start = time.perf_counter()
+    with patch("email_service.pool.SmtpPool.sendmail", sendmail):
+        await asyncio.gather(
+            *(timed(bulk, bursting[n % len(bursting)]) for n in range(args.bulk)),
+            *(steady(profile, per_tenant) for profile in steady_tenants),
+        )
+    seconds = time.perf_counter() - start
+    return {"peak": peak[0], "seconds": seconds, "latencies": latencies}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", type=int, default=8, help="profiles on the shared host (half burst)")
+    parser.add_argument("--bulk", type=int, default=2000, help="bulk messages in the burst")
+    parser.add_argument("--transactional", type=int, default=200, help="transactional messages from the others")
+    parser.add_argument("--interval-ms", type=float, default=20.0, help="gap between one tenant's transactional sends")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="simulated SMTP hand-off time")
+    parser.add_argument("--host-limit", type=int, default=8)
+    args = parser.parse_args()
+    args.tenants = max(2, args.tenants)
+
+    settings.default_group = ""
+    settings.send_queue_size = args.bulk + args.transactional
+    settings.send_max_wait = 0
+    logging.disable(logging.INFO)
+
+    print(f"{'mode':<10} {'peak':>5} {'msgs/s':>8} {'tx p50 ms':>10} {'tx p99 ms':>10} {'bulk p50 ms':>12}")
+    for label, host_limit, profile_limit in [("unlimited", 100000, 100000), ("scheduled", args.host_limit, 0)]:
+        result = asyncio.run(_run(args, host_limit, profile_limit))
+        tx, bulk = result["latencies"]["transactional"], result["latencies"]["bulk"]
+        total = len(tx) + len(bulk)
+        print(
+            f"{label:<10} {result['peak']:>5} {total / result['seconds']:>8,.0f} "
+            f"{_percentile(tx, 50) * 1000:>10,.1f} {_percentile(tx, 99) * 1000:>10,.1f} "
+            f"{_percentile(bulk, 50) * 1000:>12,.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
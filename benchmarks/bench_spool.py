@@ -0,0 +1,87 @@
+"""
+Benchmark — spool appends/sec and fsyncs per message, by concurrency.
+
+Appends messages to a spool in a temporary directory (put it on the disk
+you care about with --dir) from N concurrent senders, as /email/send does
+during a relay outage. With group commit, appends that arrive during an
+fsync share the next one, so fsyncs per message fall as concurrency rises;
+"fsync each" is the same record written with its own fsync every time,
+without the event loop and writer thread in between.
+
+Run:
+    python benchmarks/bench_spool.py [--messages 2000] [--concurrency 1,10,100] [--dir /var/spool/test]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from email_service import spool, EmailMessage  # noqa: E402
+
+
+async def _group_commit(directory: Path, message: EmailMessage, messages: int, concurrency: int) -> tuple[float, int]:
+    store = spool.Spool(directory, segment_bytes=64 * 1024 * 1024, replay_rate=0.0)
+    syncs = 0
+    real_fsync = os.fsync
+
+    def counting_fsync(fd):
+        nonlocal syncs
+        syncs += 1
+        real_fsync(fd)
+
+    remaining = messages
+
+    async def sender():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            await store.append(message, "bench")
+
+    with patch("email_service.spool.os.fsync", counting_fsync):
+        start = time.perf_counter()
+        await asyncio.gather(*(sender() for _ in range(concurrency)))
+        seconds = time.perf_counter() - start
+        await store.stop()
+    return messages / seconds, syncs
+
+
+def _per_message(directory: Path, message: EmailMessage, messages: int) -> float:
+    fd = os.open(directory / "single.spool", os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+    record = spool.encode("0" * 32, message, "bench")
+    start = time.perf_counter()
+    for _ in range(messages):
+        os.write(fd, record)
+        os.fsync(fd)
+    seconds = time.perf_counter() - start
+    os.close(fd)
+    return messages / seconds
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000, help="messages appended per level")
+    parser.add_argument("--concurrency", type=lambda v: [int(n) for n in v.split(",")], default=[1, 10, 100])
+    parser.add_argument("--size-kb", type=float, default=2.0, help="text body size")
+    parser.add_argument("--dir", help="directory to create the test spools in (default: system temp)")
+    args = parser.parse_args()
+
+    message = EmailMessage(to=["user@example.com"], subject="Spooled", text="x" * int(args.size_kb * 1024))
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        baseline = _per_message(Path(tmp), message, min(args.messages, 500))
+        print(f"{args.messages} messages of {args.size_kb:g} KB in {tmp}\n")
+        print(f"{'senders':<18} {'appends/s':>11} {'fsyncs/msg':>11}")
+        print(f"{'1, fsync each':<18} {baseline:>11,.0f} {1:>11.3f}")
+        for concurrency in args.concurrency:
+            rate, syncs = asyncio.run(_group_commit(Path(tmp) / f"c{concurrency}", message, args.messages, concurrency))
+            print(f"{f'{concurrency}, spool':<18} {rate:>11,.0f} {syncs / args.messages:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Benchmark — per-send CPU time spent obtaining an SSL context.
+
+"uncached" builds a fresh context per send (the old behaviour, which loads
+and parses the system CA bundle every time); "cached" is the per-host lookup
+the sender uses now.
+
+Run:
+    python benchmarks/bench_ssl_context.py [--sends 200]
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from email_service import SmtpProfile  # noqa: E402
+from email_service import sender  # noqa: E402
+
+
+def _cpu_per_call(fn, n: int) -> float:
+    start = time.process_time()
+    for _ in range(n):
+        fn()
+    return (time.process_time() - start) / n
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sends", type=int, default=200, help="sends to simulate per run")
+    args = parser.parse_args()
+
+    profile = SmtpProfile(
+        profile_id="bench",
+        smtp_host="smtp.example.com",
+        smtp_user="u@example.com",
+        smtp_password="pw",
+        from_email="u@example.com",
+    )
+
+    uncached = _cpu_per_call(lambda: sender._create_ssl_context(verify=profile.verify_ssl), args.sends)
+    sender._ssl_context_for(profile)  # warm the cache
+    cached = _cpu_per_call(lambda: sender._ssl_context_for(profile), args.sends * 1000)
+
+    print(f"sends             : {args.sends}")
+    print(f"uncached          : {uncached * 1e3:>10.3f} ms CPU/send")
+    print(f"cached            : {cached * 1e6:>10.3f} us CPU/send")
+    print(f"speedup           : {uncached / cached:>10.0f}x")
+
+
+if __name__ == "__main__":
+    main()
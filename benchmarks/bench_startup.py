@@ -0,0 +1,128 @@
+"""
+Benchmark — cold start: import time of the package and time to the first 200.
+
+Each measurement runs in a fresh interpreter, as a serverless invocation or
+a short-lived job would:
+
+- import time of common entry points, from `python -X importtime` (the sum
+  of every module imported by the statement, interpreter startup excluded),
+  with the modules that cost the most;
+- time to first 200: importing `main`, running the app's startup and
+  answering GET / in process over ASGI, plus the whole process wall time.
+
+`--check` exits non-zero when a median exceeds its budget (BUDGETS_MS), the
+same budgets tests/test_startup.py enforces with more headroom.
+
+Run:
+    python benchmarks/bench_startup.py [--runs 5] [--check]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+STATEMENTS = [
+    "import email_service",
+    "from email_service import profiles",
+    "from email_service import send",
+    "import main",
+]
+
+BUDGETS_MS = {
+    "import email_service": 20,
+    "from email_service import profiles": 400,
+    "first 200": 2000,
+}
+
+MARKER = "import time: -- statement --"
+
+FIRST_200 = """
+import asyncio, time
+start = time.perf_counter()
+from httpx import AsyncClient, ASGITransport
+import main
+
+async def first():
+    async with main.app.router.lifespan_context(main.app):
+        async with AsyncClient(transport=ASGITransport(app=main.app), base_url="http://bench") as client:
+            return (await client.get("/")).status_code
+
+assert asyncio.run(first()) == 200
+print(time.perf_counter() - start)
+"""
+
+
+def _env(tmp: str) -> dict:
+    # An empty working directory: no .env, profiles or queue files from the checkout.
+    return {**os.environ, "PYTHONPATH": str(ROOT), "PROFILES_FILE": str(Path(tmp) / "profiles.json")}
+
+
+def import_time(statement: str, tmp: str) -> tuple[float, list[tuple[float, str]]]:
+    """Seconds spent importing for `statement`, and (seconds, module) per module imported."""
+    code = f"import sys; sys.stderr.write({MARKER!r} + '\\n'); {statement}"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], cwd=tmp, env=_env(tmp),
+        capture_output=True, text=True, check=True,
+    )
+    lines = result.stderr.split(MARKER + "\n", 1)[1].splitlines()
+    modules = []
+    for line in lines:
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        if self_us.strip().isdigit():
+            modules.append((int(self_us) / 1e6, name.strip()))
+    return sum(seconds for seconds, _ in modules), modules
+
+
+def first_200(tmp: str) -> tuple[float, float]:
+    """(seconds from first import to the first 200, whole process wall time)."""
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", FIRST_200], cwd=tmp, env=_env(tmp), capture_output=True, text=True, check=True,
+    )
+    return float(result.stdout.split()[-1]), time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per measurement")
+    parser.add_argument("--top", type=int, default=3, help="costliest modules listed per statement")
+    parser.add_argument("--check", action="store_true", help="exit non-zero if a budget is exceeded")
+    args = parser.parse_args()
+
+    over = []
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Median of {args.runs} runs, Python {sys.version.split()[0]}\n")
+        print(f"{'statement':<38} {'import ms':>10} {'modules':>8}   costliest")
+        for statement in STATEMENTS:
+            runs = [import_time(statement, tmp) for _ in range(args.runs)]
+            ms = statistics.median(total for total, _ in runs) * 1000
+            modules = runs[-1][1]
+            costliest = ", ".join(
+                f"{name} {seconds * 1000:.0f}" for seconds, name in sorted(modules, reverse=True)[:args.top]
+            )
+            print(f"{statement:<38} {ms:>10.1f} {len(modules):>8}   {costliest}")
+            if ms > BUDGETS_MS.get(statement, float("inf")):
+                over.append(f"{statement}: {ms:.0f} ms > {BUDGETS_MS[statement]} ms")
+
+        runs = [first_200(tmp) for _ in range(args.runs)]
+        ms = statistics.median(first for first, _ in runs) * 1000
+        wall = statistics.median(total for _, total in runs) * 1000
+        print(f"\n{'first 200 (import main, startup, GET /)':<38} {ms:>10.1f} ms, process wall {wall:.1f} ms")
+        if ms > BUDGETS_MS["first 200"]:
+            over.append(f"first 200: {ms:.0f} ms > {BUDGETS_MS['first 200']} ms")
+
+    if args.check and over:
+        sys.exit("Over budget:\n  " + "\n  ".join(over))
+
+
+if __name__ == "__main__":
+    main()
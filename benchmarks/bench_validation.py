@@ -0,0 +1,114 @@
+"""
+Benchmark — POST /email/send requests/sec by recipients per message and
+address validation mode.
+
+Each request goes through the FastAPI app in process over ASGI (JSON
+parsing, validation, MIME, routing); the SMTP hand-off is replaced by a
+no-op so the numbers show request handling, not a mail server. Recipients
+are drawn from a fixed population, as real traffic repeats addresses, and
+the cached modes are measured once every address has been seen.
+
+Modes:
+- "full, uncached": email-validator on every address (EmailStr's cost);
+- "full": the same check, with validated addresses kept in the LRU;
+- "syntax, uncached" and "syntax": ADDRESS_VALIDATION=syntax, without and
+  with the LRU.
+
+"validate µs" is the cost of `EmailMessage.model_validate_json` alone.
+
+Run:
+    python benchmarks/bench_validation.py [--requests 300] [--recipients 1,100,1000]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+from aiosmtplib import SMTPResponse
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from email_service import addresses, profiles, settings, EmailMessage, SmtpProfile  # noqa: E402
+
+MODES = [
+    ("full, uncached", "full", 0),
+    ("full", "full", 100000),
+    ("syntax, uncached", "syntax", 0),
+    ("syntax", "syntax", 100000),
+]
+
+
+async def _sendmail(self, sender, recipients, data, **kwargs):
+    return {}, SMTPResponse(250, "OK")
+
+
+def _bodies(recipients: int, population: int, count: int) -> list[bytes]:
+    addresses_ = [f"user{i}@example{i % 50}.com" for i in range(population)]
+    bodies = []
+    for n in range(count):
+        start = (n * recipients) % population
+        to = [addresses_[(start + i) % population] for i in range(recipients)]
+        bodies.append(json.dumps({"to": to, "subject": "Hello", "text": "A short message."}).encode())
+    return bodies
+
+
+async def _requests_per_sec(client, bodies: list[bytes]) -> float:
+    headers = {"Content-Type": "application/json"}
+    await client.post("/email/send", content=bodies[0], headers=headers)
+    start = time.perf_counter()
+    for body in bodies:
+        r = await client.post("/email/send", content=body, headers=headers)
+        assert r.status_code == 200, r.text
+    return len(bodies) / (time.perf_counter() - start)
+
+
+def _validate_us(bodies: list[bytes]) -> float:
+    start = time.perf_counter()
+    for body in bodies:
+        EmailMessage.model_validate_json(body)
+    return (time.perf_counter() - start) / len(bodies) * 1e6
+
+
+async def _run(args) -> None:
+    from httpx import AsyncClient, ASGITransport
+    from main import app
+
+    print(f"{'recipients':>10} {'mode':<17} {'req/s':>9} {'validate µs':>12}")
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+        for recipients in args.recipients:
+            count = max(10, args.requests // max(1, recipients // 100))
+            bodies = _bodies(recipients, args.population, count)
+            for label, mode, cache_size in MODES:
+                settings.address_validation, settings.address_cache_size = mode, cache_size
+                addresses.clear_cache()
+                _validate_us(bodies)  # steady state: the population has been seen before (when cached)
+                rate = await _requests_per_sec(client, bodies)
+                print(f"{recipients:>10} {label:<17} {rate:>9,.1f} {_validate_us(bodies):>12,.0f}", flush=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300, help="requests per row at 100 recipients or fewer")
+    parser.add_argument("--recipients", type=lambda v: [int(n) for n in v.split(",")], default=[1, 100, 1000])
+    parser.add_argument("--population", type=int, default=20000, help="distinct addresses recipients come from")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        settings.profiles_file = str(Path(tmp) / "profiles.json")
+        settings.default_profile_id = "bench"
+        settings.default_group = ""
+        settings.queue_enabled = False
+        profiles.add(SmtpProfile(profile_id="bench", smtp_host="127.0.0.1", from_email="bench@example.com"))
+        logging.disable(logging.INFO)
+        with patch("email_service.pool.SmtpPool.sendmail", _sendmail):
+            asyncio.run(_run(args))
+
+
+if __name__ == "__main__":
+    main()
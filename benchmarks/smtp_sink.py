@@ -0,0 +1,204 @@
+"""
+SMTP sink — a local SMTP server for benchmarks that accepts and discards mail.
+
+Replies to the end of DATA can be delayed (server processing time) and
+randomly turned into transient (451) or permanent (554) failures. TLS is
+either implicit (the whole session, as on port 465) or offered through
+STARTTLS (as on port 587), with a self-signed certificate made by
+`make_certificate`. Replies on a connection always go out in order, so
+pipelining clients see a realistic server.
+
+Benchmarks start it as a separate process (so its CPU time is not counted
+against the client) and wait for the port with `wait_for`.
+
+Run:
+    python benchmarks/smtp_sink.py --port 2525 [--latency-ms 20] [--fail-rate 0.01]
+"""
+
+import argparse
+import asyncio
+import random
+import socket
+import ssl
+import subprocess
+import time
+from collections import deque
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+
+class SinkOptions(NamedTuple):
+    latency: float = 0.0  # seconds before the reply to end of DATA
+    fail_rate: float = 0.0  # share of messages answered 451
+    reject_rate: float = 0.0  # share of messages answered 554
+    tls: str = "none"  # "none", "implicit" or "starttls"
+    certfile: Optional[str] = None
+    keyfile: Optional[str] = None
+
+
+class _Session(asyncio.Protocol):
+    """One SMTP connection: commands in, ordered (possibly delayed) replies out."""
+
+    def __init__(self, options: SinkOptions, tls_context: Optional[ssl.SSLContext]):
+        self.options = options
+        self.tls_context = tls_context
+        self.secure = options.tls == "implicit"
+        self._pending: deque[tuple[float, bytes]] = deque()
+        self._flusher: Optional[asyncio.Task] = None
+        self._upgrading = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.buffer = b""
+        self.in_data = False
+        self._reply(b"220 sink ready")
+
+    def _reply(self, line: bytes, delay: float = 0.0) -> None:
+        if delay <= 0 and self._flusher is None:
+            self.transport.write(line + b"\r\n")
+            return
+        self._pending.append((delay, line))
+        if self._flusher is None:
+            self._flusher = asyncio.get_running_loop().create_task(self._flush())
+
+    async def _flush(self) -> None:
+        while self._pending:
+            delay, line = self._pending.popleft()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.transport.is_closing():
+                self._pending.clear()
+                break
+            self.transport.write(line + b"\r\n")
+        self._flusher = None
+
+    def _end_of_data(self) -> None:
+        options = self.options
+        roll = random.random()
+        if roll < options.fail_rate:
+            reply = b"451 4.3.0 Temporary failure, try again"
+        elif roll < options.fail_rate + options.reject_rate:
+            reply = b"554 5.7.1 Message rejected"
+        else:
+            reply = b"250 2.0.0 OK"
+        self._reply(reply, options.latency)
+
+    def data_received(self, data):
+        self.buffer += data
+        while not self._upgrading:
+            if self.in_data:
+                end = self.buffer.find(b"\r\n.\r\n")
+                if end == -1:
+                    self.buffer = self.buffer[-4:]
+                    return
+                self.buffer = self.buffer[end + 5:]
+                self.in_data = False
+                self._end_of_data()
+                continue
+            end = self.buffer.find(b"\r\n")
+            if end == -1:
+                return
+            line, self.buffer = self.buffer[:end].upper(), self.buffer[end + 2:]
+            if line.startswith((b"EHLO", b"HELO")):
+                starttls = self.options.tls == "starttls" and not self.secure
+                self._reply(b"250-sink\r\n250-PIPELINING\r\n" + (b"250-STARTTLS\r\n" if starttls else b"")
+                            + b"250 8BITMIME")
+            elif line == b"STARTTLS" and self.tls_context is not None and not self.secure:
+                self._reply(b"220 Ready to start TLS")
+                self._upgrading = True
+                asyncio.get_running_loop().create_task(self._start_tls())
+                return
+            elif line == b"DATA":
+                self.in_data = True
+                # DATA always follows a CRLF, so the terminator can be matched from here.
+                self.buffer = b"\r\n" + self.buffer
+                self._reply(b"354 Go ahead")
+            elif line == b"QUIT":
+                self._reply(b"221 Bye")
+                self.transport.close()
+                return
+            else:
+                self._reply(b"250 OK")
+
+    async def _start_tls(self) -> None:
+        if self._flusher is not None:
+            await self._flusher
+        self.buffer = b""
+        try:
+            transport = await asyncio.get_running_loop().start_tls(
+                self.transport, self, self.tls_context, server_side=True,
+            )
+        except (OSError, ssl.SSLError):
+            self.transport.close()
+            return
+        # Commands that arrived during the handshake were held back until now.
+        self.transport, self.secure, self._upgrading = transport, True, False
+        self.data_received(b"")
+
+    def connection_lost(self, exc):
+        if self._flusher is not None:
+            self._flusher.cancel()
+
+
+def make_certificate(directory: Path) -> tuple[str, str]:
+    """Write a self-signed certificate for 127.0.0.1/localhost; returns (certfile, keyfile)."""
+    cert, key = directory / "sink.crt", directory / "sink.key"
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-keyout", str(key), "-out", str(cert), "-subj", "/CN=localhost",
+         "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1"],
+        check=True, capture_output=True,
+    )
+    return str(cert), str(key)
+
+
+async def serve(port: int, options: SinkOptions = SinkOptions()) -> None:
+    """Accept SMTP connections on 127.0.0.1:`port` until cancelled."""
+    tls_context = None
+    if options.tls != "none":
+        tls_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        tls_context.load_cert_chain(options.certfile, options.keyfile)
+    server = await asyncio.get_running_loop().create_server(
+        lambda: _Session(options, tls_context), "127.0.0.1", port,
+        ssl=tls_context if options.tls == "implicit" else None,
+    )
+    async with server:
+        await server.serve_forever()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(port: int) -> None:
+    """Block until something accepts connections on the port."""
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("SMTP sink did not start")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay before acknowledging each message")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of messages refused with 451")
+    parser.add_argument("--reject-rate", type=float, default=0.0, help="share of messages refused with 554")
+    parser.add_argument("--tls", choices=("none", "implicit", "starttls"), default="none")
+    parser.add_argument("--cert", help="certificate file (TLS)")
+    parser.add_argument("--key", help="private key file (TLS)")
+    args = parser.parse_args()
+    options = SinkOptions(args.latency_ms / 1000, args.fail_rate, args.reject_rate, args.tls, args.cert, args.key)
+    try:
+        asyncio.run(serve(args.port, options))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -22,17 +22,90 @@ Usage as a module:
 
 Usage as a standalone server:
     uvicorn main:app --reload
+
+Importing the package is cheap: submodules, the models (pydantic) and the
+sender (aiosmtplib) are imported on first attribute access, and settings
+are read from .env on first use.
 """
 
-from .models import SmtpProfile, EmailMessage
-from .sender import send
-from . import profiles
-from .config import settings
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .models import SmtpProfile, EmailMessage, EmailBatch, EmailTemplate, ProfileGroup, GroupMember, Attachment
+    from .sender import send, send_many, send_sequence
+    from . import (
+        profiles, storage, groups, templates, idempotency, pool, pipeline, direct, resolver, attachments, outbox,
+        retry, ratelimit, metrics, spool, scheduler, probes, dkim,
+    )
+    from .ratelimit import RateLimitExceeded
+    from .config import settings
+
+_SUBMODULES = {
+    "profiles", "storage", "groups", "templates", "idempotency", "pool", "pipeline", "direct", "resolver",
+    "attachments", "outbox", "spool", "scheduler", "probes", "dkim", "retry", "ratelimit", "metrics",
+}
+
+# Exported names defined in a submodule: name -> module
+_ATTRIBUTES = {
+    "send": "sender",
+    "send_many": "sender",
+    "send_sequence": "sender",
+    "RateLimitExceeded": "ratelimit",
+    "SmtpProfile": "models",
+    "EmailMessage": "models",
+    "EmailBatch": "models",
+    "EmailTemplate": "models",
+    "ProfileGroup": "models",
+    "GroupMember": "models",
+    "Attachment": "models",
+    "settings": "config",
+}
 
 __all__ = [
     "send",
+    "send_many",
+    "send_sequence",
     "profiles",
+    "storage",
+    "groups",
+    "templates",
+    "idempotency",
+    "pool",
+    "pipeline",
+    "direct",
+    "resolver",
+    "attachments",
+    "outbox",
+    "spool",
+    "scheduler",
+    "probes",
+    "dkim",
+    "retry",
+    "ratelimit",
+    "metrics",
+    "RateLimitExceeded",
     "SmtpProfile",
     "EmailMessage",
+    "EmailBatch",
+    "EmailTemplate",
+    "ProfileGroup",
+    "GroupMember",
+    "Attachment",
     "settings",
 ]
+
+
+def __getattr__(name: str):
+    if name in _SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    module = _ATTRIBUTES.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f"{__name__}.{module}"), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,84 @@
+"""
+Addresses — email address validation with an LRU of addresses already seen.
+
+Every address in a request (`to`, batch recipients, a profile's from_email)
+goes through `validate`. ADDRESS_VALIDATION picks how:
+
+- "full" (default): the same check as pydantic's EmailStr, by
+  email-validator: RFC 5322/6531 syntax, internationalized domains (IDNA)
+  and normalization. No DNS lookups are made.
+- "syntax": a strict ASCII-only check, several times cheaper: a dot-atom
+  local part, a host name with at least two labels, RFC length limits.
+  Quoted local parts, IP-literal domains and non-ASCII addresses are
+  refused; the domain is lower-cased.
+
+Valid addresses are remembered (ADDRESS_CACHE_SIZE, least recently used
+evicted), so a recipient seen before costs a dictionary lookup. Invalid
+ones are not cached. The key includes the mode, so changing it never
+serves an address checked under the other one.
+"""
+
+import functools
+import re
+from typing import Callable, Optional
+
+from pydantic_core import PydanticCustomError
+
+from .config import settings
+
+_ATOM = r"[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+"
+_LABEL = r"[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?"
+_SYNTAX = re.compile(rf"({_ATOM}(?:\.{_ATOM})*)@((?:{_LABEL}\.)+[A-Za-z](?:[A-Za-z0-9-]{{0,61}}[A-Za-z0-9])?)")
+
+
+def _invalid(reason: str) -> PydanticCustomError:
+    # Same error type and wording as EmailStr, so API clients see no difference.
+    return PydanticCustomError("value_error", "value is not a valid email address: {reason}", {"reason": reason})
+
+
+def check_syntax(value: str) -> str:
+    """Strict syntax-only check; returns the address with its domain lower-cased."""
+    value = value.strip()  # as EmailStr does
+    match = _SYNTAX.fullmatch(value)
+    if match is None:
+        reason = "An email address must have an @-sign." if "@" not in value else "Invalid address syntax."
+        raise _invalid(reason)
+    local, domain = match.groups()
+    if len(local) > 64:
+        raise _invalid("The local part is too long.")
+    if len(value) > 254:
+        raise _invalid("The address is too long.")
+    return f"{local}@{domain.lower()}"
+
+
+def check_full(value: str) -> str:
+    """email-validator's check, as EmailStr does it; returns the normalized address."""
+    from pydantic.networks import validate_email  # imports email-validator on first use
+    return validate_email(value)[1]
+
+
+def _check(mode: str, value: str) -> str:
+    return check_syntax(value) if mode == "syntax" else check_full(value)
+
+
+_cached: Optional[tuple[int, Callable[[str, str], str]]] = None
+
+
+def _validator() -> Callable[[str, str], str]:
+    """`_check` behind an LRU of ADDRESS_CACHE_SIZE, rebuilt when the size setting changes."""
+    global _cached
+    size = settings.address_cache_size
+    cached = _cached
+    if cached is None or cached[0] != size:
+        cached = _cached = (size, functools.lru_cache(maxsize=max(0, size))(_check))
+    return cached[1]
+
+
+def validate(value: str) -> str:
+    """The normalized address, from the cache when it was seen before. Raises a pydantic value error."""
+    return _validator()(settings.address_validation, value)
+
+
+def clear_cache() -> None:
+    global _cached
+    _cached = None
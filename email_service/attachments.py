@@ -0,0 +1,108 @@
+"""
+Attachments — files sent with a message, streamed from disk.
+
+An attachment is a reference to a file; its bytes are read in chunks only
+while the message is being sent. Relative paths are taken from
+`settings.attachments_dir`, and the API refuses paths outside it. Uploaded
+files are written there in chunks first (under `uploads/`), so an
+attachment is never held in memory whole.
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import uuid
+from pathlib import Path
+from typing import Iterable, Optional
+
+from .config import settings
+from .models import Attachment
+from . import jsonfile
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from an upload per write to disk.
+UPLOAD_CHUNK = 1024 * 1024
+
+
+class AttachmentError(ValueError):
+    """An attachment is missing, too large, or not allowed."""
+
+
+def root() -> Path:
+    """The attachments directory."""
+    return jsonfile.resolve(settings.attachments_dir)
+
+
+def locate(attachment: Attachment) -> Path:
+    """Where an attachment's file is: its path, relative to the attachments directory."""
+    return root() / attachment.path
+
+
+def check(attachment: Attachment) -> int:
+    """Return the attachment's size; raise AttachmentError if it can't be sent."""
+    path = locate(attachment)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        raise AttachmentError(f"Attachment '{attachment.path}' not found") from None
+    if not path.is_file():
+        raise AttachmentError(f"Attachment '{attachment.path}' is not a file")
+    if st.st_size > settings.attachment_max_bytes:
+        raise AttachmentError(
+            f"Attachment '{attachment.path}' exceeds {settings.attachment_max_bytes} bytes"
+        )
+    return st.st_size
+
+
+def confine(attachment: Attachment) -> None:
+    """Refuse paths that escape the attachments directory (used for API requests)."""
+    base = root().resolve()
+    if not locate(attachment).resolve().is_relative_to(base):
+        raise AttachmentError(f"Attachment path '{attachment.path}' is outside the attachments directory")
+    check(attachment)
+
+
+def _safe_name(filename: Optional[str]) -> str:
+    name = Path(filename or "").name.strip()
+    return name if name not in ("", ".", "..") else "attachment"
+
+
+async def save_upload(upload) -> Attachment:
+    """
+    Copy an uploaded file (anything with an async `read(size)`, `filename`
+    and `content_type`, e.g. FastAPI's UploadFile) into the uploads
+    directory chunk by chunk. Raises AttachmentError if it is too large.
+    """
+    filename = _safe_name(upload.filename)
+    directory = root() / "uploads" / uuid.uuid4().hex
+    await asyncio.to_thread(directory.mkdir, parents=True)
+    dest = directory / filename
+    written = 0
+    f = await asyncio.to_thread(open, dest, "wb")
+    try:
+        while chunk := await upload.read(UPLOAD_CHUNK):
+            written += len(chunk)
+            if written > settings.attachment_max_bytes:
+                raise AttachmentError(f"Attachment '{filename}' exceeds {settings.attachment_max_bytes} bytes")
+            await asyncio.to_thread(f.write, chunk)
+    except BaseException:
+        f.close()
+        await asyncio.to_thread(shutil.rmtree, directory, True)
+        raise
+    f.close()
+    return Attachment(
+        path=str(dest.relative_to(root())),
+        filename=upload.filename or filename,
+        content_type=upload.content_type,
+    )
+
+
+def discard_uploads(attachments: Iterable[Attachment]) -> None:
+    """Delete the uploaded files among `attachments` once their message is done."""
+    uploads = (root() / "uploads").resolve()
+    for attachment in attachments:
+        directory = locate(attachment).resolve().parent
+        if directory.parent == uploads:
+            shutil.rmtree(directory, ignore_errors=True)
@@ -1,33 +1,72 @@
 """
 Configuration loader for the Email Service.
+
+`settings` stands in for the Settings object (see env.py) and builds it on
+first attribute access, so importing the package neither imports
+pydantic-settings nor reads .env. Reads, assignments (tests patch settings
+freely) and deletes all go to the loaded object.
 """
 
-from pydantic_settings import BaseSettings, SettingsConfigDict
+import threading
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from .env import Settings
+
+
+class _LazySettings:
+    """
+    Proxy for the process-wide Settings, loaded once on first use. Field
+    values are copied onto the proxy as they are read, so later reads are
+    plain attribute lookups; assignments update both.
+    """
+
+    def __init__(self):
+        object.__setattr__(self, "_loaded", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def _load(self) -> "Settings":
+        loaded = self._loaded
+        if loaded is None:
+            with self._lock:
+                loaded = self._loaded
+                if loaded is None:
+                    from .env import Settings
+                    loaded = Settings()
+                    object.__setattr__(self, "_loaded", loaded)
+        return loaded
+
+    def __getattr__(self, name: str) -> Any:
+        # Only reached for names not copied yet (and for properties, never copied).
+        loaded = self._load()
+        value = getattr(loaded, name)
+        if name in type(loaded).model_fields:
+            self.__dict__[name] = value
+        return value
 
+    def __setattr__(self, name: str, value: Any) -> None:
+        loaded = self._load()
+        setattr(loaded, name, value)
+        if name in type(loaded).model_fields:
+            self.__dict__[name] = getattr(loaded, name)
 
-class Settings(BaseSettings):
-    """Application settings loaded from .env"""
+    def __delattr__(self, name: str) -> None:
+        self.__dict__.pop(name, None)
+        delattr(self._load(), name)
 
-    # Default SMTP profile (auto-registered on startup)
-    default_profile_id: str = ""
-    smtp_host: str = ""
-    smtp_port: int = 587
-    smtp_user: str = ""
-    smtp_password: str = ""
-    from_email: str = ""
-    from_name: str = "Email Service"
-    verify_ssl: bool = True
+    def __dir__(self) -> list[str]:
+        return dir(self._load())
 
-    # App settings
-    host: str = "127.0.0.1"
-    port: int = 9001
-    profiles_file: str = "profiles.json"
+    def __repr__(self) -> str:
+        return repr(self._load())
 
-    model_config = SettingsConfigDict(env_file=".env", env_ignore_empty=True)
 
-    @property
-    def has_default_profile(self) -> bool:
-        return bool(self.default_profile_id and self.smtp_host and self.smtp_user and self.smtp_password)
+settings: "Settings" = _LazySettings()  # type: ignore[assignment]
 
 
-settings = Settings()
+def __getattr__(name: str) -> Any:
+    # `from email_service.config import Settings` keeps working, importing it on demand.
+    if name == "Settings":
+        from .env import Settings
+        return Settings
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,167 @@
+"""
+Direct Delivery — relay-less sending straight to recipients' MX hosts.
+
+Recipients are grouped by domain; each domain's MX hosts come from the
+cached `resolver`, and are tried in preference order until one takes the
+mail. Every MX host has its own small connection pool, so a slow or
+throttling destination only ever holds `settings.mx_max_connections`
+sessions, while other domains are delivered concurrently.
+"""
+
+import asyncio
+import logging
+import socket
+import ssl
+from itertools import groupby
+from typing import AsyncIterable, Callable, Optional, Sequence, Union
+
+import aiosmtplib
+from aiosmtplib import SMTPResponse
+
+from .config import settings
+from .models import SmtpProfile
+from .pool import SmtpPool
+from . import pipeline, resolver, retry
+
+logger = logging.getLogger(__name__)
+
+# Recipients per transaction: the minimum every server must accept (RFC 5321 §4.5.3.1.8).
+MAX_RECIPIENTS = 100
+
+Outcome = Union[list[SMTPResponse], BaseException]
+
+# Message content for a shared transaction: bytes, or a factory opening a
+# fresh chunk stream for each transaction (see `pipeline.send_stream`).
+Data = Union[bytes, Callable[[], AsyncIterable[bytes]]]
+
+_pools: dict[str, SmtpPool] = {}
+_tls_context: Optional[ssl.SSLContext] = None
+
+
+def _context() -> ssl.SSLContext:
+    """
+    The context for STARTTLS to MX hosts. Many MX certificates do not match
+    the host name, so verification is off unless `settings.mx_verify_tls`.
+    """
+    global _tls_context
+    if _tls_context is None:
+        _tls_context = ssl.create_default_context()
+        if not settings.mx_verify_tls:
+            _tls_context.check_hostname = False
+            _tls_context.verify_mode = ssl.CERT_NONE
+    return _tls_context
+
+
+def pool_for(host: str) -> SmtpPool:
+    """Return the connection pool for one MX host, creating it on first use."""
+    pool = _pools.get(host)
+    if pool is None:
+        # No credentials and no real sender: the pool only needs host and port.
+        profile = SmtpProfile.model_construct(
+            profile_id=f"mx:{host}", smtp_host=host, smtp_port=settings.mx_port,
+            smtp_user="", smtp_password="", direct=True,
+        )
+        pool = _pools[host] = SmtpPool(
+            profile,
+            _context(),
+            size=settings.mx_max_connections,
+            idle_timeout=settings.smtp_pool_idle_timeout,
+            max_messages=settings.smtp_pool_max_messages,
+            max_bytes=settings.smtp_pool_max_bytes,
+            opportunistic_tls=True,
+            local_hostname=settings.mx_helo_name or socket.getfqdn(),
+        )
+    return pool
+
+
+def _domain(address: str) -> str:
+    return address.rpartition("@")[2].lower()
+
+
+async def _send_run(
+    pool: SmtpPool,
+    sender: str,
+    recipients: list[str],
+    data: Optional[Data],
+    render: Optional[Callable[[str], pipeline.Content]],
+    pace: Optional[pipeline.Pace],
+) -> list[SMTPResponse]:
+    """One transaction (or one session of individual copies); a reply per recipient."""
+    if render is not None:
+        return await pool.send_copies(sender, recipients, render, pace=pace)
+    try:
+        if callable(data):
+            refused, response = await pool.send_stream(sender, recipients, data)
+        else:
+            refused, response = await pool.sendmail(sender, recipients, data)
+    except aiosmtplib.SMTPRecipientsRefused as e:
+        refused, response = {r.recipient: SMTPResponse(r.code, r.message) for r in e.recipients}, None
+    return [refused.get(rcpt) or response for rcpt in recipients]
+
+
+async def _send_domain(
+    domain: str,
+    sender: str,
+    recipients: list[str],
+    data: Optional[Data],
+    render: Optional[Callable[[str], pipeline.Content]],
+    pace: Optional[pipeline.Pace],
+) -> Outcome:
+    """Deliver to one domain, falling back to its next MX host on transient failures."""
+    try:
+        hosts = await resolver.lookup(domain)
+    except Exception as e:
+        return e
+    error: Optional[BaseException] = None
+    for host in hosts:
+        pool = pool_for(host)
+        if render is not None:
+            runs = pipeline.split(recipients, pool.size, settings.smtp_pool_max_messages)
+        else:
+            runs = pipeline.split(recipients, 1, MAX_RECIPIENTS)
+        outcomes = await asyncio.gather(
+            *(_send_run(pool, sender, run, data, render, pace) for run in runs), return_exceptions=True,
+        )
+        errors = [o for o in outcomes if isinstance(o, BaseException)]
+        if len(errors) < len(outcomes):
+            replies: list[SMTPResponse] = []
+            for run, outcome in zip(runs, outcomes):
+                if isinstance(outcome, BaseException):
+                    outcome = [SMTPResponse(retry.smtp_code(outcome) or pipeline.NOT_SENT, str(outcome))] * len(run)
+                replies.extend(outcome)
+            return replies
+        error = errors[0]
+        if retry.classify(error) != retry.TRANSIENT:
+            break
+        logger.info("MX %s for %s failed (%s), trying the next one", host, domain, error)
+    return error
+
+
+async def deliver(
+    sender: str,
+    recipients: Sequence[str],
+    *,
+    data: Optional[Data] = None,
+    render: Optional[Callable[[str], pipeline.Content]] = None,
+    pace: Optional[pipeline.Pace] = None,
+) -> list[tuple[list[str], Outcome]]:
+    """
+    Deliver `data` to every recipient, or with `render` one copy per recipient
+    (awaiting `pace()` before each), via each recipient domain's MX hosts.
+
+    Domains are delivered concurrently. Returns (recipients, outcome) per
+    domain: a reply per recipient, or the error that stopped the domain.
+    """
+    runs = [list(group) for _, group in groupby(pipeline.by_domain(recipients), key=_domain)]
+    outcomes = await asyncio.gather(
+        *(_send_domain(_domain(run[0]), sender, run, data, render, pace) for run in runs)
+    )
+    return list(zip(runs, outcomes))
+
+
+async def close_all() -> None:
+    """Close every MX connection pool. Called from the server's shutdown path."""
+    pools = list(_pools.values())
+    _pools.clear()
+    for pool in pools:
+        await pool.close()
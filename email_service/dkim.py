@@ -0,0 +1,312 @@
+"""
+DKIM — signs outgoing mail for profiles with a DKIM selector and key.
+
+A signature covers the From, To, Subject, Date, Message-ID, MIME-Version
+and Content-Type headers and a hash of the body, both canonicalized
+"relaxed" (RFC 6376), so relays that re-fold headers or trim trailing
+whitespace do not break it. RSA keys sign with rsa-sha256 and Ed25519 keys
+with ed25519-sha256 (RFC 8463).
+
+Most of the work is done once and reused:
+
+- a profile's key is parsed on first use and kept until its file changes;
+- the body hash is computed once per encoded body and cached on it (see
+  `mime.prepare`), so a message sent to many recipients, or rendered from
+  a template that only personalizes its subject, hashes its body,
+  attachments included, once; the canonical fixed headers are cached on
+  each prepared message;
+- each copy then only canonicalizes its own To, Date and Message-ID and
+  signs, in a pool of DKIM_WORKERS threads off the event loop.
+
+Keys are PEM files (PKCS#8 or traditional RSA) loaded with the optional
+`cryptography` package, imported on first use.
+"""
+
+import asyncio
+import base64
+import hashlib
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional
+
+from .config import settings
+from .models import SmtpProfile
+from . import jsonfile, metrics, mime
+
+logger = logging.getLogger(__name__)
+
+# Signed headers, in signing order; the first three come from each copy's head.
+SIGNED_HEADERS = ("from", "to", "subject", "date", "message-id", "mime-version", "content-type")
+
+# Width of the folded b= value in the emitted header.
+_FOLD = 72
+
+_FIELD_END = re.compile(rb"\r\n(?![ \t])")
+_WSP = re.compile(rb"[ \t]+")
+
+
+class DkimError(Exception):
+    """A profile's DKIM key is missing, unreadable or of an unsupported type."""
+
+
+# ─── Canonicalization ────────────────────────────────────────────────────────
+
+
+def canonical_headers(block: bytes) -> dict[str, bytes]:
+    """
+    Relaxed canonical form ("name:value\\r\\n") of each header field in a
+    CRLF-separated block, by lowercase name; the last of a repeated field wins.
+    """
+    fields = {}
+    for field in _FIELD_END.split(block):
+        name, colon, value = field.partition(b":")
+        if not colon:
+            continue
+        value = _WSP.sub(b" ", value.replace(b"\r\n", b"")).strip(b" ")
+        name = name.rstrip(b" \t").lower()
+        fields[name.decode("ascii")] = name + b":" + value + b"\r\n"
+    return fields
+
+
+class _BodyHasher:
+    """
+    SHA-256 of a body in relaxed canonical form, fed in chunks: whitespace
+    runs become one space, trailing whitespace and empty lines at the end
+    are dropped. Only whole lines are hashed; a partial one waits for the
+    next chunk.
+    """
+
+    def __init__(self):
+        self._hash = hashlib.sha256()
+        self._blank = 0  # empty lines held back: they count only if text follows
+        self._rest = b""
+
+    def update(self, data: bytes) -> None:
+        if self._rest:
+            data = self._rest + data
+        end = data.rfind(b"\r\n")
+        if end < 0:
+            self._rest = data
+            return
+        self._rest = data[end + 2:]
+        self._lines(data[:end + 2])
+
+    def _lines(self, block: bytes) -> None:
+        if not block:
+            return
+        if b" " in block or b"\t" in block:
+            block = _WSP.sub(b" ", block).replace(b" \r\n", b"\r\n")
+        text = block.rstrip(b"\r\n")
+        if not text:
+            self._blank += len(block) // 2
+            return
+        if self._blank:
+            self._hash.update(b"\r\n" * self._blank)
+        self._hash.update(text + b"\r\n")
+        self._blank = (len(block) - len(text)) // 2 - 1
+
+    def digest(self) -> str:
+        if self._rest:
+            self._lines(self._rest + b"\r\n")
+            self._rest = b""
+        return base64.b64encode(self._hash.digest()).decode("ascii")
+
+
+class _Digest:
+    """What every signature of one prepared message shares."""
+
+    __slots__ = ("body_hash", "headers")
+
+    def __init__(self, body_hash: str, headers: dict[str, bytes]):
+        self.body_hash = body_hash
+        self.headers = headers
+
+
+def _body_hash(prepared: mime.PreparedMessage) -> str:
+    """The hash of a message's body, attachments included, computed once per encoded body."""
+    body = prepared.body
+    body_hash = body.dkim
+    if body_hash is None:
+        start = time.perf_counter()
+        hasher = _BodyHasher()
+        hasher.update(body.data)
+        for part in body.files:
+            hasher.update(part.header)
+            with open(part.path, "rb") as f:
+                # The same base64 lines as `PreparedMessage.stream` sends.
+                while raw := f.read(mime.CHUNK_SIZE):
+                    hasher.update(base64.encodebytes(raw).replace(b"\n", mime.CRLF))
+        hasher.update(body.trailer)
+        body_hash = body.dkim = hasher.digest()
+        metrics.DKIM_SECONDS.observe(time.perf_counter() - start, step="body_hash")
+    return body_hash
+
+
+def _digest(prepared: mime.PreparedMessage) -> _Digest:
+    """The body hash and canonical fixed headers of a message, computed once."""
+    digest = prepared.dkim
+    if digest is None:
+        headers = canonical_headers(prepared.static[:prepared.header_size])
+        digest = prepared.dkim = _Digest(_body_hash(prepared), headers)
+    return digest
+
+
+# ─── Keys ────────────────────────────────────────────────────────────────────
+
+
+class _Key:
+    __slots__ = ("algorithm", "private_key")
+
+    def __init__(self, algorithm: str, private_key):
+        self.algorithm = algorithm
+        self.private_key = private_key
+
+    def sign(self, data: bytes) -> bytes:
+        if self.algorithm == "ed25519-sha256":
+            # RFC 8463: Ed25519 signs the SHA-256 hash of the signing input.
+            return self.private_key.sign(hashlib.sha256(data).digest())
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import padding
+        return self.private_key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+
+
+# profile_id -> ((key path, file stamp), parsed key)
+_keys: dict[str, tuple[tuple, _Key]] = {}
+
+
+def _load_key(path) -> _Key:
+    try:
+        from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+        from cryptography.hazmat.primitives.serialization import load_pem_private_key
+    except ImportError:
+        raise DkimError("DKIM signing needs the 'cryptography' package (pip install cryptography)") from None
+    try:
+        with open(path, "rb") as f:
+            private_key = load_pem_private_key(f.read(), password=None)
+    except (OSError, ValueError, TypeError) as e:
+        raise DkimError(f"Cannot load DKIM key {path}: {e}") from None
+    if isinstance(private_key, rsa.RSAPrivateKey):
+        return _Key("rsa-sha256", private_key)
+    if isinstance(private_key, ed25519.Ed25519PrivateKey):
+        return _Key("ed25519-sha256", private_key)
+    raise DkimError(f"DKIM key {path} is not an RSA or Ed25519 key")
+
+
+def key_for(profile: SmtpProfile) -> _Key:
+    """
+    The profile's parsed signing key, loaded on first use and again only
+    when the key file changes (a new path, or a rotated file).
+    """
+    path = jsonfile.resolve(profile.dkim_key_file)
+    version = (str(path), jsonfile.stamp(path))
+    cached = _keys.get(profile.profile_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    key = _load_key(path)
+    _keys[profile.profile_id] = (version, key)
+    logger.info("Loaded DKIM key for profile '%s' (%s, selector %s)",
+                profile.profile_id, key.algorithm, profile.dkim_selector)
+    return key
+
+
+# ─── Signing ─────────────────────────────────────────────────────────────────
+
+
+def _domain(profile: SmtpProfile) -> str:
+    return profile.dkim_domain or profile.from_email.rpartition("@")[2]
+
+
+def _sign(digest: _Digest, head: bytes, key: _Key, profile: SmtpProfile) -> bytes:
+    """`head` with a DKIM-Signature header in front of it."""
+    fields = {**digest.headers, **canonical_headers(head)}
+    names = [name for name in SIGNED_HEADERS if name in fields]
+    tags = [
+        "v=1",
+        f"a={key.algorithm}",
+        "c=relaxed/relaxed",
+        f"d={_domain(profile)}",
+        f"s={profile.dkim_selector}",
+        f"t={int(time.time())}",
+        f"h={':'.join(names)}",
+        f"bh={digest.body_hash}",
+        "b=",
+    ]
+    signed = b"".join(fields[name] for name in names)
+    signed += b"dkim-signature:" + "; ".join(tags).encode("ascii")
+    b = base64.b64encode(key.sign(signed)).decode("ascii")
+    # Folded between tags and inside b=; relaxed canonicalization undoes both.
+    value = ";\r\n ".join(tags) + "\r\n ".join(b[i:i + _FOLD] for i in range(0, len(b), _FOLD))
+    return f"DKIM-Signature: {value}\r\n".encode("ascii") + head
+
+
+def _sign_heads(prepared: mime.PreparedMessage, heads: list[bytes], profile: SmtpProfile) -> list[bytes]:
+    digest = _digest(prepared)
+    key = key_for(profile)
+    start = time.perf_counter()
+    signed = [_sign(digest, head, key, profile) for head in heads]
+    metrics.DKIM_SECONDS.observe(time.perf_counter() - start, step="sign")
+    metrics.DKIM_SIGNATURES.inc(len(heads), profile=profile.profile_id)
+    return signed
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _signers() -> ThreadPoolExecutor:
+    """The DKIM_WORKERS threads that hash bodies and sign, off the event loop."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(1, settings.dkim_workers), thread_name_prefix="dkim")
+        return _executor
+
+
+def enabled(profile: SmtpProfile) -> bool:
+    return bool(profile.dkim_selector)
+
+
+async def sign(prepared: mime.PreparedMessage, head: bytes, profile: SmtpProfile) -> bytes:
+    """
+    Sign one copy: returns its per-copy `head` (see `PreparedMessage.head`)
+    with a DKIM-Signature prepended, to pass to `render` or `stream`.
+    Raises DkimError if the profile's key cannot be loaded.
+    """
+    loop = asyncio.get_running_loop()
+    [signed] = await loop.run_in_executor(_signers(), _sign_heads, prepared, [head], profile)
+    return signed
+
+
+async def sign_copies(
+    prepared: mime.PreparedMessage, profile: SmtpProfile, recipients: Iterable[str]
+) -> dict[str, bytes]:
+    """
+    Sign one copy per recipient: returns each recipient's signed head. The
+    body is hashed once, then the copies are signed in parallel across the
+    DKIM worker threads.
+    """
+    recipients = list(recipients)
+    heads = [prepared.head([rcpt]) for rcpt in recipients]
+    loop = asyncio.get_running_loop()
+    if prepared.dkim is None or profile.profile_id not in _keys:
+        # Hash the body and load the key once, not in every worker.
+        await loop.run_in_executor(_signers(), _sign_heads, prepared, [], profile)
+    size = max(1, -(-len(heads) // max(1, settings.dkim_workers)))
+    chunks = await asyncio.gather(*(
+        loop.run_in_executor(_signers(), _sign_heads, prepared, heads[i:i + size], profile)
+        for i in range(0, len(heads), size)
+    ))
+    return dict(zip(recipients, (head for chunk in chunks for head in chunk)))
+
+
+def reset() -> None:
+    """Forget cached keys and stop the worker threads (they restart on use)."""
+    global _executor
+    _keys.clear()
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False)
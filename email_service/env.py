@@ -0,0 +1,129 @@
+"""
+Env — every setting the service reads from the environment and .env, with
+its default. Use `email_service.settings`, which loads this on first use.
+"""
+
+from typing import Literal
+
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class Settings(BaseSettings):
+    """Application settings loaded from .env"""
+
+    # Default SMTP profile (auto-registered on startup)
+    default_profile_id: str = ""
+    smtp_host: str = ""
+    smtp_port: int = 587
+    smtp_user: str = ""
+    smtp_password: str = ""
+    from_email: str = ""
+    from_name: str = "Email Service"
+    verify_ssl: bool = True
+
+    # Profile groups: when set, sends are spread over this group instead
+    default_group: str = ""
+    groups_file: str = "groups.json"
+    breaker_failure_threshold: int = 3
+    breaker_reset_timeout: float = 30.0
+
+    # App settings
+    host: str = "127.0.0.1"
+    port: int = 9001
+    profiles_file: str = "profiles.json"
+    # Profile store backend: "json" (profiles_file) or "sqlite" (profiles_db,
+    # for several worker processes; imports profiles_file on first use)
+    profile_store: str = "json"
+    profiles_db: str = "profiles.db"
+
+    # SMTP connection pool (per profile)
+    smtp_pool_size: int = 4
+    smtp_pool_idle_timeout: float = 60.0
+    smtp_pool_max_messages: int = 100
+    smtp_pool_max_bytes: int = 0
+
+    # Profile probes: on startup and when a profile is saved, resolve its
+    # host and open an authenticated pooled connection; look again every
+    # probe_interval seconds (a NOOP keeps the session warm; 0 = only once)
+    probe_enabled: bool = True
+    probe_concurrency: int = 16
+    probe_interval: float = 30.0
+    probe_timeout: float = 15.0
+
+    # Send scheduler: sends in flight per SMTP host (shared by its profiles)
+    # and per profile (0 = SMTP_POOL_SIZE); waiting sends per host and
+    # priority class, and how long one may wait, before refusing with 429
+    send_host_concurrency: int = 16
+    send_profile_concurrency: int = 0
+    send_queue_size: int = 1000
+    send_max_wait: float = 30.0
+
+    # Email addresses: "full" (email-validator, as EmailStr) or "syntax"
+    # (strict ASCII syntax only); validated addresses are kept in an LRU
+    address_validation: Literal["full", "syntax"] = "full"
+    address_cache_size: int = 100000
+
+    # Encoded message bodies kept for reuse across recipients; the same again
+    # for the bodies and parts that templated messages share
+    mime_cache_bytes: int = 64 * 1024 * 1024
+
+    # DKIM signing (profiles with dkim_selector): threads that hash bodies
+    # and sign copies off the event loop
+    dkim_workers: int = 2
+
+    # Stored templates, compiled once and rendered per recipient
+    templates_file: str = "templates.json"
+    template_cache_size: int = 256
+
+    # Attachments: files are streamed from this directory when sending
+    attachments_dir: str = "attachments"
+    attachment_max_bytes: int = 25 * 1024 * 1024
+
+    # Idempotency keys: retried /email/send requests replay the first outcome
+    idempotency_ttl: float = 86400.0
+    idempotency_max_keys: int = 200000
+    idempotency_content_hash: bool = False
+    idempotency_db: str = ""
+    idempotency_wait: float = 30.0
+
+    # Bulk sending
+    batch_concurrency: int = 4
+    batch_max_messages: int = 50000
+
+    # Queue mode: /email/send enqueues and returns an ID immediately
+    queue_enabled: bool = False
+    queue_db: str = "queue.db"
+    queue_workers: int = 4
+
+    # Outbound spool: mail the relay could not take (transient failure) is
+    # written here and replayed in order once it recovers ("" = off)
+    spool_dir: str = ""
+    spool_segment_bytes: int = 64 * 1024 * 1024
+    spool_replay_rate: float = 10.0
+
+    # Retries of transient SMTP failures (4xx, dropped connections)
+    retry_max_attempts: int = 5
+    retry_inline_attempts: int = 3
+    retry_base_delay: float = 1.0
+    retry_max_delay: float = 300.0
+
+    # Direct-to-MX delivery (profiles with direct=true)
+    mx_port: int = 25
+    mx_helo_name: str = ""
+    mx_max_connections: int = 2
+    mx_verify_tls: bool = False
+    dns_timeout: float = 5.0
+    dns_cache_size: int = 10000
+    dns_negative_ttl: float = 300.0
+
+    # Per-profile rate limiting
+    rate_limit_wait: bool = True
+    rate_limit_max_wait: float = 30.0
+    rate_limit_cooldown: float = 10.0
+
+    model_config = SettingsConfigDict(env_file=".env", env_ignore_empty=True)
+
+    @property
+    def has_default_profile(self) -> bool:
+        return bool(self.default_profile_id and self.smtp_host and self.smtp_user and self.smtp_password)
+
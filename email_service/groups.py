@@ -0,0 +1,249 @@
+"""
+Profile Groups — spread sends across several profiles with failover.
+
+Groups are stored in a local JSON file next to the profiles. Each send picks
+a member by weighted round-robin (or least-in-flight) and falls over to the
+next member when one fails with an auth, quota or connection error. Members
+that keep failing are parked by a circuit breaker and probed again later.
+"""
+
+import logging
+import threading
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import aiosmtplib
+
+from .config import settings
+from .models import ProfileGroup, SmtpProfile
+from . import jsonfile, profiles, retry
+from .ratelimit import RateLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_lock = threading.Lock()
+_cache: Optional[tuple[str, Optional[tuple], dict[str, ProfileGroup]]] = None
+
+
+class NoAvailableProfile(Exception):
+    """Every member of a group is parked or missing."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# ─── Storage ─────────────────────────────────────────────────────────────────
+
+
+def _load() -> dict[str, ProfileGroup]:
+    """Return the groups, reloading the file only when it has changed."""
+    global _cache
+    path = jsonfile.resolve(settings.groups_file)
+    stamp = jsonfile.stamp(path)
+    cache = _cache
+    if cache is not None and cache[0] == settings.groups_file and cache[1] == stamp:
+        return cache[2]
+    with _lock:
+        groups = {name: ProfileGroup(**data) for name, data in jsonfile.read(path).items()}
+        _cache = (settings.groups_file, stamp, groups)
+    return groups
+
+
+def get(name: str) -> Optional[ProfileGroup]:
+    """Retrieve a group by name."""
+    return _load().get(name)
+
+
+def list_all() -> list[dict]:
+    """List all groups with the live state of their members."""
+    return [status(group) for group in _load().values()]
+
+
+def add(group: ProfileGroup) -> dict:
+    """Add or update a profile group."""
+    global _cache
+    path = jsonfile.resolve(settings.groups_file)
+    with _lock, jsonfile.locked(path):
+        data = jsonfile.read(path)
+        data[group.name] = group.model_dump()
+        jsonfile.write_atomic(path, data)
+        _cache = None
+    logger.info("Group '%s' saved", group.name)
+    return {"status": "saved", "name": group.name}
+
+
+def delete(name: str) -> dict:
+    """Delete a group by name."""
+    global _cache
+    path = jsonfile.resolve(settings.groups_file)
+    with _lock, jsonfile.locked(path):
+        data = jsonfile.read(path)
+        if name not in data:
+            return {"status": "not_found", "name": name}
+        del data[name]
+        jsonfile.write_atomic(path, data)
+        _cache = None
+    logger.info("Group '%s' deleted", name)
+    return {"status": "deleted", "name": name}
+
+
+# ─── Circuit breaker ─────────────────────────────────────────────────────────
+
+
+class CircuitBreaker:
+    """
+    Parks a profile after `settings.breaker_failure_threshold` consecutive
+    failures. After `settings.breaker_reset_timeout` seconds one trial send is
+    let through (half-open): success closes the breaker, failure re-opens it.
+    """
+
+    def __init__(self):
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_running = False
+
+    def retry_in(self) -> float:
+        return max(0.0, self.opened_at + settings.breaker_reset_timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and self.retry_in() <= 0:
+            self.state = "half_open"
+        if self.state == "half_open" and not self.trial_running:
+            self.trial_running = True
+            return True
+        return False
+
+    def success(self) -> None:
+        self.state = "closed"
+        self.failures = 0
+        self.trial_running = False
+
+    def release(self) -> None:
+        """
+        The send ended without telling anything about the relay (cancelled,
+        or refused locally): let the next send try.
+        """
+        self.trial_running = False
+
+    def failure(self) -> None:
+        self.failures += 1
+        self.trial_running = False
+        if self.state == "half_open" or self.failures >= settings.breaker_failure_threshold:
+            if self.state != "open":
+                logger.warning("Circuit opened after %d failure(s)", self.failures)
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_in_flight: dict[str, int] = {}
+_current_weight: dict[tuple[str, str], float] = {}
+
+
+def breaker(profile_id: str) -> CircuitBreaker:
+    if profile_id not in _breakers:
+        _breakers[profile_id] = CircuitBreaker()
+    return _breakers[profile_id]
+
+
+def should_fail_over(exc: BaseException) -> bool:
+    """
+    True if the error is about the profile (auth, quota, connection), so
+    another member may succeed; False if the message itself was rejected.
+    """
+    if isinstance(exc, (aiosmtplib.SMTPAuthenticationError, aiosmtplib.SMTPSenderRefused)):
+        return True
+    return retry.classify(exc) == retry.TRANSIENT
+
+
+# ─── Member selection ────────────────────────────────────────────────────────
+
+
+def _order(group: ProfileGroup) -> list[tuple[str, int]]:
+    """Members in the order they should be tried for the next message."""
+    members = [(m.profile_id, m.weight) for m in group.members]
+    if group.strategy == "least_in_flight":
+        return sorted(members, key=lambda m: (_in_flight.get(m[0], 0) / m[1], -m[1]))
+
+    # Smooth weighted round-robin (as in nginx): the pick is deterministic,
+    # spread evenly, and exactly proportional to the weights over time.
+    total = sum(weight for _, weight in members)
+    for profile_id, weight in members:
+        key = (group.name, profile_id)
+        _current_weight[key] = _current_weight.get(key, 0) + weight
+    first = max(members, key=lambda m: _current_weight[(group.name, m[0])])
+    _current_weight[(group.name, first[0])] -= total
+    rest = sorted((m for m in members if m is not first), key=lambda m: -m[1])
+    return [first, *rest]
+
+
+async def deliver(
+    group: ProfileGroup,
+    send_one: Callable[[SmtpProfile], Awaitable[T]],
+) -> tuple[T, SmtpProfile]:
+    """
+    Run `send_one(profile)` on group members until one succeeds.
+
+    Returns (result, profile_used). Errors that concern the message itself
+    are raised at once; profile errors fall over to the next member, and the
+    last one is raised if every member fails.
+    """
+    last_error: Optional[BaseException] = None
+    for profile_id, _ in _order(group):
+        profile = profiles.get(profile_id)
+        cb = breaker(profile_id)
+        if profile is None or not cb.allow():
+            continue
+        _in_flight[profile_id] = _in_flight.get(profile_id, 0) + 1
+        try:
+            result = await send_one(profile)
+        except Exception as e:
+            if isinstance(e, RateLimitExceeded):
+                # Refused by our own limiter or send queue: says nothing about the relay.
+                cb.release()
+                if not should_fail_over(e):
+                    raise
+            elif not should_fail_over(e):
+                cb.success()  # the profile worked; the message was refused
+                raise
+            else:
+                cb.failure()
+            last_error = e
+            logger.warning("Group '%s': %s failed (%s), failing over", group.name, profile_id, e)
+            continue
+        except BaseException:
+            cb.release()
+            raise
+        finally:
+            _in_flight[profile_id] -= 1
+        cb.success()
+        return result, profile
+    if last_error is not None:
+        raise last_error
+    waits = [breaker(m.profile_id).retry_in() for m in group.members if m.profile_id in _breakers]
+    raise NoAvailableProfile(
+        f"No available profile in group '{group.name}'",
+        retry_after=min(waits) if waits else None,
+    )
+
+
+def status(group: ProfileGroup) -> dict:
+    """A group's definition plus per-member health and load."""
+    members = []
+    for member in group.members:
+        cb = _breakers.get(member.profile_id)
+        members.append({
+            **member.model_dump(),
+            "registered": profiles.get(member.profile_id) is not None,
+            "in_flight": _in_flight.get(member.profile_id, 0),
+            "circuit": cb.state if cb else "closed",
+            "consecutive_failures": cb.failures if cb else 0,
+            "retry_in": round(cb.retry_in(), 3) if cb and cb.state == "open" else None,
+        })
+    return {**group.model_dump(exclude={"members"}), "members": members}
@@ -0,0 +1,342 @@
+"""
+Idempotency — duplicate-send suppression for retried requests.
+
+A client that times out and retries the same request (same `Idempotency-Key`
+header, or the same content when IDEMPOTENCY_CONTENT_HASH is on) gets the
+outcome of the first attempt instead of a second email. A retry that
+arrives while the first attempt is still sending waits for it rather than
+opening another SMTP session.
+
+Keys and request fingerprints are kept as 16-byte BLAKE2b digests in an
+insertion-ordered LRU: lookups are O(1), entries expire after
+IDEMPOTENCY_TTL and the oldest are dropped beyond IDEMPOTENCY_MAX_KEYS, so
+memory stays bounded whatever the key rate. With IDEMPOTENCY_DB set,
+outcomes are also written to a SQLite database (WAL mode), which survives
+restarts and is shared by worker processes; a row is claimed before the
+send, so a retry landing on another worker waits for the first one too.
+
+Only final outcomes are remembered: successes, queued jobs and permanent
+errors. Transient failures (429, 503, ...) release the key so that the
+client's next retry sends again.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+from .config import settings
+from . import jsonfile
+
+logger = logging.getLogger(__name__)
+
+# Responses a retry should not be pinned to: the same request may succeed later.
+RETRYABLE_STATUS = frozenset({408, 425, 429, 500, 503, 504})
+
+# How long (seconds) a claimed but unfinished key blocks other workers; a
+# worker that died mid-send stops blocking the key after this.
+PENDING_TTL = 600.0
+
+# Expired rows are purged from the database every this many completions.
+PURGE_EVERY = 256
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency (
+    key          BLOB PRIMARY KEY,
+    fingerprint  BLOB NOT NULL,
+    status       INTEGER,
+    body         BLOB,
+    expires_at   REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idempotency_expiry ON idempotency (expires_at);
+"""
+
+
+class Outcome(NamedTuple):
+    """A response to replay: status code, JSON body and (not persisted) extra headers."""
+    status: int
+    body: bytes
+    headers: Optional[dict] = None
+
+
+class IdempotencyError(Exception):
+    """A request cannot be run under its idempotency key."""
+
+
+class KeyReused(IdempotencyError):
+    """The key was already used for a different request."""
+
+
+class InProgress(IdempotencyError):
+    """Another worker is still sending the request for this key."""
+
+
+def digest(value: str) -> bytes:
+    """The fixed-size form of a client key: 16 bytes whatever the header length."""
+    return hashlib.blake2b(value.encode(), digest_size=16).digest()
+
+
+def fingerprint(*parts: bytes) -> bytes:
+    """A 16-byte hash of a request's content, compared when a key is reused."""
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(len(part).to_bytes(8, "big"))
+        h.update(part)
+    return h.digest()
+
+
+def cacheable(outcome: Outcome) -> bool:
+    """True if a retry should get this outcome back instead of trying again."""
+    return outcome.status not in RETRYABLE_STATUS
+
+
+# ─── In-memory cache ─────────────────────────────────────────────────────────
+
+
+class _Entry(NamedTuple):
+    expires_at: float
+    fingerprint: bytes
+    status: int
+    body: bytes
+
+
+class _Cache:
+    """
+    Completed outcomes by key in insertion order. Every entry lives for the
+    same TTL, so the oldest entry is always the next to expire: expiry and
+    the size bound both pop from the front.
+    """
+
+    def __init__(self):
+        self._items: OrderedDict[bytes, _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: bytes) -> Optional[_Entry]:
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None and entry.expires_at <= time.time():
+                del self._items[key]
+                return None
+            return entry
+
+    def put(self, key: bytes, entry: _Entry) -> None:
+        with self._lock:
+            self._items[key] = entry
+            self._items.move_to_end(key)
+            now, limit = time.time(), max(1, settings.idempotency_max_keys)
+            items = self._items
+            while items and (len(items) > limit or next(iter(items.values())).expires_at <= now):
+                items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+_cache = _Cache()
+
+# Keys being sent right now in this process: key → (fingerprint, future outcome).
+_pending: dict[bytes, tuple[bytes, asyncio.Future]] = {}
+
+
+# ─── Persistent store ────────────────────────────────────────────────────────
+
+
+class _Record(NamedTuple):
+    fingerprint: bytes
+    status: Optional[int]  # None while the first attempt is still running
+    body: Optional[bytes]
+
+
+class SqliteStore:
+    """Outcomes in a SQLite database (WAL mode), shared by worker processes."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._pid = 0
+        self._writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        """The connection for this process; forked workers open their own. Caller holds `_lock`."""
+        if self._db is None or self._pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30.0)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(_SCHEMA)
+            self._db, self._pid = db, os.getpid()
+        return self._db
+
+    def claim(self, key: bytes, fingerprint: bytes) -> Optional[_Record]:
+        """
+        Claim `key` for a new attempt. Returns None if the caller now owns it,
+        otherwise the existing record (finished, or still in flight elsewhere).
+        """
+        now = time.time()
+        with self._lock:
+            db = self._connection()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.execute("DELETE FROM idempotency WHERE key = ? AND expires_at <= ?", (key, now))
+                claimed = db.execute(
+                    "INSERT OR IGNORE INTO idempotency (key, fingerprint, expires_at) VALUES (?, ?, ?)",
+                    (key, fingerprint, now + PENDING_TTL),
+                ).rowcount
+                row = None if claimed else db.execute(
+                    "SELECT fingerprint, status, body FROM idempotency WHERE key = ?", (key,),
+                ).fetchone()
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return None if row is None else _Record(row[0], row[1], row[2])
+
+    def complete(self, key: bytes, outcome: Outcome, expires_at: float) -> None:
+        """Record the final outcome of a claimed key."""
+        with self._lock:
+            db = self._connection()
+            db.execute(
+                "UPDATE idempotency SET status = ?, body = ?, expires_at = ? WHERE key = ?",
+                (outcome.status, outcome.body, expires_at, key),
+            )
+            self._writes += 1
+            if self._writes % PURGE_EVERY == 0:
+                db.execute("DELETE FROM idempotency WHERE expires_at <= ?", (time.time(),))
+
+    def release(self, key: bytes) -> None:
+        """Drop an unfinished claim so that the next retry runs again."""
+        with self._lock:
+            self._connection().execute("DELETE FROM idempotency WHERE key = ? AND status IS NULL", (key,))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None and self._pid == os.getpid():
+                self._db.close()
+            self._db = None
+
+
+_store: Optional[tuple[str, SqliteStore]] = None
+_store_lock = threading.Lock()
+
+
+def store() -> Optional[SqliteStore]:
+    """The database selected by `settings.idempotency_db`, or None when outcomes stay in memory."""
+    global _store
+    if not settings.idempotency_db:
+        return None
+    current = _store
+    if current is not None and current[0] == settings.idempotency_db:
+        return current[1]
+    with _store_lock:
+        if _store is None or _store[0] != settings.idempotency_db:
+            if _store is not None:
+                _store[1].close()
+            _store = (settings.idempotency_db, SqliteStore(jsonfile.resolve(settings.idempotency_db)))
+        return _store[1]
+
+
+# ─── Running a request once ──────────────────────────────────────────────────
+
+
+def _replay(entry_fingerprint: bytes, fingerprint: bytes, status: int, body: bytes) -> Outcome:
+    if entry_fingerprint != fingerprint:
+        raise KeyReused("Idempotency-Key was already used for a different request")
+    return Outcome(status, body)
+
+
+async def _claim(db: SqliteStore, key: bytes, fingerprint: bytes) -> Optional[Outcome]:
+    """
+    Claim the key in the database. Returns the stored outcome if the request
+    already finished (possibly in another worker), waiting for it while it is
+    in flight elsewhere; None once this process owns the key.
+    """
+    deadline = time.monotonic() + settings.idempotency_wait
+    delay = 0.05
+    while True:
+        record = await asyncio.to_thread(db.claim, key, fingerprint)
+        if record is None:
+            return None
+        if record.status is not None:
+            return _replay(record.fingerprint, fingerprint, record.status, record.body)
+        if record.fingerprint != fingerprint:
+            raise KeyReused("Idempotency-Key was already used for a different request")
+        if time.monotonic() >= deadline:
+            raise InProgress("A request with this Idempotency-Key is still being processed")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.5)
+
+
+async def run(key: bytes, fingerprint: bytes, call: Callable[[], Awaitable[Outcome]]) -> tuple[Outcome, bool]:
+    """
+    Run `call` at most once per key. Returns (outcome, replayed): a key seen
+    before gets its stored outcome back, and a key still in flight waits for
+    that attempt. Raises KeyReused if the key came with a different request,
+    InProgress if another worker holds it for longer than IDEMPOTENCY_WAIT.
+    """
+    entry = _cache.get(key)
+    if entry is not None:
+        return _replay(entry.fingerprint, fingerprint, entry.status, entry.body), True
+
+    pending = _pending.get(key)
+    if pending is not None:
+        if pending[0] != fingerprint:
+            raise KeyReused("Idempotency-Key was already used for a different request")
+        try:
+            return await asyncio.shield(pending[1]), True
+        except asyncio.CancelledError:
+            if not pending[1].cancelled():
+                raise
+            # The first attempt was abandoned before it finished: try again.
+            return await run(key, fingerprint, call)
+
+    future = asyncio.get_running_loop().create_future()
+    _pending[key] = (fingerprint, future)
+    db = store()
+    try:
+        stored = await _claim(db, key, fingerprint) if db is not None else None
+        if stored is not None:
+            _cache.put(key, _Entry(time.time() + settings.idempotency_ttl, fingerprint, stored.status, stored.body))
+            future.set_result(stored)
+            return stored, True
+
+        try:
+            outcome = await call()
+        except BaseException:
+            if db is not None:
+                await asyncio.to_thread(db.release, key)
+            raise
+
+        if cacheable(outcome):
+            expires_at = time.time() + settings.idempotency_ttl
+            _cache.put(key, _Entry(expires_at, fingerprint, outcome.status, outcome.body))
+            if db is not None:
+                try:
+                    await asyncio.to_thread(db.complete, key, outcome, expires_at)
+                except sqlite3.Error:
+                    logger.exception("Could not store the outcome for an idempotency key")
+        elif db is not None:
+            await asyncio.to_thread(db.release, key)
+        future.set_result(outcome)
+        return outcome, False
+    except BaseException as e:
+        if future.done():
+            pass
+        elif isinstance(e, asyncio.CancelledError):
+            future.cancel()
+        else:
+            future.set_exception(e)
+            future.exception()  # retrieved here, so it is not logged when nobody waits on it
+        raise
+    finally:
+        _pending.pop(key, None)
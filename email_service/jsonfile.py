@@ -0,0 +1,77 @@
+"""
+JSON file helpers shared by the file-backed stores (profiles, groups, templates).
+"""
+
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks; single-process use only
+    fcntl = None
+
+
+def resolve(filename: str) -> Path:
+    """Resolve a configured file path relative to the project root."""
+    path = Path(filename)
+    if not path.is_absolute():
+        path = Path(__file__).resolve().parent.parent / path
+    return path
+
+
+def stamp(path: Path) -> Optional[tuple]:
+    """Identify a version of the file by (mtime, inode, size), or None if missing."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+
+def read(path: Path) -> dict:
+    """Load a JSON object from disk; a missing file reads as empty."""
+    if not path.exists():
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def write_atomic(path: Path, data: dict) -> None:
+    """Persist a JSON object atomically (write temp file, fsync, rename)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+@contextmanager
+def locked(path: Path) -> Iterator[None]:
+    """
+    Hold an exclusive advisory lock for a read-modify-write of `path` that
+    other processes respect too. The lock is taken on the file's directory,
+    because the file itself is replaced (new inode) on every write.
+    """
+    if fcntl is None:
+        yield
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(path.parent, os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
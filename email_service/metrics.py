@@ -0,0 +1,217 @@
+"""
+Metrics — counters, gauges and histograms in Prometheus text format.
+
+Instrumentation on the hot path is a dict lookup and an add; rendering is done
+only when `/metrics` is scraped. Applications embedding `email_service` can
+register timing hooks to feed observations into their own collectors:
+
+    from email_service import metrics
+
+    def on_timing(name: str, seconds: float, labels: dict) -> None:
+        statsd.timing(name, seconds * 1000, tags=labels)
+
+    metrics.add_hook(on_timing)
+"""
+
+import logging
+import time
+from bisect import bisect_left
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+TimingHook = Callable[[str, float, dict], None]
+
+_hooks: list[TimingHook] = []
+_registry: list["_Metric"] = []
+
+
+def add_hook(hook: TimingHook) -> None:
+    """Call `hook(name, seconds, labels)` for every timing observation."""
+    _hooks.append(hook)
+
+
+def remove_hook(hook: TimingHook) -> None:
+    _hooks.remove(hook)
+
+
+def _escape(value: object) -> str:
+    """A label value as the text format requires: backslash, quote and newline escaped."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+        self._values: dict[tuple, float] = {}
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, "") for n in self.label_names)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+    def reset(self) -> None:
+        self._values.clear()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def remove(self, **labels) -> None:
+        """Drop one labelled series (e.g. for a deleted profile)."""
+        self._values.pop(self._key(labels), None)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, seconds: float, **labels) -> None:
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            # [per-bucket counts..., +Inf count, sum]
+            series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, seconds)] += 1
+        series[-1] += seconds
+        if _hooks:
+            for hook in _hooks:
+                try:
+                    hook(self.name, seconds, labels)
+                except Exception:
+                    logger.exception("Metrics hook failed")
+
+    def time(self, **labels) -> "_Timer":
+        """Context manager observing the duration of its block."""
+        return _Timer(self, labels)
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return sum(series[:-1]) if series else 0
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series[:-1]):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+    def reset(self) -> None:
+        self._series.clear()
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = 0.0
+
+    def __enter__(self) -> "_Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines: list[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def reset() -> None:
+    """Clear every recorded value (for tests)."""
+    for metric in _registry:
+        metric.reset()
+
+
+def get(name: str) -> Optional[_Metric]:
+    return next((m for m in _registry if m.name == name), None)
+
+
+# ─── Service metrics ─────────────────────────────────────────────────────────
+
+SENDS = Counter(
+    "email_sends_total", "Recipients handed to SMTP (one per recipient of each message), by profile and outcome.",
+    ("profile", "outcome"),
+)
+SMTP_RESPONSES = Counter("email_smtp_responses_total", "Final SMTP reply code for each recipient of a send.", ("code",))
+IN_FLIGHT = Gauge("email_sends_in_flight", "Sends currently in progress.")
+STAGE_SECONDS = Histogram(
+    "email_stage_seconds",
+    "Latency of send stages: mime, dkim, dns, connect, starttls, login, data.",
+    ("stage",),
+)
+PROFILE_LOAD_SECONDS = Histogram("email_profile_store_load_seconds", "Time to load and validate the profile store.")
+SPOOL_RECORDS = Counter("email_spool_records_total", "Spooled messages by event: spooled, replayed, failed, corrupt.", ("event",))
+SPOOL_DEPTH = Gauge("email_spool_depth", "Messages waiting in the spool.")
+SEND_QUEUE_WAIT = Histogram(
+    "email_send_queue_wait_seconds", "Time sends waited for a host/profile slot, by priority class.", ("priority",)
+)
+SEND_QUEUED = Gauge("email_send_queued", "Sends waiting for a host/profile slot, by priority class.", ("priority",))
+SEND_REJECTED = Counter(
+    "email_send_rejected_total", "Sends refused by the scheduler, by priority class and reason.", ("priority", "reason")
+)
+SEND_SECONDS = Histogram(
+    "email_send_seconds", "Latency of a send attempt including its queue wait, by priority class.", ("priority",)
+)
+PROFILE_READY = Gauge("email_profile_ready", "1 if the profile's last probe connected and logged in, else 0.", ("profile",))
+PROBE_SECONDS = Histogram("email_probe_seconds", "Latency of profile probes: dns, handshake (connect, TLS, AUTH).", ("stage",))
+DKIM_SIGNATURES = Counter("email_dkim_signatures_total", "DKIM signatures made, by profile.", ("profile",))
+DKIM_SECONDS = Histogram(
+    "email_dkim_seconds", "Time spent on DKIM: body_hash (once per message), sign (per batch of copies).", ("step",)
+)
@@ -0,0 +1,377 @@
+"""
+MIME Builder — encodes message bodies once and reuses the bytes.
+
+The stdlib `email.mime` classes fold headers and base64-encode the body on
+every build. Here the static part of a message (From, Subject, MIME headers
+and the encoded multipart body) is serialized once and cached; rendering a
+copy for a recipient only prepends its To, Date and Message-ID headers.
+
+Bodies, and the text parts and attachment framing they are built from, are
+cached by content too, so a message rendered from a template per recipient
+only encodes the parts its variables changed.
+
+Attachments are never part of the cached bytes: `PreparedMessage.stream()`
+reads each file in chunks and base64-encodes it on the way to the SMTP DATA
+phase, so memory per send stays at a chunk, whatever the file size.
+"""
+
+import asyncio
+import base64
+import functools
+import mimetypes
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from email.header import Header
+from email.utils import encode_rfc2231, formataddr, formatdate
+from pathlib import Path
+from typing import Any, AsyncIterator, Iterable, NamedTuple, Optional
+
+from .config import settings
+from .models import Attachment, SmtpProfile, EmailMessage
+from . import attachments as attachment_files, jsonfile
+
+CRLF = b"\r\n"
+
+# Longest line allowed in a 7bit body (RFC 5322), excluding CRLF.
+_MAX_LINE = 998
+
+# Raw attachment bytes encoded per chunk: a multiple of 57, so every chunk
+# becomes whole 76-character base64 lines.
+CHUNK_SIZE = 57 * 1024
+
+_CONTENT_TYPE = re.compile(r"^[\w.+-]+/[\w.+-]+$")
+
+
+# Header values this short go out as they are: nothing to fold or encode.
+_SHORT_HEADER = 70
+
+
+def _single_line(value: str) -> str:
+    """A header value with any line breaks turned into spaces, so it cannot start a header of its own."""
+    return " ".join(value.splitlines()) if "\r" in value or "\n" in value else value
+
+
+def _encode_header(value: str, name: str = "Subject") -> str:
+    """Fold a header value, RFC 2047-encoding it if it is not plain ASCII or cannot be folded."""
+    value = _single_line(value)
+    if value.isascii() and len(value) <= _SHORT_HEADER:
+        return value
+    if value.isascii():
+        folded = Header(value, header_name=name).encode(linesep="\r\n")
+        if max(map(len, folded.split("\r\n"))) <= _MAX_LINE:
+            return folded
+    return Header(value, "utf-8", header_name=name).encode(linesep="\r\n")
+
+
+def _encode_part(content: str, subtype: str) -> bytes:
+    """Serialize one text part: 7bit when possible, base64 otherwise."""
+    if content.isascii():
+        normalized = content.replace("\r\n", "\n").replace("\r", "\n")
+        if max(map(len, normalized.split("\n"))) <= _MAX_LINE:
+            return (
+                f'Content-Type: text/{subtype}; charset="us-ascii"\r\n'
+                "Content-Transfer-Encoding: 7bit\r\n\r\n"
+            ).encode() + normalized.replace("\n", "\r\n").encode("ascii") + CRLF
+    encoded = base64.encodebytes(content.encode("utf-8")).replace(b"\n", CRLF)
+    return (
+        f'Content-Type: text/{subtype}; charset="utf-8"\r\n'
+        "Content-Transfer-Encoding: base64\r\n\r\n"
+    ).encode() + encoded
+
+
+def _fold_addresses(addresses: Iterable[str]) -> str:
+    """Join addresses for a To header, folding long lists onto continuation lines."""
+    addresses = list(addresses)
+    joined = ", ".join(addresses)
+    return joined if len(joined) <= 900 else ",\r\n ".join(addresses)
+
+
+def _param(name: str, value: str) -> str:
+    """A MIME header parameter, RFC 2231-encoded if it is not plain ASCII."""
+    value = "".join(ch for ch in value if ch >= " " and ch != "\x7f")
+    if value.isascii():
+        escaped = value.replace("\\", "\\\\").replace('"', '\\"')
+        return f'{name}="{escaped}"'
+    return f"{name}*={encode_rfc2231(value, 'utf-8')}"
+
+
+class _FilePart(NamedTuple):
+    header: bytes  # delimiter and part headers, up to the blank line
+    path: Path
+
+
+def _attachment_part(boundary: str, attachment: Attachment) -> _FilePart:
+    filename = attachment.filename or Path(attachment.path).name
+    content_type = attachment.content_type or mimetypes.guess_type(filename)[0] or ""
+    if not _CONTENT_TYPE.match(content_type):
+        content_type = "application/octet-stream"
+    header = (
+        f"--{boundary}\r\n"
+        f"Content-Type: {content_type}; {_param('name', filename)}\r\n"
+        "Content-Transfer-Encoding: base64\r\n"
+        f"Content-Disposition: attachment; {_param('filename', filename)}\r\n"
+        "\r\n"
+    ).encode("ascii")
+    return _FilePart(header, attachment_files.locate(attachment))
+
+
+def _encode_file(path: Path) -> bytes:
+    with open(path, "rb") as f:
+        return base64.encodebytes(f.read()).replace(b"\n", CRLF)
+
+
+async def _stream_file(path: Path) -> AsyncIterator[bytes]:
+    """Base64 lines of a file, CHUNK_SIZE raw bytes at a time, read off the event loop."""
+    f = await asyncio.to_thread(open, path, "rb")
+    try:
+        while raw := await asyncio.to_thread(f.read, CHUNK_SIZE):
+            yield base64.encodebytes(raw).replace(b"\n", CRLF)
+    finally:
+        f.close()
+
+
+class _Mixed(NamedTuple):
+    """The multipart/mixed framing around a message's attachments."""
+    boundary: str
+    files: tuple[_FilePart, ...]
+    trailer: bytes
+
+
+class _Body:
+    """
+    An encoded message body: the text parts as multipart/alternative, inside
+    a multipart/mixed with the attachments if there are any. One text, html
+    and set of attachments always gives the same _Body, boundaries included,
+    whatever the subject and sender it goes out with. `dkim` caches its DKIM
+    body hash (see `dkim`).
+    """
+
+    __slots__ = ("data", "content_type", "files", "trailer", "size", "dkim")
+
+    def __init__(self, data: bytes, content_type: str, files: tuple = (), trailer: bytes = b""):
+        self.data = data
+        self.content_type = content_type
+        self.files: tuple[_FilePart, ...] = files
+        self.trailer = trailer
+        self.size = len(data) + sum(len(part.header) for part in files) + len(trailer)
+        self.dkim = None
+
+
+class PreparedMessage:
+    """
+    A message whose headers and body are serialized once.
+
+    `render(to)` returns the complete RFC 5322 bytes for one copy, with
+    fresh Date and Message-ID headers. Messages with attachments (`files`)
+    should be sent with `stream(to)` instead, which yields the same bytes
+    in CRLF-terminated chunks without reading the files whole. Both take
+    a ready-made `head` (the per-copy headers, e.g. with a DKIM signature
+    in front) instead of building one.
+
+    `static[:header_size]` holds the fixed headers and the blank line that
+    ends them; the body follows. `dkim` caches what DKIM signing derives
+    from them (see `dkim`).
+    """
+
+    __slots__ = ("static", "header_size", "domain", "size", "body", "files", "trailer", "dkim")
+
+    def __init__(self, headers: bytes, body: _Body, domain: str):
+        self.static = headers + body.data
+        self.header_size = len(headers)
+        self.domain = domain
+        self.size = len(self.static)
+        self.body = body
+        self.files = body.files
+        self.trailer = body.trailer
+        self.dkim = None
+
+    def message_id(self) -> str:
+        return f"<{uuid.uuid4().hex}@{self.domain}>"
+
+    def head(self, to: Iterable[str], message_id: Optional[str] = None) -> bytes:
+        """The headers that differ per copy: To, Date and Message-ID."""
+        return (
+            f"To: {_fold_addresses(to)}\r\n"
+            f"Date: {formatdate(usegmt=True)}\r\n"
+            f"Message-ID: {message_id or self.message_id()}\r\n"
+        ).encode("ascii")
+
+    def render(self, to: Iterable[str], message_id: Optional[str] = None, head: Optional[bytes] = None) -> bytes:
+        head = head or self.head(to, message_id)
+        if not self.files:
+            return head + self.static
+        pieces = [head, self.static]
+        for part in self.files:
+            pieces += (part.header, _encode_file(part.path))
+        pieces.append(self.trailer)
+        return b"".join(pieces)
+
+    async def stream(
+        self, to: Iterable[str], message_id: Optional[str] = None, head: Optional[bytes] = None
+    ) -> AsyncIterator[bytes]:
+        yield (head or self.head(to, message_id)) + self.static
+        for part in self.files:
+            yield part.header
+            async for chunk in _stream_file(part.path):
+                yield chunk
+        if self.trailer:
+            yield self.trailer
+
+
+@functools.lru_cache(maxsize=256)
+def _from_header(name: str, address: str) -> str:
+    """A profile's encoded From value; the same for every message it sends."""
+    return formataddr((_single_line(name), address), charset="utf-8")
+
+
+def _boundary() -> str:
+    return f"==============={uuid.uuid4().hex}=="
+
+
+def _encoded_part(content: str, subtype: str) -> bytes:
+    key = ("part", subtype, content)
+    part = _bodies.get(key)
+    if part is None:
+        part = _encode_part(content, subtype)
+        _bodies.put(key, part, len(part))
+    return part
+
+
+def _mixed(attachments: list[Attachment], files: tuple) -> _Mixed:
+    key = ("mixed", files)
+    mixed = _bodies.get(key)
+    if mixed is None:
+        boundary = _boundary()
+        parts = tuple(_attachment_part(boundary, a) for a in attachments)
+        mixed = _Mixed(boundary, parts, f"--{boundary}--\r\n".encode())
+        _bodies.put(key, mixed, sum(len(part.header) for part in parts) + len(mixed.trailer))
+    return mixed
+
+
+def _body(message: EmailMessage, files: tuple) -> _Body:
+    """The encoded body of a message; `files` identifies its attachments (see `prepare`)."""
+    key = ("body", message.text, message.html, files)
+    body = _bodies.get(key)
+    if body is not None:
+        return body
+    boundary = _boundary()
+    parts = []
+    if message.text:
+        parts.append(_encoded_part(message.text, "plain"))
+    if message.html:
+        parts.append(_encoded_part(message.html, "html"))
+
+    delimiter = f"--{boundary}\r\n".encode()
+    data = b"".join(delimiter + part for part in parts) + f"--{boundary}--\r\n".encode()
+    content_type = f'multipart/alternative; boundary="{boundary}"'
+    if message.attachments:
+        mixed = _mixed(message.attachments, files)
+        data = f"--{mixed.boundary}\r\nContent-Type: {content_type}\r\n\r\n".encode() + data
+        body = _Body(data, f'multipart/mixed; boundary="{mixed.boundary}"', mixed.files, mixed.trailer)
+    else:
+        body = _Body(data, content_type)
+    _bodies.put(key, body, body.size)
+    return body
+
+
+def _build(message: EmailMessage, profile: SmtpProfile, files: tuple) -> PreparedMessage:
+    body = _body(message, files)
+    headers = (
+        f"From: {_from_header(profile.from_name, profile.from_email)}\r\n"
+        f"Subject: {_encode_header(message.subject)}\r\n"
+        "MIME-Version: 1.0\r\n"
+        f"Content-Type: {body.content_type}\r\n"
+        "\r\n"
+    ).encode("ascii")
+    domain = profile.from_email.rpartition("@")[2] or "localhost"
+    return PreparedMessage(headers, body, domain)
+
+
+class _Cache:
+    """An LRU of encoded content bounded by its total size in bytes."""
+
+    def __init__(self):
+        self._items: OrderedDict[tuple, tuple[Any, int]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Any:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key: tuple, value: Any, size: int) -> None:
+        limit = settings.mime_cache_bytes
+        if size > limit:
+            return
+        with self._lock:
+            if key in self._items:
+                return
+            self._items[key] = (value, size)
+            self._bytes += size
+            while self._bytes > limit:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self._bytes -= evicted
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+# Prepared messages, by sender and content.
+_cache = _Cache()
+
+# Encoded bodies, and the text parts and attachment framing they are made
+# of, by content: what templated messages share with each other.
+_bodies = _Cache()
+
+
+def clear_cache() -> None:
+    """Forget every cached message, body and part."""
+    _cache.clear()
+    _bodies.clear()
+
+
+def prepare(message: EmailMessage, profile: SmtpProfile) -> PreparedMessage:
+    """
+    Return the prepared (encoded) form of a message's content for a sender.
+
+    Messages with the same sender, subject and body share one cached entry,
+    so a newsletter sent to thousands of recipients is encoded once.
+    Attachments are checked here (AttachmentError if one is missing or too
+    large) and keyed by file version, so an edited file is not served stale.
+    Messages rendered from a template are built each time, but from cached
+    parts: only the parts that differ per recipient are encoded again.
+    """
+    files = ()
+    if message.attachments:
+        for attachment in message.attachments:
+            attachment_files.check(attachment)
+        files = tuple(
+            (a.path, a.filename, a.content_type, jsonfile.stamp(attachment_files.locate(a)))
+            for a in message.attachments
+        )
+    if message.variables:
+        # Rendered from a template for one recipient: unlikely to be seen
+        # again, so it is not allowed to evict shared bodies from the cache.
+        return _build(message, profile, files)
+    key = (profile.from_name, profile.from_email, message.subject, message.text, message.html, files)
+    prepared = _cache.get(key)
+    if prepared is None:
+        prepared = _build(message, profile, files)
+        _cache.put(key, prepared, prepared.size)
+    return prepared
+
+
+def render(message: EmailMessage, profile: SmtpProfile) -> bytes:
+    """The complete bytes of a message as sent to its `to` recipients."""
+    return prepare(message, profile).render(message.to)
@@ -2,25 +2,189 @@
 Pydantic models for the Email Service.
 """
 
-from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from pydantic import AfterValidator, BaseModel, Field, WithJsonSchema, model_validator
+from typing import Annotated, Any, Dict, Iterator, Literal, Optional, List, Union
+
+from . import addresses
+
+# An email address, validated (and cached) by `addresses.validate`: EmailStr's
+# check by default, or syntax-only with ADDRESS_VALIDATION=syntax.
+Address = Annotated[str, AfterValidator(addresses.validate), WithJsonSchema({"type": "string", "format": "email"})]
+
+
+def _single_line(value: str) -> str:
+    if "\r" in value or "\n" in value:
+        raise ValueError("must not contain line breaks")
+    return value
+
+
+# Text that goes into a header (a subject, a sender name): a line break would
+# end the header and let the value add headers of its own.
+HeaderText = Annotated[str, AfterValidator(_single_line)]
 
 
 class SmtpProfile(BaseModel):
-    """SMTP credentials for one email account."""
+    """
+    SMTP credentials for one email account.
+
+    A `direct` profile needs no relay: mail is delivered straight to each
+    recipient domain's MX hosts, and the smtp_* settings are ignored.
+    """
     profile_id: str
-    smtp_host: str
+    smtp_host: str = ""
     smtp_port: int = 587
-    smtp_user: str
-    smtp_password: str
-    from_email: EmailStr
-    from_name: str = "Email Service"
+    smtp_user: str = ""
+    smtp_password: str = ""
+    from_email: Address
+    from_name: HeaderText = "Email Service"
     verify_ssl: bool = True
 
+    # Optional TLS material: a custom CA bundle and a client certificate/key
+    ca_file: Optional[str] = None
+    client_cert: Optional[str] = None
+    client_key: Optional[str] = None
+
+    # Optional provider limits, enforced locally before sending
+    max_per_second: Optional[float] = Field(default=None, gt=0)
+    max_recipients_per_message: Optional[int] = Field(default=None, ge=1)
+    daily_quota: Optional[int] = Field(default=None, ge=1)
+
+    # Send scheduling: sends in flight at once (default SEND_PROFILE_CONCURRENCY),
+    # and this profile's share of a busy SMTP host relative to other profiles on it
+    max_in_flight: Optional[int] = Field(default=None, ge=1)
+    weight: float = Field(default=1.0, gt=0)
+
+    # Optional DKIM signing: the selector and PEM private key (RSA or Ed25519)
+    # published at <selector>._domainkey.<domain> (default: from_email's domain)
+    dkim_selector: Optional[str] = Field(default=None, pattern=r"^[A-Za-z0-9_-]+(\.[A-Za-z0-9_-]+)*$")
+    dkim_key_file: Optional[str] = None
+    dkim_domain: Optional[str] = None
+
+    direct: bool = False
+
+    @model_validator(mode="after")
+    def _check_relay(self) -> "SmtpProfile":
+        if not self.direct and not self.smtp_host:
+            raise ValueError("smtp_host is required unless the profile is direct")
+        return self
+
+    @model_validator(mode="after")
+    def _check_dkim(self) -> "SmtpProfile":
+        if bool(self.dkim_selector) != bool(self.dkim_key_file):
+            raise ValueError("dkim_selector and dkim_key_file must be set together")
+        return self
+
+
+class GroupMember(BaseModel):
+    """One profile in a profile group, with its share of the traffic."""
+    profile_id: str
+    weight: int = Field(default=1, ge=1)
+
+
+class ProfileGroup(BaseModel):
+    """
+    A named set of profiles that share the sending load.
+
+    `weighted` spreads messages by weighted round-robin; `least_in_flight`
+    picks the member with the fewest sends in progress per unit of weight.
+    """
+    name: str
+    members: List[GroupMember] = Field(min_length=1)
+    strategy: Literal["weighted", "least_in_flight"] = "weighted"
+
+
+class Attachment(BaseModel):
+    """
+    A file sent with a message. It is read from disk, in chunks, only while
+    the message is sent. `path` is relative to ATTACHMENTS_DIR; absolute
+    paths work from Python but are refused by the API.
+    """
+    path: str
+    filename: Optional[str] = None
+    content_type: Optional[str] = None
+
+
+class EmailTemplate(BaseModel):
+    """
+    A stored message layout. `{{ name }}` placeholders in the subject, text
+    and html are filled from a message's `variables` when it is sent (values
+    are HTML-escaped in `html`).
+    """
+    name: str = Field(min_length=1)
+    subject: HeaderText
+    text: Optional[str] = None
+    html: Optional[str] = None
+
+    @model_validator(mode="after")
+    def _check_body(self) -> "EmailTemplate":
+        if not self.text and not self.html:
+            raise ValueError("a template needs 'text' or 'html'")
+        return self
+
 
 class EmailMessage(BaseModel):
-    """An email to be sent."""
-    to: List[EmailStr]
-    subject: str
+    """
+    An email to be sent.
+
+    With `individual`, each recipient gets a separate copy addressed only to
+    them (their own envelope and To header) instead of one shared message.
+    With `template`, subject and body come from the named stored template,
+    rendered with `variables`. `transactional` messages are sent ahead of
+    `bulk` ones waiting for the same SMTP host.
+    """
+    to: List[Address]
+    subject: HeaderText = ""
     text: Optional[str] = None
     html: Optional[str] = None
+    attachments: List[Attachment] = []
+    individual: bool = False
+    template: Optional[str] = None
+    variables: Dict[str, Any] = {}
+    priority: Literal["transactional", "bulk"] = "transactional"
+
+
+class Recipient(BaseModel):
+    """A batch recipient with its own template variables."""
+    email: Address
+    variables: Dict[str, Any] = {}
+
+
+class EmailBatch(BaseModel):
+    """
+    Many emails in one request: a list of explicit messages, and/or one
+    layout (subject + text/html, or a stored `template`) sent separately to
+    each of `recipients`. A recipient may be an address or
+    {"email", "variables"}; its variables override the shared `variables`.
+    Messages are sent with the batch's `priority` unless they set their own.
+    """
+    messages: List[EmailMessage] = []
+    recipients: List[Union[Address, Recipient]] = []
+    subject: Optional[HeaderText] = None
+    text: Optional[str] = None
+    html: Optional[str] = None
+    template: Optional[str] = None
+    variables: Dict[str, Any] = {}
+    attachments: List[Attachment] = []
+    concurrency: Optional[int] = Field(default=None, ge=1)
+    priority: Literal["transactional", "bulk"] = "bulk"
+
+    def expand(self) -> Iterator[EmailMessage]:
+        """Yield every message in the batch, fanning the layout out per recipient."""
+        for message in self.messages:
+            if "priority" not in message.model_fields_set and message.priority != self.priority:
+                message = message.model_copy(update={"priority": self.priority})
+            yield message
+        for recipient in self.recipients:
+            if isinstance(recipient, Recipient):
+                to, variables = recipient.email, {**self.variables, **recipient.variables}
+            else:
+                to, variables = recipient, self.variables
+            yield EmailMessage.model_construct(
+                to=[to], subject=self.subject or "", text=self.text, html=self.html,
+                attachments=self.attachments, template=self.template, variables=variables,
+                priority=self.priority,
+            )
+
+    @property
+    def size(self) -> int:
+        return len(self.messages) + len(self.recipients)
@@ -0,0 +1,247 @@
+"""
+Outbox — a durable send queue drained by background workers.
+
+Messages are written to a local SQLite database (WAL mode) before the caller
+gets their ID back, so a restart never loses accepted mail. A pool of asyncio
+workers sends queued jobs through the normal `sender` path and records the
+outcome, which can be looked up by ID.
+"""
+
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+from typing import Optional
+
+from .config import settings
+from .models import EmailMessage
+from . import attachments, groups, jsonfile, profiles
+from .sender import send
+from . import retry
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          TEXT PRIMARY KEY,
+    profile_id  TEXT NOT NULL,
+    group_name  TEXT,
+    message     TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    error       TEXT,
+    next_attempt_at REAL,
+    created_at  REAL NOT NULL,
+    updated_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+"""
+
+# Window (seconds) over which throughput is reported.
+THROUGHPUT_WINDOW = 60.0
+
+
+class Outbox:
+    """
+    SQLite-backed job store plus the asyncio workers that drain it.
+
+    Job statuses: queued → sending → sent | failed, with sending → retrying
+    → sending for transient failures (up to `settings.retry_max_attempts`).
+
+    Opening the database finds the jobs a previous process left unfinished;
+    both block, so `start()` below builds the outbox in a worker thread.
+    `Outbox.start` then queues those jobs on the running loop.
+    """
+
+    def __init__(self, path: Path, workers: int):
+        self.path = path
+        self.worker_count = max(1, workers)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        for column in ("next_attempt_at REAL", "group_name TEXT"):
+            if column.split()[0] not in columns:
+                self._db.execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+        self._db_lock = threading.Lock()
+        self._ready: asyncio.Queue[str] = asyncio.Queue()
+        self._workers: list[asyncio.Task] = []
+        self._in_flight = 0
+        self._completed: deque[float] = deque()
+        self.sent = 0
+        self.failed = 0
+        self._recovered = self._recover()
+
+    # ─── Storage ─────────────────────────────────────────────────────────
+
+    def _execute(self, sql: str, params: tuple = ()) -> list[sqlite3.Row]:
+        with self._db_lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _set_status(self, job_id: str, status: str, error: Optional[str] = None) -> None:
+        self._execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+            (status, error, time.time(), job_id),
+        )
+
+    async def enqueue(self, message: EmailMessage, profile_id: str = "", *, group_name: Optional[str] = None) -> str:
+        """
+        Persist a message and schedule it for sending through a profile, or
+        through a profile group when `group_name` is given. Returns the job ID.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT INTO jobs (id, profile_id, group_name, message, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+            (job_id, profile_id, group_name, message.model_dump_json(), now, now),
+        )
+        self._ready.put_nowait(job_id)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Return a job's status record, or None if the ID is unknown."""
+        rows = self._execute(
+            "SELECT id, profile_id, group_name, status, attempts, error, next_attempt_at, created_at, updated_at "
+            "FROM jobs WHERE id = ?",
+            (job_id,),
+        )
+        return dict(rows[0]) if rows else None
+
+    def stats(self) -> dict:
+        """Queue depth, in-flight count and recent throughput."""
+        counts = dict(self._execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+        cutoff = time.monotonic() - THROUGHPUT_WINDOW
+        while self._completed and self._completed[0] < cutoff:
+            self._completed.popleft()
+        return {
+            "depth": counts.get("queued", 0),
+            "in_flight": self._in_flight,
+            "retrying": counts.get("retrying", 0),
+            "workers": self.worker_count,
+            "sent": self.sent,
+            "failed": self.failed,
+            "throughput_per_sec": round(len(self._completed) / THROUGHPUT_WINDOW, 3),
+            "totals": counts,
+        }
+
+    # ─── Workers ─────────────────────────────────────────────────────────
+
+    def _recover(self) -> list[sqlite3.Row]:
+        """Jobs left behind by a previous process (queued, retrying or mid-send), oldest first, reset to queued."""
+        self._execute("UPDATE jobs SET status = 'queued' WHERE status = 'sending'")
+        return self._execute(
+            "SELECT id, status, next_attempt_at FROM jobs WHERE status IN ('queued', 'retrying') ORDER BY created_at"
+        )
+
+    async def _retry_later(self, job_id: str, attempts: int, error: Exception) -> None:
+        """Park a job as 'retrying' and put it back on the ready queue after a backoff."""
+        delay = max(retry.backoff(attempts), getattr(error, "retry_after", None) or 0.0)
+        await asyncio.to_thread(
+            self._execute,
+            "UPDATE jobs SET status = 'retrying', error = ?, next_attempt_at = ?, updated_at = ? WHERE id = ?",
+            (str(error), time.time() + delay, time.time(), job_id),
+        )
+        retry.scheduler.call_later(delay, self._ready.put_nowait, job_id)
+        logger.info("Job %s failed transiently (attempt %d), retrying in %.1fs", job_id, attempts, delay)
+
+    async def _process(self, job_id: str) -> None:
+        rows = await asyncio.to_thread(
+            self._execute,
+            "SELECT profile_id, group_name, message, status, attempts FROM jobs WHERE id = ?",
+            (job_id,),
+        )
+        if not rows or rows[0]["status"] not in ("queued", "retrying"):
+            return
+        row = rows[0]
+        await asyncio.to_thread(
+            self._execute,
+            "UPDATE jobs SET status = 'sending', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+            (time.time(), job_id),
+        )
+        if row["group_name"]:
+            target, missing = groups.get(row["group_name"]), f"Group '{row['group_name']}' not found"
+        else:
+            target, missing = await profiles.aget(row["profile_id"]), f"Profile '{row['profile_id']}' not found"
+        message = EmailMessage.model_validate_json(row["message"])
+        try:
+            if target is None:
+                raise LookupError(missing)
+            await send(message, target)
+        except Exception as e:
+            attempts = row["attempts"] + 1
+            if retry.classify(e) == retry.TRANSIENT and attempts < settings.retry_max_attempts:
+                await self._retry_later(job_id, attempts, e)
+                return
+            self.failed += 1
+            await asyncio.to_thread(self._set_status, job_id, "failed", str(e))
+        else:
+            self.sent += 1
+            await asyncio.to_thread(self._set_status, job_id, "sent")
+        if message.attachments:
+            # Files uploaded with the request are only needed until the job is final.
+            await asyncio.to_thread(attachments.discard_uploads, message.attachments)
+        self._completed.append(time.monotonic())
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._ready.get()
+            self._in_flight += 1
+            try:
+                await self._process(job_id)
+            except Exception:
+                logger.exception("Outbox worker failed on job %s", job_id)
+            finally:
+                self._in_flight -= 1
+
+    def start(self) -> None:
+        """Requeue the unfinished jobs found when the database was opened and start the worker tasks."""
+        recovered, self._recovered = self._recovered, []
+        now = time.time()
+        for row in recovered:
+            if row["status"] == "retrying":
+                retry.scheduler.call_later((row["next_attempt_at"] or now) - now, self._ready.put_nowait, row["id"])
+            else:
+                self._ready.put_nowait(row["id"])
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+        logger.info("Outbox started with %d worker(s), %d job(s) pending", self.worker_count, len(recovered))
+
+    async def stop(self) -> None:
+        """Stop the workers. Jobs still queued stay on disk for the next start."""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        with self._db_lock:
+            self._db.close()
+
+
+_outbox: Optional[Outbox] = None
+
+
+def current() -> Optional[Outbox]:
+    """The running outbox, or None when queue mode is off."""
+    return _outbox
+
+
+async def start() -> Outbox:
+    """Open the queue database (recovering unfinished jobs) and start the workers. Called from the server's lifespan."""
+    global _outbox
+    _outbox = await asyncio.to_thread(Outbox, jsonfile.resolve(settings.queue_db), settings.queue_workers)
+    _outbox.start()
+    return _outbox
+
+
+async def stop() -> None:
+    global _outbox
+    if _outbox is not None:
+        await _outbox.stop()
+        _outbox = None
@@ -0,0 +1,366 @@
+"""
+Pipelining — individually addressed copies over one SMTP session.
+
+Sending each recipient its own copy normally costs three round trips per
+copy (MAIL, RCPT, DATA) plus one for the content. When the server advertises
+PIPELINING (RFC 2920) the envelope commands go out in one write and the
+content of a copy travels together with the next copy's envelope, so a copy
+costs about one round trip. Servers without PIPELINING get the same copies
+sent one transaction at a time.
+
+aiosmtplib reads exactly one reply per command written, so while pipelining
+the transport is handed to a small reader that queues every reply it parses,
+and given back to the client afterwards. The same reader is used to stream
+message content in chunks (`send_stream`), with write flow control, instead
+of passing DATA one complete bytes object.
+"""
+
+import asyncio
+import logging
+import re
+from collections import deque
+from contextlib import aclosing
+from typing import AsyncIterable, Awaitable, Callable, Iterable, Optional, Sequence, Union
+
+import aiosmtplib
+from aiosmtplib import SMTPResponse
+from aiosmtplib.email import quote_address
+from aiosmtplib.protocol import normalize_message_line_endings
+
+logger = logging.getLogger(__name__)
+
+CRLF = b"\r\n"
+
+_LEADING_PERIOD = re.compile(rb"(?m)^\.")
+
+# Code reported for copies whose outcome the server never confirmed.
+NOT_SENT = -1
+
+Pace = Callable[[], Awaitable[object]]
+
+# Message content: complete bytes, or chunks that each end with CRLF (so
+# every chunk starts a new line and can be dot-stuffed on its own).
+Content = Union[bytes, AsyncIterable[bytes]]
+
+
+def by_domain(recipients: Iterable[str]) -> list[str]:
+    """
+    Deduplicate recipients and order them by domain, so the copies for one
+    domain are sent back to back. Input order is kept within a domain.
+    """
+    return sorted(dict.fromkeys(recipients), key=lambda addr: addr.rpartition("@")[2].lower())
+
+
+def split(recipients: Sequence[str], sessions: int, limit: int) -> list[list[str]]:
+    """
+    Cut a domain-ordered recipient list into contiguous runs, one per session:
+    at most `sessions` runs unless that would put more than `limit` copies on
+    one session.
+    """
+    if not recipients:
+        return []
+    size = max(1, min(limit, -(-len(recipients) // max(1, sessions))))
+    return [list(recipients[i:i + size]) for i in range(0, len(recipients), size)]
+
+
+def _content(data: bytes) -> bytes:
+    """Message bytes as transmitted after DATA: CRLF line endings, dot-stuffed, terminated."""
+    return _LEADING_PERIOD.sub(b"..", normalize_message_line_endings(data)) + b".\r\n"
+
+
+async def _write_chunks(
+    transport: asyncio.WriteTransport, reader: "_ReplyReader", chunks: AsyncIterable[bytes]
+) -> None:
+    """Write streamed content (without the final dot), waiting whenever the transport's buffer is full."""
+    async with aclosing(chunks.__aiter__()) as pieces:
+        async for piece in pieces:
+            if reader.error is not None:
+                raise reader.error
+            transport.write(_LEADING_PERIOD.sub(b"..", piece))
+            await reader.writable.wait()
+
+
+class _ReplyReader(asyncio.Protocol):
+    """
+    Stands in for the client's protocol while commands are pipelined: parses
+    every reply that arrives and queues it, forwarding connection events to
+    the original protocol so the client still notices a disconnect.
+    """
+
+    def __init__(self, original: asyncio.BaseProtocol):
+        self.original = original
+        self.buffer = bytearray()
+        self.lines: list[bytes] = []
+        self.replies: deque[SMTPResponse] = deque()
+        self.error: Optional[Exception] = None
+        self.waiter: Optional[asyncio.Future] = None
+        self.writable = asyncio.Event()
+        self.writable.set()
+
+    def _wake(self) -> None:
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    def data_received(self, data: bytes) -> None:
+        self.buffer.extend(data)
+        while (end := self.buffer.find(b"\n")) != -1:
+            line = bytes(self.buffer[:end + 1])
+            del self.buffer[:end + 1]
+            try:
+                code = int(line[:3])
+            except ValueError:
+                self.error = aiosmtplib.SMTPResponseException(
+                    NOT_SENT, f"Malformed SMTP response line: {line.decode('utf-8', 'replace')}"
+                )
+                break
+            self.lines.append(line[4:].strip(b" \t\r\n"))
+            if line[3:4] != b"-":
+                message = b"\n".join(self.lines).decode("utf-8", "surrogateescape")
+                self.replies.append(SMTPResponse(code, message))
+                self.lines = []
+        self._wake()
+
+    def eof_received(self) -> bool:
+        self.error = self.error or aiosmtplib.SMTPServerDisconnected("Unexpected EOF received")
+        self._wake()
+        return False
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.error = self.error or aiosmtplib.SMTPServerDisconnected("Connection lost")
+        self.writable.set()
+        self._wake()
+        self.original.connection_lost(exc)
+
+    def pause_writing(self) -> None:
+        self.writable.clear()
+        self.original.pause_writing()
+
+    def resume_writing(self) -> None:
+        self.writable.set()
+        self.original.resume_writing()
+
+    async def read(self, timeout: Optional[float]) -> SMTPResponse:
+        """The next reply, in the order the commands were written."""
+        while not self.replies:
+            if self.error is not None:
+                raise self.error
+            self.waiter = asyncio.get_running_loop().create_future()
+            try:
+                await asyncio.wait_for(self.waiter, timeout)
+            except asyncio.TimeoutError as exc:
+                raise aiosmtplib.SMTPReadTimeoutError("Timed out waiting for server response") from exc
+            finally:
+                self.waiter = None
+        return self.replies.popleft()
+
+
+async def _pipelined(
+    smtp: aiosmtplib.SMTP,
+    sender: str,
+    recipients: Sequence[str],
+    render: Callable[[str], Content],
+    pace: Optional[Pace],
+    results: list[SMTPResponse],
+) -> None:
+    transport = smtp.protocol.transport
+    reader = _ReplyReader(transport.get_protocol())
+    transport.set_protocol(reader)
+    mail_from = b"MAIL FROM:" + quote_address(sender).encode() + CRLF
+
+    # What still has to be written before the next envelope (the previous
+    # copy's content, or an RSET), and for each reply it will produce whether
+    # that reply is the previous copy's outcome.
+    tail: Content = b""
+    owed: list[bool] = []
+
+    async def flush(commands: bytes) -> None:
+        nonlocal tail, owed
+        if reader.error is not None:
+            raise reader.error
+        if isinstance(tail, bytes):
+            transport.write(tail + commands)
+        else:
+            await _write_chunks(transport, reader, tail)
+            transport.write(b".\r\n" + commands)
+        pending, tail, owed = owed, b"", []
+        for is_outcome in pending:
+            reply = await reader.read(smtp.timeout)
+            if is_outcome:
+                results.append(reply)
+        await reader.writable.wait()
+
+    try:
+        for rcpt in recipients:
+            if pace is not None:
+                try:
+                    await pace()
+                except Exception:
+                    if tail:
+                        await flush(b"")
+                    raise
+            data = render(rcpt)
+            await flush(mail_from + b"RCPT TO:" + quote_address(rcpt).encode() + CRLF + b"DATA\r\n")
+            mail = await reader.read(smtp.timeout)
+            to = await reader.read(smtp.timeout)
+            start = await reader.read(smtp.timeout)
+            if mail.code == 250 and to.code in (250, 251) and start.code == 354:
+                tail, owed = (_content(data) if isinstance(data, bytes) else data), [True]
+                continue
+            results.append(mail if mail.code != 250 else to if to.code not in (250, 251) else start)
+            if start.code == 354:
+                # The server opened DATA without a valid envelope: end it empty.
+                tail, owed = b".\r\nRSET\r\n", [False, False]
+            else:
+                tail, owed = b"RSET\r\n", [False]
+        if tail:
+            await flush(b"")
+    finally:
+        if not transport.is_closing():
+            transport.set_protocol(reader.original)
+
+
+async def _sequential(
+    smtp: aiosmtplib.SMTP,
+    sender: str,
+    recipients: Sequence[str],
+    render: Callable[[str], Content],
+    pace: Optional[Pace],
+    results: list[SMTPResponse],
+) -> None:
+    for rcpt in recipients:
+        if pace is not None:
+            await pace()
+        data = render(rcpt)
+        try:
+            if isinstance(data, bytes):
+                _, reply = await sendmail(smtp, sender, [rcpt], data)
+            else:
+                _, reply = await send_stream(smtp, sender, [rcpt], data)
+            results.append(reply)
+        except aiosmtplib.SMTPRecipientsRefused as e:
+            results.append(SMTPResponse(e.recipients[0].code, e.recipients[0].message))
+        except aiosmtplib.SMTPResponseException as e:
+            if not smtp.is_connected:
+                raise
+            results.append(SMTPResponse(e.code, e.message))
+
+
+async def send_copies(
+    smtp: aiosmtplib.SMTP,
+    sender: str,
+    recipients: Sequence[str],
+    render: Callable[[str], Content],
+    *,
+    pace: Optional[Pace] = None,
+) -> list[SMTPResponse]:
+    """
+    Send one copy per recipient over an open, authenticated session.
+
+    `render(rcpt)` returns that recipient's copy, as bytes or a stream of
+    CRLF-terminated chunks; `pace()`, if
+    given, is awaited before each copy (e.g. to wait for a rate-limit token).
+
+    Returns one reply per recipient, in order: 250 for an accepted copy, else
+    the reply that refused it (MAIL, RCPT, DATA or end of data). A refusal
+    never stops the remaining copies. If the session breaks part-way, the
+    copies without a confirmed outcome are reported with code -1; if it
+    breaks before the first reply, the error is raised instead.
+    """
+    results: list[SMTPResponse] = []
+    run = _pipelined if smtp.supports_extension("pipelining") else _sequential
+    try:
+        await run(smtp, sender, recipients, render, pace, results)
+    except Exception as e:
+        if not results:
+            raise
+        if isinstance(e, (aiosmtplib.SMTPException, OSError, asyncio.TimeoutError)):
+            # The session is in an unknown state; make sure it is not reused.
+            smtp.close()
+        logger.warning("Stopped after %d of %d copies: %s", len(results), len(recipients), e)
+        results.extend(SMTPResponse(NOT_SENT, str(e)) for _ in range(len(recipients) - len(results)))
+    return results
+
+
+async def _envelope(
+    smtp: aiosmtplib.SMTP, sender: str, recipients: Sequence[str], options: Sequence[str] = ()
+) -> dict[str, SMTPResponse]:
+    """
+    MAIL FROM and RCPT TO for one transaction. Returns the refused
+    recipients; raises SMTPRecipientsRefused if every one was refused.
+    """
+    refused: dict[str, SMTPResponse] = {}
+    await smtp.mail(sender, options=list(options))
+    for rcpt in recipients:
+        try:
+            await smtp.rcpt(rcpt)
+        except aiosmtplib.SMTPRecipientRefused as e:
+            refused[rcpt] = SMTPResponse(e.code, e.message)
+    if len(refused) == len(recipients):
+        raise aiosmtplib.SMTPRecipientsRefused(
+            [aiosmtplib.SMTPRecipientRefused(r.code, r.message, rcpt) for rcpt, r in refused.items()]
+        )
+    return refused
+
+
+async def _abort(smtp: aiosmtplib.SMTP) -> None:
+    """Reset a failed transaction's envelope, if the session is still up."""
+    if smtp.is_connected:
+        try:
+            await smtp.rset()
+        except aiosmtplib.SMTPException:
+            pass
+
+
+async def sendmail(
+    smtp: aiosmtplib.SMTP, sender: str, recipients: Sequence[str], data: bytes
+) -> tuple[dict[str, SMTPResponse], SMTPResponse]:
+    """
+    Like `SMTP.sendmail`, but returns the server's end-of-data reply itself
+    (code and text), not only its text. Returns (refused, reply).
+
+    `data` is what `mime` renders, already CRLF-terminated, so its length is
+    the SIZE announced (no normalized copy is made just to measure it).
+    """
+    options = [f"SIZE={len(data)}"] if smtp.supports_extension("size") else []
+    try:
+        refused = await _envelope(smtp, sender, recipients, options)
+        reply = await smtp.data(data)
+    except (aiosmtplib.SMTPResponseException, aiosmtplib.SMTPRecipientsRefused):
+        await _abort(smtp)
+        raise
+    return refused, reply
+
+
+async def send_stream(
+    smtp: aiosmtplib.SMTP,
+    sender: str,
+    recipients: Sequence[str],
+    chunks: AsyncIterable[bytes],
+) -> tuple[dict[str, SMTPResponse], SMTPResponse]:
+    """
+    Like `sendmail`, but the content is written chunk by chunk as `chunks`
+    produces it, so the whole message never has to be in memory. Each
+    chunk must end with CRLF. Returns (refused, reply).
+    """
+    try:
+        refused = await _envelope(smtp, sender, recipients)
+        start = await smtp.execute_command(b"DATA")
+        if start.code != 354:
+            raise aiosmtplib.SMTPDataError(start.code, start.message)
+    except (aiosmtplib.SMTPResponseException, aiosmtplib.SMTPRecipientsRefused):
+        await _abort(smtp)
+        raise
+
+    transport = smtp.protocol.transport
+    reader = _ReplyReader(transport.get_protocol())
+    transport.set_protocol(reader)
+    try:
+        await _write_chunks(transport, reader, chunks)
+        transport.write(b".\r\n")
+        reply = await reader.read(smtp.timeout)
+    finally:
+        if not transport.is_closing():
+            transport.set_protocol(reader.original)
+    if reply.code != 250:
+        raise aiosmtplib.SMTPDataError(reply.code, reply.message)
+    return refused, reply
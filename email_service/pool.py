@@ -0,0 +1,494 @@
+"""
+Connection Pool — reusable, authenticated SMTP sessions per profile.
+
+Opening an SMTP session costs a TCP connect, a TLS handshake, EHLO/STARTTLS
+and AUTH. The pool keeps a few logged-in `aiosmtplib.SMTP` clients per
+profile and hands them out for one transaction at a time, or for a whole
+sequence of transactions (`session`). Connections are recycled after a
+number of messages or bytes, to stay within provider limits.
+"""
+
+import asyncio
+import logging
+import ssl
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Optional, Sequence, TypeVar
+
+import aiosmtplib
+
+from .config import settings
+from .models import SmtpProfile
+from . import metrics, pipeline
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Connections idle for longer than this are checked with NOOP before reuse.
+HEALTH_CHECK_AFTER = 5.0
+
+# Errors after which a connection can no longer be trusted.
+_DISCONNECTS = (aiosmtplib.SMTPServerDisconnected, ConnectionError, asyncio.TimeoutError)
+
+# A refusal from the server: the transaction is over (and its envelope reset),
+# the session is fine. Any other error mid-transaction leaves it in an
+# unknown state (e.g. halfway through DATA), so the connection is dropped.
+_REFUSALS = (aiosmtplib.SMTPResponseException, aiosmtplib.SMTPRecipientsRefused)
+
+
+class _Connection:
+    """A pooled SMTP client plus its bookkeeping."""
+
+    __slots__ = ("smtp", "created_at", "last_used", "messages", "bytes", "broken")
+
+    def __init__(self, smtp: aiosmtplib.SMTP):
+        self.smtp = smtp
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.messages = 0
+        self.bytes = 0
+        self.broken = False
+
+
+class _Meter:
+    """Counts the message bytes written during one transaction."""
+
+    __slots__ = ("bytes",)
+
+    def __init__(self):
+        self.bytes = 0
+
+    def __call__(self, content: pipeline.Content) -> pipeline.Content:
+        if isinstance(content, (bytes, bytearray)):
+            self.bytes += len(content)
+            return content
+        return self._stream(content)
+
+    async def _stream(self, chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in chunks:
+                self.bytes += len(chunk)
+                yield chunk
+        finally:
+            aclose = getattr(chunks, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+
+# An operation on a connection; it passes the content it sends through the meter.
+Op = Callable[[aiosmtplib.SMTP, _Meter], Awaitable[T]]
+
+
+class SmtpPool:
+    """
+    A bounded pool of authenticated SMTP connections for one profile.
+
+    Args:
+        profile: The SMTP credentials every connection logs in with.
+        tls_context: SSL context used for implicit TLS / STARTTLS.
+        size: Maximum number of simultaneously open connections.
+        idle_timeout: Seconds an idle connection is kept before it is closed.
+        max_messages: Messages sent over one connection before it is recycled.
+        max_bytes: Message bytes sent over one connection before it is
+            recycled (0: no limit).
+        opportunistic_tls: Upgrade with STARTTLS whenever the server offers
+            it (used for MX hosts, which are contacted on port 25).
+        local_hostname: Name announced in EHLO (defaults to the local FQDN).
+    """
+
+    def __init__(
+        self,
+        profile: SmtpProfile,
+        tls_context: ssl.SSLContext,
+        *,
+        size: int,
+        idle_timeout: float,
+        max_messages: int,
+        max_bytes: int = 0,
+        opportunistic_tls: bool = False,
+        local_hostname: Optional[str] = None,
+    ):
+        self.profile = profile
+        self.tls_context = tls_context
+        self.size = max(1, size)
+        self.idle_timeout = idle_timeout
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.opportunistic_tls = opportunistic_tls
+        self.local_hostname = local_hostname
+        self._idle: deque[_Connection] = deque()
+        self._slots = asyncio.Semaphore(self.size)
+        self._closed = False
+
+    # ─── Connection lifecycle ────────────────────────────────────────────
+
+    async def _connect(self) -> _Connection:
+        """Open, secure and authenticate a new SMTP session, timing each stage."""
+        profile = self.profile
+        smtp = aiosmtplib.SMTP(
+            hostname=profile.smtp_host,
+            port=profile.smtp_port,
+            use_tls=profile.smtp_port == 465,
+            start_tls=False,
+            tls_context=self.tls_context,
+            local_hostname=self.local_hostname,
+        )
+        with metrics.STAGE_SECONDS.time(stage="connect"):
+            await smtp.connect()
+        try:
+            if self.opportunistic_tls and profile.smtp_port != 465:
+                await smtp.ehlo()
+                if smtp.supports_extension("starttls"):
+                    with metrics.STAGE_SECONDS.time(stage="starttls"):
+                        await smtp.starttls()
+            elif profile.smtp_port == 587:
+                with metrics.STAGE_SECONDS.time(stage="starttls"):
+                    await smtp.starttls()
+            if profile.smtp_user:
+                with metrics.STAGE_SECONDS.time(stage="login"):
+                    await smtp.login(profile.smtp_user, profile.smtp_password)
+        except BaseException:
+            smtp.close()
+            raise
+        logger.debug("Opened SMTP connection to %s for %s", profile.smtp_host, profile.profile_id)
+        return _Connection(smtp)
+
+    async def _discard(self, conn: _Connection) -> None:
+        """Close a connection, politely if it is still up and between transactions."""
+        if conn.broken:
+            # Mid-DATA the server would read QUIT as message text and never answer.
+            conn.smtp.close()
+            return
+        try:
+            if conn.smtp.is_connected:
+                await conn.smtp.quit()
+        except Exception:
+            conn.smtp.close()
+
+    async def _is_usable(self, conn: _Connection) -> bool:
+        """Decide whether an idle connection may be handed out again."""
+        if not conn.smtp.is_connected:
+            return False
+        idle_for = time.monotonic() - conn.last_used
+        if idle_for > self.idle_timeout:
+            return False
+        if idle_for > HEALTH_CHECK_AFTER:
+            try:
+                await conn.smtp.noop()
+            except Exception:
+                return False
+        return True
+
+    async def _checkout(self) -> tuple[_Connection, bool]:
+        """Take an idle connection or open a new one. Returns (conn, reused)."""
+        while self._idle:
+            conn = self._idle.pop()
+            if await self._is_usable(conn):
+                return conn, True
+            await self._discard(conn)
+        return await self._connect(), False
+
+    def _exhausted(self, conn: _Connection) -> bool:
+        """True once a connection has carried its share of messages or bytes."""
+        return conn.messages >= self.max_messages or (self.max_bytes > 0 and conn.bytes >= self.max_bytes)
+
+    async def _checkin(self, conn: _Connection, broken: bool) -> None:
+        """Return a connection to the pool, or retire it."""
+        conn.last_used = time.monotonic()
+        if broken or conn.broken or self._closed or self._exhausted(conn) or not conn.smtp.is_connected:
+            await self._discard(conn)
+        else:
+            self._idle.append(conn)
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[aiosmtplib.SMTP]:
+        """Borrow one connection for the duration of the block."""
+        if self._closed:
+            raise RuntimeError(f"Pool for '{self.profile.profile_id}' is closed")
+        async with self._slots:
+            conn, _ = await self._checkout()
+            broken = False
+            try:
+                yield conn.smtp
+                conn.messages += 1
+            except _DISCONNECTS:
+                broken = True
+                raise
+            finally:
+                await self._checkin(conn, broken)
+
+    # ─── Sending ─────────────────────────────────────────────────────────
+
+    async def _transact(self, conn: _Connection, op: Op[T], messages: int) -> T:
+        """Run an operation on a connection and account for it; marks the connection broken if it must go."""
+        meter = _Meter()
+        try:
+            with metrics.STAGE_SECONDS.time(stage="data"):
+                result = await op(conn.smtp, meter)
+            conn.messages += messages
+            return result
+        except _REFUSALS:
+            raise
+        except BaseException:
+            conn.broken = True
+            raise
+        finally:
+            conn.bytes += meter.bytes
+
+    async def _send_on(self, conn: _Connection, op: Op[T], messages: int) -> T:
+        try:
+            return await self._transact(conn, op, messages)
+        finally:
+            await self._checkin(conn, conn.broken)
+
+    async def _run(self, op: Op[T], messages: int = 1) -> T:
+        """
+        Run one mail transaction (or `messages` of them) over a pooled connection.
+
+        A reused connection that the server has silently dropped is replaced
+        by a fresh one and the transaction is run again, once.
+        """
+        if self._closed:
+            raise RuntimeError(f"Pool for '{self.profile.profile_id}' is closed")
+        async with self._slots:
+            conn, reused = await self._checkout()
+            try:
+                return await self._send_on(conn, op, messages)
+            except _DISCONNECTS:
+                if not reused:
+                    raise
+                logger.info("SMTP connection for %s dropped, reconnecting", self.profile.profile_id)
+            return await self._send_on(await self._connect(), op, messages)
+
+    async def send_message(self, mime, **kwargs):
+        """Send an `email.message.Message` over a pooled connection."""
+        return await self._run(lambda smtp, meter: smtp.send_message(mime, **kwargs))
+
+    async def sendmail(self, sender: str, recipients: Sequence[str], data: bytes):
+        """
+        Send pre-serialized message bytes over a pooled connection. Returns
+        (refused, reply) as `pipeline.sendmail` does.
+        """
+        return await self._run(_sendmail(sender, recipients, data))
+
+    async def send_stream(
+        self, sender: str, recipients: Sequence[str], open_stream: Callable[[], AsyncIterable[bytes]]
+    ):
+        """
+        Send a message whose content is streamed in chunks over a pooled
+        connection. `open_stream()` is called for each attempt.
+        """
+        return await self._run(_send_stream(sender, recipients, open_stream))
+
+    async def send_copies(
+        self,
+        sender: str,
+        recipients: Sequence[str],
+        render: Callable[[str], pipeline.Content],
+        *,
+        pace: Optional[pipeline.Pace] = None,
+    ) -> list[aiosmtplib.SMTPResponse]:
+        """Send each recipient its own copy over one pooled connection (see `pipeline.send_copies`)."""
+        return await self._run(_send_copies(sender, recipients, render, pace), messages=len(recipients))
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator["Session"]:
+        """
+        Hold one pool slot for a sequence of transactions (see `Session`).
+        The slot is occupied until the block exits.
+        """
+        if self._closed:
+            raise RuntimeError(f"Pool for '{self.profile.profile_id}' is closed")
+        async with self._slots:
+            session = Session(self)
+            try:
+                yield session
+            finally:
+                await session.release()
+
+    async def warm(self) -> bool:
+        """
+        Make sure an authenticated connection is waiting in the pool: open one
+        if none is idle, or check the newest idle one (NOOP once it has been
+        idle a while) so it is not retired for idleness. Does nothing while
+        every slot is busy sending. Returns True if a connection was opened.
+        """
+        if self._closed:
+            raise RuntimeError(f"Pool for '{self.profile.profile_id}' is closed")
+        if self._slots.locked():
+            return False
+        async with self._slots:
+            conn, reused = await self._checkout()
+            try:
+                if conn.smtp.last_ehlo_response is None:
+                    await conn.smtp.ehlo()  # unauthenticated sessions greet on first send otherwise
+            except BaseException:
+                conn.broken = True
+                raise
+            finally:
+                await self._checkin(conn, conn.broken)
+        return not reused
+
+    async def close(self) -> None:
+        """Close every idle connection and refuse new checkouts."""
+        self._closed = True
+        while self._idle:
+            await self._discard(self._idle.pop())
+
+    @property
+    def idle_count(self) -> int:
+        return len(self._idle)
+
+
+def _sendmail(sender: str, recipients: Sequence[str], data: bytes) -> Op:
+    return lambda smtp, meter: pipeline.sendmail(smtp, sender, recipients, meter(data))
+
+
+def _send_stream(sender: str, recipients: Sequence[str], open_stream: Callable[[], AsyncIterable[bytes]]) -> Op:
+    return lambda smtp, meter: pipeline.send_stream(smtp, sender, recipients, meter(open_stream()))
+
+
+def _send_copies(
+    sender: str, recipients: Sequence[str], render: Callable[[str], pipeline.Content], pace: Optional[pipeline.Pace],
+) -> Op:
+    return lambda smtp, meter: pipeline.send_copies(
+        smtp, sender, recipients, lambda rcpt: meter(render(rcpt)), pace=pace,
+    )
+
+
+class Session:
+    """
+    A sequence of mail transactions over one authenticated connection, so
+    sending N messages costs one connect, TLS handshake and AUTH instead of N.
+
+    A transaction the server refuses is reset (RSET) and the session carries
+    on with the next one. The connection is swapped for a fresh one when it
+    reaches the pool's message or byte limit, and after a disconnect; a
+    transaction hit by a drop on a reused connection is sent again, once.
+    """
+
+    def __init__(self, pool: SmtpPool):
+        self.pool = pool
+        self._conn: Optional[_Connection] = None
+        self._reused = False
+
+    async def release(self) -> None:
+        """Hand the current connection back to the pool (it is retired if spent or broken)."""
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            await self.pool._checkin(conn, conn.broken)
+
+    async def _run(self, op: Op[T], messages: int = 1) -> T:
+        for attempt in range(2):
+            if self._conn is None:
+                self._conn, self._reused = await self.pool._checkout()
+            conn = self._conn
+            try:
+                result = await self.pool._transact(conn, op, messages)
+            except _DISCONNECTS:
+                await self.release()
+                if attempt or not self._reused:
+                    raise
+                logger.info("SMTP connection for %s dropped, reconnecting", self.pool.profile.profile_id)
+                continue
+            except BaseException:
+                if conn.broken or self.pool._exhausted(conn):
+                    await self.release()
+                raise
+            if self.pool._exhausted(conn):
+                await self.release()
+            return result
+        raise AssertionError("unreachable")
+
+    async def sendmail(self, sender: str, recipients: Sequence[str], data: bytes):
+        """Send pre-serialized message bytes in this session."""
+        return await self._run(_sendmail(sender, recipients, data))
+
+    async def send_stream(
+        self, sender: str, recipients: Sequence[str], open_stream: Callable[[], AsyncIterable[bytes]]
+    ):
+        """Send a message streamed in chunks in this session. `open_stream()` is called for each attempt."""
+        return await self._run(_send_stream(sender, recipients, open_stream))
+
+    async def send_copies(
+        self,
+        sender: str,
+        recipients: Sequence[str],
+        render: Callable[[str], pipeline.Content],
+        *,
+        pace: Optional[pipeline.Pace] = None,
+    ) -> list[aiosmtplib.SMTPResponse]:
+        """Send each recipient its own copy in this session (see `pipeline.send_copies`)."""
+        return await self._run(_send_copies(sender, recipients, render, pace), messages=len(recipients))
+
+
+_pools: dict[str, SmtpPool] = {}
+
+# Pools replaced by `get_pool`: being closed on the loop, or waiting for
+# `close_all` when they were replaced with no loop running.
+_closing: set[asyncio.Task] = set()
+_retired: list[SmtpPool] = []
+
+
+def _retire(pool: SmtpPool) -> None:
+    """Close a replaced pool without making the caller wait for it."""
+    try:
+        task = asyncio.get_running_loop().create_task(pool.close())
+    except RuntimeError:
+        _retired.append(pool)
+        return
+    _closing.add(task)
+    task.add_done_callback(_closed)
+
+
+def _closed(task: asyncio.Task) -> None:
+    _closing.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("Closing a replaced SMTP pool failed: %s", task.exception())
+
+
+def get_pool(profile: SmtpProfile, tls_context: Callable[[], ssl.SSLContext]) -> SmtpPool:
+    """
+    Return the pool for a profile, creating it on first use.
+
+    `tls_context` is only called when a new pool has to be built. If the
+    profile has been updated since its pool was created, the old pool is
+    retired and a new one is built with the current credentials.
+    """
+    pool: Optional[SmtpPool] = _pools.get(profile.profile_id)
+    if pool is not None and pool.profile == profile:
+        return pool
+    if pool is not None:
+        _retire(pool)
+    pool = SmtpPool(
+        profile,
+        tls_context(),
+        size=settings.smtp_pool_size,
+        idle_timeout=settings.smtp_pool_idle_timeout,
+        max_messages=settings.smtp_pool_max_messages,
+        max_bytes=settings.smtp_pool_max_bytes,
+    )
+    _pools[profile.profile_id] = pool
+    return pool
+
+
+def find(profile_id: str) -> Optional[SmtpPool]:
+    """The pool of a profile, if one has been created."""
+    return _pools.get(profile_id)
+
+
+async def close_all() -> None:
+    """Drain every pool, and wait for replaced ones to close. Called from the server's shutdown path."""
+    pools = [*_pools.values(), *_retired]
+    _pools.clear()
+    _retired.clear()
+    loop = asyncio.get_running_loop()
+    closing = [task for task in _closing if task.get_loop() is loop]
+    if closing:
+        await asyncio.gather(*closing, return_exceptions=True)
+    for pool in pools:
+        await pool.close()
+    if pools:
+        logger.info("Closed %d SMTP connection pool(s)", len(pools))
@@ -0,0 +1,183 @@
+"""
+Probes — background health checks that keep each profile's SMTP session warm.
+
+After a deploy, the first send of every profile would pay DNS, TCP, TLS and
+AUTH on the request path, and a wrong password would only show up when a
+real message fails. Instead, on startup and whenever a profile is saved,
+the prober resolves the profile's host and opens an authenticated
+connection into its pool, timing both. Every PROBE_INTERVAL seconds it
+looks again: an idle pooled connection gets a NOOP, which keeps it (and the
+server's idle timer) alive, and a missing one is reopened. Keep the
+interval below SMTP_POOL_IDLE_TIMEOUT, or each check opens a new session.
+
+At most PROBE_CONCURRENCY probes run at once, each limited to PROBE_TIMEOUT
+seconds, and none of them holds up startup: the server answers while they
+run. `status()` reports each profile as "pending", "ready" or "failed" with
+its measured latencies. Direct profiles have no relay and are not probed.
+"""
+
+import asyncio
+import logging
+import socket
+import time
+from typing import Optional
+
+from .config import settings
+from .models import SmtpProfile
+from .pool import find as find_pool
+from .sender import pool_for
+from . import metrics, profiles
+
+logger = logging.getLogger(__name__)
+
+
+class Prober:
+    """Probes profiles in the background and keeps their latest results."""
+
+    def __init__(self, *, concurrency: int):
+        self._limit = asyncio.Semaphore(max(1, concurrency))
+        self._results: dict[str, dict] = {}
+        self._running: dict[str, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        tasks = [t for t in (self._task, *self._running.values()) if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._running.clear()
+
+    async def _watch(self) -> None:
+        """Probe every profile now, then again every PROBE_INTERVAL seconds."""
+        while True:
+            current = [p for p in await profiles.aall() if not p.direct]
+            registered = {p.profile_id for p in current}
+            for profile_id in [pid for pid in self._results if pid not in registered]:
+                self.forget(profile_id)
+            await asyncio.gather(*(self.submit(p, replace=False) for p in current), return_exceptions=True)
+            if settings.probe_interval <= 0:
+                return
+            await asyncio.sleep(settings.probe_interval)
+
+    def submit(self, profile: SmtpProfile, *, replace: bool = True) -> asyncio.Task:
+        """
+        Probe a profile in the background. A probe already running for it is
+        cancelled (the profile may have changed), or reused if not `replace`.
+        """
+        task = self._running.get(profile.profile_id)
+        if task is not None and not task.done():
+            if not replace:
+                return task
+            task.cancel()
+        self._results.setdefault(profile.profile_id, _pending(profile))
+        task = self._running[profile.profile_id] = asyncio.create_task(self._probe(profile))
+        task.add_done_callback(lambda t, pid=profile.profile_id: self._running.get(pid) is t and self._running.pop(pid))
+        return task
+
+    def forget(self, profile_id: str) -> None:
+        """Stop probing a deleted profile and drop its results."""
+        task = self._running.pop(profile_id, None)
+        if task is not None:
+            task.cancel()
+        self._results.pop(profile_id, None)
+        metrics.PROFILE_READY.remove(profile=profile_id)
+
+    async def _probe(self, profile: SmtpProfile) -> None:
+        async with self._limit:
+            result = self._results.get(profile.profile_id) or _pending(profile)
+            result["host"] = profile.smtp_host
+            try:
+                dns, handshake = await asyncio.wait_for(_check(profile), settings.probe_timeout)
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    e = TimeoutError(f"no answer within {settings.probe_timeout:g}s")
+                if result["status"] != "failed":
+                    logger.warning("Profile '%s' failed its probe (%s): %s", profile.profile_id, profile.smtp_host, e)
+                result.update(status="failed", error=str(e) or type(e).__name__)
+            else:
+                if result["status"] != "ready":
+                    logger.info("Profile '%s' is ready (%s)", profile.profile_id, profile.smtp_host)
+                result.update(status="ready", error=None, dns_ms=round(dns * 1000, 1))
+                if handshake is not None:
+                    result["handshake_ms"] = round(handshake * 1000, 1)
+            result["checked_at"] = time.time()
+            self._results[profile.profile_id] = result  # the entry may have been dropped by a reload
+            metrics.PROFILE_READY.set(1 if result["status"] == "ready" else 0, profile=profile.profile_id)
+
+    def status(self) -> list[dict]:
+        results = []
+        for profile_id, result in sorted(self._results.items()):
+            pool = find_pool(profile_id)
+            results.append({**result, "warm_connections": pool.idle_count if pool is not None else 0})
+        return results
+
+
+def _pending(profile: SmtpProfile) -> dict:
+    return {
+        "profile_id": profile.profile_id,
+        "host": profile.smtp_host,
+        "status": "pending",
+        "error": None,
+        "dns_ms": None,
+        "handshake_ms": None,
+        "checked_at": None,
+    }
+
+
+async def _check(profile: SmtpProfile) -> tuple[float, Optional[float]]:
+    """
+    Resolve the profile's host and warm its pool. Returns (dns seconds,
+    handshake seconds), the latter None when a warm connection was reused.
+    """
+    start = time.perf_counter()
+    await asyncio.get_running_loop().getaddrinfo(profile.smtp_host, profile.smtp_port, type=socket.SOCK_STREAM)
+    dns = time.perf_counter() - start
+    metrics.PROBE_SECONDS.observe(dns, stage="dns")
+    start = time.perf_counter()
+    opened = await pool_for(profile).warm()
+    if not opened:
+        return dns, None
+    handshake = time.perf_counter() - start
+    metrics.PROBE_SECONDS.observe(handshake, stage="handshake")
+    return dns, handshake
+
+
+# ─── Server integration ──────────────────────────────────────────────────────
+
+_prober: Optional[Prober] = None
+
+
+def current() -> Optional[Prober]:
+    """The running prober, if PROBE_ENABLED and the server has started it."""
+    return _prober
+
+
+def start() -> Prober:
+    """Start probing every profile in the background (does not wait for the probes)."""
+    global _prober
+    _prober = Prober(concurrency=settings.probe_concurrency)
+    _prober.start()
+    logger.info("Probing profiles in the background (%d at a time)", settings.probe_concurrency)
+    return _prober
+
+
+async def stop() -> None:
+    global _prober
+    prober, _prober = _prober, None
+    if prober is not None:
+        await prober.stop()
+
+
+def submit(profile: SmtpProfile) -> None:
+    """Probe a saved profile now (no-op unless the prober is running)."""
+    if _prober is not None and not profile.direct:
+        _prober.submit(profile)
+
+
+def forget(profile_id: str) -> None:
+    if _prober is not None:
+        _prober.forget(profile_id)
@@ -1,79 +1,258 @@
 """
 Profile Manager — CRUD operations for SMTP profiles.
-Profiles are stored in a local JSON file.
+Profiles are stored in a local JSON file, or a SQLite database for
+deployments with several worker processes (see `storage`).
+
+Validated `SmtpProfile` objects are kept in an in-memory snapshot, so lookups
+never touch the disk or take a lock. Writes go through to the store (an
+atomic temp-file-plus-rename for JSON, a transaction for SQLite), and the
+snapshot is reloaded whenever the store's change stamp moves (e.g. another
+worker process saved a profile).
+
+Async code should use `aget`, `alist_all`, `aall`, `aadd` and `adelete`,
+which never block the event loop: reads come from the snapshot (a stale
+one is refreshed in a thread), and writes go to a single writer thread. Writes
+submitted while the writer is busy are applied together, so a burst of
+updates costs one file write (one fsync) or one transaction.
 """
 
-import json
+import asyncio
 import logging
 import threading
-from pathlib import Path
-from typing import Optional
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Hashable, NamedTuple, Optional
 
 from .config import settings
 from .models import SmtpProfile
+from . import metrics, storage
 
 logger = logging.getLogger(__name__)
 
 _lock = threading.Lock()
 
+# How often (seconds) readers re-check the store to notice external changes.
+STAT_INTERVAL = 1.0
+
 
-def _profiles_path() -> Path:
-    """Resolve the profiles file path relative to the project root."""
-    path = Path(settings.profiles_file)
-    if not path.is_absolute():
-        path = Path(__file__).resolve().parent.parent / path
-    return path
+class _Snapshot(NamedTuple):
+    """An immutable view of the profile store. Swapped atomically on change."""
+    store: storage.ProfileStore
+    stamp: Optional[Hashable]
+    profiles: dict[str, SmtpProfile]
+    checked_at: float
+    records: dict[str, dict]  # the stored form of each profile, to spot changed ones
+
+
+_snapshot: Optional[_Snapshot] = None
 
 
 def _load_profiles() -> dict:
-    """Load all profiles from disk."""
-    path = _profiles_path()
-    if not path.exists():
-        return {}
-    with open(path, "r") as f:
-        return json.load(f)
+    """Load all profile records from the store."""
+    return storage.profile_store().load()
+
 
+def _build_snapshot(store: storage.ProfileStore, saved: Optional[dict[str, SmtpProfile]] = None) -> _Snapshot:
+    """
+    Load the store into a new snapshot. Caller holds `_lock`.
 
-def _save_profiles(profiles: dict) -> None:
-    """Persist profiles to disk."""
-    with open(_profiles_path(), "w") as f:
-        json.dump(profiles, f, indent=2)
+    Only new or changed records are validated: a record equal to the one in
+    the previous snapshot keeps its SmtpProfile, and `saved` holds profiles
+    this process just wrote (validated by the caller already).
+    """
+    previous = _snapshot if _snapshot is not None and _snapshot.store is store else None
+    with metrics.PROFILE_LOAD_SECONDS.time():
+        # Stamp first: a write landing between the two is seen at the next check.
+        stamp = store.stamp()
+        raw = _load_profiles() if stamp is not None else {}
+        profiles = {}
+        for pid, data in raw.items():
+            profile = saved.get(pid) if saved else None
+            if profile is not None and profile.model_dump() != data:
+                profile = None  # overwritten by another process meanwhile
+            if profile is None and previous is not None and previous.records.get(pid) == data:
+                profile = previous.profiles[pid]
+            profiles[pid] = profile if profile is not None else SmtpProfile(**data)
+    return _Snapshot(store, stamp, profiles, time.monotonic(), raw)
+
+
+def _current() -> _Snapshot:
+    """Return a fresh-enough snapshot, reloading it if the store changed."""
+    global _snapshot
+    snap = _snapshot
+    store = storage.profile_store()
+    if snap is not None and snap.store is store:
+        now = time.monotonic()
+        if now - snap.checked_at < STAT_INTERVAL:
+            return snap
+        if store.stamp() == snap.stamp:
+            snap = snap._replace(checked_at=now)
+            _snapshot = snap
+            return snap
+    with _lock:
+        snap = _snapshot
+        if snap is None or snap.store is not store or store.stamp() != snap.stamp:
+            snap = _build_snapshot(store)
+            logger.debug("Loaded %d profile(s) from %s", len(snap.profiles), store.location)
+        else:
+            snap = snap._replace(checked_at=time.monotonic())
+        _snapshot = snap
+    return snap
+
+
+def reload() -> int:
+    """Force a reload of the profile store. Returns the number of profiles."""
+    global _snapshot
+    with _lock:
+        _snapshot = _build_snapshot(storage.profile_store())
+    return len(_snapshot.profiles)
 
 
 def get(profile_id: str) -> Optional[SmtpProfile]:
     """Retrieve a single profile by its ID."""
-    with _lock:
-        data = _load_profiles().get(profile_id)
-    return SmtpProfile(**data) if data else None
+    return _current().profiles.get(profile_id)
 
 
 def list_all() -> list[dict]:
     """List all profiles with passwords masked."""
-    with _lock:
-        profiles = _load_profiles()
     return [
-        {**data, "smtp_password": "****"}
-        for data in profiles.values()
+        {**profile.model_dump(), "smtp_password": "****"}
+        for profile in _current().profiles.values()
     ]
 
 
 def add(profile: SmtpProfile) -> dict:
     """Add or update an SMTP profile."""
+    global _snapshot
+    store = storage.profile_store()
     with _lock:
-        profiles = _load_profiles()
-        profiles[profile.profile_id] = profile.model_dump()
-        _save_profiles(profiles)
+        store.save(profile.profile_id, profile.model_dump())
+        _snapshot = _build_snapshot(store, {profile.profile_id: profile})
     logger.info("Profile '%s' saved", profile.profile_id)
     return {"status": "saved", "profile_id": profile.profile_id}
 
 
 def delete(profile_id: str) -> dict:
     """Delete a profile by its ID."""
+    global _snapshot
+    store = storage.profile_store()
     with _lock:
-        profiles = _load_profiles()
-        if profile_id not in profiles:
+        if not store.delete(profile_id):
             return {"status": "not_found", "profile_id": profile_id}
-        del profiles[profile_id]
-        _save_profiles(profiles)
+        _snapshot = _build_snapshot(store)
     logger.info("Profile '%s' deleted", profile_id)
     return {"status": "deleted", "profile_id": profile_id}
+
+
+# ─── Async API ───────────────────────────────────────────────────────────────
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _writer() -> ThreadPoolExecutor:
+    """The single thread that performs store writes for the async API."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profile-writer")
+        return _executor
+
+
+class _Writes:
+    """Changes waiting for the writer thread, each with its caller's future."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.pending: list[tuple[storage.Change, Optional[SmtpProfile], asyncio.Future]] = []
+        self.flushing: Optional[asyncio.Task] = None
+
+
+_writes: Optional[_Writes] = None
+
+
+def _apply(changes: list[storage.Change], saved: dict[str, SmtpProfile]) -> list[bool]:
+    """Write a batch of changes at once and rebuild the snapshot. Runs in the writer thread."""
+    global _snapshot
+    store = storage.profile_store()
+    with _lock:
+        results = store.apply(changes)
+        _snapshot = _build_snapshot(store, saved)
+    for (profile_id, data), done in zip(changes, results):
+        if done:
+            logger.info("Profile '%s' %s", profile_id, "saved" if data is not None else "deleted")
+    return results
+
+
+async def _flush(writes: _Writes) -> None:
+    """Hand pending changes to the writer until none are left; later ones wait for the next batch."""
+    try:
+        while writes.pending:
+            batch, writes.pending = writes.pending, []
+            changes = [change for change, _, _ in batch]
+            # The last write to a profile wins; earlier ones in the batch are overwritten.
+            saved = {change[0]: profile for change, profile, _ in batch}
+            saved = {pid: profile for pid, profile in saved.items() if profile is not None}
+            try:
+                results = await writes.loop.run_in_executor(_writer(), _apply, changes, saved)
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, _, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+    finally:
+        writes.flushing = None
+
+
+async def _submit(change: storage.Change, profile: Optional[SmtpProfile] = None) -> bool:
+    global _writes
+    loop = asyncio.get_running_loop()
+    writes = _writes
+    if writes is None or writes.loop is not loop:
+        writes = _writes = _Writes(loop)
+    future = loop.create_future()
+    writes.pending.append((change, profile, future))
+    if writes.flushing is None:
+        writes.flushing = loop.create_task(_flush(writes))
+    return await future
+
+
+async def _acurrent() -> _Snapshot:
+    """The snapshot, refreshed in a thread when it is due for a check."""
+    snap = _snapshot
+    fresh = snap is not None and time.monotonic() - snap.checked_at < STAT_INTERVAL
+    if fresh and snap.store is storage.profile_store():
+        return snap
+    return await asyncio.to_thread(_current)
+
+
+async def aget(profile_id: str) -> Optional[SmtpProfile]:
+    """Retrieve a single profile by its ID without blocking the event loop."""
+    return (await _acurrent()).profiles.get(profile_id)
+
+
+async def alist_all() -> list[dict]:
+    """List all profiles with passwords masked, without blocking the event loop."""
+    return [{**profile.model_dump(), "smtp_password": "****"} for profile in (await _acurrent()).profiles.values()]
+
+
+async def aall() -> list[SmtpProfile]:
+    """Every registered profile, without blocking the event loop."""
+    return list((await _acurrent()).profiles.values())
+
+
+async def aadd(profile: SmtpProfile) -> dict:
+    """Add or update an SMTP profile in the writer thread, batched with concurrent writes."""
+    await _submit((profile.profile_id, profile.model_dump()), profile)
+    return {"status": "saved", "profile_id": profile.profile_id}
+
+
+async def adelete(profile_id: str) -> dict:
+    """Delete a profile in the writer thread, batched with concurrent writes."""
+    if not await _submit((profile_id, None)):
+        return {"status": "not_found", "profile_id": profile_id}
+    return {"status": "deleted", "profile_id": profile_id}
@@ -0,0 +1,177 @@
+"""
+Rate Limiter — per-profile token buckets and daily quotas.
+
+Each profile may declare `max_per_second`, `max_recipients_per_message` and
+`daily_quota` (recipients per UTC day). Sends wait for a token instead of
+bursting into the provider's throttling; when the provider still answers with
+a 4xx reply, the profile is paused for `settings.rate_limit_cooldown` seconds.
+"""
+
+import asyncio
+import datetime as dt
+import logging
+import time
+from typing import Optional
+
+from .config import settings
+from .models import SmtpProfile
+from . import retry
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitExceeded(Exception):
+    """
+    A send was refused by the local limiter.
+
+    `retry_after` is the number of seconds until it could succeed, or None if
+    it never will as-is (e.g. too many recipients for one message).
+    """
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _seconds_until_utc_midnight(now: dt.datetime) -> float:
+    tomorrow = (now + dt.timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (tomorrow - now).total_seconds()
+
+
+class ProfileLimiter:
+    """Token bucket + daily recipient counter for one profile."""
+
+    def __init__(self, profile: SmtpProfile):
+        self.profile_id = profile.profile_id
+        self.configure(profile)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.day = dt.datetime.now(dt.timezone.utc).date()
+        self.sent_today = 0
+
+    def configure(self, profile: SmtpProfile) -> None:
+        """Apply (possibly updated) limits from the profile, keeping counters."""
+        self.limits = (profile.max_per_second, profile.max_recipients_per_message, profile.daily_quota)
+        self.rate = profile.max_per_second
+        self.burst = max(1.0, self.rate) if self.rate else 0.0
+        self.max_recipients = profile.max_recipients_per_message
+        self.daily_quota = profile.daily_quota
+
+    def _refill(self, now: float) -> None:
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def _roll_day(self) -> dt.datetime:
+        now = dt.datetime.now(dt.timezone.utc)
+        if now.date() != self.day:
+            self.day = now.date()
+            self.sent_today = 0
+        return now
+
+    def reserve(self, recipients: int) -> float:
+        """
+        Claim capacity for one message and return how long the caller must
+        wait before sending it. Raises RateLimitExceeded if it cannot be sent.
+        """
+        if self.max_recipients and recipients > self.max_recipients:
+            raise RateLimitExceeded(
+                f"Profile '{self.profile_id}' allows at most {self.max_recipients} recipients per message"
+            )
+        utc_now = self._roll_day()
+        if self.daily_quota and self.sent_today + recipients > self.daily_quota:
+            raise RateLimitExceeded(
+                f"Profile '{self.profile_id}' reached its daily quota of {self.daily_quota} recipients",
+                retry_after=_seconds_until_utc_midnight(utc_now),
+            )
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self.paused_until - now)
+        if self.rate:
+            # Tokens may go negative: each waiter reserves its own slot, FIFO.
+            self.tokens -= 1
+            if self.tokens < 0:
+                wait = max(wait, -self.tokens / self.rate)
+        self.sent_today += recipients
+        return wait
+
+    def release(self, recipients: int) -> None:
+        """Give back a reservation that will not be used."""
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + 1)
+        self.sent_today = max(0, self.sent_today - recipients)
+
+    def pause(self, seconds: float) -> None:
+        """Hold back all sends for a while (the provider is throttling us)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def state(self) -> dict:
+        now = time.monotonic()
+        self._refill(now)
+        utc_now = self._roll_day()
+        return {
+            "profile_id": self.profile_id,
+            "max_per_second": self.rate,
+            "tokens": round(self.tokens, 3) if self.rate else None,
+            "max_recipients_per_message": self.max_recipients,
+            "daily_quota": self.daily_quota,
+            "sent_today": self.sent_today,
+            "quota_resets_in": round(_seconds_until_utc_midnight(utc_now)),
+            "paused_for": round(max(0.0, self.paused_until - now), 3),
+        }
+
+
+_limiters: dict[str, ProfileLimiter] = {}
+
+
+def limiter_for(profile: SmtpProfile) -> ProfileLimiter:
+    """Return the limiter for a profile, creating or reconfiguring it as needed."""
+    limiter = _limiters.get(profile.profile_id)
+    if limiter is None:
+        limiter = _limiters[profile.profile_id] = ProfileLimiter(profile)
+    elif limiter.limits != (profile.max_per_second, profile.max_recipients_per_message, profile.daily_quota):
+        limiter.configure(profile)
+    return limiter
+
+
+async def acquire(profile: SmtpProfile, recipients: int) -> ProfileLimiter:
+    """
+    Wait until the profile may send a message to `recipients` addresses.
+
+    Raises RateLimitExceeded instead of waiting when `settings.rate_limit_wait`
+    is off, or when the wait would exceed `settings.rate_limit_max_wait`.
+    """
+    limiter = limiter_for(profile)
+    wait = limiter.reserve(recipients)
+    if wait > 0:
+        if not settings.rate_limit_wait or wait > settings.rate_limit_max_wait:
+            limiter.release(recipients)
+            raise RateLimitExceeded(f"Profile '{profile.profile_id}' is rate limited", retry_after=wait)
+        try:
+            await retry.scheduler.sleep(wait)
+        except asyncio.CancelledError:
+            limiter.release(recipients)
+            raise
+    return limiter
+
+
+def record_failure(profile: SmtpProfile, exc: BaseException, recipients: int) -> None:
+    """
+    Update a profile's limiter after a failed send: refund the quota, and
+    pause the profile if the provider pushed back with a 4xx reply.
+    """
+    limiter = _limiters.get(profile.profile_id)
+    if limiter is None:
+        return
+    limiter.sent_today = max(0, limiter.sent_today - recipients)
+    code = retry.smtp_code(exc)
+    if code is not None and 400 <= code < 500 and settings.rate_limit_cooldown > 0:
+        limiter.pause(settings.rate_limit_cooldown)
+        logger.warning("Provider throttled %s (%s), pausing for %.0fs",
+                       profile.profile_id, code, settings.rate_limit_cooldown)
+
+
+def state(profile: SmtpProfile) -> dict:
+    """Current bucket and quota state for a profile."""
+    return limiter_for(profile).state()
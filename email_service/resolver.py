@@ -0,0 +1,166 @@
+"""
+Resolver — cached MX lookups for direct delivery.
+
+Answers are kept until their DNS TTL runs out; domains that do not exist or
+do not accept mail (null MX, RFC 7505) are cached for
+`settings.dns_negative_ttl` seconds. Concurrent lookups of the same domain
+share one query. The resolver itself is pluggable, so tests (or a
+deployment with its own DNS client) can swap it out:
+
+    from email_service import resolver
+
+    class StaticResolver:
+        async def mx(self, domain):
+            return [(10, "127.0.0.1")], 300.0
+
+    resolver.set_resolver(StaticResolver())
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional, Protocol, Union
+
+from .config import settings
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Bounds applied to the TTLs of positive answers (seconds).
+MIN_TTL = 5.0
+MAX_TTL = 86400.0
+
+
+class MxLookupError(Exception):
+    """
+    A domain's mail servers could not be determined.
+
+    `retry_after` is None when the failure is permanent (no such domain, null
+    MX), or a number of seconds after which a new lookup may succeed.
+    """
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Resolver(Protocol):
+    async def mx(self, domain: str) -> tuple[list[tuple[int, str]], float]:
+        """
+        Return the domain's MX records as (preference, host) pairs and the
+        answer's TTL. An empty list means the domain has no MX records.
+        Raise MxLookupError if the lookup fails.
+        """
+
+
+class DnsPythonResolver:
+    """Looks up MX records with dnspython's asyncio resolver."""
+
+    def __init__(self, timeout: Optional[float] = None):
+        import dns.asyncresolver
+
+        self._resolver = dns.asyncresolver.Resolver()
+        self.timeout = timeout if timeout is not None else settings.dns_timeout
+
+    async def mx(self, domain: str) -> tuple[list[tuple[int, str]], float]:
+        import dns.exception
+        import dns.resolver
+
+        try:
+            answer = await self._resolver.resolve(domain, "MX", lifetime=self.timeout)
+        except dns.resolver.NXDOMAIN:
+            raise MxLookupError(f"Domain '{domain}' does not exist") from None
+        except dns.resolver.NoAnswer:
+            return [], settings.dns_negative_ttl
+        except dns.exception.DNSException as e:
+            raise MxLookupError(f"MX lookup for '{domain}' failed: {e}", retry_after=self.timeout) from e
+        records = [(r.preference, r.exchange.to_text(omit_final_dot=True)) for r in answer]
+        return records, float(answer.rrset.ttl)
+
+
+class MxCache:
+    """A size-bounded cache of MX hosts per domain with TTL-based expiry."""
+
+    def __init__(self, resolver: Resolver, *, max_entries: int, negative_ttl: float):
+        self.resolver = resolver
+        self.max_entries = max(1, max_entries)
+        self.negative_ttl = negative_ttl
+        self._entries: OrderedDict[str, tuple[float, Union[list[str], MxLookupError]]] = OrderedDict()
+        self._pending: dict[str, asyncio.Future] = {}
+
+    def _store(self, domain: str, ttl: float, value: Union[list[str], MxLookupError]) -> None:
+        self._entries[domain] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(domain)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _resolve(self, domain: str) -> list[str]:
+        try:
+            with metrics.STAGE_SECONDS.time(stage="dns"):
+                records, ttl = await self.resolver.mx(domain)
+        except MxLookupError as e:
+            if e.retry_after is None:
+                self._store(domain, self.negative_ttl, e)
+            raise
+        if not records:
+            # No MX: the domain itself is the mail server (RFC 5321 §5.1).
+            hosts = [domain]
+        else:
+            hosts = [host.rstrip(".").lower() for _, host in sorted(records, key=lambda r: r[0])]
+        if hosts == [""]:
+            error = MxLookupError(f"Domain '{domain}' does not accept mail (null MX)")
+            self._store(domain, self.negative_ttl, error)
+            raise error
+        self._store(domain, min(MAX_TTL, max(MIN_TTL, ttl)), hosts)
+        return hosts
+
+    def _finished(self, domain: str, future: asyncio.Future) -> None:
+        self._pending.pop(domain, None)
+        if not future.cancelled():
+            future.exception()  # retrieved here in case every caller gave up
+
+    async def lookup(self, domain: str) -> list[str]:
+        """The domain's mail hosts, most preferred first. Raises MxLookupError."""
+        domain = domain.rstrip(".").lower()
+        entry = self._entries.get(domain)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(domain)
+                if isinstance(value, MxLookupError):
+                    raise value
+                return value
+            del self._entries[domain]
+        pending = self._pending.get(domain)
+        if pending is None:
+            pending = self._pending[domain] = asyncio.ensure_future(self._resolve(domain))
+            pending.add_done_callback(lambda f: self._finished(domain, f))
+        # Shielded so one cancelled caller does not cancel everyone's lookup.
+        return await asyncio.shield(pending)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_cache: Optional[MxCache] = None
+
+
+def set_resolver(resolver: Resolver) -> MxCache:
+    """Use `resolver` for MX lookups from now on (with a fresh, empty cache)."""
+    global _cache
+    _cache = MxCache(resolver, max_entries=settings.dns_cache_size, negative_ttl=settings.dns_negative_ttl)
+    return _cache
+
+
+def cache() -> MxCache:
+    """The MX cache, built around dnspython on first use."""
+    return _cache if _cache is not None else set_resolver(DnsPythonResolver())
+
+
+async def lookup(domain: str) -> list[str]:
+    """A domain's mail hosts, most preferred first, from the cache when fresh."""
+    return await cache().lookup(domain)
@@ -0,0 +1,165 @@
+"""
+Retry Engine — classifies SMTP failures and schedules retries.
+
+Transient failures (4xx replies, dropped connections, timeouts) are retried
+with jittered exponential backoff; permanent failures (5xx replies, bad
+input) fail fast. Delayed retries are kept on one heap served by a single
+timer task instead of one sleeping coroutine per message.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+import aiosmtplib
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+
+
+def smtp_code(exc: BaseException) -> Optional[int]:
+    """The SMTP reply code carried by an exception, if any."""
+    if isinstance(exc, aiosmtplib.SMTPRecipientsRefused) and exc.recipients:
+        return min(r.code for r in exc.recipients)
+    code = getattr(exc, "code", None)
+    return code if isinstance(code, int) and code > 0 else None
+
+
+def classify(exc: BaseException) -> str:
+    """Return TRANSIENT if the failed send is worth retrying, else PERMANENT."""
+    if hasattr(exc, "retry_after"):
+        # Refused by our own rate limiter: retryable once capacity frees up.
+        return TRANSIENT if exc.retry_after is not None else PERMANENT
+    if isinstance(exc, aiosmtplib.SMTPRecipientsRefused):
+        codes = [r.code for r in exc.recipients]
+        return TRANSIENT if any(400 <= c < 500 for c in codes) else PERMANENT
+    if isinstance(exc, aiosmtplib.SMTPResponseException):
+        if 400 <= exc.code < 500:
+            return TRANSIENT
+        if 500 <= exc.code < 600:
+            return PERMANENT
+        # aiosmtplib reports a missing/garbled reply with code -1.
+        return TRANSIENT
+    if isinstance(exc, (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPConnectError,
+                        aiosmtplib.SMTPTimeoutError, OSError)):
+        return TRANSIENT
+    return PERMANENT
+
+
+def backoff(attempt: int) -> float:
+    """
+    Delay before retry number `attempt` (1-based): "full jitter" exponential
+    backoff, uniform in [0, min(max_delay, base * 2**(attempt-1))].
+    """
+    ceiling = min(settings.retry_max_delay, settings.retry_base_delay * (2 ** (attempt - 1)))
+    return random.uniform(0, ceiling)
+
+
+class RetryScheduler:
+    """
+    A min-heap of (due time, callback) served by one timer task.
+
+    Thousands of pending retries cost one heap entry each, not one
+    sleeping coroutine each.
+    """
+
+    def __init__(self):
+        self._heap: list[tuple[float, int, Callable, tuple]] = []
+        self._seq = itertools.count()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _ensure_running(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            if self._loop is not loop:
+                self._heap.clear()
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+        return loop
+
+    def call_later(self, delay: float, callback: Callable[..., Any], *args: Any) -> None:
+        """Run `callback(*args)` on the event loop after `delay` seconds."""
+        loop = self._ensure_running()
+        entry = (loop.time() + max(0.0, delay), next(self._seq), callback, args)
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            self._wakeup.set()
+
+    def sleep(self, delay: float) -> "asyncio.Future[None]":
+        """A future that resolves after `delay` seconds, driven by the heap."""
+        loop = self._ensure_running()
+        future = loop.create_future()
+        self.call_later(delay, lambda: future.done() or future.set_result(None))
+        return future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            delay = self._heap[0][0] - loop.time()
+            if delay <= 0:
+                _, _, callback, args = heapq.heappop(self._heap)
+                try:
+                    callback(*args)
+                except Exception:
+                    logger.exception("Retry callback failed")
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    async def close(self) -> None:
+        """Stop the timer task and drop pending entries."""
+        self._heap.clear()
+        if self._task is not None:
+            # A task left behind by an event loop that has since closed cannot be awaited here.
+            if self._loop is asyncio.get_running_loop():
+                self._task.cancel()
+                await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+scheduler = RetryScheduler()
+
+
+async def run(fn: Callable[[], Awaitable[T]], *, attempts: Optional[int] = None) -> T:
+    """
+    Await `fn()`, retrying transient failures up to `attempts` times in total
+    (default `settings.retry_max_attempts`). The last error is re-raised.
+    """
+    limit = max(1, attempts or settings.retry_max_attempts)
+    attempt = 1
+    while True:
+        try:
+            return await fn()
+        except Exception as e:
+            if attempt >= limit or classify(e) == PERMANENT:
+                raise
+            if getattr(e, "retry_after", None) is not None:
+                # The rate limiter already waited as long as it is allowed to.
+                raise
+            delay = backoff(attempt)
+            logger.warning("Transient send failure (attempt %d/%d), retrying in %.2fs: %s",
+                           attempt, limit, delay, e)
+            await scheduler.sleep(delay)
+            attempt += 1
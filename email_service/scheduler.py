@@ -0,0 +1,247 @@
+"""
+Send Scheduler — in-flight limits per SMTP host and per profile, shared
+fairly between profiles, with transactional mail ahead of bulk.
+
+Every delivery attempt takes a slot first. A host (`smtp_host`) has
+SEND_HOST_CONCURRENCY slots, however many profiles point at it, and each
+profile has SEND_PROFILE_CONCURRENCY of them (default SMTP_POOL_SIZE;
+`max_in_flight` on the profile overrides it). A send that finds no free
+slot waits in its host's queue:
+
+- Priority classes are served strictly in order: a waiting "transactional"
+  send always goes before a "bulk" one that could take the same slot.
+- Within a class, profiles share the host by weighted fair queueing: each
+  waiting send gets a virtual finish tag of max(host clock, profile's last
+  tag) + slots/weight, and the smallest tag whose profile has room goes
+  next. A profile with `weight` 2 gets twice the slots of one with 1 while
+  both are busy; one tenant's burst only queues behind itself.
+
+Queues are bounded: when SEND_QUEUE_SIZE sends of a class are already
+waiting for a host, or a send has waited SEND_MAX_WAIT seconds, it is
+refused with `QueueFull` (a RateLimitExceeded, so the API answers 429 with
+Retry-After). Direct profiles have no relay host; only their profile limit
+applies (direct delivery limits connections per MX host itself).
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from .config import settings
+from .models import SmtpProfile
+from .ratelimit import RateLimitExceeded
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Served in this order.
+CLASSES = ("transactional", "bulk")
+
+_DIRECT = ""  # the pseudo-host of direct profiles: no host limit
+
+
+class QueueFull(RateLimitExceeded):
+    """A send was refused because its host's queue is full or it waited too long."""
+
+
+class _Waiter:
+    __slots__ = ("future", "flow", "priority", "slots", "tag", "queued_at")
+
+    def __init__(self, future: asyncio.Future, flow: "_Flow", priority: str, slots: int, tag: float):
+        self.future = future
+        self.flow = flow
+        self.priority = priority
+        self.slots = slots
+        self.tag = tag
+        self.queued_at = time.perf_counter()
+
+
+class _Flow:
+    """One profile's sends on a host: its limit, weight, in-flight count and queues per class."""
+
+    def __init__(self, profile_id: str):
+        self.profile_id = profile_id
+        self.limit = 0
+        self.weight = 1.0
+        self.in_flight = 0
+        self.finish = dict.fromkeys(CLASSES, 0.0)
+        self.queues: dict[str, deque[_Waiter]] = {c: deque() for c in CLASSES}
+
+    def configure(self, profile: SmtpProfile) -> None:
+        self.limit = profile.max_in_flight or settings.send_profile_concurrency or settings.smtp_pool_size
+        self.weight = profile.weight
+
+    def has_room(self, slots: int) -> bool:
+        return self.in_flight + slots <= max(self.limit, slots)
+
+
+class _Host:
+    """The slots of one SMTP host and the sends waiting for them."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.in_flight = 0
+        self.flows: dict[str, _Flow] = {}
+        self.clock = dict.fromkeys(CLASSES, 0.0)
+        self.queued = dict.fromkeys(CLASSES, 0)
+
+    @property
+    def limit(self) -> int:
+        return 0 if self.name == _DIRECT else settings.send_host_concurrency
+
+    def has_room(self, slots: int) -> bool:
+        limit = self.limit
+        return not limit or self.in_flight + slots <= max(limit, slots)
+
+    def flow(self, profile: SmtpProfile) -> _Flow:
+        flow = self.flows.get(profile.profile_id)
+        if flow is None:
+            flow = self.flows[profile.profile_id] = _Flow(profile.profile_id)
+        flow.configure(profile)
+        return flow
+
+
+class Scheduler:
+    """Slots per host and profile; see the module docstring."""
+
+    def __init__(self):
+        self._hosts: dict[str, _Host] = {}
+
+    def _host(self, profile: SmtpProfile) -> _Host:
+        name = _DIRECT if profile.direct else profile.smtp_host.lower()
+        host = self._hosts.get(name)
+        if host is None:
+            host = self._hosts[name] = _Host(name)
+        return host
+
+    @asynccontextmanager
+    async def slot(self, profile: SmtpProfile, priority: str = "transactional", slots: int = 1) -> AsyncIterator[None]:
+        """
+        Hold `slots` of the profile's host and profile limits for the block,
+        waiting for them in turn. Raises QueueFull instead of waiting when
+        the queue is full, or once SEND_MAX_WAIT has passed.
+        """
+        host = self._host(profile)
+        flow = host.flow(profile)
+        await self._acquire(host, flow, priority, slots)
+        try:
+            yield
+        finally:
+            self._release(host, flow, slots)
+
+    async def _acquire(self, host: _Host, flow: _Flow, priority: str, slots: int) -> None:
+        if not any(host.queued.values()) and host.has_room(slots) and flow.has_room(slots):
+            self._take(host, flow, slots)
+            metrics.SEND_QUEUE_WAIT.observe(0.0, priority=priority)
+            return
+        if host.queued[priority] >= settings.send_queue_size:
+            metrics.SEND_REJECTED.inc(priority=priority, reason="queue_full")
+            raise QueueFull(f"Too many {priority} sends waiting for {host.name or 'direct delivery'}", retry_after=1.0)
+
+        tag = max(host.clock[priority], flow.finish[priority]) + slots / flow.weight
+        flow.finish[priority] = tag
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), flow, priority, slots, tag)
+        flow.queues[priority].append(waiter)
+        host.queued[priority] += 1
+        metrics.SEND_QUEUED.inc(priority=priority)
+        self._dispatch(host)
+        try:
+            await asyncio.wait_for(waiter.future, settings.send_max_wait or None)
+        except BaseException as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as the caller gave up: hand the slots on.
+                self._release(host, flow, slots)
+            else:
+                # Still queued; _dispatch drops it when it reaches the front.
+                host.queued[priority] -= 1
+                metrics.SEND_QUEUED.dec(priority=priority)
+            if isinstance(e, asyncio.TimeoutError):
+                metrics.SEND_REJECTED.inc(priority=priority, reason="timeout")
+                raise QueueFull(
+                    f"Waited {settings.send_max_wait:g}s for a send slot on {host.name or 'direct delivery'}",
+                    retry_after=1.0,
+                ) from None
+            raise
+
+    def _take(self, host: _Host, flow: _Flow, slots: int) -> None:
+        host.in_flight += slots
+        flow.in_flight += slots
+
+    def _release(self, host: _Host, flow: _Flow, slots: int) -> None:
+        host.in_flight -= slots
+        flow.in_flight -= slots
+        self._dispatch(host)
+
+    def _dispatch(self, host: _Host) -> None:
+        """Grant free slots to waiting sends: highest class first, then smallest finish tag."""
+        while True:
+            waiter = self._next(host)
+            if waiter is None:
+                return
+            waiter.flow.queues[waiter.priority].popleft()
+            host.queued[waiter.priority] -= 1
+            host.clock[waiter.priority] = waiter.tag
+            self._take(host, waiter.flow, waiter.slots)
+            waiter.future.set_result(None)
+            metrics.SEND_QUEUED.dec(priority=waiter.priority)
+            metrics.SEND_QUEUE_WAIT.observe(time.perf_counter() - waiter.queued_at, priority=waiter.priority)
+
+    def _next(self, host: _Host) -> Optional[_Waiter]:
+        for priority in CLASSES:
+            if not host.queued[priority]:
+                continue
+            best = None
+            for flow in host.flows.values():
+                queue = flow.queues[priority]
+                while queue and queue[0].future.done():
+                    queue.popleft()  # gave up while waiting
+                if not queue:
+                    continue
+                head = queue[0]
+                if host.has_room(head.slots) and flow.has_room(head.slots) and (best is None or head.tag < best.tag):
+                    best = head
+            if best is not None:
+                return best
+        return None
+
+    def stats(self) -> list[dict]:
+        """In-flight and waiting sends per host and profile."""
+        return [
+            {
+                "host": host.name or None,
+                "limit": host.limit or None,
+                "in_flight": host.in_flight,
+                "queued": dict(host.queued),
+                "profiles": {
+                    flow.profile_id: {
+                        "limit": flow.limit,
+                        "weight": flow.weight,
+                        "in_flight": flow.in_flight,
+                        "queued": {c: sum(not w.future.done() for w in flow.queues[c]) for c in CLASSES},
+                    }
+                    for flow in host.flows.values()
+                },
+            }
+            for host in self._hosts.values()
+        ]
+
+
+_scheduler = Scheduler()
+
+
+def slot(profile: SmtpProfile, priority: str = "transactional", slots: int = 1):
+    """`Scheduler.slot` on the process-wide scheduler."""
+    return _scheduler.slot(profile, priority, slots)
+
+
+def stats() -> list[dict]:
+    return _scheduler.stats()
+
+
+def reset() -> None:
+    """Forget every host and queue (for tests)."""
+    global _scheduler
+    _scheduler = Scheduler()
@@ -3,78 +3,462 @@ Email Sender — sends emails using a given SMTP profile.
 Works with any email provider (Gmail, Outlook, Zoho, custom domains, etc.)
 """
 
+import asyncio
 import logging
 import ssl
-
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.utils import formataddr
+from typing import AsyncIterator, Callable, Iterable, Optional, Union
 
 import aiosmtplib
 
-from .models import SmtpProfile, EmailMessage
+from .config import settings
+from .models import SmtpProfile, EmailMessage, ProfileGroup
+from .pool import Session, SmtpPool, get_pool
+from . import direct, dkim, groups, metrics, mime, pipeline, ratelimit, retry, scheduler, templates
 
 logger = logging.getLogger(__name__)
 
 
-def _create_ssl_context(*, verify: bool = True) -> ssl.SSLContext:
+def _create_ssl_context(
+    *,
+    verify: bool = True,
+    ca_file: Optional[str] = None,
+    client_cert: Optional[str] = None,
+    client_key: Optional[str] = None,
+) -> ssl.SSLContext:
     """Create an SSL context. Verifies certificates by default."""
-    ctx = ssl.create_default_context()
+    ctx = ssl.create_default_context(cafile=ca_file)
     if not verify:
         ctx.check_hostname = False
         ctx.verify_mode = ssl.CERT_NONE
+    if client_cert:
+        ctx.load_cert_chain(client_cert, client_key)
+    return ctx
+
+
+_ssl_contexts: dict[tuple, ssl.SSLContext] = {}
+
+
+def _ssl_context_for(profile: SmtpProfile) -> ssl.SSLContext:
+    """
+    Return a shared SSL context for the profile's host and TLS settings.
+
+    Building a context parses the system CA bundle, so contexts are cached
+    and shared by every profile with the same (verify_ssl, smtp_host) and
+    certificate files.
+    """
+    key = (profile.verify_ssl, profile.smtp_host, profile.ca_file, profile.client_cert, profile.client_key)
+    ctx = _ssl_contexts.get(key)
+    if ctx is None:
+        ctx = _ssl_contexts[key] = _create_ssl_context(
+            verify=profile.verify_ssl,
+            ca_file=profile.ca_file,
+            client_cert=profile.client_cert,
+            client_key=profile.client_key,
+        )
     return ctx
 
 
-async def send(message: EmailMessage, profile: SmtpProfile) -> dict:
+def pool_for(profile: SmtpProfile) -> SmtpPool:
+    """The connection pool of a relay profile, created on first use."""
+    return get_pool(profile, lambda: _ssl_context_for(profile))
+
+
+async def _signed(prepared: mime.PreparedMessage, head: bytes, profile: SmtpProfile) -> bytes:
+    """A copy's head, with a DKIM signature if the profile signs its mail."""
+    if not dkim.enabled(profile):
+        return head
+    with metrics.STAGE_SECONDS.time(stage="dkim"):
+        return await dkim.sign(prepared, head, profile)
+
+
+async def _deliver_via(
+    message: EmailMessage, profile: SmtpProfile, session: Optional[Session] = None
+) -> tuple[dict, str]:
+    """
+    Hand one message to the profile's connection pool (or to `session`)
+    once its rate limiter allows it. Returns (refused, response).
+    """
+    with metrics.STAGE_SECONDS.time(stage="mime"):
+        prepared = mime.prepare(message, profile)
+        head = prepared.head(message.to)
+    head = await _signed(prepared, head, profile)
+    data = None if prepared.files else prepared.render(message.to, head=head)
+    await ratelimit.acquire(profile, len(message.to))
+    pool = session if session is not None else pool_for(profile)
+    metrics.IN_FLIGHT.inc()
+    try:
+        if data is None:
+            # Attachments are streamed; each retry reopens the files.
+            result = await pool.send_stream(
+                profile.from_email, message.to, lambda: prepared.stream(message.to, head=head)
+            )
+        else:
+            result = await pool.sendmail(profile.from_email, message.to, data)
+    except Exception as e:
+        ratelimit.record_failure(profile, e, len(message.to))
+        metrics.SENDS.inc(len(message.to), profile=profile.profile_id, outcome="failed")
+        metrics.SMTP_RESPONSES.inc(len(message.to), code=retry.smtp_code(e) or "none")
+        raise
+    finally:
+        metrics.IN_FLIGHT.dec()
+    refused, reply = result
+    accepted = len(message.to) - len(refused)
+    metrics.SENDS.inc(accepted, profile=profile.profile_id, outcome="success")
+    metrics.SENDS.inc(len(refused), profile=profile.profile_id, outcome="failed")
+    metrics.SMTP_RESPONSES.inc(accepted, code=reply.code)
+    for refusal in refused.values():
+        metrics.SMTP_RESPONSES.inc(code=refusal.code)
+    return refused, reply.message
+
+
+def _settle(
+    profile: SmtpProfile,
+    outcomes: list[tuple[list[str], Union[list[aiosmtplib.SMTPResponse], BaseException]]],
+    counted: int,
+) -> tuple[dict, str]:
+    """
+    Turn per-run outcomes (a reply per recipient, or the error that stopped
+    the run) into (refused, response), recording metrics and handing unused
+    quota back to the rate limiter. `counted` is how many recipients were
+    charged to the profile's quota. Raises if no recipient was accepted.
+    """
+    refused: dict[str, aiosmtplib.SMTPResponse] = {}
+    errors = []
+    total = 0
+    for run, outcome in outcomes:
+        total += len(run)
+        if isinstance(outcome, BaseException):
+            errors.append(outcome)
+            code = retry.smtp_code(outcome) or pipeline.NOT_SENT
+            outcome = [aiosmtplib.SMTPResponse(code, str(outcome))] * len(run)
+        for rcpt, reply in zip(run, outcome):
+            metrics.SMTP_RESPONSES.inc(code=reply.code if reply.code > 0 else "none")
+            if reply.code != 250:
+                refused[rcpt] = reply
+    accepted = total - len(refused)
+    metrics.SENDS.inc(accepted, profile=profile.profile_id, outcome="success")
+    metrics.SENDS.inc(len(refused), profile=profile.profile_id, outcome="failed")
+
+    if refused:
+        throttled = [r for r in refused.values() if 400 <= r.code < 500]
+        worst = (throttled or list(refused.values()))[0]
+        ratelimit.record_failure(
+            profile, aiosmtplib.SMTPResponseException(worst.code, worst.message), max(0, counted - accepted)
+        )
+    if not accepted:
+        if errors:
+            raise errors[0]
+        raise aiosmtplib.SMTPRecipientsRefused(
+            [aiosmtplib.SMTPRecipientRefused(r.code, r.message, rcpt) for rcpt, r in refused.items()]
+        )
+    return refused, f"{accepted} of {total} recipients accepted"
+
+
+class _Pacer:
+    """Waits for one rate-limit token per individual copy and counts them."""
+
+    def __init__(self, profile: SmtpProfile):
+        self.profile = profile
+        self.count = 0
+
+    async def __call__(self) -> None:
+        await ratelimit.acquire(self.profile, 1)
+        self.count += 1
+
+
+async def _copy_renderer(
+    prepared: mime.PreparedMessage, profile: SmtpProfile, recipients: list[str]
+) -> Callable[[str], pipeline.Content]:
+    """
+    Per-recipient content: bytes, or a chunk stream when there are
+    attachments. If the profile signs its mail, every copy is signed first.
+    """
+    heads: dict[str, bytes] = {}
+    if dkim.enabled(profile):
+        with metrics.STAGE_SECONDS.time(stage="dkim"):
+            heads = await dkim.sign_copies(prepared, profile, recipients)
+    if prepared.files:
+        return lambda rcpt: prepared.stream([rcpt], head=heads.get(rcpt))
+    return lambda rcpt: prepared.render([rcpt], head=heads.get(rcpt))
+
+
+async def _deliver_copies(
+    message: EmailMessage, profile: SmtpProfile, session: Optional[Session] = None
+) -> tuple[dict, str]:
+    """
+    Send each recipient of an `individual` message its own copy. Recipients
+    are ordered by domain and split into runs that each share one pooled
+    session (or that follow each other in `session`). Returns (refused,
+    response) like `_deliver_via`; raises only if no copy was accepted.
     """
-    Send an email using the provided SMTP profile.
+    recipients = pipeline.by_domain(message.to)
+    with metrics.STAGE_SECONDS.time(stage="mime"):
+        prepared = mime.prepare(message, profile)
+    render = await _copy_renderer(prepared, profile, recipients)
+    pace = _Pacer(profile)
+    metrics.IN_FLIGHT.inc(len(recipients))
+    try:
+        if session is not None:
+            runs = pipeline.split(recipients, 1, settings.smtp_pool_max_messages)
+            outcomes = []
+            for run in runs:
+                try:
+                    outcomes.append(await session.send_copies(profile.from_email, run, render, pace=pace))
+                except Exception as e:
+                    outcomes.append(e)
+        else:
+            pool = pool_for(profile)
+            runs = pipeline.split(recipients, pool.size, settings.smtp_pool_max_messages)
+            outcomes = await asyncio.gather(
+                *(pool.send_copies(profile.from_email, run, render, pace=pace) for run in runs),
+                return_exceptions=True,
+            )
+    finally:
+        metrics.IN_FLIGHT.dec(len(recipients))
+    return _settle(profile, list(zip(runs, outcomes)), pace.count)
+
+
+async def _deliver_direct(message: EmailMessage, profile: SmtpProfile) -> tuple[dict, str]:
+    """
+    Deliver without a relay, straight to each recipient domain's MX hosts.
+    Returns (refused, response) like `_deliver_via`.
+    """
+    with metrics.STAGE_SECONDS.time(stage="mime"):
+        prepared = mime.prepare(message, profile)
+    if message.individual:
+        render = await _copy_renderer(prepared, profile, message.to)
+    else:
+        head = await _signed(prepared, prepared.head(message.to), profile)
+    metrics.IN_FLIGHT.inc()
+    try:
+        if message.individual:
+            pace = _Pacer(profile)
+            outcomes = await direct.deliver(profile.from_email, message.to, render=render, pace=pace)
+            counted = pace.count
+        else:
+            await ratelimit.acquire(profile, len(message.to))
+            if prepared.files:
+                # One head (and Message-ID) for the copies streamed to each domain.
+                data = lambda: prepared.stream(message.to, head=head)  # noqa: E731
+            else:
+                data = prepared.render(message.to, head=head)
+            outcomes = await direct.deliver(profile.from_email, message.to, data=data)
+            counted = len(message.to)
+    finally:
+        metrics.IN_FLIGHT.dec()
+    return _settle(profile, outcomes, counted)
+
+
+async def _deliver_to(
+    message: EmailMessage, profile: SmtpProfile, session: Optional[Session] = None
+) -> tuple[dict, str]:
+    """
+    Pick the delivery path for a profile and message, once the scheduler
+    grants it a slot on the profile's SMTP host. An `individual` message
+    takes one slot per pooled connection it may use; a message in `session`
+    takes none, the session holds one for the whole sequence.
+    """
+    if session is not None:
+        if message.individual:
+            return await _deliver_copies(message, profile, session)
+        return await _deliver_via(message, profile, session)
+    slots = min(len(message.to), settings.smtp_pool_size) if message.individual and not profile.direct else 1
+    async with scheduler.slot(profile, message.priority, max(1, slots)):
+        if profile.direct:
+            return await _deliver_direct(message, profile)
+        if message.individual:
+            return await _deliver_copies(message, profile)
+        return await _deliver_via(message, profile)
+
+
+async def _deliver(
+    message: EmailMessage, target: Union[SmtpProfile, ProfileGroup], session: Optional[Session] = None
+) -> tuple[tuple[dict, str], SmtpProfile]:
+    """
+    Send through a profile (in `session`, if given), or through a group
+    member with failover. Returns ((refused, response), profile_used).
+    """
+    with metrics.SEND_SECONDS.time(priority=message.priority):
+        if isinstance(target, ProfileGroup):
+            return await groups.deliver(target, lambda p: _deliver_to(message, p))
+        return await _deliver_to(message, target, session), target
+
+
+async def send(message: EmailMessage, profile: Union[SmtpProfile, ProfileGroup]) -> dict:
+    """
+    Send an email using the provided SMTP profile, or a profile group.
 
     TLS mode is auto-detected from the port:
       - 465  → Implicit SSL/TLS
       - 587  → STARTTLS
       - other → No encryption (not recommended)
 
+    Connections are taken from a per-profile pool, so consecutive sends
+    reuse an already authenticated session. An `individual` message is sent
+    as one copy per recipient over shared sessions, pipelined when the
+    server supports it. A `direct` profile skips the relay and delivers to
+    each recipient domain's MX hosts.
+
     Args:
-        message: The email content (to, subject, text/html).
-        profile: The SMTP credentials to use.
+        message: The email content (to, subject, text/html), or a stored
+            template and its variables.
+        profile: The SMTP credentials to use, or a ProfileGroup to spread
+            the load over (with failover between its members).
 
     Returns:
-        {"status": "success", "profile_used": "<profile_id>"}
+        {"status": "success", "profile_used": "<profile_id>"}, plus
+        "accepted" and "rejected" ({addr: {code, message}}) for an
+        `individual` message.
 
     Raises:
+        RateLimitExceeded: If the profile's limits refuse the message, or
+            (scheduler.QueueFull) too many sends are waiting for its host.
         Exception: On SMTP connection or authentication failure.
     """
-    use_tls = profile.smtp_port == 465
-    start_tls = profile.smtp_port == 587
-    tls_context = _create_ssl_context(verify=profile.verify_ssl)
+    try:
+        message = templates.apply(message)
+        delivered, used = await _deliver(message, profile)
+        logger.info("Email sent to %s via %s (%s)", message.to, used.profile_id, used.smtp_host)
+        result = {"status": "success", "profile_used": used.profile_id}
+        if message.individual:
+            refused = delivered[0]
+            result["accepted"] = [addr for addr in pipeline.by_domain(message.to) if addr not in refused]
+            result["rejected"] = {addr: _refusal(r.code, r.message) for addr, r in refused.items()}
+        return result
+    except Exception as e:
+        logger.error("Failed via %s: %s", _target_name(profile), e)
+        raise
+
+
+def _target_name(target: Union[SmtpProfile, ProfileGroup]) -> str:
+    return f"group '{target.name}'" if isinstance(target, ProfileGroup) else target.profile_id
 
-    sender_email = profile.from_email
-    sender_name = profile.from_name
 
-    mime = MIMEMultipart("alternative")
-    mime["From"] = formataddr((sender_name, sender_email))
-    mime["To"] = ", ".join(message.to)
-    mime["Subject"] = message.subject
+def _refusal(code: int, message: str) -> dict:
+    return {"code": code, "message": message}
 
-    if message.text:
-        mime.attach(MIMEText(message.text, "plain"))
-    if message.html:
-        mime.attach(MIMEText(message.html, "html"))
 
+async def _send_one(
+    index: int,
+    message: EmailMessage,
+    profile: Union[SmtpProfile, ProfileGroup],
+    session: Optional[Session] = None,
+) -> dict:
+    """
+    Send one message of a batch and describe the outcome instead of raising.
+    Transient failures are retried up to `settings.retry_inline_attempts` times.
+    """
+    result = {"index": index, "to": list(message.to)}
+    try:
+        message = templates.apply(message)
+    except templates.TemplateError as e:
+        return {**result, "status": "failed", "retryable": False, "error": str(e)}
+    if not message.text and not message.html:
+        return {**result, "status": "failed", "retryable": False, "error": "Provide 'text' or 'html' body."}
     try:
-        await aiosmtplib.send(
-            mime,
-            hostname=profile.smtp_host,
-            port=profile.smtp_port,
-            username=profile.smtp_user,
-            password=profile.smtp_password,
-            use_tls=use_tls,
-            start_tls=start_tls,
-            tls_context=tls_context,
+        (refused, response), used = await retry.run(
+            lambda: _deliver(message, profile, session), attempts=settings.retry_inline_attempts,
         )
-        logger.info("Email sent to %s via %s (%s)", message.to, profile.profile_id, profile.smtp_host)
-        return {"status": "success", "profile_used": profile.profile_id}
+    except aiosmtplib.SMTPRecipientsRefused as e:
+        return {
+            **result,
+            "status": "failed",
+            "retryable": retry.classify(e) == retry.TRANSIENT,
+            "accepted": [],
+            "rejected": {r.recipient: _refusal(r.code, r.message) for r in e.recipients},
+        }
+    except aiosmtplib.SMTPResponseException as e:
+        return {**result, "status": "failed", "retryable": retry.classify(e) == retry.TRANSIENT,
+                "code": e.code, "error": e.message}
     except Exception as e:
-        logger.error("Failed via %s: %s", profile.profile_id, e)
-        raise
+        return {**result, "status": "failed", "retryable": retry.classify(e) == retry.TRANSIENT, "error": str(e)}
+    return {
+        **result,
+        "status": "success",
+        "profile_used": used.profile_id,
+        "code": 250,
+        "response": response,
+        "accepted": [addr for addr in message.to if addr not in refused],
+        "rejected": {addr: _refusal(r.code, r.message) for addr, r in refused.items()},
+    }
+
+
+async def send_many(
+    messages: Iterable[EmailMessage],
+    profile: Union[SmtpProfile, ProfileGroup],
+    *,
+    concurrency: Optional[int] = None,
+) -> AsyncIterator[dict]:
+    """
+    Send many emails over a few shared SMTP sessions.
+
+    At most `concurrency` messages (default `settings.batch_concurrency`) are
+    in flight at once for the profile (or group); they share its connection
+    pool(s). One failing message never aborts the rest.
+
+    Yields one result per message as soon as it completes (so not in input
+    order); `result["index"]` is the message's position in `messages`:
+        {"index": 0, "to": [...], "status": "success", "profile_used": "...", "code": 250,
+         "response": "...", "accepted": [...], "rejected": {addr: {code, message}}}
+        {"index": 1, "to": [...], "status": "failed", "retryable": False, "code": 550, "error": "..."}
+    """
+    limit = max(1, concurrency or settings.batch_concurrency)
+    pending = enumerate(messages)
+    results: asyncio.Queue = asyncio.Queue()
+    done = object()
+
+    async def worker() -> None:
+        try:
+            for index, message in pending:
+                results.put_nowait(await _send_one(index, message, profile))
+        finally:
+            results.put_nowait(done)
+
+    workers = [asyncio.create_task(worker()) for _ in range(limit)]
+    running = len(workers)
+    sent = failed = 0
+    try:
+        while running:
+            item = await results.get()
+            if item is done:
+                running -= 1
+                continue
+            if item["status"] == "success":
+                sent += 1
+            else:
+                failed += 1
+            yield item
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+    logger.info("Batch via %s finished: %d sent, %d failed", _target_name(profile), sent, failed)
+
+
+async def send_sequence(messages: Iterable[EmailMessage], profile: SmtpProfile) -> AsyncIterator[dict]:
+    """
+    Send messages one after another over a single authenticated SMTP
+    session, so N messages cost one connect, TLS handshake and AUTH.
+
+    A message the server refuses is reset (RSET) and the next one goes out
+    on the same connection; the connection is only replaced when it reaches
+    SMTP_POOL_MAX_MESSAGES / SMTP_POOL_MAX_BYTES or is dropped. The session
+    occupies one of the profile's pooled connections, and one of its send
+    scheduler slots (as bulk mail), until the sequence is done. Use
+    `send_many` to send over several sessions at once.
+
+    Yields one result per message, in input order, shaped like `send_many`'s.
+    """
+    if profile.direct:
+        raise ValueError("send_sequence needs a relay profile; use send_many for direct delivery")
+    pool = pool_for(profile)
+    sent = failed = 0
+    async with scheduler.slot(profile, "bulk"), pool.session() as session:
+        for index, message in enumerate(messages):
+            result = await _send_one(index, message, profile, session)
+            if result["status"] == "success":
+                sent += 1
+            else:
+                failed += 1
+            yield result
+    logger.info("Sequence via %s finished: %d sent, %d failed", profile.profile_id, sent, failed)
@@ -0,0 +1,437 @@
+"""
+Spool — a local on-disk outbound spool for mail the relay could not take.
+
+When SPOOL_DIR is set and a send fails transiently (relay down, a 4xx
+reply, a dropped connection) after its inline retries, the message is
+appended to the spool and the caller gets 202 instead of an error. A
+background replayer sends spooled messages in order once the relay answers
+again, at most SPOOL_REPLAY_RATE per second, so a backlog does not trip the
+provider's rate limits on recovery.
+
+On disk the spool is a series of numbered segment files
+(`00000001.spool`, ...), each a sequence of records:
+
+    payload length (u32 LE) | CRC-32 of payload (u32 LE) | payload (JSON)
+
+Records are appended and fsync'ed by one writer thread. Appends that arrive
+while an fsync is in progress are written and synced together by the next
+one (group commit), so a burst of N spooled messages costs one sequential
+write and one fsync instead of N. A torn or corrupt record at the tail (a
+crash mid-write) is cut off when the spool is opened. A corrupt record
+elsewhere is logged, skipped up to the next valid record and counted as
+dropped (the "corrupt" event of SPOOL_RECORDS).
+
+The replayer's position is kept in `cursor`, replaced atomically after
+each message is done with; segments behind it are deleted. Delivery is at
+least once: a crash between a send and its cursor update sends that
+message again.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import struct
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from .config import settings
+from .models import EmailMessage
+from . import attachments, groups, jsonfile, metrics, profiles, retry
+from .sender import send
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("<II")
+SUFFIX = ".spool"
+
+Position = tuple[int, int]  # (segment number, byte offset)
+
+
+# Every payload starts with this (see `encode`): where to look for the next
+# record after a corrupt one.
+_PAYLOAD_START = b'{"id":'
+
+
+class SpoolClosed(OSError):
+    """The spool is shutting down and takes no more messages."""
+
+
+def encode(spool_id: str, message: EmailMessage, profile_id: str = "", group_name: Optional[str] = None) -> bytes:
+    """One framed record: header plus the JSON payload."""
+    payload = (
+        f'{{"id":"{spool_id}","profile_id":{json.dumps(profile_id)},"group":{json.dumps(group_name)},'
+        f'"message":{message.model_dump_json()}}}'
+    ).encode()
+    return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _read_record(f, limit: Optional[int] = None) -> Optional[bytes]:
+    """The payload of the record at the file position, or None at the end or at a torn/corrupt record."""
+    start = f.tell()
+    header = f.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    length, crc = _HEADER.unpack(header)
+    if limit is not None and start + _HEADER.size + length > limit:
+        return None
+    payload = f.read(length)
+    if len(payload) < length or zlib.crc32(payload) != crc:
+        return None
+    return payload
+
+
+def _resync(f, start: int, limit: Optional[int] = None) -> Optional[int]:
+    """
+    The offset of the first valid record after the corrupt one at `start`,
+    or None if none follows it (before `limit`).
+    """
+    f.seek(start + 1)
+    data = f.read() if limit is None else f.read(max(0, limit - start - 1))
+    at = _HEADER.size
+    while (at := data.find(_PAYLOAD_START, at)) >= 0:
+        length, crc = _HEADER.unpack_from(data, at - _HEADER.size)
+        if at + length <= len(data) and zlib.crc32(data[at:at + length]) == crc:
+            return start + 1 + at - _HEADER.size
+        at += 1
+    return None
+
+
+class Spool:
+    """
+    The segment files, the group-committing writer and the in-order replayer.
+
+    Appends come from the event loop; file I/O runs in one writer thread
+    (appends) and in worker threads (reads, cursor updates).
+    """
+
+    def __init__(self, directory: Path, *, segment_bytes: int, replay_rate: float):
+        directory.mkdir(parents=True, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = max(1, segment_bytes)
+        self.replay_rate = replay_rate
+        self._cursor: Position = self._read_cursor()
+        self._segment, self._size, self.depth = self._recover()
+        self._fd = self._open(self._segment)
+        self._committed: Position = (self._segment, self._size)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="spool-writer")
+        self._pending: list[tuple[bytes, asyncio.Future]] = []
+        self._flushing: Optional[asyncio.Task] = None
+        self._ready: Optional[asyncio.Event] = None
+        self._replayer: Optional[asyncio.Task] = None
+        self._closing = False
+        self.spooled = 0
+        self.replayed = 0
+        self.failed = 0
+        self.corrupt = 0
+        self.last_error: Optional[str] = None
+        metrics.SPOOL_DEPTH.set(self.depth)
+
+    # ─── Files ───────────────────────────────────────────────────────────
+
+    def _path(self, segment: int) -> Path:
+        return self.directory / f"{segment:08d}{SUFFIX}"
+
+    def _segments(self) -> list[int]:
+        return sorted(int(p.stem) for p in self.directory.glob(f"*{SUFFIX}") if p.stem.isdigit())
+
+    def _open(self, segment: int) -> int:
+        fd = os.open(self._path(segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        self._sync_directory()
+        return fd
+
+    def _sync_directory(self) -> None:
+        """Make a created (or removed) segment file itself durable."""
+        try:
+            fd = os.open(self.directory, os.O_RDONLY)
+        except OSError:  # e.g. Windows: directories cannot be opened
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def _read_cursor(self) -> Position:
+        data = jsonfile.read(self.directory / "cursor")
+        return (data.get("segment", 1), data.get("offset", 0))
+
+    def _recover(self) -> tuple[int, int, int]:
+        """Cut off a torn tail and count pending records, corrupt ones included. Returns (tail segment, its size, depth)."""
+        segments = [s for s in self._segments() if s >= self._cursor[0]]
+        if not segments:
+            # Start a fresh segment; one the cursor points into would be skipped up to its offset.
+            return max(1, self._cursor[0] + (1 if self._cursor[1] else 0)), 0, 0
+        depth = 0
+        size = 0
+        for segment in segments:
+            path = self._path(segment)
+            actual = path.stat().st_size
+            with open(path, "rb") as f:
+                f.seek(self._cursor[1] if segment == self._cursor[0] else 0)
+                size = f.tell()
+                while True:
+                    if _read_record(f) is not None:
+                        depth += 1
+                        size = f.tell()
+                    elif size < actual and (resumed := _resync(f, size)) is not None:
+                        # Counted as pending, like a corrupt rest of a sealed
+                        # segment below: the replayer drops each as one record.
+                        logger.warning("Spool segment %s has a corrupt record at offset %d", path.name, size)
+                        depth += 1
+                        size = resumed
+                        f.seek(size)
+                    else:
+                        break
+            if size < actual:
+                if segment == segments[-1]:
+                    logger.warning("Spool segment %s ends with a torn record; cut %d byte(s)", path.name, actual - size)
+                    os.truncate(path, size)
+                else:
+                    logger.warning("Spool segment %s has a corrupt record at offset %d", path.name, size)
+                    depth += 1
+        return segments[-1], size, depth
+
+    # ─── Writing ─────────────────────────────────────────────────────────
+
+    def _write(self, data: bytes) -> None:
+        """Append a batch of records and fsync once. Runs in the writer thread."""
+        if self._size and self._size + len(data) > self.segment_bytes:
+            os.close(self._fd)
+            self._segment, self._size = self._segment + 1, 0
+            self._fd = self._open(self._segment)
+        view = memoryview(data)
+        try:
+            while view:
+                view = view[os.write(self._fd, view):]
+            os.fsync(self._fd)
+        except BaseException:
+            # Leave no partial record behind for the next batch to follow.
+            try:
+                os.ftruncate(self._fd, self._size)
+            except OSError:
+                pass
+            raise
+        self._size += len(data)
+        self._committed = (self._segment, self._size)
+
+    async def append(self, message: EmailMessage, profile_id: str = "", *, group_name: Optional[str] = None) -> str:
+        """
+        Write a message to the spool for the profile (or group) and return
+        its spool ID once the record is on disk. Raises SpoolClosed once the
+        spool is stopping.
+        """
+        if self._closing:
+            raise SpoolClosed(f"Spool {self.directory} is closed")
+        spool_id = uuid.uuid4().hex
+        record = encode(spool_id, message, profile_id, group_name)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((record, future))
+        if self._flushing is None:
+            self._flushing = loop.create_task(self._flush())
+        await future
+        self.spooled += 1
+        metrics.SPOOL_RECORDS.inc(event="spooled")
+        if self._ready is not None:
+            self._ready.set()
+        return spool_id
+
+    async def _flush(self) -> None:
+        """Commit pending appends, one write and fsync per batch, until none are left."""
+        loop = asyncio.get_running_loop()
+        try:
+            while self._pending:
+                batch, self._pending = self._pending, []
+                try:
+                    await loop.run_in_executor(self._executor, self._write, b"".join(r for r, _ in batch))
+                except Exception as e:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    self.depth += len(batch)
+                    metrics.SPOOL_DEPTH.set(self.depth)
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_result(None)
+        finally:
+            self._flushing = None
+
+    # ─── Replay ──────────────────────────────────────────────────────────
+
+    def _next(self) -> Optional[tuple[Optional[dict], Position]]:
+        """
+        The record at the cursor and the position after it, or None when the
+        spool is drained. A corrupt record comes back as None with the
+        position of the next valid one.
+        """
+        segment, offset = self._cursor
+        while True:
+            end_segment, end = self._committed
+            if segment > end_segment or (segment == end_segment and offset >= end):
+                return None
+            limit = end if segment == end_segment else None
+            try:
+                with open(self._path(segment), "rb") as f:
+                    f.seek(offset)
+                    payload = _read_record(f, limit)
+                    if payload is None:
+                        size = limit if limit is not None else os.fstat(f.fileno()).st_size
+                        resumed = _resync(f, offset, limit) if offset < size else None
+            except FileNotFoundError:
+                payload, size = None, offset
+            if payload is not None:
+                return json.loads(payload), (segment, offset + _HEADER.size + len(payload))
+            if offset < size:
+                if resumed is not None:
+                    skipped, after = resumed - offset, (segment, resumed)
+                elif limit is not None:
+                    skipped, after = size - offset, (segment, end)
+                else:
+                    skipped, after = size - offset, (segment + 1, 0)
+                logger.error("Corrupt spool record in %s at offset %d; skipped %d byte(s)",
+                             self._path(segment).name, offset, skipped)
+                return None, after
+            # The end of a sealed segment: go on with the next one.
+            segment, offset = segment + 1, 0
+
+    def _advance(self, position: Position) -> None:
+        """Persist the replay position and delete segments left behind."""
+        jsonfile.write_atomic(self.directory / "cursor", {"segment": position[0], "offset": position[1]})
+        self._cursor = position
+        removed = False
+        for segment in self._segments():
+            if segment >= position[0]:
+                break
+            self._path(segment).unlink(missing_ok=True)
+            removed = True
+        if removed:
+            self._sync_directory()
+
+    async def _replay(self) -> None:
+        """Send spooled messages in order, no faster than SPOOL_REPLAY_RATE; wait out relay outages."""
+        loop = asyncio.get_running_loop()
+        failures = 0
+        while True:
+            self._ready.clear()
+            item = await asyncio.to_thread(self._next)
+            if item is None:
+                await self._ready.wait()
+                continue
+            record, position = item
+            if record is None:
+                self.corrupt += 1
+                metrics.SPOOL_RECORDS.inc(event="corrupt")
+                await asyncio.to_thread(self._advance, position)
+                self.depth -= 1
+                metrics.SPOOL_DEPTH.set(self.depth)
+                continue
+            started = loop.time()
+            message = EmailMessage.model_validate(record["message"])
+            try:
+                await self._send(record, message)
+            except Exception as e:
+                if retry.classify(e) == retry.TRANSIENT:
+                    failures += 1
+                    self.last_error = str(e)
+                    delay = max(retry.backoff(failures), getattr(e, "retry_after", None) or 0.0)
+                    logger.info("Spool replay of %s failed transiently, retrying in %.1fs: %s", record["id"], delay, e)
+                    await asyncio.sleep(delay)
+                    continue
+                self.failed += 1
+                metrics.SPOOL_RECORDS.inc(event="failed")
+                logger.error("Spooled message %s failed permanently and was dropped: %s", record["id"], e)
+            else:
+                self.replayed += 1
+                metrics.SPOOL_RECORDS.inc(event="replayed")
+            failures = 0
+            self.last_error = None
+            await asyncio.to_thread(self._advance, position)
+            self.depth -= 1
+            metrics.SPOOL_DEPTH.set(self.depth)
+            if message.attachments:
+                # Files uploaded with the request are only needed until the message is final.
+                await asyncio.to_thread(attachments.discard_uploads, message.attachments)
+            if self.replay_rate > 0:
+                await asyncio.sleep(max(0.0, 1 / self.replay_rate - (loop.time() - started)))
+
+    async def _send(self, record: dict, message: EmailMessage) -> None:
+        if record["group"]:
+            target, missing = groups.get(record["group"]), f"Group '{record['group']}' not found"
+        else:
+            target, missing = await profiles.aget(record["profile_id"]), f"Profile '{record['profile_id']}' not found"
+        if target is None:
+            raise LookupError(missing)
+        await send(message, target)
+
+    # ─── Lifecycle ───────────────────────────────────────────────────────
+
+    def start(self) -> None:
+        """Start the replayer on the running loop."""
+        self._ready = asyncio.Event()
+        self._replayer = asyncio.get_running_loop().create_task(self._replay())
+        logger.info("Spool started in %s, %d message(s) pending", self.directory, self.depth)
+
+    async def stop(self) -> None:
+        """Stop the replayer, finish pending appends and close the files. Spooled mail stays for the next start."""
+        if self._closing:
+            return
+        self._closing = True
+        if self._replayer is not None:
+            self._replayer.cancel()
+            await asyncio.gather(self._replayer, return_exceptions=True)
+            self._replayer = None
+        if self._flushing is not None:
+            await asyncio.gather(self._flushing, return_exceptions=True)
+        self._executor.shutdown(wait=True)
+        os.close(self._fd)
+
+    def stats(self) -> dict:
+        """Pending messages and bytes, and counts since start."""
+        pending_bytes = 0
+        for segment in self._segments():
+            if segment >= self._cursor[0]:
+                size = self._path(segment).stat().st_size
+                pending_bytes += size - (self._cursor[1] if segment == self._cursor[0] else 0)
+        return {
+            "depth": self.depth,
+            "bytes": pending_bytes,
+            "segments": len(self._segments()),
+            "spooled": self.spooled,
+            "replayed": self.replayed,
+            "failed": self.failed,
+            "corrupt": self.corrupt,
+            "replay_rate": self.replay_rate,
+            "last_error": self.last_error,
+        }
+
+
+_spool: Optional[Spool] = None
+
+
+def current() -> Optional[Spool]:
+    """The open spool, or None when SPOOL_DIR is not set."""
+    return _spool
+
+
+async def start() -> Spool:
+    """Open the spool (recovering it after a crash) and start the replayer. Called from the server's lifespan."""
+    global _spool
+    _spool = await asyncio.to_thread(
+        Spool, jsonfile.resolve(settings.spool_dir),
+        segment_bytes=settings.spool_segment_bytes, replay_rate=settings.spool_replay_rate,
+    )
+    _spool.start()
+    return _spool
+
+
+async def stop() -> None:
+    global _spool
+    if _spool is not None:
+        await _spool.stop()
+        _spool = None
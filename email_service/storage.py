@@ -0,0 +1,237 @@
+"""
+Storage — backends for the profile store.
+
+`profiles` keeps validated profiles in memory and asks its backend only for
+a change stamp (cheap, checked at most once a second) and, when that
+changes, for all records. Writes go straight to the backend. Both backends
+are safe with several server processes sharing one store:
+
+- "json" (default): one JSON file. Writes take an advisory lock around
+  the read-modify-write and replace the file atomically. Good for a few
+  profiles and an occasional write.
+- "sqlite": a SQLite database in WAL mode. Readers never block writers.
+  Each write is one short transaction that also bumps a version counter,
+  which other processes read as the change stamp. An existing
+  PROFILES_FILE is imported the first time the database is opened.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Hashable, Optional, Protocol, Sequence
+
+from .config import settings
+from . import jsonfile
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    profile_id  TEXT PRIMARY KEY,
+    data        TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key         TEXT PRIMARY KEY,
+    value       INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+"""
+
+
+# (profile_id, record) to save, or (profile_id, None) to delete.
+Change = tuple[str, Optional[dict]]
+
+
+class ProfileStore(Protocol):
+    """Where profile records (plain dicts keyed by profile_id) are kept."""
+
+    location: str
+
+    def stamp(self) -> Optional[Hashable]:
+        """A value that changes whenever the stored records do."""
+
+    def load(self) -> dict[str, dict]:
+        """All records."""
+
+    def save(self, profile_id: str, data: dict) -> None:
+        """Insert or replace one record."""
+
+    def delete(self, profile_id: str) -> bool:
+        """Remove one record; False if it did not exist."""
+
+    def apply(self, changes: Sequence[Change]) -> list[bool]:
+        """
+        Make several changes in one write, in order: (profile_id, data) saves
+        a record, (profile_id, None) deletes it. Returns, per change, whether
+        a record was saved or deleted (False for a missing one).
+        """
+
+
+class JsonStore:
+    """Profiles in one JSON file, rewritten atomically under a cross-process lock."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.location = str(path)
+
+    def stamp(self) -> Optional[tuple]:
+        return jsonfile.stamp(self.path)
+
+    def load(self) -> dict[str, dict]:
+        return jsonfile.read(self.path)
+
+    def save(self, profile_id: str, data: dict) -> None:
+        self.apply([(profile_id, data)])
+
+    def delete(self, profile_id: str) -> bool:
+        return self.apply([(profile_id, None)])[0]
+
+    def apply(self, changes: Sequence[Change]) -> list[bool]:
+        results = []
+        with jsonfile.locked(self.path):
+            records = jsonfile.read(self.path)
+            for profile_id, data in changes:
+                if data is not None:
+                    records[profile_id] = data
+                    results.append(True)
+                else:
+                    results.append(records.pop(profile_id, None) is not None)
+            if any(results):
+                jsonfile.write_atomic(self.path, records)
+        return results
+
+
+class SqliteStore:
+    """Profiles in a SQLite database (WAL mode), one connection per process."""
+
+    def __init__(self, path: Path, import_from: Optional[Path] = None):
+        self.path = path
+        self.location = str(path)
+        self.import_from = import_from
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._pid = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        """The connection for this process; forked workers open their own. Caller holds `_lock`."""
+        if self._db is None or self._pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30.0)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            # One process at a time creates the schema and imports the JSON file.
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                for statement in filter(str.strip, _SCHEMA.split(";")):
+                    db.execute(statement)
+                if self.import_from is not None:
+                    self._import(db, self.import_from)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            self._db, self._pid = db, os.getpid()
+        return self._db
+
+    def _import(self, db: sqlite3.Connection, source: Path) -> None:
+        """Import a JSON profile file once, the first time any process opens the database."""
+        if db.execute("SELECT 1 FROM meta WHERE key = 'imported'").fetchone():
+            return
+        records = jsonfile.read(source)
+        db.executemany(
+            "INSERT OR IGNORE INTO profiles (profile_id, data) VALUES (?, ?)",
+            [(profile_id, json.dumps(data)) for profile_id, data in records.items()],
+        )
+        db.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        db.execute("INSERT INTO meta (key, value) VALUES ('imported', ?)", (len(records),))
+        if records:
+            logger.info("Imported %d profile(s) from %s into %s", len(records), source, self.path)
+
+    def stamp(self) -> int:
+        with self._lock:
+            return self._connection().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def load(self) -> dict[str, dict]:
+        with self._lock:
+            rows = self._connection().execute("SELECT profile_id, data FROM profiles").fetchall()
+        return {profile_id: json.loads(data) for profile_id, data in rows}
+
+    def save(self, profile_id: str, data: dict) -> None:
+        self.apply([(profile_id, data)])
+
+    def delete(self, profile_id: str) -> bool:
+        return self.apply([(profile_id, None)])[0]
+
+    def apply(self, changes: Sequence[Change]) -> list[bool]:
+        """All changes in one transaction, with one version bump."""
+        results = []
+        with self._lock:
+            db = self._connection()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                for profile_id, data in changes:
+                    if data is not None:
+                        db.execute(
+                            "INSERT INTO profiles (profile_id, data) VALUES (?, ?) "
+                            "ON CONFLICT (profile_id) DO UPDATE SET data = excluded.data",
+                            (profile_id, json.dumps(data)),
+                        )
+                        results.append(True)
+                    else:
+                        deleted = db.execute("DELETE FROM profiles WHERE profile_id = ?", (profile_id,)).rowcount
+                        results.append(deleted > 0)
+                if any(results):
+                    db.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return results
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None and self._pid == os.getpid():
+                self._db.close()
+            self._db = None
+
+
+def migrate(source: Path, store: ProfileStore) -> int:
+    """
+    Copy every profile from a JSON profile file into `store`, replacing
+    records with the same ID. Returns the number of profiles copied.
+    """
+    records = jsonfile.read(source)
+    for profile_id, data in records.items():
+        store.save(profile_id, data)
+    return len(records)
+
+
+_store: Optional[tuple[tuple, ProfileStore]] = None
+_store_lock = threading.Lock()
+
+
+def profile_store() -> ProfileStore:
+    """The backend selected by `settings.profile_store`, opened on first use."""
+    global _store
+    key = (settings.profile_store, settings.profiles_file, settings.profiles_db)
+    current = _store
+    if current is not None and current[0] == key:
+        return current[1]
+    with _store_lock:
+        if _store is not None and _store[0] == key:
+            return _store[1]
+        if settings.profile_store == "sqlite":
+            store: ProfileStore = SqliteStore(
+                jsonfile.resolve(settings.profiles_db), import_from=jsonfile.resolve(settings.profiles_file),
+            )
+        elif settings.profile_store == "json":
+            store = JsonStore(jsonfile.resolve(settings.profiles_file))
+        else:
+            raise ValueError(f"Unknown PROFILE_STORE '{settings.profile_store}' (expected 'json' or 'sqlite')")
+        if _store is not None and isinstance(_store[1], SqliteStore):
+            _store[1].close()
+        _store = (key, store)
+    return store
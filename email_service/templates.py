@@ -0,0 +1,208 @@
+"""
+Templates — stored message layouts rendered per recipient on the server.
+
+Templates are stored in a local JSON file next to the profiles. Each one is
+compiled once (split into literal text and placeholder names) and kept in a
+bounded LRU, so a batch to 10k recipients parses the template a single time
+and every copy is a join of ready-made pieces. Placeholders are
+`{{ name }}`; values are HTML-escaped in the html part and kept on one line
+in the subject.
+"""
+
+import html
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Mapping, NamedTuple, Optional
+
+from .config import settings
+from .models import EmailMessage, EmailTemplate
+from . import jsonfile
+
+logger = logging.getLogger(__name__)
+
+_PLACEHOLDER = re.compile(r"\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}")
+
+# How often (seconds) lookups re-stat the file to notice external changes.
+STAT_INTERVAL = 1.0
+
+_lock = threading.Lock()
+_cache: Optional[tuple[str, Optional[tuple], dict[str, EmailTemplate], float]] = None
+
+
+class TemplateError(ValueError):
+    """A template is missing, or a message lacks one of its variables."""
+
+
+# ─── Storage ─────────────────────────────────────────────────────────────────
+
+
+def _load() -> dict[str, EmailTemplate]:
+    """
+    Return the templates. The file is re-checked at most every STAT_INTERVAL
+    seconds (a batch looks its template up once per recipient) and reloaded
+    only when it has changed.
+    """
+    global _cache
+    cache = _cache
+    now = time.monotonic()
+    if cache is not None and cache[0] == settings.templates_file and now - cache[3] < STAT_INTERVAL:
+        return cache[2]
+    path = jsonfile.resolve(settings.templates_file)
+    stamp = jsonfile.stamp(path)
+    if cache is not None and cache[0] == settings.templates_file and cache[1] == stamp:
+        _cache = (cache[0], stamp, cache[2], now)
+        return cache[2]
+    with _lock:
+        templates = {name: EmailTemplate(**data) for name, data in jsonfile.read(path).items()}
+        _cache = (settings.templates_file, stamp, templates, now)
+    return templates
+
+
+def get(name: str) -> Optional[EmailTemplate]:
+    """Retrieve a template by name."""
+    return _load().get(name)
+
+
+def list_all() -> list[dict]:
+    """List all templates with the variables each one uses."""
+    return [{**t.model_dump(), "variables": sorted(compile_template(t).names)} for t in _load().values()]
+
+
+def add(template: EmailTemplate) -> dict:
+    """Add or update a template, compiling it ahead of its first send."""
+    global _cache
+    compile_template(template)
+    path = jsonfile.resolve(settings.templates_file)
+    with _lock, jsonfile.locked(path):
+        data = jsonfile.read(path)
+        data[template.name] = template.model_dump()
+        jsonfile.write_atomic(path, data)
+        _cache = None
+    logger.info("Template '%s' saved", template.name)
+    return {"status": "saved", "name": template.name}
+
+
+def delete(name: str) -> dict:
+    """Delete a template by name."""
+    global _cache
+    path = jsonfile.resolve(settings.templates_file)
+    with _lock, jsonfile.locked(path):
+        data = jsonfile.read(path)
+        if name not in data:
+            return {"status": "not_found", "name": name}
+        del data[name]
+        jsonfile.write_atomic(path, data)
+        _cache = None
+    logger.info("Template '%s' deleted", name)
+    return {"status": "deleted", "name": name}
+
+
+# ─── Compilation ─────────────────────────────────────────────────────────────
+
+
+class _Part(NamedTuple):
+    """A template part split at its placeholders: literal text with a slot per placeholder."""
+    pieces: tuple[str, ...]
+    slots: tuple[tuple[int, str], ...]  # (index in pieces, variable name)
+    names: frozenset
+
+    def fill(self, values: Mapping[str, str]) -> str:
+        if not self.slots:
+            return self.pieces[0]
+        pieces = list(self.pieces)
+        for index, name in self.slots:
+            pieces[index] = values[name]
+        return "".join(pieces)
+
+
+def _split(source: Optional[str]) -> Optional[_Part]:
+    if source is None:
+        return None
+    pieces, slots, last = [], [], 0
+    for match in _PLACEHOLDER.finditer(source):
+        pieces.append(source[last:match.start()])
+        slots.append((len(pieces), match.group(1)))
+        pieces.append("")
+        last = match.end()
+    pieces.append(source[last:])
+    return _Part(tuple(pieces), tuple(slots), frozenset(name for _, name in slots))
+
+
+class Compiled(NamedTuple):
+    subject: _Part
+    text: Optional[_Part]
+    html: Optional[_Part]
+    names: frozenset
+
+    def render(self, variables: Mapping[str, Any]) -> tuple[str, Optional[str], Optional[str]]:
+        """Return (subject, text, html) with the variables filled in. Raises TemplateError."""
+        try:
+            values = {name: str(variables[name]) for name in self.names}
+        except KeyError as e:
+            raise TemplateError(f"Missing template variable {e.args[0]!r}") from None
+        subject = self.subject.fill({name: " ".join(values[name].splitlines()) for name in self.subject.names})
+        text = self.text.fill(values) if self.text is not None else None
+        body = None
+        if self.html is not None:
+            body = self.html.fill({name: html.escape(values[name]) for name in self.html.names})
+        return subject, text, body
+
+
+class _Cache:
+    """An LRU of compiled templates keyed by their source."""
+
+    def __init__(self):
+        self._items: OrderedDict[tuple, Compiled] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[Compiled]:
+        with self._lock:
+            compiled = self._items.get(key)
+            if compiled is not None:
+                self._items.move_to_end(key)
+            return compiled
+
+    def put(self, key: tuple, compiled: Compiled) -> None:
+        with self._lock:
+            self._items[key] = compiled
+            while len(self._items) > max(1, settings.template_cache_size):
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+_compiled = _Cache()
+
+
+def compile_template(template: EmailTemplate) -> Compiled:
+    """The compiled form of a template, from the LRU when its source is unchanged."""
+    key = (template.subject, template.text, template.html)
+    compiled = _compiled.get(key)
+    if compiled is None:
+        parts = [_split(template.subject), _split(template.text), _split(template.html)]
+        compiled = Compiled(*parts, frozenset().union(*(part.names for part in parts if part is not None)))
+        _compiled.put(key, compiled)
+    return compiled
+
+
+def apply(message: EmailMessage) -> EmailMessage:
+    """
+    Fill in a message from its stored template. Messages without a template
+    are returned as they are. Raises TemplateError if the template is
+    unknown or a variable is missing.
+    """
+    if message.template is None:
+        return message
+    template = get(message.template)
+    if template is None:
+        raise TemplateError(f"Template '{message.template}' not found")
+    subject, text, body = compile_template(template).render(message.variables)
+    return message.model_copy(update={"subject": subject, "text": text, "html": body, "template": None})
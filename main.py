@@ -7,12 +7,46 @@ Run:
     uvicorn main:app --reload --port 9001
 """
 
+import asyncio
+import json
 import logging
+import math
 from contextlib import asynccontextmanager
-
-from fastapi import FastAPI, HTTPException
-
-from email_service import send, profiles, SmtpProfile, EmailMessage, settings
+from typing import List, Optional, Union
+
+from fastapi import FastAPI, File, Form, Header, HTTPException, UploadFile
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+
+from pydantic import ValidationError
+
+from email_service import (
+    send,
+    send_many,
+    profiles,
+    groups,
+    templates,
+    idempotency,
+    pool,
+    direct,
+    attachments,
+    outbox,
+    probes,
+    spool,
+    scheduler,
+    retry,
+    ratelimit,
+    metrics,
+    RateLimitExceeded,
+    SmtpProfile,
+    ProfileGroup,
+    EmailMessage,
+    EmailBatch,
+    EmailTemplate,
+    Attachment,
+    settings,
+)
+from email_service.groups import NoAvailableProfile
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 logger = logging.getLogger(__name__)
@@ -23,7 +57,8 @@ logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Auto-register the default profile from .env on startup."""
+    """Register the default profile and start queue workers and the spool; drain them and the SMTP pools on shutdown."""
+    logger.info("Loaded %d SMTP profile(s)", profiles.reload())
     if settings.has_default_profile:
         profiles.add(SmtpProfile(
             profile_id=settings.default_profile_id,
@@ -36,7 +71,19 @@ async def lifespan(app: FastAPI):
             verify_ssl=settings.verify_ssl,
         ))
         logger.info("Default profile '%s' registered from .env", settings.default_profile_id)
+    if settings.queue_enabled:
+        await outbox.start()
+    if settings.spool_dir:
+        await spool.start()
+    if settings.probe_enabled:
+        probes.start()
     yield
+    await probes.stop()
+    await outbox.stop()
+    await spool.stop()
+    await retry.scheduler.close()
+    await pool.close_all()
+    await direct.close_all()
 
 
 app = FastAPI(
@@ -50,25 +97,288 @@ app = FastAPI(
 # ─── Email Sending ────────────────────────────────────────────────────────────
 
 
-@app.post("/email/send", tags=["Email"])
-async def send_email(req: EmailMessage):
-    """Send an email using the default SMTP profile."""
-    if not req.text and not req.html:
-        raise HTTPException(status_code=400, detail="Provide 'text' or 'html' body.")
+async def _default_profile() -> Union[SmtpProfile, ProfileGroup]:
+    """
+    Resolve where default sends go: the default group if one is configured,
+    otherwise the default SMTP profile. Raises the matching HTTP error.
+    """
+    if settings.default_group:
+        group = groups.get(settings.default_group)
+        if not group:
+            raise HTTPException(status_code=404, detail=f"Group '{settings.default_group}' not found. Register it via POST /groups.")
+        return group
 
     profile_id = settings.default_profile_id
     if not profile_id:
         raise HTTPException(status_code=400, detail="No default profile configured.")
 
-    profile = profiles.get(profile_id)
+    profile = await profiles.aget(profile_id)
     if not profile:
         raise HTTPException(status_code=404, detail=f"Profile '{profile_id}' not found. Register it via POST /profiles.")
+    return profile
+
+
+def _send_error(e: Exception) -> HTTPException:
+    """
+    Map a failed send to an HTTP error: local rate limiting becomes 429,
+    transient SMTP failures 503 with a Retry-After hint, permanent ones 502.
+    """
+    if isinstance(e, NoAvailableProfile):
+        headers = {"Retry-After": str(math.ceil(e.retry_after) or 1)} if e.retry_after is not None else None
+        return HTTPException(status_code=503, detail=str(e), headers=headers)
+    if isinstance(e, RateLimitExceeded):
+        if e.retry_after is None:
+            return HTTPException(status_code=422, detail=str(e))
+        return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+    code = retry.smtp_code(e)
+    detail = f"SMTP {code}: {e}" if code else str(e)
+    if retry.classify(e) == retry.TRANSIENT:
+        delay = math.ceil(retry.backoff(settings.retry_inline_attempts)) or 1
+        return HTTPException(status_code=503, detail=detail, headers={"Retry-After": str(delay)})
+    return HTTPException(status_code=502, detail=detail)
+
+
+def _template(name: str) -> EmailTemplate:
+    template = templates.get(name)
+    if template is None:
+        raise HTTPException(status_code=404, detail=f"Template '{name}' not found. Register it via POST /templates.")
+    return template
+
+
+def _render(req: EmailMessage) -> EmailMessage:
+    """Fill a message in from its template on the server (404 unknown template, 400 missing variable)."""
+    if req.template is None:
+        return req
+    _template(req.template)
+    try:
+        return templates.apply(req)
+    except templates.TemplateError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _check_attachments(items: List[Attachment]) -> None:
+    """Refuse attachments outside ATTACHMENTS_DIR, missing or too large (400)."""
+    try:
+        for item in items:
+            attachments.confine(item)
+    except attachments.AttachmentError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/email/send", tags=["Email"])
+async def send_email(req: EmailMessage, idempotency_key: Optional[str] = Header(None, max_length=255)):
+    """
+    Send an email using the default SMTP profile (or DEFAULT_GROUP).
+
+    In queue mode the message is stored and the response (202) carries its ID;
+    poll GET /email/{id} for the outcome. With SPOOL_DIR, a message the relay
+    cannot take right now is spooled (202, "spooled") and sent once it recovers.
+
+    A retry with the same Idempotency-Key header gets the first attempt's
+    response (marked Idempotent-Replayed: true) instead of sending again.
+    """
+    key = _idempotency_key(idempotency_key, req)
+    req = _render(req)
+    if not req.text and not req.html:
+        raise HTTPException(status_code=400, detail="Provide 'text' or 'html' body, or a 'template'.")
+    _check_attachments(req.attachments)
+    if key is None:
+        return await _send_default(req)
+    return await _idempotent(*key, lambda: _send_default(req))
+
+
+def _idempotency_key(header: Optional[str], req: EmailMessage) -> Optional[tuple[bytes, bytes]]:
+    """
+    (key, fingerprint) for a send request: the Idempotency-Key header, or
+    the request content itself with IDEMPOTENCY_CONTENT_HASH. None if neither.
+    """
+    if header is None and not settings.idempotency_content_hash:
+        return None
+    fingerprint = idempotency.fingerprint(req.model_dump_json().encode())
+    if header is None:
+        return fingerprint, fingerprint
+    if not header.strip():
+        raise HTTPException(status_code=400, detail="Idempotency-Key must not be empty.")
+    return idempotency.digest(header), fingerprint
+
+
+async def _idempotent(key: bytes, fingerprint: bytes, call) -> Response:
+    """
+    Run a send at most once per idempotency key and return its response,
+    replayed for retries. 422 if the key was used for another request, 409
+    if another worker is still sending it.
+    """
+    async def attempt() -> idempotency.Outcome:
+        try:
+            result = await call()
+        except HTTPException as e:
+            body = json.dumps({"detail": jsonable_encoder(e.detail)}).encode()
+            return idempotency.Outcome(e.status_code, body, e.headers)
+        if isinstance(result, Response):
+            return idempotency.Outcome(result.status_code, result.body)
+        return idempotency.Outcome(200, json.dumps(jsonable_encoder(result)).encode())
+
+    try:
+        outcome, replayed = await idempotency.run(key, fingerprint, attempt)
+    except idempotency.KeyReused as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except idempotency.InProgress as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={"Retry-After": "1"})
+    headers = dict(outcome.headers or {})
+    if replayed:
+        headers["Idempotent-Replayed"] = "true"
+    return Response(outcome.body, status_code=outcome.status, media_type="application/json", headers=headers)
+
+
+async def _send_default(req: EmailMessage, *, uploaded: bool = False):
+    """Send or enqueue a validated message; `uploaded` files are deleted once it is done."""
+    profile = await _default_profile()
+
+    queue = outbox.current()
+    if queue is not None:
+        if isinstance(profile, ProfileGroup):
+            job_id = await queue.enqueue(req, group_name=profile.name)
+        else:
+            job_id = await queue.enqueue(req, profile.profile_id)
+        return JSONResponse(status_code=202, content={"message": "Email queued", "id": job_id, "status": "queued"})
 
     try:
-        result = await send(req, profile)
+        result = await retry.run(lambda: send(req, profile), attempts=settings.retry_inline_attempts)
         return {"message": "Email sent", **result}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        spooled = await _spool(req, profile, e)
+        if spooled is None:
+            raise _send_error(e)
+        uploaded = False  # the replayer deletes them once the message is final
+        return spooled
+    finally:
+        if uploaded:
+            await asyncio.to_thread(attachments.discard_uploads, req.attachments)
+
+
+async def _spool(
+    req: EmailMessage, profile: Union[SmtpProfile, ProfileGroup], error: Exception,
+) -> Optional[JSONResponse]:
+    """
+    Keep a message the relay could not take right now in the spool (SPOOL_DIR)
+    and answer 202. None when there is no spool, the failure is permanent or
+    our own rate limit, or the spool cannot be written.
+    """
+    store = spool.current()
+    if store is None or isinstance(error, RateLimitExceeded) or retry.classify(error) != retry.TRANSIENT:
+        return None
+    try:
+        if isinstance(profile, ProfileGroup):
+            spool_id = await store.append(req, group_name=profile.name)
+        else:
+            spool_id = await store.append(req, profile.profile_id)
+    except OSError:
+        logger.exception("Could not spool a message the relay refused")
+        return None
+    logger.warning("Relay unavailable, message spooled as %s: %s", spool_id, error)
+    return JSONResponse(status_code=202, content={"message": "Email spooled", "id": spool_id, "status": "spooled"})
+
+
+@app.post("/email/send/upload", tags=["Email"])
+async def send_email_upload(
+    to: List[str] = Form(...),
+    subject: str = Form(...),
+    text: Optional[str] = Form(None),
+    html: Optional[str] = Form(None),
+    individual: bool = Form(False),
+    files: List[UploadFile] = File(...),
+):
+    """
+    Send an email with uploaded attachments (multipart/form-data), using the
+    default SMTP profile (or DEFAULT_GROUP).
+
+    Files are written to ATTACHMENTS_DIR in chunks and streamed from there
+    into the SMTP session; they are deleted once the message is sent or has
+    failed for good.
+    """
+    if not text and not html:
+        raise HTTPException(status_code=400, detail="Provide 'text' or 'html' body.")
+    await _default_profile()
+    saved: List[Attachment] = []
+    try:
+        for upload in files:
+            saved.append(await attachments.save_upload(upload))
+        req = EmailMessage(to=to, subject=subject, text=text, html=html, individual=individual, attachments=saved)
+    except attachments.AttachmentError as e:
+        await asyncio.to_thread(attachments.discard_uploads, saved)
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValidationError as e:
+        await asyncio.to_thread(attachments.discard_uploads, saved)
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+    return await _send_default(req, uploaded=True)
+
+
+@app.post("/email/send/batch", tags=["Email"])
+async def send_email_batch(req: EmailBatch):
+    """
+    Send many emails using the default SMTP profile (or DEFAULT_GROUP).
+
+    Streams one NDJSON line per message as it completes, followed by a
+    final {"summary": {...}} line. A failed message does not stop the batch.
+    """
+    if req.size == 0:
+        raise HTTPException(status_code=400, detail="Provide 'messages' or 'recipients'.")
+    if req.size > settings.batch_max_messages:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {settings.batch_max_messages} messages.")
+    if req.template is not None:
+        _template(req.template)
+    elif req.recipients and (not req.subject or not (req.text or req.html)):
+        raise HTTPException(
+            status_code=400, detail="Provide 'subject' and 'text' or 'html', or a 'template', for 'recipients'."
+        )
+    _check_attachments([a for message in req.messages for a in message.attachments] + req.attachments)
+
+    profile = await _default_profile()
+
+    async def stream():
+        summary = {"total": req.size, "sent": 0, "failed": 0}
+        async for result in send_many(req.expand(), profile, concurrency=req.concurrency):
+            summary["sent" if result["status"] == "success" else "failed"] += 1
+            yield json.dumps(result) + "\n"
+        yield json.dumps({"summary": summary}) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@app.get("/email/queue", tags=["Email"])
+async def queue_stats():
+    """Queue depth, in-flight sends and throughput (queue mode only)."""
+    queue = outbox.current()
+    if queue is None:
+        raise HTTPException(status_code=404, detail="Queue mode is disabled.")
+    return await asyncio.to_thread(queue.stats)
+
+
+@app.get("/email/spool", tags=["Email"])
+async def spool_stats():
+    """Messages waiting in the spool and replay progress (SPOOL_DIR only)."""
+    store = spool.current()
+    if store is None:
+        raise HTTPException(status_code=404, detail="The spool is disabled.")
+    return await asyncio.to_thread(store.stats)
+
+
+@app.get("/email/scheduler", tags=["Email"])
+async def scheduler_stats():
+    """Sends in flight and waiting for a slot, per SMTP host and profile."""
+    return {"hosts": scheduler.stats()}
+
+
+@app.get("/email/{job_id}", tags=["Email"])
+async def email_status(job_id: str):
+    """Status of a queued email."""
+    queue = outbox.current()
+    if queue is None:
+        raise HTTPException(status_code=404, detail="Queue mode is disabled.")
+    job = await asyncio.to_thread(queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Email '{job_id}' not found.")
+    return job
 
 
 # ─── Profile Management ──────────────────────────────────────────────────────
@@ -76,22 +386,112 @@ async def send_email(req: EmailMessage):
 
 @app.post("/profiles", tags=["Profiles"])
 async def add_profile(req: SmtpProfile):
-    """Register or update an SMTP profile."""
-    return profiles.add(req)
+    """Register or update an SMTP profile. Its host is probed (and a session opened) in the background."""
+    result = await profiles.aadd(req)
+    probes.submit(req)
+    return result
 
 
 @app.get("/profiles", tags=["Profiles"])
 async def list_profiles():
     """List all registered SMTP profiles (passwords masked)."""
-    return profiles.list_all()
+    return await profiles.alist_all()
+
+
+@app.get("/profiles/health", tags=["Profiles"])
+async def profiles_health():
+    """
+    Readiness of each profile from its latest background probe: "pending",
+    "ready" (resolved, connected and logged in) or "failed" with the error,
+    plus the measured DNS and handshake latencies.
+    """
+    prober = probes.current()
+    if prober is None:
+        raise HTTPException(status_code=404, detail="Profile probes are disabled.")
+    results = prober.status()
+    counts = {state: sum(r["status"] == state for r in results) for state in ("ready", "failed", "pending")}
+    return {**counts, "profiles": results}
+
+
+@app.get("/profiles/{profile_id}/rate-limit", tags=["Profiles"])
+async def profile_rate_limit(profile_id: str):
+    """Current token bucket and daily quota state of a profile."""
+    profile = await profiles.aget(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail=f"Profile '{profile_id}' not found.")
+    return ratelimit.state(profile)
 
 
 @app.delete("/profiles/{profile_id}", tags=["Profiles"])
 async def remove_profile(profile_id: str):
     """Delete an SMTP profile."""
-    result = profiles.delete(profile_id)
+    result = await profiles.adelete(profile_id)
     if result["status"] == "not_found":
         raise HTTPException(status_code=404, detail=f"Profile '{profile_id}' not found.")
+    probes.forget(profile_id)
+    return result
+
+
+# ─── Profile Groups ──────────────────────────────────────────────────────────
+
+
+@app.post("/groups", tags=["Groups"])
+async def add_group(req: ProfileGroup):
+    """Register or update a profile group."""
+    return groups.add(req)
+
+
+@app.get("/groups", tags=["Groups"])
+async def list_groups():
+    """List profile groups with member health and load."""
+    return groups.list_all()
+
+
+@app.get("/groups/{name}", tags=["Groups"])
+async def get_group(name: str):
+    """A profile group with member health (circuit state) and in-flight sends."""
+    group = groups.get(name)
+    if not group:
+        raise HTTPException(status_code=404, detail=f"Group '{name}' not found.")
+    return groups.status(group)
+
+
+@app.delete("/groups/{name}", tags=["Groups"])
+async def remove_group(name: str):
+    """Delete a profile group."""
+    result = groups.delete(name)
+    if result["status"] == "not_found":
+        raise HTTPException(status_code=404, detail=f"Group '{name}' not found.")
+    return result
+
+
+# ─── Templates ────────────────────────────────────────────────────────────────
+
+
+@app.post("/templates", tags=["Templates"])
+async def add_template(req: EmailTemplate):
+    """Register or update a stored template."""
+    return templates.add(req)
+
+
+@app.get("/templates", tags=["Templates"])
+async def list_templates():
+    """List stored templates and the variables they use."""
+    return templates.list_all()
+
+
+@app.get("/templates/{name}", tags=["Templates"])
+async def get_template(name: str):
+    """A stored template."""
+    return _template(name)
+
+
+@app.delete("/templates/{name}", tags=["Templates"])
+async def remove_template(name: str):
+    """Delete a stored template."""
+    result = templates.delete(name)
+    if result["status"] == "not_found":
+        raise HTTPException(status_code=404, detail=f"Template '{name}' not found.")
     return result
 
 
@@ -103,6 +503,12 @@ def health():
     return {"status": "running", "service": "Self-Hosted Email API v2.0"}
 
 
+@app.get("/metrics", tags=["Health"], response_class=PlainTextResponse)
+def metrics_endpoint():
+    """Counters and latency histograms in Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,54 @@
+"""
+Shared fixtures: isolate module-level state between tests, and run local
+aiosmtpd servers.
+"""
+
+import socket
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from email_service import direct, groups, ratelimit, resolver, settings
+
+
+@pytest.fixture(autouse=True)
+def _reset_rate_limiters(monkeypatch):
+    monkeypatch.setattr(ratelimit, "_limiters", {})
+
+
+@pytest.fixture(autouse=True)
+def _reset_group_state(monkeypatch):
+    monkeypatch.setattr(groups, "_breakers", {})
+    monkeypatch.setattr(groups, "_in_flight", {})
+    monkeypatch.setattr(groups, "_current_weight", {})
+
+
+@pytest.fixture(autouse=True)
+def _reset_direct_delivery(monkeypatch):
+    monkeypatch.setattr(resolver, "_cache", None)
+    monkeypatch.setattr(direct, "_pools", {})
+
+
+@pytest.fixture(autouse=True)
+def _no_profile_probes(monkeypatch):
+    # Tests that start the app would otherwise connect to every profile's host.
+    monkeypatch.setattr(settings, "probe_enabled", False)
+
+
+@pytest.fixture
+def smtp_server():
+    """Start an aiosmtpd server for a handler on a free local port; returns the port."""
+    controllers = []
+
+    def start(handler) -> int:
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        controller = Controller(handler, hostname="127.0.0.1", port=port)
+        controller.start()
+        controllers.append(controller)
+        return port
+
+    yield start
+    for controller in controllers:
+        controller.stop()
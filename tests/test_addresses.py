@@ -0,0 +1,93 @@
+"""
+Tests for address validation: the strict syntax-only mode, parity of the
+full mode with EmailStr, the validated-address cache, and the API's 422.
+"""
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+from pydantic import BaseModel, EmailStr, ValidationError
+
+from email_service import addresses, settings, EmailMessage
+from main import app
+
+
+@pytest.fixture(autouse=True)
+def _fresh_cache():
+    addresses.clear_cache()
+    yield
+    addresses.clear_cache()
+
+
+class _Reference(BaseModel):
+    email: EmailStr
+
+
+VALID = [" user@example.com ", "First.Last+tag@Sub.Example.COM", "o'brien@example.co.uk", "a_b-c@x-y.example.org"]
+INVALID = ["", "plain", "@example.com", "user@", "user@localhost", "a..b@example.com", ".a@example.com",
+           "user@-example.com", "user@example..com", "user name@example.com"]
+
+
+@pytest.mark.parametrize("mode", ["full", "syntax"])
+def test_modes_agree_with_email_str_on_common_addresses(mode, monkeypatch):
+    monkeypatch.setattr(settings, "address_validation", mode)
+    for value in VALID:
+        assert EmailMessage(to=[value]).to == [_Reference(email=value).email]
+    for value in INVALID:
+        with pytest.raises(ValidationError, match="not a valid email address"):
+            EmailMessage(to=[value])
+
+
+def test_syntax_mode_is_ascii_only(monkeypatch):
+    monkeypatch.setattr(settings, "address_validation", "syntax")
+    for value in ['"quoted"@example.com', "user@[192.0.2.1]", "usér@example.com", "user@bücher.de",
+                  "Name <user@example.com>", "x" * 65 + "@example.com"]:
+        with pytest.raises(ValidationError):
+            EmailMessage(to=[value])
+
+    monkeypatch.setattr(settings, "address_validation", "full")
+    assert EmailMessage(to=["user@bücher.de"]).to == ["user@bücher.de"]
+
+
+def test_validated_addresses_are_cached(monkeypatch):
+    calls = []
+    check_full = addresses.check_full
+    monkeypatch.setattr(addresses, "check_full", lambda value: calls.append(value) or check_full(value))
+
+    for _ in range(3):
+        EmailMessage(to=["a@example.com", "b@example.com", "a@example.com"])
+    assert calls == ["a@example.com", "b@example.com"]
+
+    # Invalid addresses are checked every time.
+    for _ in range(2):
+        with pytest.raises(ValidationError):
+            EmailMessage(to=["nope"])
+    assert calls.count("nope") == 2
+
+    # A mode switch does not serve addresses checked under the other mode.
+    monkeypatch.setattr(settings, "address_validation", "syntax")
+    with pytest.raises(ValidationError):
+        EmailMessage(to=["user@bücher.de"])
+
+
+def test_cache_is_bounded_and_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(settings, "address_cache_size", 10)
+    for i in range(100):
+        addresses.validate(f"user{i}@example.com")
+    assert addresses._validator().cache_info().currsize == 10
+
+    monkeypatch.setattr(settings, "address_cache_size", 0)
+    addresses.validate("a@example.com")
+    assert addresses._validator().cache_info().currsize == 0
+
+
+@pytest.mark.anyio
+async def test_api_rejects_invalid_address_and_documents_format(monkeypatch):
+    monkeypatch.setattr(settings, "address_validation", "syntax")
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        r = await client.post("/email/send", json={"to": ["not-an-address"], "subject": "Hi", "text": "x"})
+        schema = (await client.get("/openapi.json")).json()
+    assert r.status_code == 422
+    assert "not a valid email address" in r.json()["detail"][0]["msg"]
+    assert schema["components"]["schemas"]["EmailMessage"]["properties"]["to"]["items"] == {
+        "type": "string", "format": "email",
+    }
@@ -3,6 +3,9 @@ Tests for the Email API endpoints.
 Uses httpx + FastAPI TestClient with mocked SMTP sending.
 """
 
+import json
+
+import aiosmtplib
 import pytest
 from unittest.mock import patch, AsyncMock
 
@@ -101,7 +104,7 @@ async def test_send_email_success(client, tmp_path, monkeypatch):
     }
     await client.post("/profiles", json=profile)
 
-    with patch("email_service.sender.aiosmtplib.send", new_callable=AsyncMock) as mock_send:
+    with patch("email_service.pool.SmtpPool.sendmail", new_callable=AsyncMock, return_value=({}, aiosmtplib.SMTPResponse(250, "OK"))) as mock_send:
         r = await client.post("/email/send", json={
             "to": ["recipient@example.com"],
             "subject": "Test",
@@ -112,6 +115,39 @@ async def test_send_email_success(client, tmp_path, monkeypatch):
         mock_send.assert_called_once()
 
 
+@pytest.mark.anyio
+async def test_send_email_failure_status_codes(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "profiles_file", str(tmp_path / "profiles.json"))
+    monkeypatch.setattr(settings, "default_profile_id", "sender")
+    monkeypatch.setattr(settings, "retry_base_delay", 0.001)
+    monkeypatch.setattr(settings, "rate_limit_cooldown", 0.0)
+
+    profile = {
+        "profile_id": "sender",
+        "smtp_host": "smtp.example.com",
+        "smtp_port": 465,
+        "smtp_user": "u@example.com",
+        "smtp_password": "pw",
+        "from_email": "u@example.com",
+    }
+    await client.post("/profiles", json=profile)
+    email = {"to": ["recipient@example.com"], "subject": "Test", "text": "Hello"}
+
+    busy = aiosmtplib.SMTPDataError(421, "Try again later")
+    with patch("email_service.pool.SmtpPool.sendmail", side_effect=busy) as mock_send:
+        r = await client.post("/email/send", json=email)
+    assert r.status_code == 503
+    assert "Retry-After" in r.headers
+    assert mock_send.call_count == settings.retry_inline_attempts
+
+    rejected = aiosmtplib.SMTPDataError(554, "Message rejected")
+    with patch("email_service.pool.SmtpPool.sendmail", side_effect=rejected) as mock_send:
+        r = await client.post("/email/send", json=email)
+    assert r.status_code == 502
+    assert "554" in r.json()["detail"]
+    mock_send.assert_called_once()
+
+
 @pytest.mark.anyio
 async def test_send_email_no_body(client, monkeypatch):
     monkeypatch.setattr(settings, "default_profile_id", "x")
@@ -135,3 +171,53 @@ async def test_send_email_unknown_profile(client, tmp_path, monkeypatch):
         "text": "Hello",
     })
     assert r.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_send_batch_streams_per_message_results(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "profiles_file", str(tmp_path / "profiles.json"))
+    monkeypatch.setattr(settings, "default_profile_id", "sender")
+
+    profile = {
+        "profile_id": "sender",
+        "smtp_host": "smtp.example.com",
+        "smtp_port": 465,
+        "smtp_user": "u@example.com",
+        "smtp_password": "pw",
+        "from_email": "u@example.com",
+    }
+    await client.post("/profiles", json=profile)
+
+    async def fake_send(sender, recipients, data, **kwargs):
+        if recipients == ["bad@example.com"]:
+            raise aiosmtplib.SMTPRecipientsRefused(
+                [aiosmtplib.SMTPRecipientRefused(550, "No such user", "bad@example.com")]
+            )
+        return {}, aiosmtplib.SMTPResponse(250, "2.0.0 OK")
+
+    with patch("email_service.pool.SmtpPool.sendmail", side_effect=fake_send) as mock_send:
+        r = await client.post("/email/send/batch", json={
+            "messages": [{"to": ["one@example.com"], "subject": "A", "text": "Hi"}],
+            "recipients": ["two@example.com", "bad@example.com"],
+            "subject": "Newsletter",
+            "html": "<p>Hello</p>",
+        })
+
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in r.text.splitlines()]
+    results = {line["index"]: line for line in lines if "index" in line}
+    assert mock_send.call_count == 3
+    assert results[0]["status"] == "success"
+    assert results[1]["accepted"] == ["two@example.com"]
+    assert results[2]["status"] == "failed"
+    assert results[2]["rejected"]["bad@example.com"]["code"] == 550
+    assert lines[-1] == {"summary": {"total": 3, "sent": 2, "failed": 1}}
+
+
+@pytest.mark.anyio
+async def test_send_batch_empty(client, monkeypatch):
+    monkeypatch.setattr(settings, "default_profile_id", "x")
+
+    r = await client.post("/email/send/batch", json={"messages": []})
+    assert r.status_code == 400
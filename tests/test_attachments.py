@@ -0,0 +1,264 @@
+"""
+Tests for attachments: MIME layout, chunked streaming into the DATA phase,
+path confinement and size limits, and the upload endpoint.
+"""
+
+import os
+from email import message_from_bytes, policy
+from unittest.mock import AsyncMock, patch
+
+import aiosmtplib
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+from email_service import (
+    Attachment,
+    EmailMessage,
+    SmtpProfile,
+    attachments,
+    mime,
+    pipeline,
+    pool,
+    sender,
+    settings,
+)
+from email_service.attachments import AttachmentError
+from main import app
+
+
+@pytest.fixture(autouse=True)
+def _attachments_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "attachments_dir", str(tmp_path / "files"))
+    (tmp_path / "files").mkdir()
+    mime.clear_cache()
+    yield tmp_path / "files"
+    mime.clear_cache()
+
+
+@pytest.fixture
+def profile():
+    return SmtpProfile(
+        profile_id="p",
+        smtp_host="127.0.0.1",
+        smtp_port=25,
+        from_email="news@example.com",
+    )
+
+
+def _message(*files: Attachment, **kwargs) -> EmailMessage:
+    fields = {"to": ["a@example.com"], "subject": "Report", "text": "See attached", **kwargs}
+    return EmailMessage(attachments=list(files), **fields)
+
+
+async def _collect(chunks) -> bytes:
+    return b"".join([chunk async for chunk in chunks])
+
+
+class Sink:
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((list(envelope.rcpt_tos), envelope.original_content))
+        return "250 Message accepted"
+
+
+# ─── MIME ─────────────────────────────────────────────────────────────────────
+
+
+def test_attachments_round_trip(_attachments_dir, profile):
+    payload = os.urandom(200_000)
+    (_attachments_dir / "report.bin").write_bytes(payload)
+    (_attachments_dir / "notes.txt").write_bytes(b"line one\r\n.line two\r\n")
+    message = _message(
+        Attachment(path="report.bin", content_type="application/pdf"),
+        Attachment(path="notes.txt", filename="Résumé \"final\".txt"),
+    )
+
+    parsed = message_from_bytes(mime.render(message, profile), policy=policy.default)
+
+    assert parsed.get_content_type() == "multipart/mixed"
+    body, report, notes = parsed.iter_parts()
+    assert body.get_content_type() == "multipart/alternative"
+    assert report.get_content_type() == "application/pdf"
+    assert report.get_filename() == "report.bin"
+    assert report.get_content() == payload
+    assert notes.get_content_type() == "text/plain"
+    assert notes.get_filename() == 'Résumé "final".txt'
+
+
+@pytest.mark.anyio
+async def test_stream_matches_render(_attachments_dir, profile):
+    (_attachments_dir / "big.bin").write_bytes(os.urandom(3 * mime.CHUNK_SIZE + 17))
+    prepared = mime.prepare(_message(Attachment(path="big.bin")), profile)
+
+    chunks = [chunk async for chunk in prepared.stream(["a@example.com"], "<id@example.com>")]
+
+    assert b"".join(chunks) == prepared.render(["a@example.com"], "<id@example.com>")
+    assert all(chunk.endswith(b"\r\n") for chunk in chunks)
+    assert max(len(chunk) for chunk in chunks[1:]) < 2 * mime.CHUNK_SIZE
+
+
+def test_missing_and_oversized_attachments_are_refused(_attachments_dir, profile, monkeypatch):
+    monkeypatch.setattr(settings, "attachment_max_bytes", 10)
+    (_attachments_dir / "big.bin").write_bytes(b"x" * 11)
+
+    with pytest.raises(AttachmentError, match="not found"):
+        mime.prepare(_message(Attachment(path="gone.bin")), profile)
+    with pytest.raises(AttachmentError, match="exceeds"):
+        mime.prepare(_message(Attachment(path="big.bin")), profile)
+
+
+def test_paths_are_confined_to_the_attachments_dir(_attachments_dir):
+    (_attachments_dir.parent / "secret.txt").write_text("secret")
+    (_attachments_dir / "ok.txt").write_text("ok")
+
+    attachments.confine(Attachment(path="ok.txt"))
+    for path in ("../secret.txt", str(_attachments_dir.parent / "secret.txt")):
+        with pytest.raises(AttachmentError, match="outside"):
+            attachments.confine(Attachment(path=path))
+
+
+def test_edited_file_is_not_served_from_cache(_attachments_dir, profile):
+    path = _attachments_dir / "a.txt"
+    path.write_text("first")
+    first = mime.prepare(_message(Attachment(path="a.txt")), profile)
+    path.write_text("second!")
+    assert mime.prepare(_message(Attachment(path="a.txt")), profile) is not first
+
+
+# ─── Sending ──────────────────────────────────────────────────────────────────
+
+
+@pytest.mark.anyio
+async def test_attachment_is_streamed_to_the_server(smtp_server, _attachments_dir, profile):
+    sink = Sink()
+    profile = profile.model_copy(update={"smtp_port": smtp_server(sink)})
+    payload = os.urandom(2 * mime.CHUNK_SIZE + 5)
+    (_attachments_dir / "data.bin").write_bytes(payload)
+    message = _message(Attachment(path="data.bin"), to=["x@example.com", "y@example.com"])
+
+    try:
+        result = await sender.send(message, profile)
+    finally:
+        await pool.close_all()
+
+    assert result["status"] == "success"
+    rcpts, content = sink.messages[0]
+    assert rcpts == ["x@example.com", "y@example.com"]
+    parsed = message_from_bytes(content, policy=policy.default)
+    assert list(parsed.iter_attachments())[0].get_content() == payload
+
+
+@pytest.mark.anyio
+async def test_individual_copies_stream_attachments(smtp_server, _attachments_dir, profile):
+    sink = Sink()
+    profile = profile.model_copy(update={"smtp_port": smtp_server(sink)})
+    (_attachments_dir / "a.txt").write_text("attached\n.dot line\n")
+    message = _message(Attachment(path="a.txt"), to=["x@example.com", "y@example.com"], individual=True)
+
+    try:
+        result = await sender.send(message, profile)
+    finally:
+        await pool.close_all()
+
+    assert result["accepted"] == ["x@example.com", "y@example.com"]
+    for rcpts, content in sink.messages:
+        parsed = message_from_bytes(content, policy=policy.default)
+        assert parsed["To"] == rcpts[0]
+        assert list(parsed.iter_attachments())[0].get_content() == "attached\n.dot line\n"
+
+
+@pytest.mark.anyio
+async def test_send_stream_writes_chunks_in_order(smtp_server):
+    sink = Sink()
+    smtp = aiosmtplib.SMTP(hostname="127.0.0.1", port=smtp_server(sink), start_tls=False)
+    await smtp.connect()
+
+    async def chunks():
+        yield b"Subject: x\r\n\r\n"
+        yield b".starts with a dot\r\n"
+        yield b"end\r\n"
+
+    refused, _ = await pipeline.send_stream(smtp, "a@example.com", ["b@example.com"], chunks())
+    await smtp.quit()
+
+    assert refused == {}
+    assert sink.messages[0][1] == b"Subject: x\r\n\r\n.starts with a dot\r\nend\r\n"
+
+
+# ─── Upload endpoint ──────────────────────────────────────────────────────────
+
+
+@pytest.fixture
+async def client():
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as c:
+        yield c
+
+
+async def _register(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "profiles_file", str(tmp_path / "profiles.json"))
+    monkeypatch.setattr(settings, "default_profile_id", "sender")
+    await client.post("/profiles", json={
+        "profile_id": "sender",
+        "smtp_host": "smtp.example.com",
+        "smtp_port": 465,
+        "from_email": "u@example.com",
+    })
+
+
+@pytest.mark.anyio
+async def test_upload_is_streamed_and_discarded(client, tmp_path, monkeypatch, _attachments_dir):
+    await _register(client, tmp_path, monkeypatch)
+    sent = {}
+
+    async def fake_send_stream(self, sender_addr, recipients, open_stream):
+        sent["data"] = await _collect(open_stream())
+        return {}, aiosmtplib.SMTPResponse(250, "OK")
+
+    with patch("email_service.pool.SmtpPool.send_stream", fake_send_stream):
+        r = await client.post(
+            "/email/send/upload",
+            data={"to": ["a@example.com", "b@example.com"], "subject": "Files", "text": "Hi"},
+            files=[("files", ("report.csv", b"a,b\n1,2\n", "text/csv"))],
+        )
+
+    assert r.status_code == 200, r.text
+    parsed = message_from_bytes(sent["data"], policy=policy.default)
+    assert parsed["To"] == "a@example.com, b@example.com"
+    part = list(parsed.iter_attachments())[0]
+    assert part.get_filename() == "report.csv"
+    assert part.get_content() == "a,b\n1,2\n"
+    assert list((_attachments_dir / "uploads").iterdir()) == []
+
+
+@pytest.mark.anyio
+async def test_upload_too_large(client, tmp_path, monkeypatch, _attachments_dir):
+    await _register(client, tmp_path, monkeypatch)
+    monkeypatch.setattr(settings, "attachment_max_bytes", 4)
+
+    r = await client.post(
+        "/email/send/upload",
+        data={"to": "a@example.com", "subject": "Files", "text": "Hi"},
+        files=[("files", ("big.bin", b"12345", "application/octet-stream"))],
+    )
+
+    assert r.status_code == 413
+    assert list((_attachments_dir / "uploads").iterdir()) == []
+
+
+@pytest.mark.anyio
+async def test_send_refuses_paths_outside_attachments_dir(client, tmp_path, monkeypatch):
+    await _register(client, tmp_path, monkeypatch)
+
+    with patch("email_service.pool.SmtpPool.sendmail", new_callable=AsyncMock, return_value=({}, aiosmtplib.SMTPResponse(250, "OK"))) as mock_send:
+        r = await client.post("/email/send", json={
+            "to": ["a@example.com"],
+            "subject": "Files",
+            "text": "Hi",
+            "attachments": [{"path": "../profiles.json"}],
+        })
+
+    assert r.status_code == 400
+    assert "outside" in r.json()["detail"]
+    mock_send.assert_not_called()
@@ -0,0 +1,235 @@
+"""
+Tests for direct-to-MX delivery: the cached MX resolver, and sending through
+a fake DNS to local aiosmtpd servers.
+"""
+
+import asyncio
+
+import pytest
+from aiosmtplib import SMTPResponse
+from pydantic import ValidationError
+
+from email_service import SmtpProfile, EmailMessage, direct, resolver, sender, settings
+from email_service.resolver import MxCache, MxLookupError
+
+
+class FakeDNS:
+    """A resolver answering from a dict: domain -> records, or an MxLookupError."""
+
+    def __init__(self, zones: dict, ttl: float = 300.0):
+        self.zones = zones
+        self.ttl = ttl
+        self.queries: list[str] = []
+
+    async def mx(self, domain):
+        self.queries.append(domain)
+        await asyncio.sleep(0)
+        answer = self.zones.get(domain)
+        if answer is None:
+            raise MxLookupError(f"Domain '{domain}' does not exist")
+        if isinstance(answer, Exception):
+            raise answer
+        return answer, self.ttl
+
+
+class Sink:
+    """Records delivered messages; refuses recipients starting with 'nobody'."""
+
+    def __init__(self):
+        self.messages = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("nobody"):
+            return "550 5.1.1 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((envelope.mail_from, list(envelope.rcpt_tos), envelope.content))
+        return "250 Message accepted"
+
+
+def _cache(dns: FakeDNS, **kwargs) -> MxCache:
+    return MxCache(dns, max_entries=kwargs.get("max_entries", 100), negative_ttl=kwargs.get("negative_ttl", 60.0))
+
+
+# ─── Resolver cache ───────────────────────────────────────────────────────────
+
+
+@pytest.mark.anyio
+async def test_mx_hosts_ordered_by_preference_and_cached():
+    dns = FakeDNS({"x.com": [(20, "mx2.x.com."), (10, "MX1.x.com.")]})
+    cache = _cache(dns)
+
+    assert await cache.lookup("X.com") == ["mx1.x.com", "mx2.x.com"]
+    assert await cache.lookup("x.com") == ["mx1.x.com", "mx2.x.com"]
+    assert dns.queries == ["x.com"]
+
+
+@pytest.mark.anyio
+async def test_entries_expire_with_their_ttl(monkeypatch):
+    dns = FakeDNS({"x.com": [(10, "mx.x.com")]}, ttl=60.0)
+    cache = _cache(dns)
+    now = [1000.0]
+    monkeypatch.setattr(resolver.time, "monotonic", lambda: now[0])
+
+    await cache.lookup("x.com")
+    now[0] += 59
+    await cache.lookup("x.com")
+    assert len(dns.queries) == 1
+    now[0] += 2
+    await cache.lookup("x.com")
+    assert len(dns.queries) == 2
+
+
+@pytest.mark.anyio
+async def test_missing_domains_and_null_mx_are_negatively_cached():
+    dns = FakeDNS({"null.com": [(0, ".")]})
+    cache = _cache(dns)
+
+    for _ in range(2):
+        with pytest.raises(MxLookupError, match="does not exist"):
+            await cache.lookup("gone.com")
+        with pytest.raises(MxLookupError, match="null MX"):
+            await cache.lookup("null.com")
+    assert dns.queries == ["gone.com", "null.com"]
+
+
+@pytest.mark.anyio
+async def test_transient_failures_are_not_cached():
+    dns = FakeDNS({"x.com": MxLookupError("SERVFAIL", retry_after=5.0)})
+    cache = _cache(dns)
+
+    for _ in range(2):
+        with pytest.raises(MxLookupError):
+            await cache.lookup("x.com")
+    assert len(dns.queries) == 2
+
+
+@pytest.mark.anyio
+async def test_domain_without_mx_is_its_own_mail_host():
+    cache = _cache(FakeDNS({"x.com": []}))
+    assert await cache.lookup("x.com") == ["x.com"]
+
+
+@pytest.mark.anyio
+async def test_concurrent_lookups_share_one_query():
+    dns = FakeDNS({"x.com": [(10, "mx.x.com")]})
+    cache = _cache(dns)
+
+    results = await asyncio.gather(*(cache.lookup("x.com") for _ in range(10)))
+    assert all(r == ["mx.x.com"] for r in results)
+    assert dns.queries == ["x.com"]
+
+
+@pytest.mark.anyio
+async def test_cache_size_is_bounded():
+    dns = FakeDNS({f"d{i}.com": [(10, "mx")] for i in range(5)})
+    cache = _cache(dns, max_entries=3)
+
+    for i in range(5):
+        await cache.lookup(f"d{i}.com")
+    assert len(cache) == 3
+    await cache.lookup("d0.com")
+    assert dns.queries.count("d0.com") == 2
+
+
+# ─── Delivery ─────────────────────────────────────────────────────────────────
+
+
+def _direct_profile(**overrides) -> SmtpProfile:
+    return SmtpProfile(profile_id="direct", from_email="news@example.com", direct=True, **overrides)
+
+
+def test_relay_profile_requires_host():
+    with pytest.raises(ValidationError):
+        SmtpProfile(profile_id="p", from_email="news@example.com")
+    assert _direct_profile().smtp_host == ""
+
+
+@pytest.mark.anyio
+async def test_direct_send_per_domain(smtp_server, monkeypatch):
+    sink = Sink()
+    monkeypatch.setattr(settings, "mx_port", smtp_server(sink))
+    resolver.set_resolver(FakeDNS({"a.example.com": [(10, "127.0.0.1")], "b.example.com": []}))
+    # b.example.com has no MX, so its own name is the host; make it resolve locally.
+    monkeypatch.setattr(direct, "pool_for", _localhost(direct.pool_for))
+
+    to = ["x@a.example.com", "y@b.example.com", "z@a.example.com", "nobody@a.example.com", "q@missing.example.com"]
+    message = EmailMessage(to=to, subject="Hi", text="Hello")
+    (refused, _), used = await sender._deliver(message, _direct_profile())
+    await direct.close_all()
+
+    delivered = sorted(rcpts for _, rcpts, _ in sink.messages)
+    assert delivered == [["x@a.example.com", "z@a.example.com"], ["y@b.example.com"]]
+    assert {addr: r.code for addr, r in refused.items()} == {
+        "nobody@a.example.com": 550,
+        "q@missing.example.com": -1,
+    }
+    # Every copy carries the full To header of the original message.
+    assert b"To: x@a.example.com, y@b.example.com" in sink.messages[0][2]
+
+
+@pytest.mark.anyio
+async def test_direct_send_individual_copies(smtp_server, monkeypatch):
+    sink = Sink()
+    monkeypatch.setattr(settings, "mx_port", smtp_server(sink))
+    resolver.set_resolver(FakeDNS({"a.example.com": [(10, "127.0.0.1")]}))
+
+    message = EmailMessage(to=["x@a.example.com", "y@a.example.com"], subject="Hi", text="Hello", individual=True)
+    result = await sender.send(message, _direct_profile())
+    await direct.close_all()
+
+    assert result["accepted"] == ["x@a.example.com", "y@a.example.com"]
+    assert sorted(rcpts for _, rcpts, _ in sink.messages) == [["x@a.example.com"], ["y@a.example.com"]]
+
+
+@pytest.mark.anyio
+async def test_unreachable_mx_falls_back_to_next(smtp_server, monkeypatch):
+    sink = Sink()
+    monkeypatch.setattr(settings, "mx_port", smtp_server(sink))
+    # Nothing listens on 127.0.0.2, so the preferred MX refuses the connection.
+    resolver.set_resolver(FakeDNS({"a.example.com": [(10, "127.0.0.2"), (20, "127.0.0.1")]}))
+
+    message = EmailMessage(to=["x@a.example.com"], subject="Hi", text="Hello")
+    await sender.send(message, _direct_profile())
+    await direct.close_all()
+
+    assert sink.messages[0][0] == "news@example.com"
+
+
+@pytest.mark.anyio
+async def test_direct_send_fails_when_no_domain_resolves():
+    resolver.set_resolver(FakeDNS({}))
+    message = EmailMessage(to=["x@gone.example.com"], subject="Hi", text="Hello")
+    with pytest.raises(MxLookupError):
+        await sender.send(message, _direct_profile())
+
+
+@pytest.mark.anyio
+async def test_per_mx_concurrency_limit(monkeypatch):
+    monkeypatch.setattr(settings, "mx_max_connections", 2)
+    resolver.set_resolver(FakeDNS({f"d{i}.example.com": [(10, "mx.example.com")] for i in range(6)}))
+    active = peak = 0
+
+    async def fake_sendmail(self, sender_addr, recipients, data, **kwargs):
+        nonlocal active, peak
+        async with self._slots:
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+        return {}, SMTPResponse(250, "OK")
+
+    monkeypatch.setattr("email_service.pool.SmtpPool.sendmail", fake_sendmail)
+    message = EmailMessage(to=[f"u@d{i}.example.com" for i in range(6)], subject="Hi", text="Hello")
+    await sender.send(message, _direct_profile())
+
+    assert peak == 2
+    assert list(direct._pools) == ["mx.example.com"]
+
+
+def _localhost(pool_for):
+    def wrapper(host: str):
+        return pool_for("127.0.0.1" if host.endswith(".example.com") else host)
+    return wrapper
@@ -0,0 +1,243 @@
+"""
+Tests for DKIM signing: signatures that an independent verifier (dkimpy)
+accepts for RSA and Ed25519 keys, relaxed body canonicalization, the body
+hash computed once per message, key caching, attachments, and errors.
+Runs against a local aiosmtpd server.
+"""
+
+import base64
+import hashlib
+import os
+import random
+from unittest.mock import patch
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+from email_service import (
+    dkim, metrics, mime, pool, profiles, send, settings, templates, Attachment, EmailMessage, EmailTemplate, SmtpProfile,
+)
+from email_service.dkim import DkimError
+from main import app
+
+dkimpy = pytest.importorskip("dkim")
+pytest.importorskip("cryptography")
+
+from cryptography.hazmat.primitives import serialization  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa  # noqa: E402
+from dkim.canonicalization import Relaxed  # noqa: E402
+
+
+class Sink:
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((list(envelope.rcpt_tos), envelope.original_content))
+        return "250 Message accepted"
+
+
+@pytest.fixture(autouse=True)
+def _isolate(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "attachments_dir", str(tmp_path))
+    mime.clear_cache()
+    dkim.reset()
+    yield
+    dkim.reset()
+    mime.clear_cache()
+
+
+@pytest.fixture
+async def server(smtp_server):
+    """A local SMTP server that keeps what it receives; returns (sink, port)."""
+    sink = Sink()
+    yield sink, smtp_server(sink)
+    await pool.close_all()
+
+
+def _write_key(path, kind: str = "rsa") -> bytes:
+    """Write a PEM private key; returns the DNS TXT record of its public key."""
+    if kind == "rsa":
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        public = key.public_key().public_bytes(
+            serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+    else:
+        key = ed25519.Ed25519PrivateKey.generate()
+        public = key.public_key().public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+    path.write_bytes(key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ))
+    return f"v=DKIM1; k={kind}; p={base64.b64encode(public).decode()}".encode()
+
+
+def _verify(message: bytes, record: bytes) -> bool:
+    def dns(name, timeout=5):
+        assert name == b"mail._domainkey.example.com."
+        return record
+    return dkimpy.verify(message, dnsfunc=dns)
+
+
+def _profile(port: int, key_file, **fields) -> SmtpProfile:
+    return SmtpProfile(
+        profile_id="signed", smtp_host="127.0.0.1", smtp_port=port, from_email="news@example.com",
+        dkim_selector="mail", dkim_key_file=str(key_file), **fields,
+    )
+
+
+# ─── Signatures ──────────────────────────────────────────────────────────────
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("kind", ["rsa", "ed25519"])
+async def test_sent_mail_is_signed(server, tmp_path, kind):
+    if kind == "ed25519":
+        pytest.importorskip("nacl")  # dkimpy verifies Ed25519 with PyNaCl
+    record = _write_key(tmp_path / "key.pem", kind)
+    sink, port = server
+    profile = _profile(port, tmp_path / "key.pem")
+    html = "<p>Hello   there,\t world</p>  \n\n\n"
+    await send(EmailMessage(to=["a@example.com", "b@example.org"], subject="Héllo " * 20, html=html), profile)
+
+    [(_, data)] = sink.messages
+    assert data.startswith(b"DKIM-Signature: v=1;")
+    assert f"a={kind}-sha256;".encode() in data
+    assert b"d=example.com" in data and b"s=mail" in data
+    assert _verify(data, record)
+    assert not _verify(data.replace(b"Hello", b"Hallo"), record)
+
+
+@pytest.mark.anyio
+async def test_signatures_survive_refolding_and_whitespace_changes(server, tmp_path):
+    record = _write_key(tmp_path / "key.pem")
+    sink, port = server
+    await send(EmailMessage(to=["a@example.com"], subject="Hi", text="one two\nthree"), _profile(port, tmp_path / "key.pem"))
+    [(_, data)] = sink.messages
+
+    # What relays commonly do: re-fold headers, add trailing blanks and whitespace.
+    relayed = data.replace(b"Subject: Hi", b"Subject:\r\n\tHi").replace(b"one two", b"one  two ") + b"\r\n\r\n"
+    assert _verify(relayed, record)
+
+
+def test_body_hash_matches_the_reference_canonicalization():
+    rng = random.Random(7)
+    pieces = [b"a", b" ", b"\t", b"\r\n", b"b  c", b"\r\n\r\n", b"  \t\r\n"]
+    for _ in range(200):
+        body = b"".join(rng.choice(pieces) for _ in range(rng.randint(0, 40)))
+        # SMTP bodies end in CRLF (dkimpy keeps trailing whitespace on a last line without one).
+        body = body.replace(b"\r\n", b"\n").replace(b"\n", b"\r\n") + b"\r\n"
+        expected = base64.b64encode(hashlib.sha256(Relaxed.canonicalize_body(body)).digest()).decode()
+        hasher = dkim._BodyHasher()
+        cut = sorted(rng.randint(0, len(body)) for _ in range(3))
+        for start, end in zip([0] + cut, cut + [len(body)]):
+            hasher.update(body[start:end])
+        assert hasher.digest() == expected, body
+
+
+# ─── Reuse ───────────────────────────────────────────────────────────────────
+
+
+@pytest.mark.anyio
+async def test_body_is_hashed_once_for_many_recipients(server, tmp_path):
+    record = _write_key(tmp_path / "key.pem")
+    sink, port = server
+    profile = _profile(port, tmp_path / "key.pem")
+    recipients = [f"user{n}@example.com" for n in range(20)]
+    metrics.reset()
+
+    with patch("email_service.dkim._load_key", wraps=dkim._load_key) as load:
+        await send(EmailMessage(to=recipients, subject="News", text="Same body", individual=True), profile)
+        await send(EmailMessage(to=recipients[:3], subject="News", text="Same body", individual=True), profile)
+
+    assert len(sink.messages) == 23
+    assert all(_verify(data, record) for _, data in sink.messages)
+    # One message-id per copy, each signed with To naming just that recipient.
+    assert len({data.split(b"Message-ID: ")[1].split(b"\r\n")[0] for _, data in sink.messages}) == 23
+    assert metrics.DKIM_SECONDS.count(step="body_hash") == 1
+    assert metrics.DKIM_SIGNATURES.value(profile="signed") == 23
+    assert load.call_count == 1
+
+
+@pytest.mark.anyio
+async def test_key_is_reloaded_when_its_file_changes(server, tmp_path):
+    _write_key(tmp_path / "key.pem")
+    sink, port = server
+    profile = _profile(port, tmp_path / "key.pem")
+    message = EmailMessage(to=["a@example.com"], subject="Hi", text="x")
+    await send(message, profile)
+
+    record = _write_key(tmp_path / "key.pem")  # rotated
+    os.utime(tmp_path / "key.pem", ns=(1, 1))
+    await send(message, profile)
+
+    assert not _verify(sink.messages[0][1], record)
+    assert _verify(sink.messages[1][1], record)
+
+
+@pytest.mark.anyio
+async def test_attachments_are_covered_by_the_body_hash(server, tmp_path):
+    record = _write_key(tmp_path / "key.pem")
+    (tmp_path / "report.bin").write_bytes(os.urandom(3 * mime.CHUNK_SIZE + 100))
+    sink, port = server
+    profile = _profile(port, tmp_path / "key.pem")
+    message = EmailMessage(to=["a@example.com"], subject="Report", text="Attached", attachments=[Attachment(path="report.bin")])
+
+    await send(message, profile)
+    await send(message.model_copy(update={"individual": True, "to": ["b@example.com", "c@example.com"]}), profile)
+
+    assert len(sink.messages) == 3
+    assert all(_verify(data, record) for _, data in sink.messages)
+
+
+@pytest.mark.anyio
+async def test_templated_copies_share_one_body_hash(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "templates_file", str(tmp_path / "templates.json"))
+    monkeypatch.setattr(templates, "_cache", None)
+    templates._compiled.clear()
+    templates.add(EmailTemplate(name="invoice", subject="Your invoice, {{ name }}", text="Attached, as every month."))
+    record = _write_key(tmp_path / "key.pem")
+    (tmp_path / "invoice.pdf").write_bytes(os.urandom(2 * mime.CHUNK_SIZE))
+    sink, port = server
+    profile = _profile(port, tmp_path / "key.pem")
+    metrics.reset()
+
+    for n in range(5):
+        await send(EmailMessage(to=[f"user{n}@example.com"], template="invoice", variables={"name": f"User {n}"},
+                                attachments=[Attachment(path="invoice.pdf")]), profile)
+
+    assert len(sink.messages) == 5
+    assert all(_verify(data, record) for _, data in sink.messages)
+    assert len({data.split(b"Subject: ")[1].split(b"\r\n")[0] for _, data in sink.messages}) == 5
+    assert metrics.DKIM_SECONDS.count(step="body_hash") == 1
+    templates._compiled.clear()
+
+
+# ─── Errors ──────────────────────────────────────────────────────────────────
+
+
+def test_selector_and_key_file_go_together():
+    with pytest.raises(ValueError, match="dkim_selector and dkim_key_file"):
+        SmtpProfile(profile_id="p", smtp_host="h", from_email="a@example.com", dkim_selector="mail")
+    with pytest.raises(ValueError):
+        SmtpProfile(profile_id="p", smtp_host="h", from_email="a@example.com", dkim_selector="bad selector",
+                    dkim_key_file="key.pem")
+
+
+@pytest.mark.anyio
+async def test_unloadable_key_fails_the_send_without_retrying(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "profiles_file", str(tmp_path / "profiles.json"))
+    monkeypatch.setattr(settings, "default_profile_id", "signed")
+    monkeypatch.setattr(settings, "default_group", "")
+    sink, port = server
+    profiles.add(_profile(port, tmp_path / "missing.pem"))
+
+    with pytest.raises(DkimError):
+        await send(EmailMessage(to=["a@example.com"], text="x"), profiles.get("signed"))
+    (tmp_path / "bad.pem").write_text("not a key")
+    profiles.add(_profile(port, tmp_path / "bad.pem"))
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        r = await client.post("/email/send", json={"to": ["a@example.com"], "subject": "Hi", "text": "x"})
+
+    assert r.status_code == 502
+    assert "Cannot load DKIM key" in r.json()["detail"]
+    assert sink.messages == []
@@ -0,0 +1,177 @@
+"""
+Tests for profile groups: load balancing, failover and circuit breaking.
+SMTP delivery is replaced by a fake per-profile deliver function.
+"""
+
+import asyncio
+from collections import Counter
+
+import aiosmtplib
+import pytest
+from unittest.mock import patch
+
+from httpx import AsyncClient, ASGITransport
+
+from email_service import groups, profiles, ratelimit, scheduler, send, settings, SmtpProfile, ProfileGroup, GroupMember, EmailMessage
+from email_service.groups import NoAvailableProfile
+from main import app
+
+
+@pytest.fixture
+def members(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "profiles_file", str(tmp_path / "profiles.json"))
+    monkeypatch.setattr(settings, "groups_file", str(tmp_path / "groups.json"))
+    for profile_id in ("a", "b"):
+        profiles.add(SmtpProfile(
+            profile_id=profile_id,
+            smtp_host=f"smtp.{profile_id}.example.com",
+            smtp_user="u@example.com",
+            smtp_password="pw",
+            from_email="u@example.com",
+        ))
+    return ["a", "b"]
+
+
+def _message() -> EmailMessage:
+    return EmailMessage(to=["r@example.com"], subject="Hi", text="Hello")
+
+
+class FakeDeliver:
+    """Records which profile each send used; fails for profiles in `failing`."""
+
+    def __init__(self, failing=None):
+        self.used = Counter()
+        self.failing = failing or {}
+
+    async def __call__(self, message, profile, session=None):
+        self.used[profile.profile_id] += 1
+        if profile.profile_id in self.failing:
+            raise self.failing[profile.profile_id]
+        return {}, "OK"
+
+
+@pytest.mark.anyio
+async def test_weighted_round_robin(members):
+    group = ProfileGroup(name="g", members=[GroupMember(profile_id="a", weight=3), GroupMember(profile_id="b")])
+    fake = FakeDeliver()
+    with patch("email_service.sender._deliver_via", fake):
+        for _ in range(8):
+            await send(_message(), group)
+    assert fake.used == {"a": 6, "b": 2}
+
+
+@pytest.mark.anyio
+async def test_fails_over_and_parks_failing_member(members, monkeypatch):
+    monkeypatch.setattr(settings, "breaker_failure_threshold", 2)
+    group = ProfileGroup(name="g", members=[GroupMember(profile_id="a"), GroupMember(profile_id="b")])
+    fake = FakeDeliver({"a": aiosmtplib.SMTPAuthenticationError(535, "bad credentials")})
+
+    with patch("email_service.sender._deliver_via", fake):
+        results = [await send(_message(), group) for _ in range(6)]
+
+    assert all(r["profile_used"] == "b" for r in results)
+    assert fake.used["a"] == 2  # parked after two failures
+    assert groups.status(group)["members"][0]["circuit"] == "open"
+
+
+@pytest.mark.anyio
+async def test_message_rejection_is_not_failed_over(members):
+    group = ProfileGroup(name="g", members=[GroupMember(profile_id="a"), GroupMember(profile_id="b")])
+    fake = FakeDeliver({"a": aiosmtplib.SMTPDataError(554, "spam"), "b": aiosmtplib.SMTPDataError(554, "spam")})
+
+    with patch("email_service.sender._deliver_via", fake):
+        with pytest.raises(aiosmtplib.SMTPDataError):
+            await send(_message(), group)
+    assert sum(fake.used.values()) == 1
+
+
+@pytest.mark.anyio
+async def test_all_members_parked(members, monkeypatch):
+    monkeypatch.setattr(settings, "breaker_failure_threshold", 1)
+    group = ProfileGroup(name="g", members=[GroupMember(profile_id="a"), GroupMember(profile_id="b")])
+    down = aiosmtplib.SMTPServerDisconnected("down")
+    fake = FakeDeliver({"a": down, "b": down})
+
+    with patch("email_service.sender._deliver_via", fake):
+        with pytest.raises(aiosmtplib.SMTPServerDisconnected):
+            await send(_message(), group)
+        with pytest.raises(NoAvailableProfile) as exc:
+            await send(_message(), group)
+    assert exc.value.retry_after > 0
+
+
+@pytest.mark.anyio
+async def test_cancelled_trial_send_does_not_park_the_member(members, monkeypatch):
+    monkeypatch.setattr(settings, "breaker_failure_threshold", 1)
+    monkeypatch.setattr(settings, "breaker_reset_timeout", 0.0)
+    group = ProfileGroup(name="g", members=[GroupMember(profile_id="a")])
+    started = asyncio.Event()
+
+    async def hang(message, profile, session=None):
+        started.set()
+        await asyncio.sleep(10)
+
+    with patch("email_service.sender._deliver_via", FakeDeliver({"a": aiosmtplib.SMTPServerDisconnected("down")})):
+        with pytest.raises(aiosmtplib.SMTPServerDisconnected):
+            await send(_message(), group)
+    with patch("email_service.sender._deliver_via", hang):
+        trial = asyncio.create_task(send(_message(), group))  # the half-open trial
+        await started.wait()
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+    assert groups.breaker("a").state == "half_open"  # not counted as a success
+
+    fake = FakeDeliver()
+    with patch("email_service.sender._deliver_via", fake):
+        result = await send(_message(), group)
+    assert result["profile_used"] == "a"
+    assert groups.breaker("a").state == "closed"
+
+
+@pytest.mark.anyio
+async def test_local_limits_fail_over_without_parking_the_member(members, monkeypatch):
+    monkeypatch.setattr(settings, "breaker_failure_threshold", 2)
+    profiles.add(SmtpProfile(profile_id="a", smtp_host="smtp.a.example.com", from_email="u@example.com", daily_quota=1))
+    group = ProfileGroup(name="g", members=[GroupMember(profile_id="a"), GroupMember(profile_id="b")])
+    fake = FakeDeliver()
+
+    async def limited(message, profile, session=None):
+        await ratelimit.acquire(profile, len(message.to))
+        return await fake(message, profile, session)
+
+    with patch("email_service.sender._deliver_via", limited):
+        results = [await send(_message(), group) for _ in range(6)]
+
+    # "a" is out of quota after its first send; the rest go to "b".
+    assert [r["profile_used"] for r in results] == ["a", "b", "b", "b", "b", "b"]
+    assert groups.breaker("a").state == "closed" and groups.breaker("a").failures == 0
+
+    full = FakeDeliver({"b": scheduler.QueueFull("Send queue for smtp.b.example.com is full", retry_after=1.0)})
+    with patch("email_service.sender._deliver_via", full):
+        for _ in range(4):
+            await send(_message(), group)
+    assert full.used["a"] == 4
+    assert groups.breaker("b").state == "closed" and groups.breaker("b").failures == 0
+
+
+@pytest.mark.anyio
+async def test_group_api_and_default_group_send(members, monkeypatch):
+    monkeypatch.setattr(settings, "default_group", "pool")
+    fake = FakeDeliver()
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        r = await client.post("/groups", json={"name": "pool", "members": [{"profile_id": "a"}, {"profile_id": "b"}]})
+        assert r.json()["status"] == "saved"
+
+        with patch("email_service.sender._deliver_via", fake):
+            for _ in range(2):
+                r = await client.post("/email/send", json={"to": ["r@example.com"], "subject": "Hi", "text": "Hello"})
+                assert r.status_code == 200
+        assert fake.used == {"a": 1, "b": 1}
+
+        r = await client.get("/groups/pool")
+        assert [m["circuit"] for m in r.json()["members"]] == ["closed", "closed"]
+
+        assert (await client.delete("/groups/pool")).status_code == 200
+        assert (await client.get("/groups/pool")).status_code == 404
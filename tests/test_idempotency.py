@@ -0,0 +1,224 @@
+"""
+Tests for idempotency keys: replayed responses, retries waiting on the
+in-flight attempt, expiry and the size bound, the SQLite store, and the
+content-hash mode.
+"""
+
+import asyncio
+from unittest.mock import patch
+
+import aiosmtplib
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+from email_service import idempotency, settings
+from main import app
+
+
+@pytest.fixture(autouse=True)
+def _state(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "profiles_file", str(tmp_path / "profiles.json"))
+    monkeypatch.setattr(settings, "default_profile_id", "sender")
+    monkeypatch.setattr(settings, "idempotency_db", "")
+    monkeypatch.setattr(idempotency, "_pending", {})
+    idempotency._cache.clear()
+    yield
+    idempotency._cache.clear()
+    if idempotency._store is not None:
+        idempotency._store[1].close()
+        monkeypatch.setattr(idempotency, "_store", None)
+
+
+@pytest.fixture
+async def client():
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as c:
+        await c.post("/profiles", json={
+            "profile_id": "sender",
+            "smtp_host": "smtp.example.com",
+            "smtp_port": 465,
+            "from_email": "u@example.com",
+        })
+        yield c
+
+
+MESSAGE = {"to": ["a@example.com"], "subject": "Order 1", "text": "Thanks"}
+
+
+def _counting_sendmail(calls: list, delay: float = 0.0, error: Exception = None):
+    async def fake_sendmail(self, sender_addr, recipients, data, **kwargs):
+        calls.append(recipients)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return {}, aiosmtplib.SMTPResponse(250, "OK")
+    return fake_sendmail
+
+
+# ─── API ──────────────────────────────────────────────────────────────────────
+
+
+@pytest.mark.anyio
+async def test_retry_replays_first_response(client):
+    calls = []
+    headers = {"Idempotency-Key": "order-1"}
+    with patch("email_service.pool.SmtpPool.sendmail", _counting_sendmail(calls)):
+        first = await client.post("/email/send", json=MESSAGE, headers=headers)
+        retry = await client.post("/email/send", json=MESSAGE, headers=headers)
+        other = await client.post("/email/send", json=MESSAGE, headers={"Idempotency-Key": "order-2"})
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert "idempotent-replayed" not in first.headers
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert len(calls) == 2  # order-1 once, order-2 once
+
+
+@pytest.mark.anyio
+async def test_concurrent_retry_waits_for_in_flight_send(client):
+    calls = []
+    headers = {"Idempotency-Key": "slow"}
+    with patch("email_service.pool.SmtpPool.sendmail", _counting_sendmail(calls, delay=0.2)):
+        responses = await asyncio.gather(*(
+            client.post("/email/send", json=MESSAGE, headers=headers) for _ in range(5)
+        ))
+
+    assert [r.status_code for r in responses] == [200] * 5
+    assert len({r.text for r in responses}) == 1
+    assert len(calls) == 1
+
+
+@pytest.mark.anyio
+async def test_key_reused_for_another_message(client):
+    with patch("email_service.pool.SmtpPool.sendmail", _counting_sendmail([])):
+        await client.post("/email/send", json=MESSAGE, headers={"Idempotency-Key": "k"})
+        r = await client.post("/email/send", json={**MESSAGE, "subject": "Order 2"}, headers={"Idempotency-Key": "k"})
+    assert r.status_code == 422
+
+
+@pytest.mark.anyio
+async def test_permanent_failure_is_replayed_transient_is_retried(client, monkeypatch):
+    monkeypatch.setattr(settings, "rate_limit_cooldown", 0.0)
+    calls = []
+    permanent = aiosmtplib.SMTPRecipientsRefused([aiosmtplib.SMTPRecipientRefused(550, "No such user", "a@example.com")])
+    with patch("email_service.pool.SmtpPool.sendmail", _counting_sendmail(calls, error=permanent)):
+        first = await client.post("/email/send", json=MESSAGE, headers={"Idempotency-Key": "bad"})
+        again = await client.post("/email/send", json=MESSAGE, headers={"Idempotency-Key": "bad"})
+    assert first.status_code == again.status_code == 502
+    assert len(calls) == 1
+
+    calls.clear()
+    transient = aiosmtplib.SMTPResponseException(421, "Try later")
+    with patch.object(settings, "retry_inline_attempts", 1), \
+            patch("email_service.pool.SmtpPool.sendmail", _counting_sendmail(calls, error=transient)):
+        first = await client.post("/email/send", json=MESSAGE, headers={"Idempotency-Key": "busy"})
+    with patch("email_service.pool.SmtpPool.sendmail", _counting_sendmail(calls)):
+        again = await client.post("/email/send", json=MESSAGE, headers={"Idempotency-Key": "busy"})
+    assert first.status_code == 503
+    assert again.status_code == 200
+    assert len(calls) == 2
+
+
+@pytest.mark.anyio
+async def test_content_hash_mode(client, monkeypatch):
+    calls = []
+    monkeypatch.setattr(settings, "idempotency_content_hash", True)
+    with patch("email_service.pool.SmtpPool.sendmail", _counting_sendmail(calls)):
+        await client.post("/email/send", json=MESSAGE)
+        replay = await client.post("/email/send", json=MESSAGE)
+        await client.post("/email/send", json={**MESSAGE, "text": "Thanks again"})
+    assert replay.headers["idempotent-replayed"] == "true"
+    assert len(calls) == 2
+
+
+@pytest.mark.anyio
+async def test_without_key_every_request_sends(client):
+    calls = []
+    with patch("email_service.pool.SmtpPool.sendmail", _counting_sendmail(calls)):
+        await client.post("/email/send", json=MESSAGE)
+        await client.post("/email/send", json=MESSAGE)
+    assert len(calls) == 2
+
+
+# ─── Cache and store ──────────────────────────────────────────────────────────
+
+
+def _outcome(body: bytes = b"{}") -> idempotency.Outcome:
+    return idempotency.Outcome(200, body)
+
+
+@pytest.mark.anyio
+async def test_expired_keys_run_again(monkeypatch):
+    monkeypatch.setattr(settings, "idempotency_ttl", 0.05)
+    runs = []
+
+    async def call():
+        runs.append(1)
+        return _outcome()
+
+    key = idempotency.digest("k")
+    assert (await idempotency.run(key, b"f", call))[1] is False
+    assert (await idempotency.run(key, b"f", call))[1] is True
+    await asyncio.sleep(0.06)
+    assert (await idempotency.run(key, b"f", call))[1] is False
+    assert len(runs) == 2
+
+
+@pytest.mark.anyio
+async def test_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(settings, "idempotency_max_keys", 100)
+
+    async def call():
+        return _outcome()
+
+    for i in range(1000):
+        await idempotency.run(idempotency.digest(str(i)), b"f", call)
+    assert len(idempotency._cache) == 100
+    assert idempotency._cache.get(idempotency.digest("999")) is not None
+    assert idempotency._cache.get(idempotency.digest("0")) is None
+
+
+@pytest.mark.anyio
+async def test_store_survives_restart(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "idempotency_db", str(tmp_path / "idempotency.db"))
+    runs = []
+
+    async def call():
+        runs.append(1)
+        return _outcome(b'{"id": 1}')
+
+    key = idempotency.digest("k")
+    await idempotency.run(key, b"f", call)
+    idempotency._cache.clear()  # a restarted process has an empty cache
+    idempotency.store().close()
+
+    outcome, replayed = await idempotency.run(key, b"f", call)
+    assert replayed and outcome.body == b'{"id": 1}'
+    assert len(runs) == 1
+    with pytest.raises(idempotency.KeyReused):
+        idempotency._cache.clear()
+        await idempotency.run(key, b"other", call)
+
+
+@pytest.mark.anyio
+async def test_store_waits_for_another_worker(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "idempotency_db", str(tmp_path / "idempotency.db"))
+    monkeypatch.setattr(settings, "idempotency_wait", 0.2)
+    key = idempotency.digest("k")
+
+    # Another worker process has claimed the key and is still sending.
+    other = idempotency.SqliteStore(tmp_path / "idempotency.db")
+    assert other.claim(key, b"f") is None
+
+    async def call():
+        raise AssertionError("sent twice")
+
+    with pytest.raises(idempotency.InProgress):
+        await idempotency.run(key, b"f", call)
+
+    async def finish():
+        await asyncio.sleep(0.05)
+        await asyncio.to_thread(other.complete, key, _outcome(b'{"done": true}'), 1e12)
+
+    outcome, replayed = (await asyncio.gather(idempotency.run(key, b"f", call), finish()))[0]
+    assert replayed and outcome.body == b'{"done": true}'
+    other.close()
@@ -0,0 +1,117 @@
+"""
+Tests for metrics collection and the /metrics endpoint.
+"""
+
+import pytest
+from aiosmtplib import SMTPResponse
+from unittest.mock import patch, AsyncMock
+
+from httpx import AsyncClient, ASGITransport
+
+from email_service import metrics, settings
+from email_service.metrics import Counter, Histogram
+from main import app
+
+
+def test_histogram_renders_cumulative_buckets():
+    hist = Histogram("test_latency_seconds", "Test.", ("stage",), buckets=(0.1, 1.0))
+    try:
+        hist.observe(0.05, stage="a")
+        hist.observe(0.5, stage="a")
+        hist.observe(5.0, stage="a")
+        lines = hist.render()
+    finally:
+        metrics._registry.remove(hist)
+
+    assert 'test_latency_seconds_bucket{stage="a",le="0.1"} 1' in lines
+    assert 'test_latency_seconds_bucket{stage="a",le="1.0"} 2' in lines
+    assert 'test_latency_seconds_bucket{stage="a",le="+Inf"} 3' in lines
+    assert 'test_latency_seconds_count{stage="a"} 3' in lines
+
+
+def test_counter_labels():
+    counter = Counter("test_events_total", "Test.", ("kind",))
+    try:
+        counter.inc(kind="x")
+        counter.inc(2, kind="x")
+        assert counter.value(kind="x") == 3
+        assert 'test_events_total{kind="x"} 3' in counter.render()
+    finally:
+        metrics._registry.remove(counter)
+
+
+def test_label_values_are_escaped():
+    counter = Counter("test_events_total", "Test.", ("kind",))
+    try:
+        counter.inc(kind='evil"x\ny\\z')
+        lines = counter.render()
+    finally:
+        metrics._registry.remove(counter)
+
+    assert 'test_events_total{kind="evil\\"x\\ny\\\\z"} 1' in lines
+    assert all("\n" not in line for line in lines)
+
+
+def test_timing_hooks_receive_observations():
+    seen = []
+    hook = lambda name, seconds, labels: seen.append((name, labels))  # noqa: E731
+    metrics.add_hook(hook)
+    try:
+        with metrics.STAGE_SECONDS.time(stage="mime"):
+            pass
+    finally:
+        metrics.remove_hook(hook)
+
+    assert seen == [("email_stage_seconds", {"stage": "mime"})]
+
+
+@pytest.mark.anyio
+async def test_metrics_endpoint_reports_sends(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "profiles_file", str(tmp_path / "profiles.json"))
+    monkeypatch.setattr(settings, "default_profile_id", "sender")
+    metrics.reset()
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        await client.post("/profiles", json={
+            "profile_id": "sender",
+            "smtp_host": "smtp.example.com",
+            "smtp_port": 465,
+            "smtp_user": "u@example.com",
+            "smtp_password": "pw",
+            "from_email": "u@example.com",
+        })
+        with patch("email_service.pool.SmtpPool.sendmail", new_callable=AsyncMock, return_value=({}, SMTPResponse(250, "OK"))):
+            await client.post("/email/send", json={"to": ["r@example.com"], "subject": "Hi", "text": "Hello"})
+
+        r = await client.get("/metrics")
+
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain")
+    assert 'email_sends_total{profile="sender",outcome="success"} 1' in r.text
+    assert 'email_smtp_responses_total{code="250"} 1' in r.text
+    assert 'email_stage_seconds_count{stage="mime"} 1' in r.text
+    assert "email_profile_store_load_seconds_count" in r.text
+    assert "email_sends_in_flight 0" in r.text
+
+
+@pytest.mark.anyio
+async def test_sends_and_replies_are_counted_per_recipient(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "profiles_file", str(tmp_path / "profiles.json"))
+    monkeypatch.setattr(settings, "default_profile_id", "sender")
+    metrics.reset()
+    reply = ({"b@example.com": SMTPResponse(550, "No such user")}, SMTPResponse(250, "2.0.0 Queued"))
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        await client.post("/profiles", json={
+            "profile_id": "sender", "smtp_host": "smtp.example.com", "from_email": "u@example.com",
+        })
+        with patch("email_service.pool.SmtpPool.sendmail", new_callable=AsyncMock, return_value=reply):
+            r = await client.post("/email/send", json={
+                "to": ["a@example.com", "b@example.com", "c@example.com"], "subject": "Hi", "text": "Hello",
+            })
+
+    assert r.status_code == 200
+    assert metrics.SENDS.value(profile="sender", outcome="success") == 2
+    assert metrics.SENDS.value(profile="sender", outcome="failed") == 1
+    assert metrics.SMTP_RESPONSES.value(code=250) == 2
+    assert metrics.SMTP_RESPONSES.value(code=550) == 1
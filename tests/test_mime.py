@@ -0,0 +1,135 @@
+"""
+Tests for the cached MIME builder.
+"""
+
+from email import message_from_bytes, policy
+from unittest.mock import patch
+
+import pytest
+from pydantic import ValidationError
+
+from email_service import mime, settings, Attachment, SmtpProfile, EmailMessage
+
+
+@pytest.fixture(autouse=True)
+def _empty_cache():
+    mime.clear_cache()
+    yield
+    mime.clear_cache()
+
+
+@pytest.fixture
+def profile():
+    return SmtpProfile(
+        profile_id="p",
+        smtp_host="smtp.example.com",
+        smtp_user="u@example.com",
+        smtp_password="pw",
+        from_email="news@example.com",
+        from_name="Ünïcode Néws",
+    )
+
+
+def _parse(data: bytes):
+    return message_from_bytes(data, policy=policy.default)
+
+
+def test_rendered_message_round_trips(profile):
+    message = EmailMessage(
+        to=["a@example.com", "b@example.com"],
+        subject="Grüße",
+        text="plain body\n.leading dot",
+        html="<p>héllo</p>",
+    )
+    parsed = _parse(mime.render(message, profile))
+
+    assert parsed["To"] == "a@example.com, b@example.com"
+    assert parsed["Subject"] == "Grüße"
+    assert parsed["From"].addresses[0].display_name == "Ünïcode Néws"
+    assert parsed["Message-ID"].endswith("@example.com>")
+    assert parsed.get_content_type() == "multipart/alternative"
+    text, html = parsed.iter_parts()
+    assert text.get_content().replace("\r\n", "\n") == "plain body\n.leading dot"
+    assert html.get_content() == "<p>héllo</p>"
+
+
+def test_body_is_encoded_once_per_content(profile):
+    html = "<p>newsletter</p>" * 1000
+    first = EmailMessage(to=["a@example.com"], subject="News", html=html)
+    second = EmailMessage(to=["b@example.com"], subject="News", html=html)
+
+    assert mime.prepare(first, profile) is mime.prepare(second, profile)
+    a, b = _parse(mime.render(first, profile)), _parse(mime.render(second, profile))
+    assert (a["To"], b["To"]) == ("a@example.com", "b@example.com")
+    assert a["Message-ID"] != b["Message-ID"]
+
+
+def test_templated_copies_encode_only_the_rendered_parts(profile, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "attachments_dir", str(tmp_path))
+    (tmp_path / "terms.pdf").write_bytes(b"%PDF" * 1000)
+    html = "<p>Shared layout</p>" * 100
+
+    with patch("email_service.mime._encode_part", wraps=mime._encode_part) as encode, \
+            patch("email_service.mime._attachment_part", wraps=mime._attachment_part) as frame:
+        copies = [
+            mime.render(EmailMessage(
+                to=[f"u{i}@example.com"], subject="Welcome", text=f"Hi U{i}", html=html,
+                attachments=[Attachment(path="terms.pdf")], variables={"name": f"U{i}"},
+            ), profile)
+            for i in range(5)
+        ]
+
+    assert [call.args[1] for call in encode.call_args_list].count("html") == 1
+    assert [call.args[1] for call in encode.call_args_list].count("plain") == 5
+    assert frame.call_count == 1
+    for i, data in enumerate(copies):
+        alternative, attachment = _parse(data).iter_parts()
+        text, rendered = alternative.iter_parts()
+        assert text.get_content().rstrip() == f"Hi U{i}"
+        assert rendered.get_content().rstrip() == html
+        assert attachment.get_content() == b"%PDF" * 1000
+    assert len(mime._cache) == 0
+
+
+def test_line_breaks_cannot_inject_headers(profile):
+    with pytest.raises(ValidationError, match="line breaks"):
+        EmailMessage(to=["a@example.com"], subject="hi\r\nBcc: evil@x.com", text="x")
+    with pytest.raises(ValidationError, match="line breaks"):
+        SmtpProfile(profile_id="p", smtp_host="h", from_email="a@example.com", from_name="Eve\nBcc: evil@x.com")
+
+    # Messages built without validation (batches, templates) are cleaned when encoded.
+    message = EmailMessage.model_construct(
+        to=["a@example.com"], subject="hi\r\nBcc: evil@x.com", text="x", html=None, attachments=[], variables={},
+    )
+    sender = profile.model_copy(update={"from_name": "Eve\r\nCc: evil@x.com"})
+    parsed = _parse(mime.render(message, sender))
+
+    assert parsed["Bcc"] is None and parsed["Cc"] is None
+    assert parsed["Subject"] == "hi Bcc: evil@x.com"
+    assert parsed["From"].addresses[0].display_name == "Eve Cc: evil@x.com"
+
+
+@pytest.mark.parametrize("subject", ["word " * 400, "x" * 1500, "Grüße " * 200])
+def test_long_subjects_are_folded(profile, subject):
+    data = mime.render(EmailMessage(to=["a@example.com"], subject=subject, text="x"), profile)
+    headers = data.split(b"\r\n\r\n")[0]
+
+    assert max(len(line) for line in headers.split(b"\r\n")) <= 998
+    assert " ".join(_parse(data)["Subject"].split()) == " ".join(subject.split())
+
+
+def test_long_lines_are_base64_encoded(profile):
+    message = EmailMessage(to=["a@example.com"], subject="x", html="x" * 5000)
+    data = mime.render(message, profile)
+
+    assert max(len(line) for line in data.split(b"\r\n")) <= 998
+    assert next(_parse(data).iter_parts()).get_content() == "x" * 5000
+
+
+def test_cache_is_bounded_by_bytes(profile, monkeypatch):
+    monkeypatch.setattr(settings, "mime_cache_bytes", 10_000)
+    for i in range(20):
+        mime.prepare(EmailMessage(to=["a@example.com"], subject=str(i), text="y" * 1000), profile)
+
+    assert mime._cache._bytes <= 10_000
+    assert len(mime._cache) < 20
@@ -0,0 +1,158 @@
+"""
+Tests for the durable send queue (queue mode).
+SMTP delivery is mocked at the connection pool.
+"""
+
+import asyncio
+import sqlite3
+import threading
+
+import aiosmtplib
+import pytest
+from unittest.mock import patch, AsyncMock
+
+from httpx import AsyncClient, ASGITransport
+
+from email_service import outbox, profiles, settings, SmtpProfile, EmailMessage
+from email_service.outbox import Outbox
+from main import app
+
+
+@pytest.fixture
+def sender_profile(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "profiles_file", str(tmp_path / "profiles.json"))
+    monkeypatch.setattr(settings, "queue_db", str(tmp_path / "queue.db"))
+    monkeypatch.setattr(settings, "default_profile_id", "sender")
+    profiles.add(SmtpProfile(
+        profile_id="sender",
+        smtp_host="smtp.example.com",
+        smtp_port=465,
+        smtp_user="u@example.com",
+        smtp_password="pw",
+        from_email="u@example.com",
+    ))
+    return "sender"
+
+
+async def _wait_for(queue: Outbox, job_id: str, status: str) -> dict:
+    for _ in range(200):
+        job = queue.get(job_id)
+        if job["status"] == status:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job {job_id} stuck in {job['status']}")
+
+
+def _message() -> EmailMessage:
+    return EmailMessage(to=["r@example.com"], subject="Hi", text="Hello")
+
+
+@pytest.mark.anyio
+async def test_worker_sends_queued_job(sender_profile, tmp_path):
+    queue = Outbox(tmp_path / "queue.db", workers=2)
+    queue.start()
+    try:
+        with patch("email_service.pool.SmtpPool.sendmail", new_callable=AsyncMock, return_value=({}, aiosmtplib.SMTPResponse(250, "OK"))) as mock_send:
+            job_id = await queue.enqueue(_message(), sender_profile)
+            job = await _wait_for(queue, job_id, "sent")
+        assert job["attempts"] == 1
+        mock_send.assert_called_once()
+        assert queue.stats()["sent"] == 1
+    finally:
+        await queue.stop()
+
+
+@pytest.mark.anyio
+async def test_failed_send_is_recorded(sender_profile, tmp_path):
+    queue = Outbox(tmp_path / "queue.db", workers=1)
+    queue.start()
+    try:
+        refused = aiosmtplib.SMTPDataError(554, "Message rejected")
+        with patch("email_service.pool.SmtpPool.sendmail", side_effect=refused) as mock_send:
+            job_id = await queue.enqueue(_message(), sender_profile)
+            job = await _wait_for(queue, job_id, "failed")
+        assert job["error"] == "(554, 'Message rejected')"
+        mock_send.assert_called_once()
+    finally:
+        await queue.stop()
+
+
+@pytest.mark.anyio
+async def test_transient_failure_is_retried(sender_profile, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "retry_base_delay", 0.01)
+    monkeypatch.setattr(settings, "rate_limit_cooldown", 0.0)
+    queue = Outbox(tmp_path / "queue.db", workers=1)
+    queue.start()
+    try:
+        busy = aiosmtplib.SMTPDataError(421, "Try again later")
+        with patch("email_service.pool.SmtpPool.sendmail", side_effect=[busy, ({}, aiosmtplib.SMTPResponse(250, "OK"))]) as mock_send:
+            job_id = await queue.enqueue(_message(), sender_profile)
+            job = await _wait_for(queue, job_id, "sent")
+        assert job["attempts"] == 2
+        assert mock_send.call_count == 2
+    finally:
+        await queue.stop()
+
+
+@pytest.mark.anyio
+async def test_jobs_survive_restart(sender_profile, tmp_path):
+    queue = Outbox(tmp_path / "queue.db", workers=1)
+    job_id = await queue.enqueue(_message(), sender_profile)
+    await queue.stop()  # never started: the job is only on disk
+
+    restarted = Outbox(tmp_path / "queue.db", workers=1)
+    restarted.start()
+    try:
+        with patch("email_service.pool.SmtpPool.sendmail", new_callable=AsyncMock, return_value=({}, aiosmtplib.SMTPResponse(250, "OK"))):
+            await _wait_for(restarted, job_id, "sent")
+    finally:
+        await restarted.stop()
+
+
+@pytest.mark.anyio
+async def test_backlog_is_recovered_off_the_event_loop(sender_profile, tmp_path):
+    queue = Outbox(tmp_path / "queue.db", workers=1)
+    job_ids = [await queue.enqueue(_message(), sender_profile) for _ in range(3)]
+    await queue.stop()
+    opened_in = []
+    real_connect = sqlite3.connect
+
+    def connect(*args, **kwargs):
+        opened_in.append(threading.current_thread())
+        return real_connect(*args, **kwargs)
+
+    with patch("email_service.outbox.sqlite3.connect", connect):
+        await outbox.start()
+    try:
+        assert opened_in and threading.main_thread() not in opened_in
+        with patch("email_service.pool.SmtpPool.sendmail", new_callable=AsyncMock, return_value=({}, aiosmtplib.SMTPResponse(250, "OK"))):
+            for job_id in job_ids:
+                await _wait_for(outbox.current(), job_id, "sent")
+    finally:
+        await outbox.stop()
+
+
+@pytest.mark.anyio
+async def test_queue_mode_endpoints(sender_profile):
+    await outbox.start()
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            with patch("email_service.pool.SmtpPool.sendmail", new_callable=AsyncMock, return_value=({}, aiosmtplib.SMTPResponse(250, "OK"))):
+                r = await client.post("/email/send", json={
+                    "to": ["r@example.com"], "subject": "Hi", "text": "Hello",
+                })
+                assert r.status_code == 202
+                job_id = r.json()["id"]
+                await _wait_for(outbox.current(), job_id, "sent")
+
+            r = await client.get(f"/email/{job_id}")
+            assert r.status_code == 200
+            assert r.json()["status"] == "sent"
+
+            r = await client.get("/email/queue")
+            assert r.json()["totals"] == {"sent": 1}
+
+            r = await client.get("/email/unknown")
+            assert r.status_code == 404
+    finally:
+        await outbox.stop()
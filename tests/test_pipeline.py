@@ -0,0 +1,194 @@
+"""
+Tests for per-recipient delivery over one session, with and without
+PIPELINING. Runs against a local aiosmtpd server.
+"""
+
+import aiosmtplib
+import pytest
+from unittest.mock import patch
+
+from email_service import SmtpProfile, EmailMessage, pipeline, sender
+
+
+class Handler:
+    """Accepts everything except recipients starting with 'bounce' or 'later'."""
+
+    def __init__(self, pipelining: bool):
+        self.pipelining = pipelining
+        self.messages = []
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        session.host_name = hostname
+        if self.pipelining:
+            responses.insert(-1, "250-PIPELINING")
+        return responses
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("bounce"):
+            return "550 5.1.1 No such user"
+        if address.startswith("later"):
+            return "450 4.2.1 Try again later"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((list(envelope.rcpt_tos), envelope.content))
+        return "250 Message accepted"
+
+
+@pytest.fixture(params=[True, False], ids=["pipelining", "sequential"])
+def server(request, smtp_server):
+    handler = Handler(pipelining=request.param)
+    return handler, smtp_server(handler)
+
+
+async def _session(port: int) -> aiosmtplib.SMTP:
+    smtp = aiosmtplib.SMTP(hostname="127.0.0.1", port=port, start_tls=False, timeout=5)
+    await smtp.connect()
+    await smtp.ehlo()
+    return smtp
+
+
+def _render(rcpt: str) -> bytes:
+    return f"To: {rcpt}\r\nSubject: hi\r\n\r\nHello {rcpt}\r\n.leading dot\r\n".encode()
+
+
+def test_by_domain_groups_and_deduplicates():
+    ordered = pipeline.by_domain(["b@y.com", "a@x.com", "c@y.com", "a@x.com", "d@X.com"])
+    assert ordered == ["a@x.com", "d@X.com", "b@y.com", "c@y.com"]
+
+
+def test_split_keeps_runs_contiguous():
+    assert pipeline.split(list("abcdefg"), 3, 100) == [list("abc"), list("def"), list("g")]
+    assert pipeline.split(list("abcd"), 1, 2) == [list("ab"), list("cd")]
+    assert pipeline.split([], 4, 10) == []
+
+
+@pytest.mark.anyio
+async def test_copies_delivered_individually(server):
+    handler, port = server
+    smtp = await _session(port)
+    recipients = ["a@x.com", "b@x.com", "c@y.com"]
+
+    replies = await pipeline.send_copies(smtp, "from@example.com", recipients, _render)
+    await smtp.quit()
+
+    assert [r.code for r in replies] == [250, 250, 250]
+    assert [rcpts for rcpts, _ in handler.messages] == [[r] for r in recipients]
+    # Content arrives intact: one recipient per copy, leading dot unstuffed.
+    assert handler.messages[2][1] == _render("c@y.com")
+
+
+@pytest.mark.anyio
+async def test_rejections_reported_per_address(server):
+    handler, port = server
+    smtp = await _session(port)
+    recipients = ["a@x.com", "bounce@x.com", "later@y.com", "d@y.com"]
+
+    replies = await pipeline.send_copies(smtp, "from@example.com", recipients, _render)
+
+    assert [r.code for r in replies] == [250, 550, 450, 250]
+    assert [rcpts for rcpts, _ in handler.messages] == [["a@x.com"], ["d@y.com"]]
+    # The session is still in a clean state afterwards.
+    await smtp.sendmail("from@example.com", ["e@z.com"], b"Subject: after\r\n\r\nok\r\n")
+    assert handler.messages[-1][0] == ["e@z.com"]
+    await smtp.quit()
+
+
+@pytest.mark.anyio
+async def test_pipelining_batches_round_trips(smtp_server):
+    handler = Handler(pipelining=True)
+    smtp = await _session(smtp_server(handler))
+    transport = smtp.protocol.transport
+    writes = []
+    real_write = transport.write
+    transport.write = lambda data: (writes.append(data), real_write(data))[1]
+
+    await pipeline.send_copies(smtp, "from@example.com", ["a@x.com", "b@x.com", "c@x.com"], _render)
+    session_writes = len(writes)
+    await smtp.quit()
+
+    # One write per copy (its envelope plus the previous copy's content), then the last content.
+    assert session_writes == 4
+    assert writes[1].startswith(b"To: a@x.com") and b"RCPT TO:<b@x.com>" in writes[1]
+    assert len(handler.messages) == 3
+
+
+class SizeHandler(Handler):
+    """Also records the MAIL FROM parameters."""
+
+    async def handle_MAIL(self, server, session, envelope, address, mail_options):
+        self.mail_options = mail_options
+        envelope.mail_from = address
+        return "250 OK"
+
+
+@pytest.mark.anyio
+async def test_sendmail_announces_the_size_without_copying_the_message(smtp_server):
+    handler = SizeHandler(pipelining=False)
+    smtp = await _session(smtp_server(handler))
+    data = _render("a@example.com") * 1000
+
+    with patch("email_service.pipeline.normalize_message_line_endings", wraps=pipeline.normalize_message_line_endings) as normalize:
+        refused, reply = await pipeline.sendmail(smtp, "s@example.com", ["a@example.com"], data)
+    await smtp.quit()
+
+    assert (refused, reply.code) == ({}, 250)
+    assert handler.mail_options == [f"SIZE={len(data)}"]
+    assert normalize.call_count == 0
+
+
+@pytest.mark.anyio
+async def test_pace_failure_stops_remaining_copies(server):
+    handler, port = server
+    smtp = await _session(port)
+    calls = 0
+
+    async def pace():
+        nonlocal calls
+        calls += 1
+        if calls == 3:
+            raise RuntimeError("rate limited")
+
+    replies = await pipeline.send_copies(smtp, "from@example.com", ["a@x.com", "b@x.com", "c@x.com"],
+                                         _render, pace=pace)
+    await smtp.quit()
+
+    assert [r.code for r in replies] == [250, 250, pipeline.NOT_SENT]
+    assert len(handler.messages) == 2
+
+
+# ─── Sender ───────────────────────────────────────────────────────────────────
+
+
+def _profile() -> SmtpProfile:
+    return SmtpProfile(profile_id="p", smtp_host="smtp.example.com", smtp_user="u",
+                       smtp_password="pw", from_email="from@example.com")
+
+
+@pytest.mark.anyio
+async def test_send_individual_reports_accepted_and_rejected():
+    async def fake_copies(self, sender_addr, recipients, render, *, pace=None):
+        for rcpt in recipients:
+            await pace()
+            assert render(rcpt).startswith(f"To: {rcpt}\r\n".encode())
+        return [aiosmtplib.SMTPResponse(550 if r.startswith("bounce") else 250, "x") for r in recipients]
+
+    message = EmailMessage(to=["b@y.com", "bounce@x.com", "a@x.com"], subject="Hi", text="Hello", individual=True)
+    with patch("email_service.pool.SmtpPool.send_copies", fake_copies):
+        result = await sender.send(message, _profile())
+
+    assert result["accepted"] == ["a@x.com", "b@y.com"]
+    assert result["rejected"] == {"bounce@x.com": {"code": 550, "message": "x"}}
+
+
+@pytest.mark.anyio
+async def test_send_individual_all_refused_raises():
+    async def fake_copies(self, sender_addr, recipients, render, *, pace=None):
+        return [aiosmtplib.SMTPResponse(550, "No such user") for _ in recipients]
+
+    message = EmailMessage(to=["a@x.com", "b@x.com"], subject="Hi", text="Hello", individual=True)
+    with patch("email_service.pool.SmtpPool.send_copies", fake_copies):
+        with pytest.raises(aiosmtplib.SMTPRecipientsRefused) as exc:
+            await sender.send(message, _profile())
+    assert {r.recipient for r in exc.value.recipients} == {"a@x.com", "b@x.com"}
@@ -0,0 +1,166 @@
+"""
+Tests for the per-profile SMTP connection pool.
+Uses a fake aiosmtplib.SMTP client so no network is touched.
+"""
+
+import asyncio
+
+import pytest
+from unittest.mock import patch
+
+import aiosmtplib
+
+from email_service import SmtpProfile, pool as pools, settings
+from email_service.pool import SmtpPool, get_pool, close_all
+
+
+class FakeSMTP:
+    """Stand-in for aiosmtplib.SMTP that records what happens to it."""
+
+    instances: list["FakeSMTP"] = []
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.is_connected = False
+        self.sent = []
+        self.quit_called = False
+        self.drop_next_send = False
+        FakeSMTP.instances.append(self)
+
+    async def connect(self):
+        self.is_connected = True
+
+    async def starttls(self):
+        self.tls = True
+
+    async def login(self, username, password):
+        self.username = username
+
+    async def noop(self):
+        if not self.is_connected:
+            raise aiosmtplib.SMTPServerDisconnected("gone")
+
+    async def send_message(self, mime, **kwargs):
+        if self.drop_next_send:
+            self.is_connected = False
+            raise aiosmtplib.SMTPServerDisconnected("Connection lost")
+        self.sent.append(mime)
+        return {}, "OK"
+
+    async def quit(self):
+        self.quit_called = True
+        self.is_connected = False
+
+    def close(self):
+        self.is_connected = False
+
+
+@pytest.fixture
+def fake_smtp():
+    FakeSMTP.instances = []
+    with patch("email_service.pool.aiosmtplib.SMTP", FakeSMTP):
+        yield FakeSMTP
+
+
+@pytest.fixture
+def profile():
+    return SmtpProfile(
+        profile_id="pooled",
+        smtp_host="smtp.example.com",
+        smtp_port=587,
+        smtp_user="u@example.com",
+        smtp_password="pw",
+        from_email="u@example.com",
+    )
+
+
+def _pool(profile, **overrides):
+    options = {"size": 2, "idle_timeout": 60.0, "max_messages": 100}
+    options.update(overrides)
+    return SmtpPool(profile, tls_context=None, **options)
+
+
+@pytest.mark.anyio
+async def test_connection_is_reused(fake_smtp, profile):
+    pool = _pool(profile)
+    for _ in range(3):
+        await pool.send_message("msg")
+
+    assert len(fake_smtp.instances) == 1
+    assert len(fake_smtp.instances[0].sent) == 3
+    assert fake_smtp.instances[0].tls is True
+
+
+@pytest.mark.anyio
+async def test_connection_recycled_after_max_messages(fake_smtp, profile):
+    pool = _pool(profile, max_messages=2)
+    for _ in range(3):
+        await pool.send_message("msg")
+
+    assert len(fake_smtp.instances) == 2
+    assert fake_smtp.instances[0].quit_called
+
+
+@pytest.mark.anyio
+async def test_reconnects_when_server_drops_connection(fake_smtp, profile):
+    pool = _pool(profile)
+    await pool.send_message("first")
+    fake_smtp.instances[0].drop_next_send = True
+
+    await pool.send_message("second")
+
+    assert len(fake_smtp.instances) == 2
+    assert fake_smtp.instances[1].sent == ["second"]
+
+
+@pytest.mark.anyio
+async def test_idle_connection_expires(fake_smtp, profile):
+    pool = _pool(profile, idle_timeout=0.0)
+    await pool.send_message("a")
+    await pool.send_message("b")
+
+    assert len(fake_smtp.instances) == 2
+
+
+@pytest.mark.anyio
+async def test_close_all_drains_pools(fake_smtp, profile, monkeypatch):
+    monkeypatch.setattr(settings, "smtp_pool_size", 1)
+    pool = get_pool(profile, lambda: None)
+    await pool.send_message("msg")
+    assert pool.idle_count == 1
+
+    await close_all()
+
+    assert pool.idle_count == 0
+    assert fake_smtp.instances[0].quit_called
+    with pytest.raises(RuntimeError):
+        await pool.send_message("late")
+
+
+@pytest.mark.anyio
+async def test_replaced_pool_is_closed_and_awaited_on_shutdown(fake_smtp, profile, monkeypatch):
+    monkeypatch.setattr(settings, "smtp_pool_size", 1)
+    old = get_pool(profile, lambda: None)
+    await old.send_message("msg")
+
+    new = get_pool(profile.model_copy(update={"smtp_password": "rotated"}), lambda: None)
+    assert new is not old
+    assert len(pools._closing) == 1  # kept until it is done
+
+    await close_all()
+
+    assert not pools._closing
+    assert old.idle_count == 0
+    assert fake_smtp.instances[0].quit_called
+
+
+def test_pool_replaced_without_a_loop_is_closed_on_shutdown(fake_smtp, profile):
+    old = get_pool(profile, lambda: None)
+    get_pool(profile.model_copy(update={"smtp_password": "rotated"}), lambda: None)
+    assert pools._retired == [old]
+
+    asyncio.run(close_all())
+
+    assert pools._retired == []
+    with pytest.raises(RuntimeError):
+        asyncio.run(old.send_message("late"))
@@ -0,0 +1,182 @@
+"""
+Tests for background profile probes: warm sessions opened at startup and on
+profile saves, failures reported before any message is sent, the
+keep-alive loop, bounded concurrency and the /profiles/health endpoint.
+Runs against a local aiosmtpd server.
+"""
+
+import asyncio
+import socket
+import time
+from unittest.mock import patch
+
+import aiosmtplib
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+from email_service import pool, probes, profiles, send, settings, EmailMessage, SmtpProfile
+from main import app
+
+
+class Handler:
+    """Accepts every message and counts SMTP sessions (EHLO) and NOOPs."""
+
+    def __init__(self):
+        self.connections = 0
+        self.noops = 0
+        self.delivered = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        session.host_name = hostname
+        self.connections += 1
+        return responses
+
+    async def handle_NOOP(self, server, session, envelope, arg):
+        self.noops += 1
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.delivered += 1
+        return "250 Message accepted"
+
+
+@pytest.fixture
+def setup(smtp_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "profiles_file", str(tmp_path / "profiles.json"))
+    monkeypatch.setattr(settings, "default_profile_id", "")
+    monkeypatch.setattr(settings, "probe_enabled", True)
+    monkeypatch.setattr(settings, "probe_interval", 0.0)
+    monkeypatch.setattr(settings, "probe_timeout", 5.0)
+    handler = Handler()
+    return handler, smtp_server(handler)
+
+
+@pytest.fixture(autouse=True)
+async def _close_pools():
+    yield
+    await pool.close_all()
+
+
+def _profile(profile_id: str, port: int, **fields) -> SmtpProfile:
+    return SmtpProfile(profile_id=profile_id, smtp_host="127.0.0.1", smtp_port=port, from_email="u@example.com", **fields)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _wait(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def _settled(prober) -> bool:
+    return all(r["status"] != "pending" for r in prober.status())
+
+
+@pytest.mark.anyio
+async def test_startup_warms_every_profile(setup):
+    handler, port = setup
+    for n in range(3):
+        profiles.add(_profile(f"p{n}", port))
+    profiles.add(SmtpProfile(profile_id="mx", direct=True, from_email="u@example.com"))
+
+    async with app.router.lifespan_context(app):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            await _wait(lambda: _settled(probes.current()) and len(probes.current().status()) == 3)
+            health = (await client.get("/profiles/health")).json()
+
+            # The first send reuses the session the probe opened.
+            await send(EmailMessage(to=["a@example.com"], subject="Hi", text="x"), profiles.get("p0"))
+
+    assert (health["ready"], health["failed"], health["pending"]) == (3, 0, 0)
+    assert [p["profile_id"] for p in health["profiles"]] == ["p0", "p1", "p2"]  # direct profiles are not probed
+    for result in health["profiles"]:
+        assert result["handshake_ms"] > 0 and result["dns_ms"] >= 0
+        assert result["warm_connections"] == 1 and result["error"] is None
+    assert handler.connections == 3 and handler.delivered == 1
+
+
+@pytest.mark.anyio
+async def test_failures_are_reported_before_any_send(setup):
+    handler, port = setup
+    profiles.add(_profile("down", _free_port()))
+    profiles.add(_profile("badpass", port, smtp_user="user", smtp_password="wrong"))
+
+    async def refuse_login(self, username, password, **kwargs):
+        raise aiosmtplib.SMTPAuthenticationError(535, "5.7.8 Authentication credentials invalid")
+
+    with patch("aiosmtplib.SMTP.login", refuse_login):
+        async with app.router.lifespan_context(app):
+            await _wait(lambda: _settled(probes.current()) and len(probes.current().status()) == 2)
+            results = {r["profile_id"]: r for r in probes.current().status()}
+
+    assert results["down"]["status"] == "failed" and results["down"]["error"]
+    assert results["badpass"]["status"] == "failed"
+    assert "Authentication credentials invalid" in results["badpass"]["error"]
+    assert results["badpass"]["warm_connections"] == 0
+
+
+@pytest.mark.anyio
+async def test_saved_profiles_are_probed_and_deleted_ones_forgotten(setup):
+    handler, port = setup
+    async with app.router.lifespan_context(app):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            r = await client.post("/profiles", json=_profile("new", port).model_dump())
+            assert r.status_code == 200
+            await _wait(lambda: [p["status"] for p in probes.current().status()] == ["ready"])
+            assert handler.connections == 1
+
+            await client.delete("/profiles/new")
+            assert (await client.get("/profiles/health")).json()["profiles"] == []
+
+
+@pytest.mark.anyio
+async def test_idle_sessions_are_kept_alive(setup, monkeypatch):
+    handler, port = setup
+    monkeypatch.setattr(settings, "probe_interval", 0.05)
+    monkeypatch.setattr(pool, "HEALTH_CHECK_AFTER", 0.01)
+    profiles.add(_profile("p", port))
+
+    async with app.router.lifespan_context(app):
+        await _wait(lambda: handler.noops >= 3)
+        [result] = probes.current().status()
+
+    # Every round after the first NOOPs the same connection instead of reconnecting.
+    assert handler.connections == 1
+    assert result["status"] == "ready" and result["handshake_ms"] > 0
+
+
+@pytest.mark.anyio
+async def test_probes_are_bounded_and_do_not_hold_up_startup(setup, monkeypatch):
+    handler, port = setup
+    monkeypatch.setattr(settings, "probe_concurrency", 3)
+    for n in range(12):
+        profiles.add(_profile(f"p{n:02}", port))
+    running, peak = [0], [0]
+
+    async def slow_check(profile):
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(0.05)
+        running[0] -= 1
+        return 0.001, 0.002
+
+    with patch("email_service.probes._check", slow_check):
+        async with app.router.lifespan_context(app):
+            assert [r["status"] for r in probes.current().status()] in ([], ["pending"] * 12)
+            await _wait(lambda: _settled(probes.current()) and len(probes.current().status()) == 12)
+
+    assert peak[0] == 3
+
+
+@pytest.mark.anyio
+async def test_health_endpoint_is_off_when_probes_are_disabled(setup, monkeypatch):
+    monkeypatch.setattr(settings, "probe_enabled", False)
+    async with app.router.lifespan_context(app):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            assert (await client.get("/profiles/health")).status_code == 404
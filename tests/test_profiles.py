@@ -0,0 +1,180 @@
+"""
+Tests for the in-memory profile cache, its write-through persistence, and
+the async API (non-blocking reads, coalesced writes).
+"""
+
+import asyncio
+import json
+import os
+import time
+
+import pytest
+from unittest.mock import patch
+
+from email_service import profiles, settings, SmtpProfile
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    path = tmp_path / "profiles.json"
+    monkeypatch.setattr(settings, "profiles_file", str(path))
+    monkeypatch.setattr(profiles, "STAT_INTERVAL", 0.0)
+    return path
+
+
+def _profile(profile_id: str, **overrides) -> SmtpProfile:
+    data = {
+        "profile_id": profile_id,
+        "smtp_host": "smtp.example.com",
+        "smtp_user": "u@example.com",
+        "smtp_password": "pw",
+        "from_email": "u@example.com",
+    }
+    data.update(overrides)
+    return SmtpProfile(**data)
+
+
+def test_get_is_served_from_memory(store):
+    profiles.add(_profile("cached"))
+
+    with patch("email_service.profiles._load_profiles", side_effect=AssertionError("disk read")):
+        assert profiles.get("cached").profile_id == "cached"
+        assert profiles.get("missing") is None
+
+
+def test_external_change_invalidates_cache(store):
+    profiles.add(_profile("mine"))
+    assert profiles.get("mine").smtp_host == "smtp.example.com"
+
+    # Another worker process rewrites the file.
+    data = json.loads(store.read_text())
+    data["mine"]["smtp_host"] = "smtp.other.com"
+    data["theirs"] = _profile("theirs").model_dump()
+    tmp = store.with_suffix(".new")
+    tmp.write_text(json.dumps(data))
+    os.replace(tmp, store)
+
+    assert profiles.get("mine").smtp_host == "smtp.other.com"
+    assert profiles.get("theirs") is not None
+
+
+def test_save_is_atomic_and_leaves_no_temp_files(store):
+    profiles.add(_profile("a"))
+    profiles.add(_profile("b"))
+    profiles.delete("a")
+
+    assert sorted(json.loads(store.read_text())) == ["b"]
+    assert [p.name for p in store.parent.iterdir()] == ["profiles.json"]
+
+
+def test_failed_save_keeps_previous_file(store):
+    profiles.add(_profile("a"))
+
+    with patch("email_service.jsonfile.json.dump", side_effect=OSError("disk full")):
+        with pytest.raises(OSError):
+            profiles.add(_profile("b"))
+
+    assert sorted(json.loads(store.read_text())) == ["a"]
+    assert profiles.get("b") is None
+
+
+def test_profiles_are_validated_once_when_stored(store, monkeypatch):
+    validated = []
+
+    def counting(**data):
+        validated.append(data["profile_id"])
+        return SmtpProfile(**data)
+
+    monkeypatch.setattr(profiles, "SmtpProfile", counting)
+    a = _profile("a")
+    profiles.add(a)
+    profiles.add(_profile("b"))
+    profiles.add(_profile("b", smtp_host="smtp.other.com"))
+
+    assert validated == []  # each profile was validated by its caller
+    assert profiles.get("a") is a
+
+    # A change made by another process is validated on reload, and only that record.
+    data = json.loads(store.read_text())
+    data["b"]["smtp_port"] = 465
+    store.write_text(json.dumps(data))
+    os.utime(store, (time.time() + 5, time.time() + 5))
+    assert profiles.get("b").smtp_port == 465
+    assert validated == ["b"]
+
+
+# ─── Async API ────────────────────────────────────────────────────────────────
+
+
+async def _max_loop_lag(work) -> float:
+    """Run `work` while a heartbeat measures the longest stall of the event loop."""
+    lag = 0.0
+    done = False
+
+    async def heartbeat():
+        nonlocal lag
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lag = max(lag, time.perf_counter() - start)
+
+    beat = asyncio.create_task(heartbeat())
+    await asyncio.sleep(0)
+    try:
+        await work
+    finally:
+        done = True
+        await beat
+    return lag
+
+
+@pytest.mark.anyio
+async def test_async_api_never_blocks_the_loop(store):
+    real_write = profiles.storage.jsonfile.write_atomic
+
+    def slow_write(path, data):
+        time.sleep(0.2)  # a slow disk
+        real_write(path, data)
+
+    with patch("email_service.jsonfile.write_atomic", slow_write):
+        async def work():
+            await profiles.aadd(_profile("a"))
+            await asyncio.gather(profiles.aget("a"), profiles.alist_all(), profiles.adelete("a"))
+
+        lag = await _max_loop_lag(work())
+
+    assert lag < 0.05
+    assert await profiles.aget("a") is None
+
+
+@pytest.mark.anyio
+async def test_burst_of_writes_is_one_store_write(store):
+    real_write = profiles.storage.jsonfile.write_atomic
+    writes = []
+
+    def counting_write(path, data):
+        writes.append(sorted(data))
+        real_write(path, data)
+
+    with patch("email_service.jsonfile.write_atomic", counting_write):
+        results = await asyncio.gather(
+            *(profiles.aadd(_profile(f"p{i}")) for i in range(50)),
+            profiles.adelete("p0"),
+            profiles.adelete("never-existed"),
+        )
+
+    assert len(writes) == 1
+    assert results[-2]["status"] == "deleted"
+    assert results[-1]["status"] == "not_found"
+    assert sorted(json.loads(store.read_text())) == sorted(f"p{i}" for i in range(1, 50))
+    assert profiles.get("p49") is not None
+
+
+@pytest.mark.anyio
+async def test_async_write_errors_reach_every_caller(store):
+    with patch("email_service.jsonfile.json.dump", side_effect=OSError("disk full")):
+        results = await asyncio.gather(
+            profiles.aadd(_profile("a")), profiles.aadd(_profile("b")), return_exceptions=True,
+        )
+    assert [type(r) for r in results] == [OSError, OSError]
+    assert await profiles.aget("a") is None
@@ -0,0 +1,96 @@
+"""
+Tests for per-profile rate limiting and provider throttling.
+"""
+
+import time
+
+import aiosmtplib
+import pytest
+from unittest.mock import patch, AsyncMock
+
+from httpx import AsyncClient, ASGITransport
+
+from email_service import ratelimit, settings, SmtpProfile, RateLimitExceeded
+from main import app
+
+
+def _profile(**limits) -> SmtpProfile:
+    return SmtpProfile(
+        profile_id="limited",
+        smtp_host="smtp.example.com",
+        smtp_port=465,
+        smtp_user="u@example.com",
+        smtp_password="pw",
+        from_email="u@example.com",
+        **limits,
+    )
+
+
+@pytest.mark.anyio
+async def test_bucket_spaces_out_sends():
+    profile = _profile(max_per_second=20)
+    start = time.monotonic()
+    for _ in range(25):  # burst of 20, then 5 more at 20/s
+        await ratelimit.acquire(profile, 1)
+    assert time.monotonic() - start >= 0.2
+
+
+@pytest.mark.anyio
+async def test_rejects_instead_of_waiting_when_disabled(monkeypatch):
+    monkeypatch.setattr(settings, "rate_limit_wait", False)
+    profile = _profile(max_per_second=1)
+    await ratelimit.acquire(profile, 1)
+
+    with pytest.raises(RateLimitExceeded) as exc:
+        await ratelimit.acquire(profile, 1)
+    assert 0 < exc.value.retry_after <= 1
+
+
+@pytest.mark.anyio
+async def test_recipient_and_daily_limits():
+    profile = _profile(max_recipients_per_message=2, daily_quota=3)
+
+    with pytest.raises(RateLimitExceeded) as exc:
+        await ratelimit.acquire(profile, 3)
+    assert exc.value.retry_after is None
+
+    await ratelimit.acquire(profile, 2)
+    with pytest.raises(RateLimitExceeded) as exc:
+        await ratelimit.acquire(profile, 2)
+    assert exc.value.retry_after > 0
+    assert ratelimit.state(profile)["sent_today"] == 2
+
+
+def test_provider_throttling_pauses_profile(monkeypatch):
+    monkeypatch.setattr(settings, "rate_limit_cooldown", 30.0)
+    profile = _profile()
+    ratelimit.limiter_for(profile).reserve(1)
+
+    ratelimit.record_failure(profile, aiosmtplib.SMTPDataError(421, "slow down"), 1)
+
+    state = ratelimit.state(profile)
+    assert state["paused_for"] > 29
+    assert state["sent_today"] == 0
+
+
+@pytest.mark.anyio
+async def test_api_returns_429_and_reports_state(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "profiles_file", str(tmp_path / "profiles.json"))
+    monkeypatch.setattr(settings, "default_profile_id", "limited")
+    monkeypatch.setattr(settings, "rate_limit_wait", False)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        await client.post("/profiles", json=_profile(max_per_second=1).model_dump())
+        email = {"to": ["r@example.com"], "subject": "Hi", "text": "Hello"}
+
+        with patch("email_service.pool.SmtpPool.sendmail", new_callable=AsyncMock, return_value=({}, aiosmtplib.SMTPResponse(250, "OK"))) as mock_send:
+            assert (await client.post("/email/send", json=email)).status_code == 200
+            r = await client.post("/email/send", json=email)
+        assert r.status_code == 429
+        assert int(r.headers["Retry-After"]) >= 1
+        mock_send.assert_called_once()
+
+        r = await client.get("/profiles/limited/rate-limit")
+        assert r.status_code == 200
+        assert r.json()["max_per_second"] == 1
+        assert r.json()["sent_today"] == 1
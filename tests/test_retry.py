@@ -0,0 +1,76 @@
+"""
+Tests for SMTP failure classification and the retry scheduler.
+"""
+
+import asyncio
+
+import aiosmtplib
+import pytest
+from unittest.mock import AsyncMock
+
+from email_service import retry, settings
+from email_service.retry import RetryScheduler, classify, TRANSIENT, PERMANENT
+
+
+@pytest.mark.parametrize("exc, expected", [
+    (aiosmtplib.SMTPDataError(421, "try again later"), TRANSIENT),
+    (aiosmtplib.SMTPSenderRefused(451, "greylisted", "me@example.com"), TRANSIENT),
+    (aiosmtplib.SMTPDataError(554, "rejected"), PERMANENT),
+    (aiosmtplib.SMTPAuthenticationError(535, "bad credentials"), PERMANENT),
+    (aiosmtplib.SMTPServerDisconnected("lost"), TRANSIENT),
+    (aiosmtplib.SMTPConnectTimeoutError("timeout"), TRANSIENT),
+    (ConnectionResetError(), TRANSIENT),
+    (aiosmtplib.SMTPRecipientsRefused([aiosmtplib.SMTPRecipientRefused(550, "unknown", "a@x.com")]), PERMANENT),
+    (aiosmtplib.SMTPRecipientsRefused([aiosmtplib.SMTPRecipientRefused(452, "full", "a@x.com")]), TRANSIENT),
+    (ValueError("bad address"), PERMANENT),
+])
+def test_classify(exc, expected):
+    assert classify(exc) == expected
+
+
+def test_backoff_is_capped(monkeypatch):
+    monkeypatch.setattr(settings, "retry_base_delay", 1.0)
+    monkeypatch.setattr(settings, "retry_max_delay", 10.0)
+    assert all(0 <= retry.backoff(n) <= 10.0 for n in range(1, 30))
+
+
+@pytest.mark.anyio
+async def test_scheduler_fires_in_due_order():
+    scheduler = RetryScheduler()
+    fired = []
+    scheduler.call_later(0.03, fired.append, "late")
+    scheduler.call_later(0.01, fired.append, "early")
+    scheduler.call_later(0.0, fired.append, "now")
+
+    await asyncio.sleep(0.06)
+    await scheduler.close()
+
+    assert fired == ["now", "early", "late"]
+
+
+@pytest.mark.anyio
+async def test_run_retries_transient_then_succeeds(monkeypatch):
+    monkeypatch.setattr(settings, "retry_base_delay", 0.001)
+    fn = AsyncMock(side_effect=[aiosmtplib.SMTPServerDisconnected("lost"), "ok"])
+
+    assert await retry.run(fn, attempts=3) == "ok"
+    assert fn.call_count == 2
+
+
+@pytest.mark.anyio
+async def test_run_fails_fast_on_permanent():
+    fn = AsyncMock(side_effect=aiosmtplib.SMTPDataError(550, "no"))
+
+    with pytest.raises(aiosmtplib.SMTPDataError):
+        await retry.run(fn, attempts=5)
+    assert fn.call_count == 1
+
+
+@pytest.mark.anyio
+async def test_run_caps_attempts(monkeypatch):
+    monkeypatch.setattr(settings, "retry_base_delay", 0.001)
+    fn = AsyncMock(side_effect=aiosmtplib.SMTPDataError(421, "busy"))
+
+    with pytest.raises(aiosmtplib.SMTPDataError):
+        await retry.run(fn, attempts=3)
+    assert fn.call_count == 3
@@ -0,0 +1,259 @@
+"""
+Tests for the send scheduler: in-flight limits per SMTP host and profile,
+strict priority between classes, weighted fair sharing between profiles,
+bounded queues, and its use by the sender and the API. SMTP delivery is
+mocked at the connection pool.
+"""
+
+import asyncio
+from unittest.mock import patch
+
+import pytest
+from aiosmtplib import SMTPResponse
+from httpx import AsyncClient, ASGITransport
+
+from email_service import metrics, profiles, scheduler, settings, send, EmailBatch, EmailMessage, SmtpProfile
+from email_service.scheduler import QueueFull, Scheduler
+from main import app
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    monkeypatch.setattr(settings, "send_host_concurrency", 1)
+    monkeypatch.setattr(settings, "send_profile_concurrency", 10)
+    monkeypatch.setattr(settings, "send_queue_size", 1000)
+    monkeypatch.setattr(settings, "send_max_wait", 5.0)
+    scheduler.reset()
+    yield
+    scheduler.reset()
+
+
+def _profile(profile_id: str, host: str = "smtp.example.com", **fields) -> SmtpProfile:
+    return SmtpProfile(profile_id=profile_id, smtp_host=host, from_email="u@example.com", **fields)
+
+
+async def _settle() -> None:
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def _pass_through(sched: Scheduler, profile: SmtpProfile) -> None:
+    async with sched.slot(profile, "transactional"):
+        pass
+
+
+async def _grant_order(sched: Scheduler, waiters: list[tuple[SmtpProfile, str]]) -> list[str]:
+    """Queue `waiters` behind a held slot, release it, and return who was served in which order."""
+    order: list[str] = []
+    gate = asyncio.Event()
+
+    async def blocker():
+        async with sched.slot(waiters[0][0]):
+            await gate.wait()
+
+    async def waiter(profile, priority):
+        async with sched.slot(profile, priority):
+            order.append(f"{profile.profile_id}:{priority}")
+            await asyncio.sleep(0)
+
+    held = asyncio.create_task(blocker())
+    await _settle()
+    tasks = []
+    for profile, priority in waiters:
+        tasks.append(asyncio.create_task(waiter(profile, priority)))
+        await _settle()
+    gate.set()
+    await asyncio.gather(held, *tasks)
+    return order
+
+
+# ─── Limits ──────────────────────────────────────────────────────────────────
+
+
+async def _peak(sched: Scheduler, profile_list: list[SmtpProfile], sends_each: int) -> dict:
+    running: dict[str, int] = {}
+    peak: dict[str, int] = {}
+
+    async def one(profile):
+        async with sched.slot(profile):
+            for key in (profile.smtp_host, profile.profile_id):
+                running[key] = running.get(key, 0) + 1
+                peak[key] = max(peak.get(key, 0), running[key])
+            await asyncio.sleep(0.005)
+            for key in (profile.smtp_host, profile.profile_id):
+                running[key] -= 1
+
+    await asyncio.gather(*(one(p) for p in profile_list for _ in range(sends_each)))
+    return peak
+
+
+@pytest.mark.anyio
+async def test_profiles_on_one_host_share_its_limit(monkeypatch):
+    monkeypatch.setattr(settings, "send_host_concurrency", 3)
+    peak = await _peak(Scheduler(), [_profile(f"p{n}") for n in range(5)] + [_profile("other", "smtp.other.com")], 8)
+    assert peak["smtp.example.com"] == 3
+    assert peak["smtp.other.com"] == 3  # its own limit, not held back by the busy host
+
+
+@pytest.mark.anyio
+async def test_profile_limit(monkeypatch):
+    monkeypatch.setattr(settings, "send_host_concurrency", 100)
+    monkeypatch.setattr(settings, "send_profile_concurrency", 2)
+    peak = await _peak(Scheduler(), [_profile("a"), _profile("b", max_in_flight=4)], 10)
+    assert peak["a"] == 2
+    assert peak["b"] == 4
+
+
+@pytest.mark.anyio
+async def test_direct_profiles_have_no_host_limit():
+    direct = SmtpProfile(profile_id="mx", direct=True, from_email="u@example.com")
+    peak = await _peak(Scheduler(), [direct], 6)
+    assert peak["mx"] == 6
+
+
+# ─── Ordering ────────────────────────────────────────────────────────────────
+
+
+@pytest.mark.anyio
+async def test_transactional_goes_before_bulk():
+    a, b = _profile("a"), _profile("b")
+    order = await _grant_order(Scheduler(), [(a, "bulk"), (b, "bulk"), (a, "transactional"), (b, "transactional")])
+    assert order[:2] == ["a:transactional", "b:transactional"]
+    assert sorted(order[2:]) == ["a:bulk", "b:bulk"]
+
+
+@pytest.mark.anyio
+async def test_a_burst_does_not_starve_other_profiles():
+    burst, quiet = _profile("burst"), _profile("quiet")
+    order = await _grant_order(Scheduler(), [(burst, "bulk")] * 10 + [(quiet, "bulk")] * 2)
+    # The quiet profile arrived last but is served within the first few slots.
+    served = [name.split(":")[0] for name in order]
+    assert served.index("quiet") <= 2
+    assert served[:5].count("quiet") == 2
+
+
+@pytest.mark.anyio
+async def test_weights_split_a_busy_host():
+    heavy, light = _profile("heavy", weight=2), _profile("light")
+    order = await _grant_order(Scheduler(), [(heavy, "bulk")] * 10 + [(light, "bulk")] * 10)
+    served = [name.split(":")[0] for name in order[:9]]
+    assert served.count("heavy") == 6
+    assert served.count("light") == 3
+
+
+# ─── Backpressure ────────────────────────────────────────────────────────────
+
+
+@pytest.mark.anyio
+async def test_full_queue_is_refused(monkeypatch):
+    monkeypatch.setattr(settings, "send_queue_size", 2)
+    sched, profile = Scheduler(), _profile("a")
+    gate = asyncio.Event()
+
+    async def hold():
+        async with sched.slot(profile, "bulk"):
+            await gate.wait()
+
+    tasks = [asyncio.create_task(hold()) for _ in range(3)]
+    await _settle()
+    with pytest.raises(QueueFull) as refused:
+        async with sched.slot(profile, "bulk"):
+            pass
+    assert refused.value.retry_after is not None
+    # Bulk being full does not hold back transactional mail.
+    transactional = asyncio.create_task(_pass_through(sched, profile))
+    await _settle()
+    gate.set()
+    await asyncio.gather(*tasks, transactional)
+
+
+@pytest.mark.anyio
+async def test_long_wait_is_refused_and_slots_are_not_leaked(monkeypatch):
+    monkeypatch.setattr(settings, "send_max_wait", 0.05)
+    sched, profile = Scheduler(), _profile("a")
+    gate = asyncio.Event()
+
+    async def hold():
+        async with sched.slot(profile):
+            await gate.wait()
+
+    held = asyncio.create_task(hold())
+    await _settle()
+    with pytest.raises(QueueFull):
+        async with sched.slot(profile):
+            pass
+    cancelled = asyncio.create_task(_pass_through(sched, profile))
+    await _settle()
+    cancelled.cancel()
+    gate.set()
+    await asyncio.gather(held, cancelled, return_exceptions=True)
+
+    [host] = sched.stats()
+    assert host["in_flight"] == 0
+    assert host["queued"] == {"transactional": 0, "bulk": 0}
+    async with sched.slot(profile):
+        pass
+
+
+# ─── Sender and API ──────────────────────────────────────────────────────────
+
+
+@pytest.mark.anyio
+async def test_sends_through_profiles_on_one_host_are_limited(monkeypatch):
+    monkeypatch.setattr(settings, "send_host_concurrency", 2)
+    running, peak = [0], [0]
+
+    async def fake_sendmail(self, *args, **kwargs):
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(0.01)
+        running[0] -= 1
+        return {}, SMTPResponse(250, "OK")
+
+    metrics.reset()
+    message = EmailMessage(to=["a@example.com"], subject="Hi", text="x")
+    with patch("email_service.pool.SmtpPool.sendmail", fake_sendmail):
+        await asyncio.gather(*(send(message, _profile(f"p{n % 4}")) for n in range(12)))
+    assert peak[0] == 2
+    assert metrics.SEND_QUEUE_WAIT.count(priority="transactional") == 12
+    assert metrics.SEND_SECONDS.count(priority="transactional") == 12
+
+
+def test_batch_messages_are_bulk_unless_they_say_otherwise():
+    batch = EmailBatch(
+        messages=[{"to": ["a@example.com"], "text": "x"}, {"to": ["b@example.com"], "text": "x", "priority": "transactional"}],
+        recipients=["c@example.com"], subject="Hi", text="x",
+    )
+    assert [m.priority for m in batch.expand()] == ["bulk", "transactional", "bulk"]
+    urgent = EmailBatch(recipients=["c@example.com"], text="x", priority="transactional")
+    assert [m.priority for m in urgent.expand()] == ["transactional"]
+
+
+@pytest.mark.anyio
+async def test_api_answers_429_when_the_queue_is_full(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "profiles_file", str(tmp_path / "profiles.json"))
+    monkeypatch.setattr(settings, "default_profile_id", "sender")
+    monkeypatch.setattr(settings, "default_group", "")
+    monkeypatch.setattr(settings, "send_queue_size", 0)
+    profile = _profile("sender")
+    profiles.add(profile)
+
+    gate = asyncio.Event()
+
+    async def hold():
+        async with scheduler.slot(profile):
+            await gate.wait()
+
+    held = asyncio.create_task(hold())
+    await _settle()
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        r = await client.post("/email/send", json={"to": ["a@example.com"], "subject": "Hi", "text": "x"})
+        stats = (await client.get("/email/scheduler")).json()
+    gate.set()
+    await held
+
+    assert r.status_code == 429
+    assert "Retry-After" in r.headers
+    [host] = stats["hosts"]
+    assert host["host"] == "smtp.example.com" and host["in_flight"] == 1
+    assert host["profiles"]["sender"]["in_flight"] == 1
@@ -0,0 +1,51 @@
+"""
+Tests for the sender internals: SSL context caching.
+"""
+
+import ssl
+
+import pytest
+
+from email_service import sender, SmtpProfile
+
+
+@pytest.fixture(autouse=True)
+def _empty_context_cache(monkeypatch):
+    monkeypatch.setattr(sender, "_ssl_contexts", {})
+
+
+def _profile(profile_id: str, **overrides) -> SmtpProfile:
+    data = {
+        "profile_id": profile_id,
+        "smtp_host": "smtp.example.com",
+        "smtp_user": "u@example.com",
+        "smtp_password": "pw",
+        "from_email": "u@example.com",
+    }
+    data.update(overrides)
+    return SmtpProfile(**data)
+
+
+def test_ssl_context_shared_per_host():
+    first = sender._ssl_context_for(_profile("a"))
+    second = sender._ssl_context_for(_profile("b"))
+    other_host = sender._ssl_context_for(_profile("c", smtp_host="smtp.other.com"))
+
+    assert first is second
+    assert first is not other_host
+    assert first.verify_mode == ssl.CERT_REQUIRED
+
+
+def test_unverified_context_is_separate():
+    verified = sender._ssl_context_for(_profile("a"))
+    unverified = sender._ssl_context_for(_profile("b", verify_ssl=False))
+
+    assert verified is not unverified
+    assert unverified.verify_mode == ssl.CERT_NONE
+    assert not unverified.check_hostname
+
+
+def test_custom_ca_bundle_is_loaded(tmp_path):
+    missing = tmp_path / "missing-ca.pem"
+    with pytest.raises(FileNotFoundError):
+        sender._ssl_context_for(_profile("a", ca_file=str(missing)))
@@ -0,0 +1,137 @@
+"""
+Tests for sequences of messages over one SMTP session: connection reuse,
+RSET after a refused message, rotation by message count and bytes, and
+dropping a connection left mid-transaction. Runs against a local aiosmtpd
+server.
+"""
+
+import pytest
+
+from email_service import EmailMessage, SmtpProfile, pool, send_sequence, settings
+
+
+class Handler:
+    """Accepts everything except recipients starting with 'bounce'; counts sessions."""
+
+    def __init__(self):
+        self.connections = 0
+        self.resets = 0
+        self.delivered = []
+        self.sizes = []
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        session.host_name = hostname
+        self.connections += 1
+        return responses
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("bounce"):
+            return "550 5.1.1 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_RSET(self, server, session, envelope):
+        self.resets += 1
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.delivered.append(envelope.rcpt_tos[0])
+        self.sizes.append(len(envelope.original_content))
+        return "250 Message accepted"
+
+
+@pytest.fixture
+def server(smtp_server):
+    handler = Handler()
+    port = smtp_server(handler)
+    profile = SmtpProfile(profile_id="seq", smtp_host="127.0.0.1", smtp_port=port, from_email="news@example.com")
+    yield handler, profile
+
+
+@pytest.fixture(autouse=True)
+async def _close_pools():
+    yield
+    await pool.close_all()
+
+
+def _messages(*recipients: str, text: str = "Hello") -> list[EmailMessage]:
+    return [EmailMessage(to=[rcpt], subject="Hi", text=text) for rcpt in recipients]
+
+
+async def _collect(messages, profile) -> list[dict]:
+    return [result async for result in send_sequence(messages, profile)]
+
+
+@pytest.mark.anyio
+async def test_sequence_uses_one_session(server):
+    handler, profile = server
+    results = await _collect(_messages(*(f"user{i}@example.com" for i in range(10))), profile)
+
+    assert [r["index"] for r in results] == list(range(10))
+    assert all(r["status"] == "success" for r in results)
+    assert handler.connections == 1
+    assert handler.delivered == [f"user{i}@example.com" for i in range(10)]
+
+
+@pytest.mark.anyio
+async def test_refused_message_is_reset_and_session_continues(server):
+    handler, profile = server
+    results = await _collect(_messages("a@example.com", "bounce@example.com", "b@example.com"), profile)
+
+    assert [r["status"] for r in results] == ["success", "failed", "success"]
+    assert results[1]["rejected"]["bounce@example.com"]["code"] == 550
+    assert handler.resets >= 1
+    assert handler.connections == 1
+    assert handler.delivered == ["a@example.com", "b@example.com"]
+
+
+@pytest.mark.anyio
+async def test_rotates_after_max_messages(server, monkeypatch):
+    handler, profile = server
+    monkeypatch.setattr(settings, "smtp_pool_max_messages", 3)
+    await _collect(_messages(*(f"user{i}@example.com" for i in range(7))), profile)
+
+    assert len(handler.delivered) == 7
+    assert handler.connections == 3
+
+
+@pytest.mark.anyio
+async def test_rotates_after_max_bytes(server, monkeypatch):
+    handler, profile = server
+    messages = _messages(*(f"user{i}@example.com" for i in range(6)), text="x" * 2000)
+    await _collect(messages[:1], profile)
+    await pool.close_all()
+    size, handler.connections = handler.sizes[0], 0
+
+    # Room for two and a half messages: each connection carries three.
+    monkeypatch.setattr(settings, "smtp_pool_max_bytes", size * 5 // 2)
+    await _collect(messages, profile)
+
+    assert len(handler.delivered) == 7
+    assert handler.connections == 2
+
+
+@pytest.mark.anyio
+async def test_connection_left_mid_data_is_dropped(server):
+    handler, profile = server
+    smtp_pool = pool.get_pool(profile, lambda: None)
+
+    async def broken_stream():
+        yield b"Subject: half\r\n\r\n"
+        raise OSError("attachment vanished")
+
+    async with smtp_pool.session() as session:
+        with pytest.raises(OSError):
+            await session.send_stream(profile.from_email, ["a@example.com"], broken_stream)
+        await session.sendmail(profile.from_email, ["b@example.com"], b"Subject: ok\r\n\r\nfine\r\n")
+
+    assert handler.delivered == ["b@example.com"]
+    assert handler.connections == 2
+    assert smtp_pool.idle_count == 1
+
+
+@pytest.mark.anyio
+async def test_direct_profiles_are_refused():
+    profile = SmtpProfile(profile_id="mx", direct=True, from_email="news@example.com")
+    with pytest.raises(ValueError, match="relay"):
+        await _collect(_messages("a@example.com"), profile)
@@ -0,0 +1,257 @@
+"""
+Tests for the outbound spool: the on-disk format (group commit, torn tails,
+segments and the cursor), spooling from /email/send while the relay is down,
+and in-order, rate-limited replay once it recovers. SMTP delivery is mocked
+at the connection pool.
+"""
+
+import asyncio
+import os
+import time
+from unittest.mock import AsyncMock, patch
+
+import aiosmtplib
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+from email_service import metrics, profiles, settings, spool, EmailMessage, SmtpProfile
+from email_service.spool import Spool
+from main import app
+
+
+@pytest.fixture
+def directory(tmp_path):
+    return tmp_path / "spool"
+
+
+@pytest.fixture
+def sender_profile(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "profiles_file", str(tmp_path / "profiles.json"))
+    monkeypatch.setattr(settings, "default_profile_id", "sender")
+    monkeypatch.setattr(settings, "spool_dir", str(tmp_path / "spool"))
+    monkeypatch.setattr(settings, "spool_replay_rate", 0.0)
+    monkeypatch.setattr(settings, "retry_inline_attempts", 1)
+    monkeypatch.setattr(settings, "rate_limit_cooldown", 0.0)
+    profiles.add(SmtpProfile(profile_id="sender", smtp_host="smtp.example.com", from_email="u@example.com"))
+    return "sender"
+
+
+def _message(n: int) -> EmailMessage:
+    return EmailMessage(to=[f"user{n}@example.com"], subject=f"Message {n}", text="Hello")
+
+
+def _open(directory, **options) -> Spool:
+    return Spool(directory, segment_bytes=options.get("segment_bytes", 1 << 20), replay_rate=0.0)
+
+
+def _drain(store: Spool) -> list[str]:
+    subjects = []
+    while (item := store._next()) is not None:
+        record, position = item
+        if record is not None:  # None: a corrupt record, skipped
+            subjects.append(record["message"]["subject"])
+        store._advance(position)
+    return subjects
+
+
+# ─── On-disk format ───────────────────────────────────────────────────────────
+
+
+@pytest.mark.anyio
+async def test_concurrent_appends_share_one_fsync(directory):
+    store = _open(directory)
+    syncs = []
+    real_fsync = os.fsync
+
+    def slow_fsync(fd):
+        syncs.append(fd)
+        time.sleep(0.02)
+        real_fsync(fd)
+
+    with patch("email_service.spool.os.fsync", slow_fsync):
+        await store.append(_message(0), "sender")
+        await asyncio.gather(*(store.append(_message(n), "sender") for n in range(1, 51)))
+    await store.stop()
+
+    # The first append, then everything that queued behind it in one batch.
+    assert len(syncs) <= 3
+    reopened = _open(directory)
+    assert reopened.depth == 51
+    assert _drain(reopened) == [f"Message {n}" for n in range(51)]
+    await reopened.stop()
+
+
+@pytest.mark.anyio
+async def test_torn_tail_is_cut_off_on_open(directory):
+    store = _open(directory)
+    for n in range(3):
+        await store.append(_message(n), "sender")
+    await store.stop()
+
+    segment = next(directory.glob("*.spool"))
+    intact = segment.stat().st_size
+    with open(segment, "ab") as f:
+        f.write(spool.encode("torn", _message(9), "sender")[:-5])  # crash mid-write
+
+    store = _open(directory)
+    assert store.depth == 3
+    assert segment.stat().st_size == intact
+    await store.append(_message(3), "sender")
+    assert _drain(store) == ["Message 0", "Message 1", "Message 2", "Message 3"]
+    await store.stop()
+
+
+@pytest.mark.anyio
+async def test_segments_roll_and_are_deleted_behind_the_cursor(directory):
+    store = _open(directory, segment_bytes=600)
+    for n in range(10):
+        await store.append(_message(n), "sender")
+    assert len(list(directory.glob("*.spool"))) > 3
+
+    for _ in range(5):
+        record, position = store._next()
+        store._advance(position)
+    await store.stop()
+
+    # A restart resumes after the last message done with.
+    store = _open(directory, segment_bytes=600)
+    assert store.depth == 5
+    assert _drain(store) == [f"Message {n}" for n in range(5, 10)]
+    assert len(list(directory.glob("*.spool"))) == 1
+    await store.stop()
+
+
+@pytest.mark.anyio
+async def test_replay_skips_a_corrupt_record_and_resyncs(directory):
+    store = _open(directory, segment_bytes=1000)
+    for n in range(8):
+        await store.append(_message(n), "sender")
+    await store.stop()
+
+    first = min(directory.glob("*.spool"))
+    data = bytearray(first.read_bytes())
+    second = data.index(b'{"id":', data.index(b'{"id":') + 1)
+    data[second + 40] ^= 0xFF  # bit rot in the second record of a sealed segment
+    first.write_bytes(bytes(data))
+    metrics.reset()
+
+    store = _open(directory, segment_bytes=1000)
+    assert store.depth == 8
+    with patch.object(Spool, "_send", AsyncMock()) as send:
+        store.start()
+        await _wait(lambda: store.depth == 0)
+        await store.stop()
+
+    subjects = [call.args[1].subject for call in send.call_args_list]
+    assert subjects == [f"Message {n}" for n in range(8) if n != 1]
+    assert metrics.SPOOL_RECORDS.value(event="corrupt") == 1
+    assert metrics.SPOOL_RECORDS.value(event="replayed") == 7
+    assert metrics.SPOOL_DEPTH.value() == 0
+    assert store.stats()["corrupt"] == 1
+
+
+@pytest.mark.anyio
+async def test_appends_are_refused_once_stopping(directory):
+    store = _open(directory)
+    await store.append(_message(0), "sender")
+    await store.stop()
+
+    with pytest.raises(spool.SpoolClosed):
+        await store.append(_message(1), "sender")
+    await store.stop()
+    assert _open(directory).depth == 1
+
+
+# ─── API and replay ───────────────────────────────────────────────────────────
+
+
+def _relay(delivered: list, down: dict):
+    async def fake_sendmail(self, sender_addr, recipients, data, **kwargs):
+        if down["value"]:
+            raise aiosmtplib.SMTPConnectError("Connection refused")
+        delivered.append(recipients[0])
+        return {}, aiosmtplib.SMTPResponse(250, "OK")
+    return fake_sendmail
+
+
+async def _wait(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.anyio
+async def test_relay_outage_spools_and_replays_in_order(sender_profile, monkeypatch):
+    delivered, down = [], {"value": True}
+    monkeypatch.setattr("email_service.retry.backoff", lambda attempt: 0.05)
+    with patch("email_service.pool.SmtpPool.sendmail", _relay(delivered, down)):
+        async with app.router.lifespan_context(app):
+            async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+                responses = [
+                    await client.post("/email/send", json={"to": [f"user{n}@example.com"], "subject": "Hi", "text": "x"})
+                    for n in range(5)
+                ]
+                assert [r.status_code for r in responses] == [202] * 5
+                assert {r.json()["status"] for r in responses} == {"spooled"}
+                await asyncio.sleep(0.1)
+                assert delivered == []
+                assert (await client.get("/email/spool")).json()["depth"] == 5
+
+                down["value"] = False
+                await _wait(lambda: len(delivered) == 5)
+                stats = (await client.get("/email/spool")).json()
+
+    assert delivered == [f"user{n}@example.com" for n in range(5)]
+    assert stats["depth"] == 0 and stats["replayed"] == 5
+
+
+@pytest.mark.anyio
+async def test_replay_is_rate_limited(sender_profile, monkeypatch):
+    monkeypatch.setattr(settings, "spool_replay_rate", 20.0)
+    delivered, down = [], {"value": False}
+    with patch("email_service.pool.SmtpPool.sendmail", _relay(delivered, down)):
+        async with app.router.lifespan_context(app):
+            store = spool.current()
+            for n in range(6):
+                await store.append(_message(n), "sender")
+            start = time.monotonic()
+            await _wait(lambda: len(delivered) == 6)
+            elapsed = time.monotonic() - start
+    assert elapsed >= 5 / 20
+
+
+@pytest.mark.anyio
+async def test_permanent_failures_are_not_spooled(sender_profile):
+    refused = aiosmtplib.SMTPResponseException(554, "Rejected")
+
+    async def fake_sendmail(self, *args, **kwargs):
+        raise refused
+
+    with patch("email_service.pool.SmtpPool.sendmail", fake_sendmail):
+        async with app.router.lifespan_context(app):
+            async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+                r = await client.post("/email/send", json={"to": ["a@example.com"], "subject": "Hi", "text": "x"})
+                assert r.status_code == 502
+                assert (await client.get("/email/spool")).json()["spooled"] == 0
+
+
+@pytest.mark.anyio
+async def test_stopped_spool_answers_as_if_there_were_none(sender_profile):
+    async def fake_sendmail(self, *args, **kwargs):
+        raise aiosmtplib.SMTPConnectError("Connection refused")
+
+    with patch("email_service.pool.SmtpPool.sendmail", fake_sendmail):
+        async with app.router.lifespan_context(app):
+            await spool.current().stop()  # shutdown has begun
+            async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+                r = await client.post("/email/send", json={"to": ["a@example.com"], "subject": "Hi", "text": "x"})
+    assert r.status_code == 503
+
+
+@pytest.mark.anyio
+async def test_spool_disabled_by_default(sender_profile, monkeypatch):
+    monkeypatch.setattr(settings, "spool_dir", "")
+    async with app.router.lifespan_context(app):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            assert (await client.get("/email/spool")).status_code == 404
@@ -0,0 +1,88 @@
+"""
+Tests for cold start: importing the package stays cheap, heavy dependencies
+load on first use, and the server answers its first request within budget.
+Each check runs in a fresh interpreter (see benchmarks/bench_startup.py).
+"""
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Budgets have headroom over benchmarks/bench_startup.py for slow CI machines.
+IMPORT_BUDGET_MS = 50
+FIRST_200_BUDGET_S = 5.0
+
+
+def _run(code: str, tmp_path: Path, *flags: str) -> subprocess.CompletedProcess:
+    env = {**os.environ, "PYTHONPATH": str(ROOT), "PROFILES_FILE": str(tmp_path / "profiles.json")}
+    return subprocess.run(
+        [sys.executable, *flags, "-c", code], cwd=tmp_path, env=env, capture_output=True, text=True, check=True,
+    )
+
+
+def _modules_after(statement: str, tmp_path: Path) -> set[str]:
+    code = f"import json, sys; before = set(sys.modules); {statement}; print(json.dumps(sorted(set(sys.modules) - before)))"
+    return set(json.loads(_run(code, tmp_path).stdout))
+
+
+def test_package_import_is_lazy(tmp_path):
+    assert _modules_after("import email_service", tmp_path) == {"email_service"}
+
+
+def test_package_import_time_within_budget(tmp_path):
+    stderr = _run("import email_service", tmp_path, "-X", "importtime").stderr
+    line = next(line for line in stderr.splitlines() if line.endswith("| email_service"))
+    cumulative_us = int(line.split("|")[1])
+    assert cumulative_us / 1000 < IMPORT_BUDGET_MS
+
+
+def test_profiles_do_not_load_smtp_or_settings(tmp_path):
+    loaded = _modules_after("from email_service import profiles", tmp_path)
+    assert "email_service.profiles" in loaded
+    assert not {"aiosmtplib", "pydantic_settings", "dns", "email_validator", "email_service.sender"} & loaded
+
+
+def test_settings_load_on_first_use(tmp_path):
+    (tmp_path / ".env").write_text("SMTP_POOL_SIZE=7\n")
+    code = (
+        "import sys; from email_service import settings; "
+        "assert 'pydantic_settings' not in sys.modules; print(settings.smtp_pool_size)"
+    )
+    assert _run(code, tmp_path).stdout.strip() == "7"
+
+
+def test_lazy_exports_resolve():
+    import email_service
+    from email_service import models, sender
+
+    assert email_service.send is sender.send
+    assert email_service.SmtpProfile is models.SmtpProfile
+    assert set(email_service.__all__) <= set(dir(email_service))
+    with pytest.raises(AttributeError):
+        email_service.missing
+
+
+FIRST_200 = """
+import asyncio, time
+start = time.perf_counter()
+from httpx import AsyncClient, ASGITransport
+import main
+
+async def first():
+    async with main.app.router.lifespan_context(main.app):
+        async with AsyncClient(transport=ASGITransport(app=main.app), base_url="http://test") as client:
+            return (await client.get("/")).status_code
+
+assert asyncio.run(first()) == 200
+print(time.perf_counter() - start)
+"""
+
+
+def test_first_200_within_budget(tmp_path):
+    assert float(_run(FIRST_200, tmp_path).stdout.split()[-1]) < FIRST_200_BUDGET_S
@@ -0,0 +1,163 @@
+"""
+Tests for the profile store backends (JSON and SQLite), the JSON import into
+SQLite, and a stress test with several processes doing CRUD and sends on one
+shared store.
+"""
+
+import asyncio
+import json
+import multiprocessing
+import sqlite3
+
+import pytest
+
+from email_service import pool, profiles, sender, settings, storage, EmailMessage, SmtpProfile
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def backend(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "profile_store", request.param)
+    monkeypatch.setattr(settings, "profiles_file", str(tmp_path / "profiles.json"))
+    monkeypatch.setattr(settings, "profiles_db", str(tmp_path / "profiles.db"))
+    monkeypatch.setattr(profiles, "STAT_INTERVAL", 0.0)
+    yield request.param
+    current = storage._store
+    if current is not None and isinstance(current[1], storage.SqliteStore):
+        current[1].close()
+
+
+def _profile(profile_id: str, port: int = 25, **overrides) -> SmtpProfile:
+    data = {
+        "profile_id": profile_id,
+        "smtp_host": "127.0.0.1",
+        "smtp_port": port,
+        "from_email": "news@example.com",
+    }
+    data.update(overrides)
+    return SmtpProfile(**data)
+
+
+def test_crud(backend):
+    profiles.add(_profile("a"))
+    profiles.add(_profile("b"))
+    profiles.add(_profile("a", from_name="Renamed"))
+
+    assert profiles.get("a").from_name == "Renamed"
+    assert profiles.delete("b")["status"] == "deleted"
+    assert profiles.delete("b")["status"] == "not_found"
+    assert [p["profile_id"] for p in profiles.list_all()] == ["a"]
+
+
+def test_apply_makes_changes_in_order(backend):
+    store = storage.profile_store()
+    changes = [("a", {"n": 1}), ("b", {"n": 2}), ("a", None), ("missing", None), ("b", {"n": 3})]
+
+    assert store.apply(changes) == [True, True, True, False, True]
+    assert store.load() == {"b": {"n": 3}}
+    assert store.apply([("missing", None)]) == [False]
+
+
+def test_sqlite_sees_writes_from_other_connections(backend, tmp_path):
+    if backend != "sqlite":
+        pytest.skip("SQLite only")
+    profiles.add(_profile("mine"))
+    assert profiles.get("theirs") is None
+
+    # Another worker process writes through its own store.
+    other = storage.SqliteStore(tmp_path / "profiles.db")
+    other.save("theirs", _profile("theirs").model_dump())
+    other.close()
+
+    assert profiles.get("theirs") is not None
+
+
+def test_sqlite_imports_json_once(tmp_path, monkeypatch):
+    source = tmp_path / "profiles.json"
+    source.write_text(json.dumps({"old": _profile("old").model_dump()}))
+
+    store = storage.SqliteStore(tmp_path / "profiles.db", import_from=source)
+    assert list(store.load()) == ["old"]
+    store.delete("old")
+    store.close()
+
+    # A deleted profile is not resurrected by the next process.
+    reopened = storage.SqliteStore(tmp_path / "profiles.db", import_from=source)
+    assert reopened.load() == {}
+    reopened.close()
+    with sqlite3.connect(tmp_path / "profiles.db") as db:
+        assert db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_migrate_copies_profiles(tmp_path):
+    source = tmp_path / "profiles.json"
+    source.write_text(json.dumps({p: _profile(p).model_dump() for p in ("a", "b")}))
+    store = storage.SqliteStore(tmp_path / "profiles.db")
+
+    assert storage.migrate(source, store) == 2
+    assert sorted(store.load()) == ["a", "b"]
+    store.close()
+
+
+def test_unknown_backend(monkeypatch):
+    monkeypatch.setattr(settings, "profile_store", "redis")
+    with pytest.raises(ValueError, match="PROFILE_STORE"):
+        storage.profile_store()
+
+
+# ─── Multi-process stress ─────────────────────────────────────────────────────
+
+
+WORKERS = 4
+ROUNDS = 20
+
+
+class Sink:
+    def __init__(self):
+        self.count = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        self.count += 1
+        return "250 OK"
+
+
+def _worker(worker: int, backend: str, profiles_file: str, profiles_db: str, port: int) -> None:
+    settings.profile_store = backend
+    settings.profiles_file = profiles_file
+    settings.profiles_db = profiles_db
+    profiles.STAT_INTERVAL = 0.0
+
+    async def run() -> None:
+        for i in range(ROUNDS):
+            profile_id = f"w{worker}-{i}"
+            profiles.add(_profile(profile_id, port))
+            profiles.add(_profile("shared", port, from_name=f"worker {worker}"))
+            profile = profiles.get(profile_id)
+            assert profile is not None, f"{profile_id} lost"
+            await sender.send(EmailMessage(to=["x@example.com"], subject=profile_id, text="Hi"), profile)
+            if i % 2:
+                assert profiles.delete(profile_id)["status"] == "deleted"
+        await pool.close_all()
+
+    asyncio.run(run())
+
+
+def test_processes_share_one_store(backend, smtp_server):
+    sink = Sink()
+    port = smtp_server(sink)
+    ctx = multiprocessing.get_context("spawn")
+    workers = [
+        ctx.Process(
+            target=_worker,
+            args=(w, backend, settings.profiles_file, settings.profiles_db, port),
+        )
+        for w in range(WORKERS)
+    ]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join(60)
+
+    assert [p.exitcode for p in workers] == [0] * WORKERS
+    expected = {"shared"} | {f"w{w}-{i}" for w in range(WORKERS) for i in range(0, ROUNDS, 2)}
+    assert {p["profile_id"] for p in profiles.list_all()} == expected
+    assert sink.count == WORKERS * ROUNDS
@@ -0,0 +1,192 @@
+"""
+Tests for stored templates: compilation, rendering, the compiled-template
+cache, and templated sends through the API.
+"""
+
+import json
+from email import message_from_bytes, policy
+from unittest.mock import patch
+
+import pytest
+from aiosmtplib import SMTPResponse
+from httpx import AsyncClient, ASGITransport
+
+from email_service import EmailMessage, EmailTemplate, SmtpProfile, mime, settings, templates
+from email_service.templates import TemplateError
+from main import app
+
+
+@pytest.fixture(autouse=True)
+def _store(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "templates_file", str(tmp_path / "templates.json"))
+    monkeypatch.setattr(templates, "_cache", None)
+    templates._compiled.clear()
+    yield
+    templates._compiled.clear()
+
+
+def _welcome(**overrides) -> EmailTemplate:
+    fields = {
+        "name": "welcome",
+        "subject": "Welcome, {{ name }}",
+        "text": "Hi {{name}}, your code is {{ code }}. {literal} braces stay.",
+        "html": "<p>Hi {{ name }}</p>",
+    }
+    return EmailTemplate(**{**fields, **overrides})
+
+
+# ─── Rendering ────────────────────────────────────────────────────────────────
+
+
+def test_render_fills_and_escapes():
+    compiled = templates.compile_template(_welcome())
+
+    subject, text, html = compiled.render({"name": "Ann <b>\nBob", "code": 42})
+
+    assert subject == "Welcome, Ann <b> Bob"
+    assert text == "Hi Ann <b>\nBob, your code is 42. {literal} braces stay."
+    assert html == "<p>Hi Ann &lt;b&gt;\nBob</p>"
+    assert compiled.names == {"name", "code"}
+
+
+def test_missing_variable():
+    with pytest.raises(TemplateError, match="'code'"):
+        templates.compile_template(_welcome()).render({"name": "Ann"})
+
+
+def test_template_needs_a_body():
+    with pytest.raises(ValueError):
+        EmailTemplate(name="empty", subject="Hi")
+
+
+def test_compiled_once_and_cache_bounded(monkeypatch):
+    monkeypatch.setattr(settings, "template_cache_size", 2)
+    first = templates.compile_template(_welcome())
+    assert templates.compile_template(_welcome()) is first
+
+    for i in range(3):
+        templates.compile_template(_welcome(subject=f"Subject {i}"))
+    assert len(templates._compiled) == 2
+    assert templates.compile_template(_welcome()) is not first
+
+
+def test_edited_template_is_recompiled():
+    templates.add(_welcome())
+    message = EmailMessage(to=["a@example.com"], template="welcome", variables={"name": "Ann", "code": 1})
+    assert templates.apply(message).subject == "Welcome, Ann"
+
+    templates.add(_welcome(subject="Hello again, {{ name }}"))
+    assert templates.apply(message).subject == "Hello again, Ann"
+
+
+def test_apply_unknown_template():
+    with pytest.raises(TemplateError, match="not found"):
+        templates.apply(EmailMessage(to=["a@example.com"], template="nope"))
+
+
+def test_personalized_bodies_do_not_fill_the_mime_cache():
+    profile = SmtpProfile(profile_id="p", smtp_host="smtp.example.com", from_email="news@example.com")
+    mime.clear_cache()
+    templates.add(_welcome())
+    for i in range(5):
+        message = EmailMessage(to=["a@example.com"], template="welcome", variables={"name": f"U{i}", "code": i})
+        mime.render(templates.apply(message), profile)
+    assert len(mime._cache) == 0
+
+
+# ─── API ──────────────────────────────────────────────────────────────────────
+
+
+@pytest.fixture
+async def client():
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as c:
+        yield c
+
+
+async def _register(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "profiles_file", str(tmp_path / "profiles.json"))
+    monkeypatch.setattr(settings, "default_profile_id", "sender")
+    await client.post("/profiles", json={
+        "profile_id": "sender",
+        "smtp_host": "smtp.example.com",
+        "smtp_port": 465,
+        "from_email": "u@example.com",
+    })
+    r = await client.post("/templates", json=_welcome().model_dump())
+    assert r.status_code == 200
+
+
+@pytest.mark.anyio
+async def test_template_crud(client, tmp_path, monkeypatch):
+    await _register(client, tmp_path, monkeypatch)
+
+    r = await client.get("/templates")
+    assert [(t["name"], t["variables"]) for t in r.json()] == [("welcome", ["code", "name"])]
+    assert (await client.get("/templates/welcome")).json()["subject"] == "Welcome, {{ name }}"
+
+    assert (await client.delete("/templates/welcome")).status_code == 200
+    assert (await client.get("/templates/welcome")).status_code == 404
+    assert (await client.delete("/templates/welcome")).status_code == 404
+
+
+@pytest.mark.anyio
+async def test_send_with_template(client, tmp_path, monkeypatch):
+    await _register(client, tmp_path, monkeypatch)
+    sent = []
+
+    async def fake_sendmail(self, sender_addr, recipients, data, **kwargs):
+        sent.append(message_from_bytes(data, policy=policy.default))
+        return {}, SMTPResponse(250, "OK")
+
+    with patch("email_service.pool.SmtpPool.sendmail", fake_sendmail):
+        r = await client.post("/email/send", json={
+            "to": ["a@example.com"], "template": "welcome", "variables": {"name": "Ann", "code": "X1"},
+        })
+        missing = await client.post("/email/send", json={
+            "to": ["a@example.com"], "template": "welcome", "variables": {"name": "Ann"},
+        })
+        unknown = await client.post("/email/send", json={"to": ["a@example.com"], "template": "nope"})
+
+    assert r.status_code == 200, r.text
+    assert sent[0]["Subject"] == "Welcome, Ann"
+    assert "your code is X1" in sent[0].get_body(("plain",)).get_content()
+    assert missing.status_code == 400
+    assert unknown.status_code == 404
+    assert len(sent) == 1
+
+
+@pytest.mark.anyio
+async def test_batch_renders_per_recipient(client, tmp_path, monkeypatch):
+    await _register(client, tmp_path, monkeypatch)
+    subjects = {}
+
+    async def fake_sendmail(self, sender_addr, recipients, data, **kwargs):
+        subjects[recipients[0]] = message_from_bytes(data, policy=policy.default)["Subject"]
+        return {}, SMTPResponse(250, "OK")
+
+    with patch("email_service.pool.SmtpPool.sendmail", fake_sendmail):
+        r = await client.post("/email/send/batch", json={
+            "template": "welcome",
+            "variables": {"name": "friend", "code": 0},
+            "recipients": [
+                "a@example.com",
+                {"email": "b@example.com", "variables": {"name": "Bea"}},
+                {"email": "c@example.com", "variables": {"code": None, "name": "Cy"}},
+            ],
+        })
+
+    lines = [json.loads(line) for line in r.text.splitlines()]
+    assert lines[-1]["summary"] == {"total": 3, "sent": 3, "failed": 0}
+    assert subjects == {
+        "a@example.com": "Welcome, friend",
+        "b@example.com": "Welcome, Bea",
+        "c@example.com": "Welcome, Cy",
+    }
+    assert len(templates._compiled) == 1
+
+
+@pytest.mark.anyio
+async def test_batch_unknown_template(client, tmp_path, monkeypatch):
+    await _register(client, tmp_path, monkeypatch)
+    r = await client.post("/email/send/batch", json={"template": "nope", "recipients": ["a@example.com"]})
+    assert r.status_code == 404